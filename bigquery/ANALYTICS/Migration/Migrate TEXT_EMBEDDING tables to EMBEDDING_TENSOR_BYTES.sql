@@ -0,0 +1,37 @@
+-- One-off migration of the embedding tables from the legacy repeated FLOAT64 column (EMBEDDING_TENSOR_DATA) to the
+-- bytes format (EMBEDDING_TENSOR_DTYPE, EMBEDDING_TENSOR_BYTES), in place, so the stored embeddings are kept. For every
+-- table that still has the legacy column, the new columns are added, the legacy values are converted to float32 bytes
+-- with ANALYTICS.UDF_TO_FLOAT32_BYTES and the legacy column is dropped, so that the table schema matches the schema the
+-- writers append with (util.embedding.storage.get_embedding_schema). Tables that are already migrated are skipped, so
+-- the script can be run again after a failure.
+-- Run it once, after creating ANALYTICS.UDF_TO_FLOAT32_BYTES and before the embedding writers run.
+FOR legacy_table IN (
+    SELECT table_name
+    FROM `collaboration-recommender`.ANALYTICS.INFORMATION_SCHEMA.COLUMNS
+    WHERE table_name IN ('TEXT_EMBEDDING_ARTICLE',
+                         'TEXT_EMBEDDING_RESEARCH_TOPIC',
+                         'TEXT_EMBEDDING_RESEARCH_TOPIC_METADATA',
+                         'TEXT_EMBEDDING_RESEARCH_TOPIC_TOP_N_ARTICLES')
+      AND column_name = 'EMBEDDING_TENSOR_DATA'
+)
+DO
+    -- Add the columns of the bytes format
+    EXECUTE IMMEDIATE FORMAT("""
+        ALTER TABLE `collaboration-recommender`.ANALYTICS.%s
+            ADD COLUMN IF NOT EXISTS EMBEDDING_TENSOR_DTYPE STRING,
+            ADD COLUMN IF NOT EXISTS EMBEDDING_TENSOR_BYTES BYTES""", legacy_table.table_name);
+
+    -- Convert the legacy FLOAT64 arrays to float32 bytes
+    EXECUTE IMMEDIATE FORMAT("""
+        UPDATE `collaboration-recommender`.ANALYTICS.%s
+        SET EMBEDDING_TENSOR_SHAPE = IF(ARRAY_LENGTH(EMBEDDING_TENSOR_SHAPE) > 0, EMBEDDING_TENSOR_SHAPE,
+                                        [ARRAY_LENGTH(EMBEDDING_TENSOR_DATA)]),
+            EMBEDDING_TENSOR_DTYPE = 'float32',
+            EMBEDDING_TENSOR_BYTES = `collaboration-recommender`.ANALYTICS.UDF_TO_FLOAT32_BYTES(EMBEDDING_TENSOR_DATA)
+        WHERE EMBEDDING_TENSOR_BYTES IS NULL""", legacy_table.table_name);
+
+    -- Drop the legacy column, so that the appends of the writers match the table schema
+    EXECUTE IMMEDIATE FORMAT("""
+        ALTER TABLE `collaboration-recommender`.ANALYTICS.%s
+            DROP COLUMN EMBEDDING_TENSOR_DATA""", legacy_table.table_name);
+END FOR;
@@ -0,0 +1,12 @@
+CREATE OR REPLACE TABLE `collaboration-recommender`.ANALYTICS.COLLABORATION_NOVELTY_AUTHOR_YEAR
+(
+    AUTHOR_SID                                  STRING,
+    YEAR                                        INT64,
+    ARTICLE_COUNT                               INT64,
+    NEW_AUTHOR_COLLABORATION_ARTICLE_COUNT      INT64,
+    NEW_INSTITUTION_COLLABORATION_ARTICLE_COUNT INT64,
+    NEW_PARTNER_COUNT                           INT64,
+    REPEAT_PARTNER_COUNT                        INT64,
+    INSTITUTION_COUNT                           INT64
+);
+
@@ -1,8 +1,11 @@
-CREATE OR REPLACE TABLE `collaboration-recommender`.ANALYTICS.TEXT_EMBEDDING_ARTICLE
+-- Created only if it does not exist, so that the stored embeddings are never replaced. Tables with the legacy
+-- EMBEDDING_TENSOR_DATA column are migrated by Migration/Migrate TEXT_EMBEDDING tables to EMBEDDING_TENSOR_BYTES.sql.
+CREATE TABLE IF NOT EXISTS `collaboration-recommender`.ANALYTICS.TEXT_EMBEDDING_ARTICLE
 (
     DOI                    STRING,
     EMBEDDING_TENSOR_SHAPE ARRAY <INT64>,
-    EMBEDDING_TENSOR_DATA  ARRAY <FLOAT64>
+    EMBEDDING_TENSOR_DTYPE STRING,
+    EMBEDDING_TENSOR_BYTES BYTES
 );
 
 
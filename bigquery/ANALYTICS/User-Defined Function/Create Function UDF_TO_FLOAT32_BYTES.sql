@@ -0,0 +1,26 @@
+-- Function accepts an array of FLOAT64 values (the legacy EMBEDDING_TENSOR_DATA column) and returns the values as
+-- little-endian float32 bytes, the format of EMBEDDING_TENSOR_BYTES with EMBEDDING_TENSOR_DTYPE = 'float32'. BYTES are
+-- returned from JavaScript UDFs as base64-encoded strings.
+CREATE OR REPLACE FUNCTION `collaboration-recommender`.ANALYTICS.UDF_TO_FLOAT32_BYTES(data ARRAY <FLOAT64>)
+    RETURNS BYTES
+    LANGUAGE js AS """
+  if (data == null) {
+    return null;
+  }
+
+  // Write the values as little-endian float32
+  const view = new DataView(new ArrayBuffer(data.length * 4));
+  data.forEach((value, i) => view.setFloat32(i * 4, value, true));
+  const bytes = new Uint8Array(view.buffer);
+
+  // Encode the bytes in base64
+  const alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/';
+  let base64 = '';
+  for (let i = 0; i < bytes.length; i += 3) {
+    const n = (bytes[i] << 16) | ((bytes[i + 1] || 0) << 8) | (bytes[i + 2] || 0);
+    base64 += alphabet[(n >> 18) & 63] + alphabet[(n >> 12) & 63]
+      + (i + 1 < bytes.length ? alphabet[(n >> 6) & 63] : '=')
+      + (i + 2 < bytes.length ? alphabet[n & 63] : '=');
+  }
+  return base64;
+""";
@@ -0,0 +1,12 @@
+WITH REF_COLLABORATION_NOVELTY_AUTHOR_YEAR AS (SELECT *
+                                               FROM {{ source('ANALYTICS', 'COLLABORATION_NOVELTY_AUTHOR_YEAR') }})
+SELECT AUTHOR_SID,
+       YEAR,
+       ARTICLE_COUNT,
+       NEW_AUTHOR_COLLABORATION_ARTICLE_COUNT,
+       NEW_INSTITUTION_COLLABORATION_ARTICLE_COUNT,
+       NEW_PARTNER_COUNT,
+       REPEAT_PARTNER_COUNT,
+       INSTITUTION_COUNT,
+       DATALAKE.UDF_MD5_HASH([AUTHOR_SID, CAST(YEAR AS STRING)]) AS PK_COLLABORATION_NOVELTY_AUTHOR_YEAR
+FROM REF_COLLABORATION_NOVELTY_AUTHOR_YEAR
@@ -0,0 +1,127 @@
+"""
+Script: Backfill collaboration novelty
+
+This script recomputes the collaboration novelty of all the published articles since MIN_YEAR from an empty
+collaboration history, in parallel. Articles that share no authors and no pairs of institutions cannot influence each
+other's novelty, so the collaboration stream is partitioned into independent components (union-find over authors and
+institution pairs) that are processed in separate worker processes. The partial collaboration graphs are merged into
+the final author and institution graphs, and the results are identical to running derive_collaboration_novelty.py on an
+empty history.
+
+The target tables and the collaboration checkpoint must be empty. The merged history is stored as a checkpoint snapshot
+with the watermark of the last article, so derive_collaboration_novelty.py continues incrementally from there.
+
+"""
+import os
+import sys
+
+import pandas as pd
+from box import Box
+from google.cloud import bigquery
+from google.cloud import storage
+from loguru import logger
+
+# Add the root directory of the project to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from util.collaboration_novelty.author_novelty import AuthorNoveltyCounters
+from util.collaboration_novelty.backfill import backfill_collaboration_novelty
+from util.collaboration_novelty.checkpoint import CollaborationCheckpoint
+from util.collaboration_novelty.cursor import get_collaboration_watermark
+from util.collaboration_novelty.query import has_rows, query_collaboration_stream
+from util.collaboration_novelty.temporal import get_temporal_collaboration_history
+from util.common.helpers import offload_batch_to_bigquery, set_logger
+
+# -------------------- IMPORT LIBRARIES --------------------
+
+# -------------------- GLOBAL VARIABLES --------------------
+PATH_TO_CONFIG_FILE = 'config.yml'
+
+# -------------------- MAIN SCRIPT --------------------
+
+if __name__ == '__main__':
+    # Set logger
+    set_logger()
+    # Load the configuration file
+    config = Box.from_yaml(filename=PATH_TO_CONFIG_FILE)
+
+    # Full table IDs
+    source_table_id = f"{config.GCP.PROJECT_ID}.{config.GCP.READ_SCHEMA}.{config.ANALYTICS.COLLABORATION_NOVELTY.SOURCE_TABLE_NAME}"
+    target_table_id_collaboration_novelty_metadata = f"{config.GCP.PROJECT_ID}.{config.GCP.ANALYTICS_SCHEMA}.{config.ANALYTICS.COLLABORATION_NOVELTY.TARGET_TABLE_NAME_COLLABORATION_NOVELTY_METADATA}"
+    target_table_id_collaboration_novelty_index = f"{config.GCP.PROJECT_ID}.{config.GCP.ANALYTICS_SCHEMA}.{config.ANALYTICS.COLLABORATION_NOVELTY.TARGET_TABLE_NAME_COLLABORATION_NOVELTY_INDEX}"
+    target_table_id_collaboration_novelty_author_year = f"{config.GCP.PROJECT_ID}.{config.GCP.ANALYTICS_SCHEMA}.{config.ANALYTICS.COLLABORATION_NOVELTY.TARGET_TABLE_NAME_COLLABORATION_NOVELTY_AUTHOR_YEAR}"
+
+    # Create a BigQuery client and a Google Cloud Storage client
+    bq_client = bigquery.Client(project=config.GCP.PROJECT_ID)
+    storage_client = storage.Client(project=config.GCP.PROJECT_ID)
+    bucket = storage_client.get_bucket(bucket_or_name=config.GCP.BUCKET_NAME)
+
+    # The backfill starts from an empty collaboration history
+    checkpoint = CollaborationCheckpoint(
+        bucket=bucket,
+        prefix=config.ANALYTICS.COLLABORATION_NOVELTY.CHECKPOINT_PREFIX,
+        compaction_interval=config.ANALYTICS.COLLABORATION_NOVELTY.CHECKPOINT_COMPACTION_INTERVAL,
+        compression=config.ANALYTICS.COLLABORATION_NOVELTY.CHECKPOINT_COMPRESSION
+    )
+    G_a, G_i, institution_index, temporal_history, author_novelty = checkpoint.fetch(
+        backend=config.ANALYTICS.COLLABORATION_NOVELTY.GRAPH_BACKEND,
+        graph_a_blob_name=config.ANALYTICS.COLLABORATION_NOVELTY.GRAPH_AUTHOR_COLLABORATION_BLOB_NAME,
+        graph_i_blob_name=config.ANALYTICS.COLLABORATION_NOVELTY.GRAPH_INSTITUTION_COLLABORATION_BLOB_NAME,
+        institution_index_blob_name=config.ANALYTICS.COLLABORATION_NOVELTY.INSTITUTION_COLLABORATION_INDEX_BLOB_NAME,
+        temporal_history=get_temporal_collaboration_history(
+            variant=config.ANALYTICS.COLLABORATION_NOVELTY.NCI_VARIANT,
+            window_years=config.ANALYTICS.COLLABORATION_NOVELTY.NCI_WINDOW_YEARS,
+            half_life_years=config.ANALYTICS.COLLABORATION_NOVELTY.NCI_HALF_LIFE_YEARS
+        ),
+        author_novelty=AuthorNoveltyCounters(),
+        require_history=has_rows(bq_client=bq_client, table_id=target_table_id_collaboration_novelty_index)
+    )
+    if checkpoint.watermark is not None or G_a.number_of_edges() > 0 or G_i.number_of_edges() > 0:
+        logger.error("The collaboration history is not empty. Clear the checkpoint and the target tables before "
+                     "running the backfill, or use derive_collaboration_novelty.py to continue incrementally.")
+        sys.exit(1)
+
+    # Fetch the whole collaboration stream
+    logger.info("Fetching the collaboration stream...")
+    record_batches = query_collaboration_stream(bq_client=bq_client,
+                                                source_table_id=source_table_id,
+                                                target_table_id=target_table_id_collaboration_novelty_index,
+                                                min_year=config.ANALYTICS.COLLABORATION_NOVELTY.MIN_YEAR)
+    dfs = [record_batch.to_pandas() for record_batch in record_batches]
+    df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+    if df.empty:
+        logger.info("There are no collaborations to backfill.")
+        sys.exit(0)
+
+    # Derive the collaboration novelty of independent components in parallel
+    logger.info(f"Backfilling the collaboration novelty of {df['ARTICLE_SID'].nunique()} articles...")
+    cni_rows, metadata_rows, G_a, G_i, institution_index, temporal_history, author_novelty = backfill_collaboration_novelty(
+        df=df,
+        n_workers=config.ANALYTICS.COLLABORATION_NOVELTY.BACKFILL_N_WORKERS,
+        batch_size=config.ANALYTICS.COLLABORATION_NOVELTY.BATCH_SIZE,
+        backend=config.ANALYTICS.COLLABORATION_NOVELTY.GRAPH_BACKEND,
+        temporal_history=temporal_history,
+        author_novelty=author_novelty
+    )
+
+    # Write the results to BigQuery. The rows of the current year are written as well, derive_collaboration_novelty.py
+    # merges the rows of that year on (AUTHOR_SID, YEAR) from there on.
+    logger.info("Offloading the results to BigQuery...")
+    offload_batch_size = config.ANALYTICS.COLLABORATION_NOVELTY.BACKFILL_OFFLOAD_BATCH_SIZE
+    author_year_rows = author_novelty.pop_closed_rows() + author_novelty.get_current_rows()
+    for table_id, rows in ((target_table_id_collaboration_novelty_index, cni_rows),
+                           (target_table_id_collaboration_novelty_metadata, metadata_rows),
+                           (target_table_id_collaboration_novelty_author_year, author_year_rows)):
+        for ix in range(0, len(rows), offload_batch_size):
+            offload_batch_to_bigquery(lst_batch=rows[ix:ix + offload_batch_size],
+                                      table_id=table_id,
+                                      client=bq_client,
+                                      verbose=False)
+
+    # Store the merged collaboration history with the watermark of the last article
+    checkpoint.compact(G_a=G_a,
+                       G_i=G_i,
+                       institution_index=institution_index,
+                       temporal_history=temporal_history,
+                       author_novelty=author_novelty,
+                       watermark=get_collaboration_watermark(df_batch=df))
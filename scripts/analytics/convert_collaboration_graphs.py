@@ -0,0 +1,159 @@
+"""
+Script: Convert collaboration graphs
+
+This script converts the collaboration history stored as pickles by earlier versions to the current formats: the
+author and institution collaboration graphs to the CSR graph format (a sorted node SID dictionary with CSR arrays of
+neighbors and weights, optionally compressed) and the institution collaboration index, temporal collaboration history
+and author novelty counters to Parquet files. Uncompressed CSR files can be memory-mapped with
+util.collaboration_novelty.csr_graph.read_csr_graph, so the novelty job and the recommender can open them in
+milliseconds and processes on the same node share one copy. It is the only place where pickles are loaded, since
+unpickling can run arbitrary code.
+
+With --source graphs, the pickled graphs and institution index stored next to the configured blobs with the .pkl
+extension are converted and written to the configured blob names (GRAPH_AUTHOR_COLLABORATION_BLOB_NAME,
+GRAPH_INSTITUTION_COLLABORATION_BLOB_NAME and INSTITUTION_COLLABORATION_INDEX_BLOB_NAME). With --source checkpoint,
+the latest collaboration checkpoint is rewritten as a snapshot in the current formats. With --output-dir, only the
+graphs are written to local files G_a.csr and G_i.csr instead. The sizes and load times of the graphs are logged.
+
+Usage:
+    python scripts/analytics/convert_collaboration_graphs.py [--source graphs|checkpoint] [--output-dir DIR]
+        [--compression zstd|lz4|none] [--local-bucket PATH]
+
+"""
+import argparse
+import os
+import sys
+import time
+
+from box import Box
+from google.cloud import storage
+from loguru import logger
+
+# Add the root directory of the project to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from util.collaboration_novelty.author_novelty import AuthorNoveltyCounters
+from util.collaboration_novelty.checkpoint import CollaborationCheckpoint
+from util.collaboration_novelty.csr_graph import deserialize_csr_graph, read_csr_graph, write_csr_graph
+from util.collaboration_novelty.graph import deserialize_collaboration_graph, fetch_institution_collaboration_index, \
+    save_institution_collaboration_index, serialize_collaboration_graph
+from util.collaboration_novelty.temporal import get_temporal_collaboration_history
+from util.common.helpers import set_logger
+from util.common.storage import LocalBucket
+
+# -------------------- GLOBAL VARIABLES --------------------
+PATH_TO_CONFIG_FILE = 'config.yml'
+
+# -------------------- MAIN SCRIPT --------------------
+
+if __name__ == '__main__':
+    # Parse the arguments
+    parser = argparse.ArgumentParser(description='Convert the collaboration graphs to the CSR graph format.')
+    parser.add_argument('--source', choices=['graphs', 'checkpoint'], default='graphs',
+                        help='Convert the pickled graph blobs or the latest collaboration checkpoint.')
+    parser.add_argument('--output-dir', default=None,
+                        help='Local directory to write the graphs to instead of the bucket.')
+    parser.add_argument('--compression', choices=['zstd', 'lz4', 'none'], default=None,
+                        help='Compression of the converted files. Defaults to CHECKPOINT_COMPRESSION in the bucket and '
+                             'none for local files, which can only be memory-mapped uncompressed.')
+    parser.add_argument('--local-bucket', default=None,
+                        help='Directory with a local copy of the bucket to read from and write to.')
+    args = parser.parse_args()
+
+    # Set logger
+    set_logger()
+    # Load the configuration file
+    config = Box.from_yaml(filename=PATH_TO_CONFIG_FILE)
+    blob_names = dict(G_a=config.ANALYTICS.COLLABORATION_NOVELTY.GRAPH_AUTHOR_COLLABORATION_BLOB_NAME,
+                      G_i=config.ANALYTICS.COLLABORATION_NOVELTY.GRAPH_INSTITUTION_COLLABORATION_BLOB_NAME)
+    institution_index_blob_name = config.ANALYTICS.COLLABORATION_NOVELTY.INSTITUTION_COLLABORATION_INDEX_BLOB_NAME
+    if args.compression is not None:
+        compression = None if args.compression == 'none' else args.compression
+    elif args.output_dir is not None:
+        compression = None
+    else:
+        compression = config.ANALYTICS.COLLABORATION_NOVELTY.CHECKPOINT_COMPRESSION
+
+    # Get the bucket with the collaboration graphs
+    if args.local_bucket is not None:
+        bucket = LocalBucket(root_path=args.local_bucket)
+    else:
+        storage_client = storage.Client(project=config.GCP.PROJECT_ID)
+        bucket = storage_client.get_bucket(bucket_or_name=config.GCP.BUCKET_NAME)
+
+    # Get the graphs
+    if args.source == 'checkpoint':
+        checkpoint = CollaborationCheckpoint(
+            bucket=bucket,
+            prefix=config.ANALYTICS.COLLABORATION_NOVELTY.CHECKPOINT_PREFIX,
+            compaction_interval=config.ANALYTICS.COLLABORATION_NOVELTY.CHECKPOINT_COMPACTION_INTERVAL,
+            compression=compression
+        )
+        G_a, G_i, institution_index, temporal_history, author_novelty = checkpoint.fetch(
+            backend='compact',
+            graph_a_blob_name=blob_names['G_a'],
+            graph_i_blob_name=blob_names['G_i'],
+            institution_index_blob_name=institution_index_blob_name,
+            temporal_history=get_temporal_collaboration_history(
+                variant=config.ANALYTICS.COLLABORATION_NOVELTY.NCI_VARIANT,
+                window_years=config.ANALYTICS.COLLABORATION_NOVELTY.NCI_WINDOW_YEARS,
+                half_life_years=config.ANALYTICS.COLLABORATION_NOVELTY.NCI_HALF_LIFE_YEARS
+            ),
+            author_novelty=AuthorNoveltyCounters(),
+            initialize=False,
+            allow_pickle=True
+        )
+        graphs = dict(G_a=G_a, G_i=G_i)
+
+        # Rewrite the checkpoint as a snapshot in the current formats, keeping its watermark
+        if args.output_dir is None and checkpoint.watermark is not None:
+            checkpoint.compact(G_a=G_a, G_i=G_i, institution_index=institution_index,
+                               temporal_history=temporal_history, author_novelty=author_novelty,
+                               watermark=checkpoint.watermark)
+            logger.info(f"Rewrote the collaboration checkpoint up to {checkpoint.watermark} as snapshot "
+                        f"{checkpoint.manifest['snapshot']['sequence']}.")
+    else:
+        graphs = dict()
+        for name, blob_name in blob_names.items():
+            pickle_blob_name = f"{os.path.splitext(blob_name)[0]}.pkl"
+            blob = bucket.blob(blob_name=pickle_blob_name)
+            if not blob.exists():
+                logger.error(f"Could not find the pickled collaboration graph {pickle_blob_name}.")
+                sys.exit(1)
+            data = blob.download_as_string()
+            start = time.perf_counter()
+            graphs[name] = deserialize_collaboration_graph(data=data, backend='compact', allow_pickle=True)
+            logger.info(f"Loaded {pickle_blob_name} ({len(data) / 2 ** 20:.1f} MiB) in "
+                        f"{time.perf_counter() - start:.2f} seconds.")
+
+        # Convert the pickled institution index, or bootstrap it from the institution graph if there is none
+        if args.output_dir is None:
+            institution_index = fetch_institution_collaboration_index(
+                bucket=bucket,
+                institution_index_blob_name=f"{os.path.splitext(institution_index_blob_name)[0]}.pkl",
+                G_i=graphs['G_i'],
+                allow_pickle=True)
+            save_institution_collaboration_index(bucket=bucket,
+                                                 institution_index_blob_name=institution_index_blob_name,
+                                                 institution_index=institution_index,
+                                                 compression=compression)
+            logger.info(f"Wrote {institution_index_blob_name} ({len(institution_index)} pairs of institutions).")
+
+    # Write the graphs in the CSR graph format. The graphs of a checkpoint are already part of its new snapshot.
+    for name, G in graphs.items():
+        G_csr = G.to_csr()
+        if args.output_dir is not None:
+            os.makedirs(args.output_dir, exist_ok=True)
+            path = os.path.join(args.output_dir, f'{name}.csr')
+            write_csr_graph(G=G_csr, path=path, compression=compression)
+            start = time.perf_counter()
+            read_csr_graph(path=path)
+            logger.info(f"Wrote {path} ({os.path.getsize(path) / 2 ** 20:.1f} MiB, {G_csr.number_of_nodes()} nodes, "
+                        f"{G_csr.number_of_edges()} edges), opened in {time.perf_counter() - start:.4f} seconds.")
+        elif args.source == 'graphs':
+            data = serialize_collaboration_graph(G=G_csr, graph_format='csr', compression=compression)
+            bucket.blob(blob_name=blob_names[name]).upload_from_string(data, content_type='application/octet-stream')
+            start = time.perf_counter()
+            deserialize_csr_graph(data=data)
+            logger.info(f"Wrote {blob_names[name]} ({len(data) / 2 ** 20:.1f} MiB, {G_csr.number_of_nodes()} nodes, "
+                        f"{G_csr.number_of_edges()} edges), loaded in {time.perf_counter() - start:.4f} seconds.")
@@ -4,13 +4,22 @@ Script: Derive article topics
 This script reads through the articles that are included in the network and derives the top 3 most probable research topics
 for each article based on the article embeddings and the research topic embeddings.
 
+With --local-store, the local embedding stores (see scripts/embedding/sync_embedding_store.py) are synced first and the
+embeddings are read from them instead of being downloaded from BigQuery for every batch.
+
+Usage:
+    python scripts/analytics/derive_article_topics.py [--local-store]
+
 """
 
 # -------------------- IMPORT LIBRARIES --------------------
 
+import argparse
 import os
 import sys
 
+import pandas as pd
+import pyarrow.compute as pc
 from box import Box
 from google.cloud import bigquery
 from loguru import logger
@@ -20,6 +29,8 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.
 
 from util.analytics.article_topic import process_article_embedding_batch
 from util.common.helpers import set_logger
+from util.embedding.storage import get_embedding_matrix
+from util.embedding.store import sync_embedding_store
 
 # -------------------- GLOBAL VARIABLES --------------------
 PATH_TO_CONFIG_FILE = 'config.yml'
@@ -27,6 +38,12 @@ PATH_TO_CONFIG_FILE = 'config.yml'
 # -------------------- MAIN SCRIPT --------------------
 
 if __name__ == '__main__':
+    # Parse the arguments
+    parser = argparse.ArgumentParser(description='Derive the top 3 research topics of the articles.')
+    parser.add_argument('--local-store', action='store_true',
+                        help='Sync and read the embeddings from the local embedding stores.')
+    args = parser.parse_args()
+
     # Set logger 
     set_logger()
     # Load the configuration file
@@ -40,42 +57,75 @@ if __name__ == '__main__':
     # Create a BigQuery client
     bq_client = bigquery.Client(project=config.GCP.PROJECT_ID)
 
-    logger.info("Fetching all research topic embeddings...")
-
-    # Fetch all research topic embeddings
-    topic_embeddings = bq_client.query(f"""
-        SELECT  RESEARCH_TOPIC_CODE,
-                EMBEDDING_TENSOR_SHAPE,
-                EMBEDDING_TENSOR_DATA
-        FROM `{source_table_id_topic_embedding}`
-    """).result().to_dataframe()
+    if args.local_store:
+        # Sync the local embedding stores
+        sync_batch_size = config.TEXT_EMBEDDING.STORE_SYNC_BATCH_SIZE
+        topic_store = sync_embedding_store(path=config.EMBEDDING.RESEARCH_TOPIC_COMBINED.LOCAL_STORE_PATH,
+                                           bq_client=bq_client,
+                                           table_id=source_table_id_topic_embedding,
+                                           key_column='RESEARCH_TOPIC_CODE',
+                                           batch_size=sync_batch_size,
+                                           rebuild=True)
+        article_store = sync_embedding_store(path=config.EMBEDDING.ARTICLE.LOCAL_STORE_PATH,
+                                             bq_client=bq_client,
+                                             table_id=source_table_id_article_embedding,
+                                             key_column='DOI',
+                                             batch_size=sync_batch_size)
+        topic_embeddings = pd.DataFrame(dict(RESEARCH_TOPIC_CODE=topic_store.keys.to_numpy()))
+
+        # Find the rows of the articles that are not yet in the target table
+        target_dois = bq_client.query(f"SELECT DISTINCT DOI FROM `{target_table_id}`").result().to_arrow()['DOI']
+        positions = pc.indices_nonzero(pc.invert(pc.is_in(article_store.keys,
+                                                          value_set=target_dois.combine_chunks()))).to_numpy()
+        logger.info(f"Deriving the topics of {len(positions)} articles from the local embedding store...")
+
+        for start in range(0, len(positions), 10000):
+            batch_positions = positions[start:start + 10000]
+            process_article_embedding_batch(
+                article_embeddings=pd.DataFrame(dict(DOI=article_store.keys.take(batch_positions).to_numpy())),
+                topic_embeddings=topic_embeddings,
+                topic_embedding_values=topic_store.embeddings,
+                bq_client=bq_client,
+                target_table_id=target_table_id,
+                article_embedding_values=article_store.embeddings[batch_positions]
+            )
+    else:
+        logger.info("Fetching all research topic embeddings...")
+
+        # Fetch all research topic embeddings
+        topic_embeddings = bq_client.query(f"""
+            SELECT  RESEARCH_TOPIC_CODE,
+                    EMBEDDING_TENSOR_DTYPE,
+                    EMBEDDING_TENSOR_BYTES
+            FROM `{source_table_id_topic_embedding}`
+        """).result().to_dataframe()
 
-    # Extract the research topic embeddings
-    topic_embedding_values = topic_embeddings['EMBEDDING_TENSOR_DATA'].values.tolist()
+        # Decode the research topic embeddings into a matrix
+        topic_embedding_values = get_embedding_matrix(topic_embeddings)
 
-    logger.info("Fetching article embeddings batch...")
+        logger.info("Fetching article embeddings batch...")
 
-    # Fetch all article embeddings that are not yet in the target table
-    while bq_client.query(f"""SELECT COUNT(1)
-                                FROM `{source_table_id_article_embedding}` A
-                                LEFT JOIN `{target_table_id}` T USING (DOI)
-                                WHERE T.DOI IS NULL""").result().to_dataframe().values[0][0] > 0:
         # Fetch all article embeddings that are not yet in the target table
-        article_embeddings = bq_client.query(f"""
-            SELECT  A.DOI,
-                    A.EMBEDDING_TENSOR_SHAPE,
-                    A.EMBEDDING_TENSOR_DATA
-            FROM `{source_table_id_article_embedding}` A
-            LEFT JOIN `{target_table_id}` T USING (DOI)
-            WHERE T.DOI IS NULL
-            LIMIT 10000
-        """).result().to_dataframe()
-
-        # Process the article embedding batch
-        process_article_embedding_batch(
-            article_embeddings=article_embeddings,
-            topic_embeddings=topic_embeddings,
-            topic_embedding_values=topic_embedding_values,
-            bq_client=bq_client,
-            target_table_id=target_table_id
-        )
+        while bq_client.query(f"""SELECT COUNT(1)
+                                    FROM `{source_table_id_article_embedding}` A
+                                    LEFT JOIN `{target_table_id}` T USING (DOI)
+                                    WHERE T.DOI IS NULL""").result().to_dataframe().values[0][0] > 0:
+            # Fetch all article embeddings that are not yet in the target table
+            article_embeddings = bq_client.query(f"""
+                SELECT  A.DOI,
+                        A.EMBEDDING_TENSOR_DTYPE,
+                        A.EMBEDDING_TENSOR_BYTES
+                FROM `{source_table_id_article_embedding}` A
+                LEFT JOIN `{target_table_id}` T USING (DOI)
+                WHERE T.DOI IS NULL
+                LIMIT 10000
+            """).result().to_dataframe()
+
+            # Process the article embedding batch
+            process_article_embedding_batch(
+                article_embeddings=article_embeddings,
+                topic_embeddings=topic_embeddings,
+                topic_embedding_values=topic_embedding_values,
+                bq_client=bq_client,
+                target_table_id=target_table_id
+            )
@@ -5,9 +5,13 @@ This script reads through the published articles and defines the ones that are n
 affiliations and historic collaborations.
 It also calculates the Novelty Collaboration Index (NCI) for each article.
 New collaboration is defined on author level and institution level, whereas NCI is calculated on publication level.
+Per-author novelty counters (new and repeat partners, distinct institutions) are aggregated by year and merged into a
+separate table on (AUTHOR_SID, YEAR): the rows of a year are merged as soon as the year is complete, and the rows of the
+current year are merged at the end of every run, so they are updated until the year is complete.
 
 This script is designed to be run incrementally and logs the calculation details to a separate table in BigQuery besides
-the table where final results are stored.
+the table where final results are stored. Articles are streamed in chronological order (publication date, article SID)
+starting after the high-water mark stored with the collaboration graph checkpoint.
 
 """
 import os
@@ -22,10 +26,13 @@ from tqdm import tqdm
 # Add the root directory of the project to the path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
-from util.collaboration_novelty.graph import fetch_collaboration_graph, save_graphs
-from util.collaboration_novelty.process import process_article_collaboration_novelty
-from util.collaboration_novelty.query import query_collaboration_batch, query_collaboration_n_batches
-from util.common.helpers import offload_batch_to_bigquery, set_logger
+from util.collaboration_novelty.author_novelty import AUTHOR_NOVELTY_KEY_COLUMNS, AuthorNoveltyCounters
+from util.collaboration_novelty.checkpoint import CollaborationCheckpoint
+from util.collaboration_novelty.cursor import iterate_collaboration_batches
+from util.collaboration_novelty.pipeline import run_collaboration_novelty_pipeline
+from util.collaboration_novelty.query import has_rows, query_collaboration_stream
+from util.collaboration_novelty.temporal import get_temporal_collaboration_history
+from util.common.helpers import merge_batch_to_bigquery, set_logger
 
 # -------------------- IMPORT LIBRARIES --------------------
 
@@ -44,73 +51,74 @@ if __name__ == '__main__':
     source_table_id = f"{config.GCP.PROJECT_ID}.{config.GCP.READ_SCHEMA}.{config.ANALYTICS.COLLABORATION_NOVELTY.SOURCE_TABLE_NAME}"
     target_table_id_collaboration_novelty_metadata = f"{config.GCP.PROJECT_ID}.{config.GCP.ANALYTICS_SCHEMA}.{config.ANALYTICS.COLLABORATION_NOVELTY.TARGET_TABLE_NAME_COLLABORATION_NOVELTY_METADATA}"
     target_table_id_collaboration_novelty_index = f"{config.GCP.PROJECT_ID}.{config.GCP.ANALYTICS_SCHEMA}.{config.ANALYTICS.COLLABORATION_NOVELTY.TARGET_TABLE_NAME_COLLABORATION_NOVELTY_INDEX}"
+    target_table_id_collaboration_novelty_author_year = f"{config.GCP.PROJECT_ID}.{config.GCP.ANALYTICS_SCHEMA}.{config.ANALYTICS.COLLABORATION_NOVELTY.TARGET_TABLE_NAME_COLLABORATION_NOVELTY_AUTHOR_YEAR}"
 
     # Create a BigQuery client and a Google Cloud Storage client
     bq_client = bigquery.Client(project=config.GCP.PROJECT_ID)
     storage_client = storage.Client(project=config.GCP.PROJECT_ID)
     bucket = storage_client.get_bucket(bucket_or_name=config.GCP.BUCKET_NAME)
 
-    logger.info("Fetching number of batches...")
-    N = query_collaboration_n_batches(bq_client=bq_client,
-                                      source_table_id=source_table_id,
-                                      target_table_id=target_table_id_collaboration_novelty_index,
-                                      batch_size=config.ANALYTICS.COLLABORATION_NOVELTY.BATCH_SIZE,
-                                      min_year=config.ANALYTICS.COLLABORATION_NOVELTY.MIN_YEAR)
-
-    # # Get the author and institution collaboration history
-    G_a, G_i = fetch_collaboration_graph(
+    # Get the author and institution collaboration history from the latest checkpoint
+    checkpoint = CollaborationCheckpoint(
         bucket=bucket,
+        prefix=config.ANALYTICS.COLLABORATION_NOVELTY.CHECKPOINT_PREFIX,
+        compaction_interval=config.ANALYTICS.COLLABORATION_NOVELTY.CHECKPOINT_COMPACTION_INTERVAL,
+        compression=config.ANALYTICS.COLLABORATION_NOVELTY.CHECKPOINT_COMPRESSION
+    )
+    G_a, G_i, institution_index, temporal_history, author_novelty = checkpoint.fetch(
+        backend=config.ANALYTICS.COLLABORATION_NOVELTY.GRAPH_BACKEND,
         graph_a_blob_name=config.ANALYTICS.COLLABORATION_NOVELTY.GRAPH_AUTHOR_COLLABORATION_BLOB_NAME,
-        graph_i_blob_name=config.ANALYTICS.COLLABORATION_NOVELTY.GRAPH_INSTITUTION_COLLABORATION_BLOB_NAME
+        graph_i_blob_name=config.ANALYTICS.COLLABORATION_NOVELTY.GRAPH_INSTITUTION_COLLABORATION_BLOB_NAME,
+        institution_index_blob_name=config.ANALYTICS.COLLABORATION_NOVELTY.INSTITUTION_COLLABORATION_INDEX_BLOB_NAME,
+        temporal_history=get_temporal_collaboration_history(
+            variant=config.ANALYTICS.COLLABORATION_NOVELTY.NCI_VARIANT,
+            window_years=config.ANALYTICS.COLLABORATION_NOVELTY.NCI_WINDOW_YEARS,
+            half_life_years=config.ANALYTICS.COLLABORATION_NOVELTY.NCI_HALF_LIFE_YEARS
+        ),
+        author_novelty=AuthorNoveltyCounters(),
+        require_history=has_rows(bq_client=bq_client, table_id=target_table_id_collaboration_novelty_index)
     )
 
+    # Resume after the last article covered by the checkpoint. Without a watermark (e.g. on the first run after
+    # graphs were stored without one) the articles that are already in the target table are skipped instead.
+    watermark = checkpoint.watermark if checkpoint.watermark and 'ARTICLE_SID' in checkpoint.watermark else None
+    logger.info(f"Streaming collaborations after {watermark}...")
+    record_batches = query_collaboration_stream(bq_client=bq_client,
+                                                source_table_id=source_table_id,
+                                                target_table_id=target_table_id_collaboration_novelty_index,
+                                                min_year=config.ANALYTICS.COLLABORATION_NOVELTY.MIN_YEAR,
+                                                watermark=watermark)
+
     logger.info("Iterating through batches...")
-    # Iterate through all the batches
-    for ix in tqdm(range(N)):
-        df_batch = query_collaboration_batch(bq_client=bq_client,
-                                             source_table_id=source_table_id,
-                                             target_table_id=target_table_id_collaboration_novelty_index,
-                                             batch_size=config.ANALYTICS.COLLABORATION_NOVELTY.BATCH_SIZE,
-                                             min_year=config.ANALYTICS.COLLABORATION_NOVELTY.MIN_YEAR)
-
-        # Initialize the lists to store the collaboration novelty index and the metadata
-        cni_rows, metadata_rows = list(), list()
-
-        # Iterate through all the articles
-        for iy, article_sid in enumerate(df_batch['ARTICLE_SID'].unique()):
-            # Get the article rows
-            df_batch_article = df_batch[df_batch['ARTICLE_SID'] == article_sid]
-            # Get the authors and institutions pairs for the article
-            author_institution_pairs = df_batch_article[['AUTHOR_SID', 'INSTITUTION_SID']].drop_duplicates()
-
-            # Process the article
-            cni_row_i, metadata_rows_i = process_article_collaboration_novelty(
-                article_sid=article_sid,
-                df=df_batch_article,
-                G_a=G_a,
-                G_i=G_i,
-            )
-
-            # Append the collaboration to the lists
-            cni_rows.append(cni_row_i)
-            metadata_rows.extend(metadata_rows_i)
-
-        # Write the results to BigQuery
-        # 1. Collaboration Novelty Index
-        offload_batch_to_bigquery(lst_batch=cni_rows,
-                                  table_id=target_table_id_collaboration_novelty_index,
-                                  client=bq_client,
-                                  verbose=False)
-
-        # 2. Collaboration Novelty Metadata
-        offload_batch_to_bigquery(lst_batch=metadata_rows,
-                                  table_id=target_table_id_collaboration_novelty_metadata,
-                                  client=bq_client,
-                                  verbose=False)
-
-    # Save the graphs to Google Cloud Storage
-    save_graphs(bucket=bucket,
-                _G_a=G_a,
-                _G_i=G_i,
-                graph_i_blob_name=config.ANALYTICS.COLLABORATION_NOVELTY.GRAPH_INSTITUTION_COLLABORATION_BLOB_NAME,
-                graph_a_blob_name=config.ANALYTICS.COLLABORATION_NOVELTY.GRAPH_AUTHOR_COLLABORATION_BLOB_NAME)
+    # Iterate through all the batches of whole articles in chronological order. The next batch is fetched and the
+    # previous one is offloaded and checkpointed in the background, while the graphs are only updated in this thread.
+    timer = run_collaboration_novelty_pipeline(
+        batches=tqdm(iterate_collaboration_batches(record_batches=record_batches,
+                                                   batch_size=config.ANALYTICS.COLLABORATION_NOVELTY.BATCH_SIZE)),
+        G_a=G_a,
+        G_i=G_i,
+        institution_index=institution_index,
+        checkpoint=checkpoint,
+        bq_client=bq_client,
+        target_table_id_collaboration_novelty_index=target_table_id_collaboration_novelty_index,
+        target_table_id_collaboration_novelty_metadata=target_table_id_collaboration_novelty_metadata,
+        prefetch_size=config.ANALYTICS.COLLABORATION_NOVELTY.PREFETCH_SIZE,
+        write_queue_size=config.ANALYTICS.COLLABORATION_NOVELTY.WRITE_QUEUE_SIZE,
+        temporal_history=temporal_history,
+        author_novelty=author_novelty,
+        target_table_id_collaboration_novelty_author_year=target_table_id_collaboration_novelty_author_year
+    )
+    timer.log_report()
+
+    # Merge the rows of the current year, which is not complete yet, so its running counters are up to date
+    merge_batch_to_bigquery(lst_batch=author_novelty.get_current_rows(),
+                            table_id=target_table_id_collaboration_novelty_author_year,
+                            client=bq_client,
+                            key_columns=AUTHOR_NOVELTY_KEY_COLUMNS)
+
+    # Compact the remaining deltas into a snapshot
+    checkpoint.compact(G_a=G_a,
+                       G_i=G_i,
+                       institution_index=institution_index,
+                       temporal_history=temporal_history,
+                       author_novelty=author_novelty)
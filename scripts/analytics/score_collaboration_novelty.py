@@ -0,0 +1,107 @@
+"""
+Script: Score collaboration novelty of hypothetical teams
+
+This script scores how novel a publication by each of many hypothetical author teams would be, e.g. to rank
+collaboration recommendation candidates by their expected Novelty Collaboration Impact (NCI). The teams are scored
+against the latest collaboration checkpoint in a single call, without updating the collaboration history.
+
+The input is a CSV file with the columns TEAM_ID, AUTHOR_SID and INSTITUTION_SID (one row per team member and
+affiliation). The output is a CSV file with the NCI and the number of new and old author and institution pairs of every
+team, sorted by NCI in descending order.
+
+With --n-workers above 1 the teams are scored in worker processes that share one memory-mapped copy of the collaboration
+graphs, instead of each unpickling its own.
+
+Usage:
+    python scripts/analytics/score_collaboration_novelty.py --input teams.csv --output scores.csv [--year 2024]
+        [--local-bucket PATH] [--n-workers 4]
+
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+from box import Box
+from google.cloud import storage
+from loguru import logger
+
+# Add the root directory of the project to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from util.collaboration_novelty.checkpoint import CollaborationCheckpoint
+from util.collaboration_novelty.scoring import score_collaboration_novelty, score_collaboration_novelty_parallel
+from util.collaboration_novelty.temporal import get_temporal_collaboration_history
+from util.common.helpers import set_logger
+from util.common.storage import LocalBucket
+
+# -------------------- IMPORT LIBRARIES --------------------
+
+# -------------------- GLOBAL VARIABLES --------------------
+PATH_TO_CONFIG_FILE = 'config.yml'
+
+# -------------------- MAIN SCRIPT --------------------
+
+if __name__ == '__main__':
+    # Parse the arguments
+    parser = argparse.ArgumentParser(description='Score the collaboration novelty of hypothetical teams.')
+    parser.add_argument('--input', required=True, help='CSV file with TEAM_ID, AUTHOR_SID and INSTITUTION_SID.')
+    parser.add_argument('--output', required=True, help='CSV file to write the scores to.')
+    parser.add_argument('--year', type=int, default=None,
+                        help='Year of the hypothetical publications for the windowed and decayed NCI variants.')
+    parser.add_argument('--local-bucket', default=None,
+                        help='Directory with a local copy of the bucket to read the checkpoint from.')
+    parser.add_argument('--n-workers', type=int, default=1,
+                        help='Number of worker processes that score the teams on shared memory-mapped graphs.')
+    args = parser.parse_args()
+
+    # Set logger
+    set_logger()
+    # Load the configuration file
+    config = Box.from_yaml(filename=PATH_TO_CONFIG_FILE)
+
+    # Get the bucket with the collaboration checkpoint
+    if args.local_bucket is not None:
+        bucket = LocalBucket(root_path=args.local_bucket)
+    else:
+        storage_client = storage.Client(project=config.GCP.PROJECT_ID)
+        bucket = storage_client.get_bucket(bucket_or_name=config.GCP.BUCKET_NAME)
+
+    # Get the author and institution collaboration history from the latest checkpoint, without writing to it
+    checkpoint = CollaborationCheckpoint(bucket=bucket, prefix=config.ANALYTICS.COLLABORATION_NOVELTY.CHECKPOINT_PREFIX)
+    G_a, G_i, institution_index, temporal_history, _ = checkpoint.fetch(
+        backend=config.ANALYTICS.COLLABORATION_NOVELTY.GRAPH_BACKEND,
+        graph_a_blob_name=config.ANALYTICS.COLLABORATION_NOVELTY.GRAPH_AUTHOR_COLLABORATION_BLOB_NAME,
+        graph_i_blob_name=config.ANALYTICS.COLLABORATION_NOVELTY.GRAPH_INSTITUTION_COLLABORATION_BLOB_NAME,
+        institution_index_blob_name=config.ANALYTICS.COLLABORATION_NOVELTY.INSTITUTION_COLLABORATION_INDEX_BLOB_NAME,
+        temporal_history=get_temporal_collaboration_history(
+            variant=config.ANALYTICS.COLLABORATION_NOVELTY.NCI_VARIANT,
+            window_years=config.ANALYTICS.COLLABORATION_NOVELTY.NCI_WINDOW_YEARS,
+            half_life_years=config.ANALYTICS.COLLABORATION_NOVELTY.NCI_HALF_LIFE_YEARS
+        ),
+        initialize=False
+    )
+
+    # Score the teams
+    df_teams = pd.read_csv(args.input, dtype=str)
+    start = time.perf_counter()
+    if args.n_workers > 1:
+        df_scores = score_collaboration_novelty_parallel(df_teams=df_teams,
+                                                         G_a=G_a,
+                                                         G_i=G_i,
+                                                         institution_index=institution_index,
+                                                         n_workers=args.n_workers,
+                                                         temporal_history=temporal_history,
+                                                         year=args.year)
+    else:
+        df_scores = score_collaboration_novelty(df_teams=df_teams,
+                                                G_a=G_a,
+                                                G_i=G_i,
+                                                institution_index=institution_index,
+                                                temporal_history=temporal_history,
+                                                year=args.year)
+    logger.info(f"Scored {len(df_scores)} teams in {time.perf_counter() - start:.3f} seconds.")
+
+    # Write the scores
+    df_scores.sort_values('COLLABORATION_NOVELTY_INDEX', ascending=False).to_csv(args.output, index=False)
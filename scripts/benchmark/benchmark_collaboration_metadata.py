@@ -0,0 +1,130 @@
+"""
+Script: Benchmark collaboration novelty metadata
+
+This script measures the time it takes to build the collaboration novelty metadata rows of large consortium articles,
+comparing the membership check through element_in_flattened_list (a linear scan over all new pairs for every author,
+cubic in the number of authors) with the set-based membership of the collaboration difference (linear). It also checks
+that both give the same rows and reports the time of the whole per-article process.
+
+The articles are synthetic: every author has one affiliation, a share of the authors has a second one, and half of the
+author pairs have collaborated before.
+
+"""
+import itertools
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+# Add the root directory of the project to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from util.collaboration_novelty.compact_graph import get_empty_collaboration_graph
+from util.collaboration_novelty.difference import collaboration_difference
+from util.collaboration_novelty.institution_index import InstitutionCollaborationIndex
+from util.collaboration_novelty.process import process_article_collaboration_novelty
+from util.common.helpers import element_in_flattened_list
+
+# -------------------- GLOBAL VARIABLES --------------------
+ARTICLE_SIZES = [50, 200, 500]
+N_INSTITUTIONS = 60
+SHARE_DUAL_AFFILIATIONS = 0.1
+SHARE_OLD_AUTHOR_PAIRS = 0.5
+SEED = 0
+
+
+def get_consortium_article(n_authors: int, rng: random.Random) -> pd.DataFrame:
+    """
+    Generate the rows of a synthetic consortium article.
+    :param n_authors: Number of authors
+    :param rng: Random number generator
+    :return: DataFrame with the article SID, author SID, institution SID and publication date
+    """
+    rows = list()
+    for ix_author in range(n_authors):
+        n_affiliations = 2 if rng.random() < SHARE_DUAL_AFFILIATIONS else 1
+        for institution in rng.sample(range(N_INSTITUTIONS), n_affiliations):
+            rows.append(dict(ARTICLE_SID=f'ART_{n_authors}',
+                             AUTHOR_SID=f'A{ix_author}',
+                             INSTITUTION_SID=f'I{institution}',
+                             ARTICLE_PUBLICATION_DT=pd.Timestamp('2020-01-01')))
+    return pd.DataFrame(rows)
+
+
+def get_collaboration_history(df: pd.DataFrame, rng: random.Random) -> tuple:
+    """
+    Generate a collaboration history in which a share of the article's author and institution pairs are old.
+    :param df: DataFrame with the rows of the article
+    :param rng: Random number generator
+    :return: Tuple of the author graph, institution graph and institution collaboration index
+    """
+    G_a, G_i = get_empty_collaboration_graph(backend='compact'), get_empty_collaboration_graph(backend='compact')
+    institution_index = InstitutionCollaborationIndex()
+    for author_1, author_2 in itertools.combinations(df['AUTHOR_SID'].unique(), 2):
+        if rng.random() < SHARE_OLD_AUTHOR_PAIRS:
+            G_a.add_edge(author_1, author_2, weight=rng.randint(1, 5))
+    for institution_1, institution_2 in itertools.combinations(df['INSTITUTION_SID'].unique(), 2):
+        if rng.random() < SHARE_OLD_AUTHOR_PAIRS:
+            G_i.add_edge(institution_1, institution_2, weight=rng.randint(1, 5))
+            institution_index.add_collaboration(institution_1, institution_2)
+    return G_a, G_i, institution_index
+
+
+def build_metadata_flags_scan(author_affiliations: pd.DataFrame, diff: dict) -> list:
+    """
+    Build the new collaboration flags of the metadata rows with a linear scan over the new pairs.
+    """
+    return [(element_in_flattened_list(element=author_sid, list_of_lists=diff['new_authors']),
+             element_in_flattened_list(element=institution_sid, list_of_lists=diff['new_institutions']))
+            for (author_sid, institution_sid) in author_affiliations.values]
+
+
+def build_metadata_flags_set(author_affiliations: pd.DataFrame, diff: dict) -> list:
+    """
+    Build the new collaboration flags of the metadata rows with the membership sets of the difference.
+    """
+    return [(author_sid in diff['new_author_participants'],
+             institution_sid in diff['new_institution_participants'])
+            for (author_sid, institution_sid) in author_affiliations.values]
+
+
+# -------------------- MAIN SCRIPT --------------------
+
+if __name__ == '__main__':
+    rng = random.Random(SEED)
+    results = list()
+
+    for n_authors in ARTICLE_SIZES:
+        df = get_consortium_article(n_authors=n_authors, rng=rng)
+        G_a, G_i, institution_index = get_collaboration_history(df=df, rng=rng)
+        author_affiliations = df[['AUTHOR_SID', 'INSTITUTION_SID']].drop_duplicates()
+        diff = collaboration_difference(G=G_a, institution_index=institution_index,
+                                        author_affiliations=author_affiliations)
+
+        start = time.perf_counter()
+        flags_scan = build_metadata_flags_scan(author_affiliations=author_affiliations, diff=diff)
+        time_scan = time.perf_counter() - start
+
+        start = time.perf_counter()
+        flags_set = build_metadata_flags_set(author_affiliations=author_affiliations, diff=diff)
+        time_set = time.perf_counter() - start
+
+        if flags_scan != flags_set:
+            raise AssertionError(f"The metadata flags differ for the article with {n_authors} authors.")
+
+        start = time.perf_counter()
+        process_article_collaboration_novelty(article_sid=f'ART_{n_authors}', df=df, G_a=G_a, G_i=G_i,
+                                              institution_index=institution_index)
+        time_process = time.perf_counter() - start
+
+        results.append(dict(N_AUTHORS=n_authors,
+                            N_METADATA_ROWS=len(author_affiliations),
+                            N_NEW_AUTHOR_PAIRS=len(diff['new_authors']),
+                            SCAN_SECONDS=time_scan,
+                            SET_SECONDS=time_set,
+                            SPEEDUP=time_scan / max(time_set, 1e-9),
+                            PROCESS_ARTICLE_SECONDS=time_process))
+
+    print(pd.DataFrame(results).to_string(index=False))
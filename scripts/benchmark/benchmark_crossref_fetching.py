@@ -0,0 +1,153 @@
+"""
+Script: Benchmark Crossref fetching
+
+This script compares the sequential fetching of the top N articles of research topics (query_top_n_by_keyword, one
+blocking request at a time) with the concurrent, rate-limited fetching (iterate_top_n_by_keywords) against a local mock
+of the Crossref search API, so no request reaches Crossref. The mock server answers every search after a fixed latency,
+announces its rate limit in the X-Rate-Limit-Limit and X-Rate-Limit-Interval headers like Crossref and answers 429
+with a Retry-After header to the requests beyond that limit. The results of both runs must be identical, and the
+concurrent run must not receive any 429.
+
+Usage:
+    python scripts/benchmark/benchmark_crossref_fetching.py [--n-keywords 200] [--n-articles 16] [--latency 0.2]
+        [--server-rate 50] [--max-concurrency 3] [--requests-per-second 10]
+
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Add the root directory of the project to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from util.academic.crossref import iterate_top_n_by_keywords, query_top_n_by_keyword
+
+# -------------------- GLOBAL VARIABLES --------------------
+PATH_TO_CONFIG_FILE = 'config.yml'
+
+
+class MockCrossrefHandler(BaseHTTPRequestHandler):
+    """
+    Handler of the mock Crossref search API: GET /works?query=...&rows=N answers N deterministic articles of the query.
+    """
+    latency = 0.2
+    rate = 50
+    request_times = deque()
+    n_requests = 0
+    n_rate_limited = 0
+    lock = threading.Lock()
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        cls = self.__class__
+
+        # Answer 429 to the requests beyond the rate limit of the last second
+        with cls.lock:
+            now = time.monotonic()
+            while cls.request_times and cls.request_times[0] <= now - 1:
+                cls.request_times.popleft()
+            cls.n_requests += 1
+            rate_limited = len(cls.request_times) >= cls.rate
+            if rate_limited:
+                cls.n_rate_limited += 1
+            else:
+                cls.request_times.append(now)
+
+        if url.path != '/works' or 'query' not in params:
+            self.send_response(404)
+            self.end_headers()
+            return
+        if rate_limited:
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self.end_headers()
+            return
+
+        time.sleep(cls.latency)
+        query, rows = params['query'][0], int(params.get('rows', ['20'])[0])
+        digest = hashlib.sha1(query.encode()).hexdigest()[:12]
+        items = [dict(DOI=f'10.0000/{digest}.{ix}', title=[f'{query} {ix}'], abstract=f'Abstract {ix} on {query}.')
+                 for ix in range(rows)]
+        body = json.dumps(dict(status='ok', message=dict(items=items))).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Rate-Limit-Limit', str(cls.rate))
+        self.send_header('X-Rate-Limit-Interval', '1s')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def start_mock_server(latency: float, rate: int) -> ThreadingHTTPServer:
+    """
+    Start the mock Crossref search API on a free local port in a background thread.
+    :param latency: Seconds the server waits before answering a search
+    :param rate: Number of requests per second the server answers before it answers 429
+    :return: The running server
+    """
+    MockCrossrefHandler.latency, MockCrossrefHandler.rate = latency, rate
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockCrossrefHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def reset_mock_server() -> None:
+    """
+    Reset the request counters and the rate limit window of the mock server.
+    """
+    with MockCrossrefHandler.lock:
+        MockCrossrefHandler.request_times.clear()
+        MockCrossrefHandler.n_requests, MockCrossrefHandler.n_rate_limited = 0, 0
+
+
+# -------------------- MAIN SCRIPT --------------------
+
+if __name__ == '__main__':
+    # Parse the arguments
+    parser = argparse.ArgumentParser(description='Benchmark sequential and concurrent Crossref fetching on a mock API.')
+    parser.add_argument('--n-keywords', type=int, default=200, help='Number of research topics to fetch.')
+    parser.add_argument('--n-articles', type=int, default=16, help='Number of articles per research topic.')
+    parser.add_argument('--latency', type=float, default=0.2, help='Latency of the mock server in seconds.')
+    parser.add_argument('--server-rate', type=int, default=50, help='Rate limit of the mock server per second.')
+    parser.add_argument('--max-concurrency', type=int, default=3, help='Maximum number of concurrent requests.')
+    parser.add_argument('--requests-per-second', type=float, default=10, help='Maximum number of requests per second.')
+    args = parser.parse_args()
+
+    server = start_mock_server(latency=args.latency, rate=args.server_rate)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    keywords = [f'research topic {ix}' for ix in range(args.n_keywords)]
+
+    # Fetch the research topics one at a time
+    start = time.perf_counter()
+    sequential = [query_top_n_by_keyword(keyword=keyword, n=args.n_articles, base_url=base_url)
+                  for keyword in keywords]
+    seconds_sequential = time.perf_counter() - start
+
+    # Fetch the research topics concurrently under the rate limit
+    reset_mock_server()
+    start = time.perf_counter()
+    concurrent = list(iterate_top_n_by_keywords(keywords=keywords,
+                                                n=args.n_articles,
+                                                max_concurrency=args.max_concurrency,
+                                                requests_per_second=args.requests_per_second,
+                                                base_url=base_url))
+    seconds_concurrent = time.perf_counter() - start
+    server.shutdown()
+
+    print(f"Sequential: {seconds_sequential:.2f} s ({len(keywords) / seconds_sequential:.1f} topics/s)")
+    print(f"Concurrent: {seconds_concurrent:.2f} s ({len(keywords) / seconds_concurrent:.1f} topics/s), "
+          f"{MockCrossrefHandler.n_requests} requests, {MockCrossrefHandler.n_rate_limited} rate limited")
+    print(f"Speedup: {seconds_sequential / seconds_concurrent:.2f}x, identical results: {sequential == concurrent}")
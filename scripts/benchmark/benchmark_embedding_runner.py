@@ -0,0 +1,159 @@
+"""
+Script: Benchmark embedding runners
+
+This script compares the embedding runners of embed_articles.py on the CPU by throughput (texts per second) and peak
+resident memory of all the processes of the run:
+    - pool: a process pool of --n-workers workers, with the model and tokenizer pickled into every task as in
+      process_worker_batch, so every worker holds its own copy of the model;
+    - threaded: one copy of the model in one process, with a tokenizer thread pool and a background writer (see
+      util.embedding.runner.embed_batches_threaded).
+Each runner is measured in a fresh process, so that the peak memory of one does not count for the other. Nothing is
+written to BigQuery: the writer of the threaded runner and the workers of the pool only collect the embeddings.
+
+The abstracts are synthetic: random words from the model's vocabulary, with log-normally distributed lengths similar to
+those of article abstracts.
+
+Usage:
+    python scripts/benchmark/benchmark_embedding_runner.py [--n-texts 2048] [--n-workers 4] [--n-tokenizer-threads 2]
+        [--model MODEL_NAME]
+
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+import psutil
+from box import Box
+
+# Add the root directory of the project to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from util.embedding.helpers import get_model_and_tokenizer, split_list_to_batch
+from util.embedding.inference import embed_texts
+from util.embedding.runner import EMBEDDING_RUNNERS, embed_batches_threaded
+
+# -------------------- GLOBAL VARIABLES --------------------
+PATH_TO_CONFIG_FILE = 'config.yml'
+ARTICLE_BATCH_SIZE = 64
+RSS_SAMPLING_INTERVAL = 0.05
+SEED = 0
+
+
+def get_synthetic_abstracts(n_texts: int, tokenizer, rng: random.Random) -> list:
+    """
+    Generate synthetic abstracts from the words of the tokenizer's vocabulary.
+    :param n_texts: Number of abstracts
+    :param tokenizer: Tokenizer of the model
+    :param rng: Random number generator
+    :return: List of abstracts
+    """
+    words = [word for word in tokenizer.get_vocab() if word.isalpha() and len(word) > 2]
+    return [' '.join(rng.choices(words, k=min(int(rng.lognormvariate(5.0, 0.6)), 600))) for _ in range(n_texts)]
+
+
+def sample_peak_rss(stop_event: threading.Event, peak: list) -> None:
+    """
+    Sample the total resident memory of this process and its children until the event is set.
+    :param stop_event: Event that stops the sampling
+    :param peak: One-element list to store the peak resident memory in bytes to
+    """
+    process = psutil.Process()
+    while not stop_event.is_set():
+        rss = 0
+        for member in [process, *process.children(recursive=True)]:
+            try:
+                rss += member.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        peak[0] = max(peak[0], rss)
+        time.sleep(RSS_SAMPLING_INTERVAL)
+
+
+def embed_worker_batch(texts: list, model, tokenizer) -> np.ndarray:
+    """
+    Embed the texts of a worker task in article batches, like embed_article_batch in a pool worker.
+    """
+    return np.concatenate([embed_texts(lst_to_embed=batch, model=model, tokenizer=tokenizer).numpy()
+                           for batch in split_list_to_batch(lst=texts, batch_size=ARTICLE_BATCH_SIZE)])
+
+
+def run(runner: str, n_texts: int, n_workers: int, n_tokenizer_threads: int, model_name: str) -> dict:
+    """
+    Load the model and embed the synthetic abstracts with one runner.
+    :return: Dictionary with the throughput and peak resident memory of the run
+    """
+    stop_event, peak = threading.Event(), [0]
+    sampler = threading.Thread(target=sample_peak_rss, args=(stop_event, peak), daemon=True)
+    sampler.start()
+
+    model, tokenizer = get_model_and_tokenizer(model_name=model_name)
+    model.eval()
+    texts = get_synthetic_abstracts(n_texts=n_texts, tokenizer=tokenizer, rng=random.Random(SEED))
+
+    start = time.perf_counter()
+    if runner == 'pool':
+        # Split the texts into worker tasks as embed_articles.py does, with the model pickled into each task
+        with Pool(processes=n_workers) as pool:
+            results = [pool.apply_async(embed_worker_batch, args=(worker_texts, model, tokenizer))
+                       for worker_texts in split_list_to_batch(lst=texts, batch_size=-(-len(texts) // n_workers))]
+            embeddings = np.concatenate([result.get() for result in results])
+    else:
+        written = list()
+        batches = split_list_to_batch(lst=pd.DataFrame(dict(EMBEDDING_INPUT=texts)), batch_size=ARTICLE_BATCH_SIZE)
+        embed_batches_threaded(batches=batches, model=model, tokenizer=tokenizer,
+                               write=lambda embedded_batch: written.append(embedded_batch[1]),
+                               n_tokenizer_threads=n_tokenizer_threads)
+        embeddings = np.concatenate(written)
+    seconds = time.perf_counter() - start
+
+    stop_event.set()
+    sampler.join()
+    return dict(RUNNER=runner, N_TEXTS=len(embeddings), SECONDS=seconds, TEXTS_PER_SECOND=len(embeddings) / seconds,
+                PEAK_RSS_MIB=peak[0] / 2 ** 20, CHECKSUM=float(np.abs(embeddings).sum()))
+
+
+# -------------------- MAIN SCRIPT --------------------
+
+if __name__ == '__main__':
+    # Parse the arguments
+    parser = argparse.ArgumentParser(description='Benchmark the embedding runners by throughput and peak memory.')
+    parser.add_argument('--runner', default=None, choices=EMBEDDING_RUNNERS,
+                        help='Measure a single runner in this process, all runners in fresh processes by default.')
+    parser.add_argument('--n-texts', type=int, default=2048, help='Number of synthetic abstracts to embed.')
+    parser.add_argument('--n-workers', type=int, default=4, help='Number of workers of the pool runner.')
+    parser.add_argument('--n-tokenizer-threads', type=int, default=2,
+                        help='Number of tokenizer threads of the threaded runner.')
+    parser.add_argument('--model', default=None, help='Model name, TEXT_EMBEDDING.MODEL_NAME by default.')
+    args = parser.parse_args()
+
+    config = Box.from_yaml(filename=PATH_TO_CONFIG_FILE)
+    model_name = args.model or config.TEXT_EMBEDDING.MODEL_NAME
+
+    if args.runner is not None:
+        print(json.dumps(run(runner=args.runner, n_texts=args.n_texts, n_workers=args.n_workers,
+                             n_tokenizer_threads=args.n_tokenizer_threads, model_name=model_name)))
+        sys.exit(0)
+
+    # Measure each runner in a fresh process
+    results = list()
+    for runner in EMBEDDING_RUNNERS:
+        output = subprocess.run([sys.executable, __file__, '--runner', runner, '--n-texts', str(args.n_texts),
+                                 '--n-workers', str(args.n_workers),
+                                 '--n-tokenizer-threads', str(args.n_tokenizer_threads), '--model', model_name],
+                                check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    df_results = pd.DataFrame(results)
+    print(df_results.drop(columns=['CHECKSUM']).to_string(index=False))
+    threaded, pool = df_results.set_index('RUNNER').loc['threaded'], df_results.set_index('RUNNER').loc['pool']
+    print(f"Threaded vs pool: {threaded['TEXTS_PER_SECOND'] / pool['TEXTS_PER_SECOND']:.2f}x throughput, "
+          f"{threaded['PEAK_RSS_MIB'] / pool['PEAK_RSS_MIB']:.2f}x peak memory. Checksums: "
+          f"{threaded['CHECKSUM']:.4f} (threaded), {pool['CHECKSUM']:.4f} (pool).")
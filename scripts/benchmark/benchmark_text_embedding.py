@@ -0,0 +1,109 @@
+"""
+Script: Benchmark text embedding
+
+This script measures the throughput (texts per second) of embedding abstracts on the CPU, comparing fixed batches of 8
+texts padded to their longest text with autograd enabled (the former embed_batch) with the inference engine, which
+sorts the texts by token length, builds batches under a token budget and runs the model in inference mode. It also
+checks that both give the same embeddings, in the order of the input texts.
+
+The abstracts are synthetic: random words from the model's vocabulary, with log-normally distributed lengths similar to
+those of article abstracts.
+
+Usage:
+    python scripts/benchmark/benchmark_text_embedding.py [--n-texts 512] [--model MODEL_NAME]
+        [--max-batch-tokens 8192] [--max-batch-size 64]
+
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn.functional as F
+from box import Box
+
+# Add the root directory of the project to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from util.embedding.helpers import get_model_and_tokenizer, split_list_to_batch
+from util.embedding.inference import MAX_BATCH_SIZE, MAX_BATCH_TOKENS, average_pool, embed_texts
+
+# -------------------- GLOBAL VARIABLES --------------------
+PATH_TO_CONFIG_FILE = 'config.yml'
+BASELINE_BATCH_SIZE = 8
+SEED = 0
+
+
+def get_synthetic_abstracts(n_texts: int, tokenizer, rng: random.Random) -> list:
+    """
+    Generate synthetic abstracts from the words of the tokenizer's vocabulary.
+    :param n_texts: Number of abstracts
+    :param tokenizer: Tokenizer of the model
+    :param rng: Random number generator
+    :return: List of abstracts
+    """
+    words = [word for word in tokenizer.get_vocab() if word.isalpha() and len(word) > 2]
+    return [' '.join(rng.choices(words, k=min(int(rng.lognormvariate(5.0, 0.6)), 600))) for _ in range(n_texts)]
+
+
+def embed_baseline(texts: list, model, tokenizer) -> torch.Tensor:
+    """
+    Embed texts in fixed batches padded to their longest text, with autograd enabled.
+    """
+    embeddings = list()
+    for batch in split_list_to_batch(lst=texts, batch_size=BASELINE_BATCH_SIZE):
+        batch_dict = tokenizer(batch, max_length=512, padding=True, truncation=True, return_tensors='pt')
+        outputs = model(**batch_dict)
+        embeddings.append(F.normalize(average_pool(outputs.last_hidden_state, batch_dict['attention_mask']),
+                                      p=2, dim=1).detach())
+    return torch.cat(embeddings)
+
+
+# -------------------- MAIN SCRIPT --------------------
+
+if __name__ == '__main__':
+    # Parse the arguments
+    parser = argparse.ArgumentParser(description='Benchmark the throughput of text embedding on the CPU.')
+    parser.add_argument('--n-texts', type=int, default=512, help='Number of synthetic abstracts to embed.')
+    parser.add_argument('--model', default=None, help='Model name, TEXT_EMBEDDING.MODEL_NAME by default.')
+    parser.add_argument('--max-batch-tokens', type=int, default=MAX_BATCH_TOKENS,
+                        help='Maximum number of padded tokens in a batch of the inference engine.')
+    parser.add_argument('--max-batch-size', type=int, default=MAX_BATCH_SIZE,
+                        help='Maximum number of texts in a batch of the inference engine.')
+    args = parser.parse_args()
+
+    # Load the configuration file
+    config = Box.from_yaml(filename=PATH_TO_CONFIG_FILE)
+    model, tokenizer = get_model_and_tokenizer(model_name=args.model or config.TEXT_EMBEDDING.MODEL_NAME)
+    model.eval()
+
+    texts = get_synthetic_abstracts(n_texts=args.n_texts, tokenizer=tokenizer, rng=random.Random(SEED))
+    lengths = np.array([len(input_ids) for input_ids in
+                        tokenizer(texts, max_length=512, truncation=True)['input_ids']])
+    print(f"{len(texts)} texts with {lengths.min()} to {lengths.max()} tokens (median {int(np.median(lengths))}), "
+          f"{torch.get_num_threads()} threads.")
+
+    start = time.perf_counter()
+    embeddings_baseline = embed_baseline(texts=texts, model=model, tokenizer=tokenizer)
+    time_baseline = time.perf_counter() - start
+
+    start = time.perf_counter()
+    embeddings_engine = embed_texts(lst_to_embed=texts, model=model, tokenizer=tokenizer,
+                                    max_batch_tokens=args.max_batch_tokens, max_batch_size=args.max_batch_size)
+    time_engine = time.perf_counter() - start
+
+    # Padding changes the results only by floating-point noise, so the embeddings must point in the same direction
+    min_cosine = float((embeddings_baseline * embeddings_engine).sum(dim=1).min())
+    if min_cosine < 0.9999:
+        raise AssertionError(f"The embeddings of the inference engine differ (minimum cosine similarity "
+                             f"{min_cosine:.6f}).")
+
+    print(pd.DataFrame([
+        dict(METHOD='fixed batches', SECONDS=time_baseline, TEXTS_PER_SECOND=len(texts) / time_baseline),
+        dict(METHOD='inference engine', SECONDS=time_engine, TEXTS_PER_SECOND=len(texts) / time_engine)
+    ]).to_string(index=False))
+    print(f"Speedup: {time_baseline / time_engine:.2f}x, minimum cosine similarity: {min_cosine:.8f}")
@@ -0,0 +1,125 @@
+"""
+Script: Replay and diff collaboration novelty
+
+This script replays the collaboration novelty pipeline with two engine configurations (e.g. another graph backend,
+batch size or the per-article engine) over a local Parquet snapshot of INT_COLLABORATION, collecting the results in
+memory. It compares both replays row by row (NCI with a float tolerance, metadata flags and per-author-per-year
+counters exactly) and reports the throughput of each configuration in articles per second.
+
+Without a snapshot, a synthetic co-authorship stream is generated, so the check can run in CI without access to
+BigQuery. The script exits with status 1 if the replays differ.
+
+Usage:
+    python scripts/benchmark/replay_collaboration_novelty.py [--source PATH | --synthetic-articles N]
+        [--baseline KEY=VALUE,...] [--candidate KEY=VALUE,...] [--rtol 1e-9] [--atol 1e-12] [--output-diff PATH]
+
+    The baseline starts from the ANALYTICS.COLLABORATION_NOVELTY section of config.yml and the candidate starts from
+    the baseline, e.g. --candidate GRAPH_BACKEND=networkx,BATCH_SIZE=100 or --candidate ENGINE=article.
+
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import pandas as pd
+import yaml
+from box import Box
+from loguru import logger
+
+# Add the root directory of the project to the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from util.collaboration_novelty.replay import DEFAULT_ENGINE_CONFIG, diff_collaboration_novelty, \
+    generate_collaboration_stream, replay_collaboration_novelty
+from util.common.helpers import set_logger
+
+# -------------------- GLOBAL VARIABLES --------------------
+PATH_TO_CONFIG_FILE = 'config.yml'
+
+
+def parse_engine_config(value: str) -> dict:
+    """
+    Parse an engine configuration given as comma-separated KEY=VALUE pairs.
+    :param value: Engine configuration, e.g. 'GRAPH_BACKEND=networkx,BATCH_SIZE=100'
+    :return: Dictionary with the engine configuration, with the values parsed as YAML scalars
+    """
+    engine_config = dict()
+    for item in filter(None, value.split(',')):
+        key, _, item_value = item.partition('=')
+        engine_config[key.strip().upper()] = yaml.safe_load(item_value.strip())
+    return engine_config
+
+
+# -------------------- MAIN SCRIPT --------------------
+
+if __name__ == '__main__':
+    # Parse the arguments
+    parser = argparse.ArgumentParser(description='Replay and diff collaboration novelty engine configurations.')
+    parser.add_argument('--source', default=None, help='Parquet snapshot of INT_COLLABORATION.')
+    parser.add_argument('--synthetic-articles', type=int, default=5000,
+                        help='Number of synthetic articles to generate when there is no snapshot.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic co-authorship stream.')
+    parser.add_argument('--baseline', type=parse_engine_config, default=dict(),
+                        help='Engine configuration overrides of the baseline.')
+    parser.add_argument('--candidate', type=parse_engine_config, default=dict(),
+                        help='Engine configuration overrides of the candidate, on top of the baseline.')
+    parser.add_argument('--rtol', type=float, default=1e-9, help='Relative tolerance of the NCI.')
+    parser.add_argument('--atol', type=float, default=1e-12, help='Absolute tolerance of the NCI.')
+    parser.add_argument('--output-diff', default=None, help='CSV file to write the differences to.')
+    args = parser.parse_args()
+
+    # Set logger
+    set_logger()
+    # Load the configuration file
+    config = Box.from_yaml(filename=PATH_TO_CONFIG_FILE)
+    min_year = config.ANALYTICS.COLLABORATION_NOVELTY.MIN_YEAR
+
+    # Engine configurations
+    baseline = {key: config.ANALYTICS.COLLABORATION_NOVELTY[key] for key in DEFAULT_ENGINE_CONFIG
+                if key in config.ANALYTICS.COLLABORATION_NOVELTY}
+    baseline.update(args.baseline)
+    candidate = {**baseline, **args.candidate}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Generate a synthetic snapshot if none is given
+        source_path = args.source
+        if source_path is None:
+            logger.info(f"Generating a synthetic co-authorship stream with {args.synthetic_articles} articles...")
+            source_path = os.path.join(temp_dir, 'INT_COLLABORATION.parquet')
+            generate_collaboration_stream(n_articles=args.synthetic_articles,
+                                          n_authors=max(args.synthetic_articles // 2, 10),
+                                          min_year=min_year,
+                                          seed=args.seed).to_parquet(source_path, index=False)
+
+        # Replay both configurations
+        results = dict()
+        for name, engine_config in (('baseline', baseline), ('candidate', candidate)):
+            logger.info(f"Replaying the {name}: {engine_config}")
+            results[name] = replay_collaboration_novelty(source_path=source_path,
+                                                         min_year=min_year,
+                                                         engine_config=engine_config)
+            results[name]['timer'].log_report()
+
+    # Report the throughput
+    print(pd.DataFrame([dict(CONFIGURATION=name,
+                             N_ARTICLES=result['n_articles'],
+                             SECONDS=result['seconds'],
+                             ARTICLES_PER_SECOND=result['n_articles'] / max(result['seconds'], 1e-9))
+                        for name, result in results.items()]).to_string(index=False))
+
+    # Compare the replays
+    df_diff = diff_collaboration_novelty(result_a=results['baseline'],
+                                         result_b=results['candidate'],
+                                         rtol=args.rtol,
+                                         atol=args.atol)
+    if args.output_diff is not None:
+        df_diff.to_csv(args.output_diff, index=False)
+    if df_diff.empty:
+        logger.info("The replays are identical within the tolerance.")
+        sys.exit(0)
+
+    logger.error(f"The replays differ in {len(df_diff)} values:\n"
+                 f"{df_diff.groupby(['TABLE', 'COLUMN']).size().to_string()}\n"
+                 f"{df_diff.head(20).to_string(index=False)}")
+    sys.exit(1)
@@ -3,6 +3,18 @@ Script: Embed articles
 
 This script reads through the articles that are included in the network and embeds the articles using a transformer model.
 
+With the 'threaded' runner (EMBEDDING.ARTICLE.RUNNER), the model is loaded once and runs in this process with the
+intra-op threads of the backend, while a thread pool tokenizes the next batches and a single background writer stages
+the embeddings in rolling Parquet files that are loaded to BigQuery in the background. The articles of every batch are
+queued in a local ledger (EMBEDDING.ARTICLE.LEDGER_PATH) and tracked until their embeddings are loaded, so a stopped run
+resumes from the ledger: the articles that were not embedded yet are embedded and the staged embeddings are loaded,
+without querying BigQuery for the remaining articles. The 'pool' runner starts MAX_WORKERS processes with a copy of the
+model each.
+
+Abstracts longer than the maximum length of the model are truncated, unless EMBEDDING.ARTICLE.CHUNKING is enabled: then
+every text is split into overlapping windows of tokens, the windows of all the articles of a batch are embedded
+together and the embeddings of the windows of an article are pooled into its embedding.
+
 """
 # -------------------- IMPORT LIBRARIES --------------------
 
@@ -18,7 +30,12 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 
 from util.common.helpers import process_worker_batch, set_logger
 from util.embedding.article import embed_article_batch, get_article_batch_count, get_article_batch
+from util.embedding.cache import get_embedding_cache
 from util.embedding.helpers import get_model_and_tokenizer, split_list_to_batch
+from util.embedding.ledger import EmbeddingLedger
+from util.embedding.runner import embed_articles_threaded
+from util.embedding.staging import EmbeddingStagingWriter
+from util.embedding.storage import get_embedding_schema
 
 # -------------------- GLOBAL VARIABLES --------------------
 PATH_TO_CONFIG_FILE = 'config.yml'
@@ -41,71 +58,138 @@ if __name__ == '__main__':
     iteration_batch_size = config.EMBEDDING.ARTICLE.ITERATION_BATCH_SIZE
 
     # Set model and tokenizer used to embed the text
-    model, tokenizer = get_model_and_tokenizer(model_name=config.TEXT_EMBEDDING.MODEL_NAME)
+    model, tokenizer = get_model_and_tokenizer(model_name=config.TEXT_EMBEDDING.MODEL_NAME,
+                                               backend=config.TEXT_EMBEDDING.BACKEND,
+                                               onnx_model_path=config.TEXT_EMBEDDING.ONNX_MODEL_PATH,
+                                               n_threads=config.TEXT_EMBEDDING.N_THREADS)
+
+    # Chunk long input texts into overlapping windows pooled per article, or truncate them
+    chunking = config.EMBEDDING.ARTICLE.CHUNKING.to_dict() if config.EMBEDDING.ARTICLE.CHUNKING.ENABLED else None
+
+    # Open the cache of the embeddings of the input texts
+    cache = get_embedding_cache(cache_path=config.TEXT_EMBEDDING.CACHE_PATH,
+                                model_name=config.TEXT_EMBEDDING.MODEL_NAME,
+                                backend=config.TEXT_EMBEDDING.BACKEND,
+                                max_bytes=config.TEXT_EMBEDDING.CACHE_MAX_BYTES,
+                                chunking=chunking,
+                                onnx_model_path=config.TEXT_EMBEDDING.ONNX_MODEL_PATH)
 
     # Create metadata
     metadata = dict(
         tokenizer=tokenizer,
         model=model,
+        cache=cache,
+        chunking=chunking,
+        storage_dtype=config.TEXT_EMBEDDING.STORAGE_DTYPE,
         bq_project_id=config.GCP.PROJECT_ID
     )
 
     # Define the schema
     data_schema = [
         bigquery.SchemaField("DOI", "STRING"),
-        bigquery.SchemaField("EMBEDDING_TENSOR_SHAPE", "INT64", mode="REPEATED"),
-        bigquery.SchemaField("EMBEDDING_TENSOR_DATA", "FLOAT64", mode="REPEATED")
+        *get_embedding_schema()
     ]
 
-    # Get the number of article batches
-    n_batches = get_article_batch_count(bq_client=bq_client,
-                                        source_table_id=source_table_id,
-                                        target_table_id=target_table_id,
-                                        batch_size=iteration_batch_size)
-
-    # Embed articles in batches until all articles are embedded
-    for ix_batch in range(n_batches):
-
-        logger.info(f'Fetching articles to query (B{ix_batch}/{n_batches})... ')
-
-        # Get the articles that are included in the network
-        articles = get_article_batch(bq_client=bq_client,
-                                     source_table_id=source_table_id,
-                                     target_table_id=target_table_id,
-                                     batch_size=iteration_batch_size)
-
-        # Split articles into batches
-        article_batches = split_list_to_batch(lst=articles,
-                                              batch_size=config.EMBEDDING.ARTICLE.ARTICLE_BATCH_SIZE)
-        worker_batches = split_list_to_batch(lst=article_batches,
-                                             batch_size=config.EMBEDDING.ARTICLE.WORKER_BATCH_SIZE)
-
-        # Print that the articles are being embedded
-        logger.info(f'Embedding articles (B{ix_batch}/{n_batches})...')
-
-        # Process the large batches of article batches in parallel
-        with Pool(processes=config.EMBEDDING.ARTICLE.MAX_WORKERS) as pool:
-            results = list()
-            # Process each worker batch in parallel
-            for ix_worker, worker_batch in enumerate(worker_batches):
-                params = dict(
-                    iterable=worker_batch,
-                    function_process_single=embed_article_batch,
-                    table_id=target_table_id,
-                    metadata=metadata,
-                    max_records=config.EMBEDDING.ARTICLE.N_MAX_RECORDS,
-                    max_iterations_to_offload=config.EMBEDDING.ARTICLE.N_MAX_ITERATIONS_TO_OFFLOAD,
-                    data_schema=data_schema
-                )
-                result = pool.apply_async(process_worker_batch, kwds=params)
-                results.append(result)
-
-            # Wait for all processes to finish
-            for ix_worker, result in enumerate(results):
-                result.get()
-                logger.info(f'Finished embedding articles for worker {ix_worker} (B{ix_batch}/{n_batches}).')
-
-            # Close the pool (no more tasks can be submitted)
-            pool.close()
-            # Join the pool (wait for all processes to finish)
-            pool.join()
+    # Open the ledger of the threaded runner and create the writer that stages its embeddings
+    ledger = EmbeddingLedger(path=config.EMBEDDING.ARTICLE.LEDGER_PATH) \
+        if config.EMBEDDING.ARTICLE.LEDGER_PATH is not None else None
+    staging_writer = EmbeddingStagingWriter(bq_client=bq_client,
+                                            table_id=target_table_id,
+                                            staging_dir=config.EMBEDDING.ARTICLE.STAGING_DIR,
+                                            data_schema=data_schema,
+                                            dtype=config.TEXT_EMBEDDING.STORAGE_DTYPE,
+                                            rows_per_file=config.EMBEDDING.ARTICLE.STAGING_ROWS_PER_FILE,
+                                            ledger=ledger)
+
+    if config.EMBEDDING.ARTICLE.RUNNER == 'threaded':
+        # Resume a stopped run: load its staged embeddings and embed the articles of its ledger first
+        if ledger is not None:
+            staging_writer.recover()
+            staging_writer.flush()
+
+        while True:
+            articles = ledger.get_queued() if ledger is not None else None
+            if articles is None or articles.empty:
+                logger.info('Fetching articles to embed...')
+                articles = get_article_batch(bq_client=bq_client,
+                                             source_table_id=source_table_id,
+                                             target_table_id=target_table_id,
+                                             batch_size=iteration_batch_size)
+                if articles.empty:
+                    break
+                if ledger is not None:
+                    # Articles that are done in the ledger are in BigQuery, so none of them should be fetched again
+                    if ledger.enqueue(articles=articles) == 0:
+                        logger.warning('All the fetched articles are done in the ledger, stopping.')
+                        break
+                    articles = ledger.get_queued()
+            else:
+                logger.info(f'Resuming the {len(articles)} queued articles of the ledger...')
+
+            # Embed the articles with the model of this process
+            logger.info(f'Embedding {len(articles)} articles...')
+            timer = embed_articles_threaded(articles=articles,
+                                            model=model,
+                                            tokenizer=tokenizer,
+                                            staging_writer=staging_writer,
+                                            cache=cache,
+                                            article_batch_size=config.EMBEDDING.ARTICLE.ARTICLE_BATCH_SIZE,
+                                            n_tokenizer_threads=config.EMBEDDING.ARTICLE.N_TOKENIZER_THREADS,
+                                            chunking=chunking)
+            timer.log_report()
+
+        # Stop the load thread of the staging writer
+        staging_writer.close()
+    else:
+        # Get the number of article batches
+        n_batches = get_article_batch_count(bq_client=bq_client,
+                                            source_table_id=source_table_id,
+                                            target_table_id=target_table_id,
+                                            batch_size=iteration_batch_size)
+
+        # Embed articles in batches until all articles are embedded
+        for ix_batch in range(n_batches):
+
+            logger.info(f'Fetching articles to query (B{ix_batch}/{n_batches})... ')
+
+            # Get the articles that are included in the network
+            articles = get_article_batch(bq_client=bq_client,
+                                         source_table_id=source_table_id,
+                                         target_table_id=target_table_id,
+                                         batch_size=iteration_batch_size)
+
+            # Print that the articles are being embedded
+            logger.info(f'Embedding articles (B{ix_batch}/{n_batches})...')
+
+            # Split articles into batches
+            article_batches = split_list_to_batch(lst=articles,
+                                                  batch_size=config.EMBEDDING.ARTICLE.ARTICLE_BATCH_SIZE)
+            worker_batches = split_list_to_batch(lst=article_batches,
+                                                 batch_size=config.EMBEDDING.ARTICLE.WORKER_BATCH_SIZE)
+
+            # Process the large batches of article batches in parallel
+            with Pool(processes=config.EMBEDDING.ARTICLE.MAX_WORKERS) as pool:
+                results = list()
+                # Process each worker batch in parallel
+                for ix_worker, worker_batch in enumerate(worker_batches):
+                    params = dict(
+                        iterable=worker_batch,
+                        function_process_single=embed_article_batch,
+                        table_id=target_table_id,
+                        metadata=metadata,
+                        max_records=config.EMBEDDING.ARTICLE.N_MAX_RECORDS,
+                        max_iterations_to_offload=config.EMBEDDING.ARTICLE.N_MAX_ITERATIONS_TO_OFFLOAD,
+                        data_schema=data_schema
+                    )
+                    result = pool.apply_async(process_worker_batch, kwds=params)
+                    results.append(result)
+
+                # Wait for all processes to finish
+                for ix_worker, result in enumerate(results):
+                    result.get()
+                    logger.info(f'Finished embedding articles for worker {ix_worker} (B{ix_batch}/{n_batches}).')
+
+                # Close the pool (no more tasks can be submitted)
+                pool.close()
+                # Join the pool (wait for all processes to finish)
+                pool.join()
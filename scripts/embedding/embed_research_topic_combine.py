@@ -1,7 +1,8 @@
 """
 Script: Embed research topic metadata
 
-This script reads through the CERIF research topics and embeds the research topics using a transformer model.
+This script reads through the CERIF research topics and combines the embedding of every research topic with the
+average embedding of its top N articles. The embeddings are already computed, so no model is loaded.
 
 """
 
@@ -13,14 +14,13 @@ import sys
 from box import Box
 from google.cloud import bigquery
 from loguru import logger
-from tqdm import tqdm
 
 # Add the root directory of the project to the path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
 from util.common.helpers import offload_batch_to_bigquery, set_logger
-from util.embedding.helpers import get_model_and_tokenizer
 from util.embedding.research_topic import combine_research_topic_embeddings
+from util.embedding.storage import encode_embeddings, get_embedding_schema
 
 # -------------------- GLOBAL VARIABLES --------------------
 # The path to the configuration file
@@ -36,9 +36,6 @@ if __name__ == '__main__':
     # Create a BigQuery client
     bq_client = bigquery.Client(project=config.GCP.PROJECT_ID)
 
-    # Set model and tokenizer used to embed the text
-    model, tokenizer = get_model_and_tokenizer(model_name=config.TEXT_EMBEDDING.MODEL_NAME)
-
     # --------------- Table: TEXT_EMBEDDING_CERIF_RESEARCH_TOPIC ---------------
     source_table_id_research_topic_metadata = f"{config.GCP.PROJECT_ID}.{config.GCP.ANALYTICS_SCHEMA}.{config.EMBEDDING.RESEARCH_TOPIC_METADATA.TARGET_TABLE_NAME}"
     source_table_id_research_topic_top_n_articles = f"{config.GCP.PROJECT_ID}.{config.GCP.ANALYTICS_SCHEMA}.{config.EMBEDDING.RESEARCH_TOPIC_TOP_N_ARTICLES.TARGET_TABLE_NAME}"
@@ -56,29 +53,24 @@ if __name__ == '__main__':
     # Print that we start combining embeddings
     logger.info("Combining the embeddings...")
 
-    # Initialize the list of combined embeddings
-    lst_embeddings_combined = list()
-    # Go through research topic codes and for each average the embeddings
-    for research_topic_code in tqdm(df_research_topic_metadata['RESEARCH_TOPIC_CODE'].unique()):
-        # Generate the combined embedding
-        embedding_combined = combine_research_topic_embeddings(research_topic_code=research_topic_code,
-                                                               df_research_topic_metadata=df_research_topic_metadata,
-                                                               df_research_topic_top_n_articles=df_research_topic_top_n_articles)
-
-        # Append the combined embedding to the list
-        lst_embeddings_combined.append(
-            {
-                'RESEARCH_TOPIC_CODE': research_topic_code,
-                'EMBEDDING_TENSOR_SHAPE': list(embedding_combined.shape),
-                'EMBEDDING_TENSOR_DATA': embedding_combined.flatten().tolist()
-            }
-        )
+    # Combine the embeddings of all the research topics at once
+    research_topic_codes, embeddings_combined = combine_research_topic_embeddings(
+        df_research_topic_metadata=df_research_topic_metadata,
+        df_research_topic_top_n_articles=df_research_topic_top_n_articles)
+    lst_embeddings_combined = [
+        {
+            'RESEARCH_TOPIC_CODE': research_topic_code,
+            **embedding_fields
+        }
+        for research_topic_code, embedding_fields in
+        zip(research_topic_codes, encode_embeddings(embeddings=embeddings_combined,
+                                                    dtype=config.TEXT_EMBEDDING.STORAGE_DTYPE))
+    ]
 
     # Configure the load job to replace data on an existing table
     data_schema = [
         bigquery.SchemaField("RESEARCH_TOPIC_CODE", "STRING"),
-        bigquery.SchemaField("EMBEDDING_TENSOR_SHAPE", "INT64", mode="REPEATED"),
-        bigquery.SchemaField("EMBEDDING_TENSOR_DATA", "FLOAT64", mode="REPEATED")
+        *get_embedding_schema()
     ]
 
     # Offload the DataFrame to BigQuery, truncating the existing table
@@ -17,8 +17,10 @@ from google.cloud import bigquery
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
 from util.common.helpers import set_logger
+from util.embedding.cache import get_embedding_cache
 from util.embedding.helpers import get_model_and_tokenizer, split_list_to_batch
 from util.embedding.research_topic import embed_research_topic_metadata
+from util.embedding.storage import get_embedding_schema
 
 # Add the root directory of the project to the path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
@@ -38,7 +40,17 @@ if __name__ == '__main__':
     bq_client = bigquery.Client(project=config.GCP.PROJECT_ID)
 
     # Set model and tokenizer used to embed the text
-    model, tokenizer = get_model_and_tokenizer(model_name=config.TEXT_EMBEDDING.MODEL_NAME)
+    model, tokenizer = get_model_and_tokenizer(model_name=config.TEXT_EMBEDDING.MODEL_NAME,
+                                               backend=config.TEXT_EMBEDDING.BACKEND,
+                                               onnx_model_path=config.TEXT_EMBEDDING.ONNX_MODEL_PATH,
+                                               n_threads=config.TEXT_EMBEDDING.N_THREADS)
+
+    # Open the cache of the embeddings of the input texts
+    cache = get_embedding_cache(cache_path=config.TEXT_EMBEDDING.CACHE_PATH,
+                                model_name=config.TEXT_EMBEDDING.MODEL_NAME,
+                                backend=config.TEXT_EMBEDDING.BACKEND,
+                                max_bytes=config.TEXT_EMBEDDING.CACHE_MAX_BYTES,
+                                onnx_model_path=config.TEXT_EMBEDDING.ONNX_MODEL_PATH)
 
     # --------------- Table: TEXT_EMBEDDING_CERIF_RESEARCH_TOPIC ---------------
     source_table_id = f"{config.GCP.PROJECT_ID}.{config.GCP.READ_SCHEMA}.{config.EMBEDDING.RESEARCH_TOPIC_METADATA.SOURCE_TABLE_NAME}"
@@ -55,15 +67,16 @@ if __name__ == '__main__':
     # Embed the research topics
     df_embeddings = embed_research_topic_metadata(lst_research_topics=research_topics,
                                                   model=model,
-                                                  tokenizer=tokenizer)
+                                                  tokenizer=tokenizer,
+                                                  cache=cache,
+                                                  storage_dtype=config.TEXT_EMBEDDING.STORAGE_DTYPE)
 
     # Configure the load job to replace data on an existing table
     job_config = bigquery.LoadJobConfig(
         write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
         schema=[
             bigquery.SchemaField("RESEARCH_TOPIC_CODE", "STRING"),
-            bigquery.SchemaField("EMBEDDING_TENSOR_SHAPE", "INT64", mode="REPEATED"),
-            bigquery.SchemaField("EMBEDDING_TENSOR_DATA", "FLOAT64", mode="REPEATED")
+            *get_embedding_schema()
         ]
     )
 
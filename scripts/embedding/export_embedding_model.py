@@ -0,0 +1,103 @@
+"""
+Script: Export and validate the embedding model
+
+This script exports the text embedding model to ONNX for the 'onnx' embedding backend, with its weights dynamically
+quantized to INT8 if TEXT_EMBEDDING.ONNX_QUANTIZE is set, and validates an embedding backend against the FP32 PyTorch
+model. The validation embeds a sample of article texts with both, reports the cosine drift of the backend's embeddings
+and the throughput of both, and fails if the drift exceeds TEXT_EMBEDDING.MAX_COSINE_DRIFT.
+
+The sample is read from the --input CSV file (column EMBEDDING_INPUT) or, by default, from the article embedding source
+table in BigQuery.
+
+Usage:
+    python scripts/embedding/export_embedding_model.py [--backend onnx] [--skip-export] [--input texts.csv]
+
+"""
+# -------------------- IMPORT LIBRARIES --------------------
+
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+from box import Box
+from google.cloud import bigquery
+from loguru import logger
+from transformers import AutoModel, AutoTokenizer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from util.common.helpers import set_logger
+from util.embedding.backend import EMBEDDING_BACKENDS, export_onnx_model, get_cosine_drift, get_embedding_model
+from util.embedding.inference import embed_texts
+
+# -------------------- GLOBAL VARIABLES --------------------
+PATH_TO_CONFIG_FILE = 'config.yml'
+
+# -------------------- MAIN SCRIPT --------------------
+if __name__ == '__main__':
+    # Load the configuration file
+    config = Box.from_yaml(filename=PATH_TO_CONFIG_FILE)
+
+    # Parse the arguments
+    parser = argparse.ArgumentParser(description='Export the embedding model to ONNX and validate a backend.')
+    parser.add_argument('--backend', default=config.TEXT_EMBEDDING.BACKEND, choices=EMBEDDING_BACKENDS,
+                        help='Embedding backend to validate against the FP32 PyTorch model.')
+    parser.add_argument('--skip-export', action='store_true', help='Validate an already exported ONNX model.')
+    parser.add_argument('--input', default=None,
+                        help='CSV file with the texts to validate on (column EMBEDDING_INPUT).')
+    args = parser.parse_args()
+
+    # Set the logger
+    set_logger()
+
+    # Load the FP32 model and the tokenizer
+    reference_model = AutoModel.from_pretrained(config.TEXT_EMBEDDING.MODEL_NAME)
+    reference_model.eval()
+    tokenizer = AutoTokenizer.from_pretrained(config.TEXT_EMBEDDING.MODEL_NAME)
+
+    # Export the model to ONNX
+    if args.backend == 'onnx' and not args.skip_export:
+        export_onnx_model(model=reference_model,
+                          tokenizer=tokenizer,
+                          onnx_model_path=config.TEXT_EMBEDDING.ONNX_MODEL_PATH,
+                          quantize=config.TEXT_EMBEDDING.ONNX_QUANTIZE)
+
+    # Get the sample of texts to validate on
+    if args.input is not None:
+        df_texts = pd.read_csv(args.input)
+    else:
+        bq_client = bigquery.Client(project=config.GCP.PROJECT_ID)
+        source_table_id = (f"{config.GCP.PROJECT_ID}.{config.GCP.READ_SCHEMA}."
+                           f"{config.EMBEDDING.ARTICLE.SOURCE_TABLE_NAME}")
+        df_texts = bq_client.query(f"""SELECT EMBEDDING_INPUT
+                                       FROM `{source_table_id}`
+                                       LIMIT {config.TEXT_EMBEDDING.N_VALIDATION_TEXTS}""").result().to_dataframe()
+    texts = df_texts['EMBEDDING_INPUT'].astype(str).tolist()[:config.TEXT_EMBEDDING.N_VALIDATION_TEXTS]
+
+    # Embed the texts with the backend and the FP32 model
+    model = get_embedding_model(model_name=config.TEXT_EMBEDDING.MODEL_NAME,
+                                backend=args.backend,
+                                onnx_model_path=config.TEXT_EMBEDDING.ONNX_MODEL_PATH,
+                                n_threads=config.TEXT_EMBEDDING.N_THREADS)
+    start = time.perf_counter()
+    embeddings = embed_texts(lst_to_embed=texts, model=model, tokenizer=tokenizer)
+    time_backend = time.perf_counter() - start
+    start = time.perf_counter()
+    reference_embeddings = embed_texts(lst_to_embed=texts, model=reference_model, tokenizer=tokenizer)
+    time_reference = time.perf_counter() - start
+
+    # Report the cosine drift and the throughput
+    drift = get_cosine_drift(embeddings=embeddings, reference_embeddings=reference_embeddings)
+    logger.info(f"Backend '{args.backend}' on {drift['N_TEXTS']} texts: minimum cosine similarity "
+                f"{drift['MIN_COSINE_SIMILARITY']:.6f}, 1st percentile {drift['P01_COSINE_SIMILARITY']:.6f}, mean "
+                f"{drift['MEAN_COSINE_SIMILARITY']:.6f}.")
+    logger.info(f"Throughput: {len(texts) / time_backend:.1f} texts/s with '{args.backend}', "
+                f"{len(texts) / time_reference:.1f} texts/s with the FP32 model "
+                f"({time_reference / time_backend:.2f}x).")
+
+    if drift['MAX_COSINE_DRIFT'] > config.TEXT_EMBEDDING.MAX_COSINE_DRIFT:
+        logger.error(f"The cosine drift {drift['MAX_COSINE_DRIFT']:.6f} exceeds the maximum of "
+                     f"{config.TEXT_EMBEDDING.MAX_COSINE_DRIFT}.")
+        sys.exit(1)
@@ -0,0 +1,68 @@
+"""
+Script: Mirror embeddings
+
+This script downloads an embedding table from BigQuery into a local Parquet mirror, with the key columns of the table
+and the embeddings as a fixed-size list column, so that analyses can load all the embeddings as one NumPy matrix
+(see util.embedding.storage.read_embedding_mirror) without querying BigQuery. The embedding bytes are decoded from the
+Arrow result without copying.
+
+Usage:
+    python scripts/embedding/mirror_embeddings.py --table article [--output data/TEXT_EMBEDDING_ARTICLE.parquet]
+
+"""
+# -------------------- IMPORT LIBRARIES --------------------
+
+import argparse
+import os
+import sys
+
+from box import Box
+from google.cloud import bigquery
+from loguru import logger
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from util.common.helpers import set_logger
+from util.embedding.storage import decode_embeddings, write_embedding_mirror
+
+# -------------------- GLOBAL VARIABLES --------------------
+PATH_TO_CONFIG_FILE = 'config.yml'
+
+# -------------------- MAIN SCRIPT --------------------
+if __name__ == '__main__':
+    # Parse the arguments
+    parser = argparse.ArgumentParser(description='Download an embedding table into a local Parquet mirror.')
+    parser.add_argument('--table', required=True, choices=['article', 'research_topic'],
+                        help='Embedding table to mirror.')
+    parser.add_argument('--output', default=None, help='Path of the Parquet mirror, data/<TABLE>.parquet by default.')
+    args = parser.parse_args()
+
+    # Set the logger
+    set_logger()
+    # Load the configuration file
+    config = Box.from_yaml(filename=PATH_TO_CONFIG_FILE)
+
+    # Full table ID
+    table_name = dict(article=config.EMBEDDING.ARTICLE.TARGET_TABLE_NAME,
+                      research_topic=config.EMBEDDING.RESEARCH_TOPIC_COMBINED.TARGET_TABLE_NAME)[args.table]
+    table_id = f"{config.GCP.PROJECT_ID}.{config.GCP.ANALYTICS_SCHEMA}.{table_name}"
+    output_path = args.output or os.path.join('data', f'{table_name}.parquet')
+
+    # Download the table as Arrow
+    bq_client = bigquery.Client(project=config.GCP.PROJECT_ID)
+    logger.info(f"Downloading the embeddings of {table_id}...")
+    table = bq_client.query(f"SELECT * FROM `{table_id}`").result().to_arrow()
+
+    # Decode the embeddings and write them with the key columns
+    dtypes = table['EMBEDDING_TENSOR_DTYPE'].unique().to_pylist()
+    if len(dtypes) > 1:
+        raise ValueError(f"The embeddings are stored in several data types: {dtypes}.")
+    dtype = dtypes[0] if dtypes else config.TEXT_EMBEDDING.STORAGE_DTYPE
+    embeddings = decode_embeddings(values=table['EMBEDDING_TENSOR_BYTES'], dtype=dtype)
+    keys = table.drop_columns(['EMBEDDING_TENSOR_SHAPE', 'EMBEDDING_TENSOR_DTYPE',
+                               'EMBEDDING_TENSOR_BYTES']).to_pandas()
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    write_embedding_mirror(path=output_path, keys=keys, embeddings=embeddings, dtype=dtype)
+    logger.info(f"Mirrored {len(keys)} embeddings of shape {embeddings.shape[1:]} to {output_path} "
+                f"({os.path.getsize(output_path) / 2 ** 20:.1f} MiB).")
@@ -0,0 +1,60 @@
+"""
+Script: Sync embedding store
+
+This script syncs the local memory-mapped embedding store of an embedding table (see util.embedding.store) with
+BigQuery. The article store is synced incrementally: only the embeddings of DOIs that are not in the store yet are
+downloaded and appended. The research topic embeddings are replaced by every run of embed_research_topic_combine.py, so
+their store is rebuilt. The stores are read by the analytics jobs (e.g. derive_article_topics.py --local-store) without
+querying BigQuery.
+
+Usage:
+    python scripts/embedding/sync_embedding_store.py --table article [--rebuild]
+
+"""
+# -------------------- IMPORT LIBRARIES --------------------
+
+import argparse
+import os
+import sys
+
+from box import Box
+from google.cloud import bigquery
+from loguru import logger
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from util.common.helpers import set_logger
+from util.embedding.store import sync_embedding_store
+
+# -------------------- GLOBAL VARIABLES --------------------
+PATH_TO_CONFIG_FILE = 'config.yml'
+
+# -------------------- MAIN SCRIPT --------------------
+if __name__ == '__main__':
+    # Parse the arguments
+    parser = argparse.ArgumentParser(description='Sync the local embedding store of an embedding table.')
+    parser.add_argument('--table', required=True, choices=['article', 'research_topic'],
+                        help='Embedding table to sync.')
+    parser.add_argument('--rebuild', action='store_true', help='Remove the embeddings of the store first.')
+    args = parser.parse_args()
+
+    # Set the logger
+    set_logger()
+    # Load the configuration file
+    config = Box.from_yaml(filename=PATH_TO_CONFIG_FILE)
+
+    # Settings of the table
+    table_config = dict(article=config.EMBEDDING.ARTICLE,
+                        research_topic=config.EMBEDDING.RESEARCH_TOPIC_COMBINED)[args.table]
+    key_column = dict(article='DOI', research_topic='RESEARCH_TOPIC_CODE')[args.table]
+    table_id = f"{config.GCP.PROJECT_ID}.{config.GCP.ANALYTICS_SCHEMA}.{table_config.TARGET_TABLE_NAME}"
+
+    # Sync the store
+    bq_client = bigquery.Client(project=config.GCP.PROJECT_ID)
+    store = sync_embedding_store(path=table_config.LOCAL_STORE_PATH,
+                                 bq_client=bq_client,
+                                 table_id=table_id,
+                                 key_column=key_column,
+                                 batch_size=config.TEXT_EMBEDDING.STORE_SYNC_BATCH_SIZE,
+                                 rebuild=args.rebuild or args.table == 'research_topic')
+    logger.info(f"The store at {table_config.LOCAL_STORE_PATH} holds {len(store)} embeddings of dimension {store.dim}.")
@@ -2,6 +2,8 @@
 Script: Fetch CERIF topic Crossref articles
 
 This script reads through the CERIF research topics and fetches top N most relevant articles from Crossref that are related to the research topics.
+The research topics are fetched concurrently (MAX_CONCURRENCY requests in flight) under a token-bucket rate limit of
+REQUESTS_PER_SECOND, lowered to the rate limit Crossref announces in its response headers.
 """
 
 # -------------------- IMPORT LIBRARIES --------------------
@@ -18,7 +20,7 @@ from tqdm import tqdm
 # Add the root directory of the project to the path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
-from util.academic.crossref import query_top_n_by_keyword
+from util.academic.crossref import iterate_top_n_by_keywords
 from util.common.helpers import set_logger
 
 # -------------------- GLOBAL VARIABLES --------------------
@@ -47,14 +49,18 @@ if __name__ == '__main__':
     # Read data from the source table
     df_cerif = bq_client.query(f"SELECT * FROM {source_table_id_research_topic}").result().to_dataframe()
 
+    # Query the top N DOIs of every research topic concurrently, within the rate limit of the Crossref polite pool
+    iter_articles_keywords = iterate_top_n_by_keywords(
+        keywords=df_cerif['RESEARCH_TOPIC_NAME'],
+        n=config.HISTORIC.CERIF_RESEARCH_TOPIC_TOP_N_ARTICLES.N_ARTICLES,
+        max_concurrency=config.HISTORIC.CERIF_RESEARCH_TOPIC_TOP_N_ARTICLES.MAX_CONCURRENCY,
+        requests_per_second=config.HISTORIC.CERIF_RESEARCH_TOPIC_TOP_N_ARTICLES.REQUESTS_PER_SECOND,
+        base_url=config.HISTORIC.CERIF_RESEARCH_TOPIC_TOP_N_ARTICLES.API_URL)
+
     # Initialize list to store articles related to research topics
     lst_articles = list()
-    for research_topic in tqdm(df_cerif.iterrows()):
-        research_topic = research_topic[1]
-        # Query the top N DOIs by keyword concatenated to a string to be input into the text embedding model
-        lst_articles_keywords = query_top_n_by_keyword(keyword=research_topic['RESEARCH_TOPIC_NAME'],
-                                                       n=config.HISTORIC.CERIF_RESEARCH_TOPIC_TOP_N_ARTICLES.N_ARTICLES)
-
+    for (_, research_topic), lst_articles_keywords in tqdm(zip(df_cerif.iterrows(), iter_articles_keywords),
+                                                           total=len(df_cerif)):
         # Add keyword and research topic code to the list
         lst_articles_keywords_with_cerif = [
             {
@@ -5,8 +5,10 @@ from bs4 import BeautifulSoup
 from tqdm import tqdm
 from transformers import AutoTokenizer, AutoModel
 
-from util.academic.crossref import query_top_n_by_keyword
+from util.academic.crossref import CROSSREF_POLITE_MAX_CONCURRENCY, CROSSREF_POLITE_REQUESTS_PER_SECOND, \
+    iterate_top_n_by_keywords, query_top_n_by_keyword
 from util.embedding.helpers import embed_batch, split_list_to_batch
+from util.embedding.storage import EMBEDDING_STORAGE_DTYPE, encode_embeddings
 
 
 def get_initial_research_branch() -> dict:
@@ -73,24 +75,18 @@ def extract_research_topics(html: BeautifulSoup) -> pd.DataFrame:
     return pd.DataFrame(list_research_topic)
 
 
-def generate_crossref_topic_embedding_keyword(keyword: str,
-                                              model: AutoModel,
-                                              tokenizer: AutoTokenizer,
-                                              n_articles: int = 10,
-                                              batch_size: int = 8) -> list:
+def embed_crossref_articles(articles: list,
+                            model: AutoModel,
+                            tokenizer: AutoTokenizer,
+                            batch_size: int = 8) -> list:
     """
-    Generate embeddings for the research topics by extracting top 10 most relevant articles from Crossref API.
-    :param batch_size: The batch size
-    :param n_articles: The number of articles to extract
-    :param keyword: The keyword to search for
+    Generate embeddings for the articles extracted from Crossref API.
+    :param articles: The articles to embed
     :param model: The model to use for embeddings
     :param tokenizer: The tokenizer to use for embeddings
-    :return: The embeddings for the research topics
+    :param batch_size: The batch size
+    :return: The embeddings for the articles
     """
-    # Search for the keyword in the Crossref API
-    articles = query_top_n_by_keyword(keyword=keyword,
-                                      n=n_articles)
-
     # Split the articles into batches
     article_batches = split_list_to_batch(lst=articles,
                                           batch_size=batch_size)
@@ -109,26 +105,59 @@ def generate_crossref_topic_embedding_keyword(keyword: str,
     return list_article_embeddings
 
 
+def generate_crossref_topic_embedding_keyword(keyword: str,
+                                              model: AutoModel,
+                                              tokenizer: AutoTokenizer,
+                                              n_articles: int = 10,
+                                              batch_size: int = 8) -> list:
+    """
+    Generate embeddings for the research topics by extracting top 10 most relevant articles from Crossref API.
+    :param batch_size: The batch size
+    :param n_articles: The number of articles to extract
+    :param keyword: The keyword to search for
+    :param model: The model to use for embeddings
+    :param tokenizer: The tokenizer to use for embeddings
+    :return: The embeddings for the research topics
+    """
+    # Search for the keyword in the Crossref API
+    articles = query_top_n_by_keyword(keyword=keyword,
+                                      n=n_articles)
+
+    # Embed the articles
+    return embed_crossref_articles(articles=articles,
+                                   model=model,
+                                   tokenizer=tokenizer,
+                                   batch_size=batch_size)
+
+
 def generate_crossref_topic_embedding_batch(batch: pd.DataFrame,
                                             model: AutoModel,
                                             tokenizer: AutoTokenizer,
                                             n_articles: int = 10,
-                                            batch_size: int = 8) -> list:
+                                            batch_size: int = 8,
+                                            max_concurrency: int = CROSSREF_POLITE_MAX_CONCURRENCY,
+                                            requests_per_second: float = CROSSREF_POLITE_REQUESTS_PER_SECOND) -> list:
     """
-    Generate embeddings for the research topics by extracting top 10 most relevant articles from Crossref API.
+    Generate embeddings for the research topics by extracting top 10 most relevant articles from Crossref API. The
+    articles of the topics are fetched concurrently in the background (see iterate_top_n_by_keywords), so the articles
+    of a topic are embedded while those of the next topics are fetched.
     :param batch_size: The batch size.
     :param n_articles: The number of articles to extract.
     :param batch: The batch of research topics.
+    :param max_concurrency: Maximum number of concurrent requests to Crossref API.
+    :param requests_per_second: Maximum number of requests per second to Crossref API.
     :return: The embeddings for the research topics.
     """
     list_topic_embeddings = list()
-    for topic in batch['RESEARCH_TOPIC_NAME']:
-        # Generate embeddings for the keyword
-        keyword_embeddings = generate_crossref_topic_embedding_keyword(keyword=topic,
-                                                                       model=model,
-                                                                       tokenizer=tokenizer,
-                                                                       n_articles=n_articles,
-                                                                       batch_size=batch_size)
+    for articles in iterate_top_n_by_keywords(keywords=batch['RESEARCH_TOPIC_NAME'],
+                                              n=n_articles,
+                                              max_concurrency=max_concurrency,
+                                              requests_per_second=requests_per_second):
+        # Generate embeddings for the articles of the keyword
+        keyword_embeddings = embed_crossref_articles(articles=articles,
+                                                     model=model,
+                                                     tokenizer=tokenizer,
+                                                     batch_size=batch_size)
 
         # Aggregate the embeddings
         aggregated_topic_embedding = torch.mean(torch.stack(keyword_embeddings), dim=0)
@@ -144,7 +173,10 @@ def process_cerif_embedding_batch(batch: pd.DataFrame,
                                   model: AutoModel,
                                   tokenizer: AutoTokenizer,
                                   n_articles: int = 10,
-                                  batch_size: int = 8) -> list:
+                                  batch_size: int = 8,
+                                  max_concurrency: int = CROSSREF_POLITE_MAX_CONCURRENCY,
+                                  requests_per_second: float = CROSSREF_POLITE_REQUESTS_PER_SECOND,
+                                  storage_dtype: str = EMBEDDING_STORAGE_DTYPE) -> list:
     """
     Process a batch of CERIF research topics. This generates embeddings for the research topics from CERIF and enhances
     them by extracting top n most relevant articles from Crossref API. These articles will then be embedded and
@@ -153,7 +185,10 @@ def process_cerif_embedding_batch(batch: pd.DataFrame,
     :param tokenizer: The tokenizer to use for embeddings
     :param n_articles: The number of articles to extract from Crossref API to enhance the research topic embeddings.
     :param batch_size: The batch size.
-    :return: The embeddings for the research topics.
+    :param max_concurrency: Maximum number of concurrent requests to Crossref API.
+    :param requests_per_second: Maximum number of requests per second to Crossref API.
+    :param storage_dtype: The data type to store the embeddings in.
+    :return: The embeddings for the research topics, encoded as bytes.
     """
     # List of research topic codes and full text
     lst_research_topic_code = batch['RESEARCH_TOPIC_CODE']
@@ -171,15 +206,17 @@ def process_cerif_embedding_batch(batch: pd.DataFrame,
                                                                         model=model,
                                                                         tokenizer=tokenizer,
                                                                         n_articles=n_articles,
-                                                                        batch_size=batch_size)
+                                                                        batch_size=batch_size,
+                                                                        max_concurrency=max_concurrency,
+                                                                        requests_per_second=requests_per_second)
 
     # Create a new batch combined from 20% CERIF embeddings and 80% Crossref embeddings
+    embeddings_combined = 0.2 * cerif_topic_embeddings + 0.8 * torch.stack(crossref_topic_embeddings)
     return [
         {
             'RESEARCH_TOPIC_CODE': code,
-            'EMBEDDING_TENSOR_SHAPE': list(cerif_tensor.shape),
-            'EMBEDDING_TENSOR_DATA': (0.2 * cerif_tensor + 0.8 * crossref_tensor).flatten().tolist()
+            **embedding_fields
         }
-        for code, cerif_tensor, crossref_tensor in
-        zip(lst_research_topic_code, cerif_topic_embeddings, crossref_topic_embeddings)
+        for code, embedding_fields in
+        zip(lst_research_topic_code, encode_embeddings(embeddings=embeddings_combined.numpy(), dtype=storage_dtype))
     ]
@@ -1,14 +1,30 @@
+import asyncio
 import gzip
 import json
 import os
+import queue
+import random
+import threading
+from typing import Iterable
 
+import httpx
 from requests import HTTPError
 from util.academic.eutopia import is_eutopia_affiliated_string
 from util.common.helpers import make_request, MAILTO_EMAIL
+from util.common.rate_limit import AsyncTokenBucket
 
-BASE_URL = "https://api.crossref.org/works/"
+CROSSREF_API_URL = "https://api.crossref.org"
+BASE_URL = f"{CROSSREF_API_URL}/works/"
 PARAMS = {"mailto": MAILTO_EMAIL}
 
+# Limits of the polite pool of the Crossref API (requests with a mailto): requests per second and concurrent requests
+CROSSREF_POLITE_REQUESTS_PER_SECOND = 10
+CROSSREF_POLITE_MAX_CONCURRENCY = 3
+
+# Timeout of a request in seconds and number of tries of a request that fails with a rate limit, server or network error
+CROSSREF_TIMEOUT = 60
+CROSSREF_MAX_TRIES = 8
+
 
 def is_crossref_doi(doi: str) -> bool:
     """
@@ -99,22 +115,203 @@ def process_json_gz(item: str,
     return iteration_settings
 
 
-def query_top_n_by_keyword(keyword: str,
+def get_top_n_by_keyword_params(keyword: str,
+                                n: int) -> dict:
+    """
+    Get the query parameters of the search of the top N articles by keyword, sorted by relevance, with an abstract.
+    :param keyword: Keyword to search for.
+    :param n: Number of articles to return.
+    :return: Dictionary of the query parameters
+    """
+    return dict(PARAMS, query=keyword, sort='relevance', rows=n, filter='has-abstract:true')
+
+
+def parse_top_n_by_keyword(response: dict,
                            n: int) -> list:
     """
+    Parse the articles of a search response.
+    :param response: JSON response of the search
+    :param n: Number of articles to return.
+    :return: List of dictionaries with the DOI and the JSON of each article.
+    """
+    return [dict(
+        DOI=article['DOI'],
+        JSON=json.dumps(article)
+    ) for article in response.get("message")['items']][:n]
+
+
+def query_top_n_by_keyword(keyword: str,
+                           n: int,
+                           base_url: str = CROSSREF_API_URL) -> list:
+    """
     Query the top N DOIs by keyword concatenated to a string to be input into the text embedding model.
     :param keyword: Keyword to search for.
     :param n: Number of DOIs to return.
+    :param base_url: URL of the Crossref API.
     :return: List of DOIs.
     """
 
     # Query the top N by keyword, sorted by relevance, only select title and abstract
-    url = f"https://api.crossref.org/works?query={keyword}&sort=relevance&rows={n}&filter=has-abstract:true"
-    response = make_request(url, PARAMS)
-    return [dict(
-        DOI=article['DOI'],
-        JSON=json.dumps(article)
-    ) for article in response.get("message")['items']][:n]
+    response = make_request(f"{base_url}/works", get_top_n_by_keyword_params(keyword=keyword, n=n))
+    return parse_top_n_by_keyword(response=response, n=n)
+
+
+def update_rate_limit(rate_limiter: AsyncTokenBucket,
+                      headers: httpx.Headers) -> None:
+    """
+    Lower the rate of the rate limiter to the rate limit announced by Crossref in the X-Rate-Limit-Limit and
+    X-Rate-Limit-Interval headers of a response, e.g. 50 requests per '1s'.
+    :param rate_limiter: The rate limiter of the requests.
+    :param headers: Headers of a response of the Crossref API.
+    """
+    try:
+        limit = float(headers['X-Rate-Limit-Limit'])
+        interval = float(headers['X-Rate-Limit-Interval'].rstrip('s'))
+    except (KeyError, ValueError):
+        return
+    if limit > 0 and interval > 0 and limit / interval < rate_limiter.rate:
+        rate_limiter.set_rate(limit / interval)
+
+
+def get_retry_delay(response: httpx.Response,
+                    ix_try: int) -> float:
+    """
+    Get the delay before the next try of a request: the Retry-After of the response if any, exponential backoff with
+    full jitter otherwise.
+    :param response: Response of the failed try, None after a network error.
+    :param ix_try: Index of the failed try.
+    :return: Delay in seconds
+    """
+    if response is not None:
+        try:
+            return float(response.headers['Retry-After'])
+        except (KeyError, ValueError):
+            pass
+    return random.uniform(0, 2 ** ix_try)
+
+
+async def query_top_n_by_keyword_async(client: httpx.AsyncClient,
+                                       keyword: str,
+                                       n: int,
+                                       rate_limiter: AsyncTokenBucket,
+                                       base_url: str = CROSSREF_API_URL,
+                                       max_tries: int = CROSSREF_MAX_TRIES) -> list:
+    """
+    Query the top N DOIs by keyword, like query_top_n_by_keyword, through an asynchronous client. Every try takes a
+    token of the rate limiter, and tries that fail with a rate limit (429), server or network error are retried.
+    :param client: The asynchronous HTTP client.
+    :param keyword: Keyword to search for.
+    :param n: Number of DOIs to return.
+    :param rate_limiter: The rate limiter shared by all the requests.
+    :param base_url: URL of the Crossref API.
+    :param max_tries: Maximum number of tries of the request.
+    :return: List of DOIs.
+    """
+    params = get_top_n_by_keyword_params(keyword=keyword, n=n)
+    for ix_try in range(max_tries):
+        await rate_limiter.acquire()
+        try:
+            response = await client.get(f"{base_url}/works", params=params)
+        except httpx.TransportError:
+            if ix_try == max_tries - 1:
+                raise
+            await asyncio.sleep(get_retry_delay(response=None, ix_try=ix_try))
+            continue
+
+        update_rate_limit(rate_limiter=rate_limiter, headers=response.headers)
+        if (response.status_code == 429 or response.status_code >= 500) and ix_try < max_tries - 1:
+            await asyncio.sleep(get_retry_delay(response=response, ix_try=ix_try))
+            continue
+        response.raise_for_status()
+        return parse_top_n_by_keyword(response=response.json(), n=n)
+
+
+async def fetch_top_n_by_keywords(keywords: list,
+                                  n: int,
+                                  on_result: callable,
+                                  max_concurrency: int = CROSSREF_POLITE_MAX_CONCURRENCY,
+                                  requests_per_second: float = CROSSREF_POLITE_REQUESTS_PER_SECOND,
+                                  base_url: str = CROSSREF_API_URL,
+                                  stop_event: threading.Event = None) -> None:
+    """
+    Query the top N DOIs of many keywords concurrently. max_concurrency tasks take the keywords in order and share one
+    connection pool and one token-bucket rate limiter, so there are never more than max_concurrency requests in flight
+    and never more than requests_per_second requests per second (or the lower rate announced by Crossref).
+    :param keywords: List of the keywords to search for.
+    :param n: Number of DOIs to return per keyword.
+    :param on_result: Function called with the index of a keyword and its list of DOIs when they are fetched.
+    :param max_concurrency: Maximum number of concurrent requests.
+    :param requests_per_second: Maximum number of requests per second.
+    :param base_url: URL of the Crossref API.
+    :param stop_event: Event that stops the tasks before their next keyword, None to fetch all the keywords.
+    """
+    rate_limiter = AsyncTokenBucket(rate=requests_per_second)
+    keyword_queue = asyncio.Queue()
+    for ix_keyword, keyword in enumerate(keywords):
+        keyword_queue.put_nowait((ix_keyword, keyword))
+
+    limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=CROSSREF_TIMEOUT) as client:
+        async def fetch() -> None:
+            while not keyword_queue.empty() and (stop_event is None or not stop_event.is_set()):
+                ix_keyword, keyword = keyword_queue.get_nowait()
+                on_result(ix_keyword, await query_top_n_by_keyword_async(client=client,
+                                                                         keyword=keyword,
+                                                                         n=n,
+                                                                         rate_limiter=rate_limiter,
+                                                                         base_url=base_url))
+
+        await asyncio.gather(*[fetch() for _ in range(max_concurrency)])
+
+
+def iterate_top_n_by_keywords(keywords: Iterable,
+                              n: int,
+                              max_concurrency: int = CROSSREF_POLITE_MAX_CONCURRENCY,
+                              requests_per_second: float = CROSSREF_POLITE_REQUESTS_PER_SECOND,
+                              base_url: str = CROSSREF_API_URL) -> Iterable:
+    """
+    Iterate over the top N DOIs of many keywords, fetched concurrently in a background thread (see
+    fetch_top_n_by_keywords), so that the caller can process the results of a keyword, e.g. embed them, while the next
+    keywords are fetched.
+    :param keywords: Iterable of the keywords to search for.
+    :param n: Number of DOIs to return per keyword.
+    :param max_concurrency: Maximum number of concurrent requests.
+    :param requests_per_second: Maximum number of requests per second.
+    :param base_url: URL of the Crossref API.
+    :return: Iterator of the lists of DOIs of the keywords, in the order of the keywords
+    """
+    keywords = list(keywords)
+    result_queue = queue.Queue()
+    stop_event = threading.Event()
+
+    def fetch() -> None:
+        try:
+            asyncio.run(fetch_top_n_by_keywords(keywords=keywords,
+                                                n=n,
+                                                on_result=lambda ix_keyword, articles: result_queue.put(
+                                                    (ix_keyword, articles)),
+                                                max_concurrency=max_concurrency,
+                                                requests_per_second=requests_per_second,
+                                                base_url=base_url,
+                                                stop_event=stop_event))
+        except BaseException as e:
+            result_queue.put((None, e))
+
+    thread = threading.Thread(target=fetch, name='crossref-fetch', daemon=True)
+    thread.start()
+    try:
+        # Yield the results in the order of the keywords, keeping the ones that are fetched ahead
+        results = dict()
+        for ix_keyword in range(len(keywords)):
+            while ix_keyword not in results:
+                ix_result, result = result_queue.get()
+                if ix_result is None:
+                    raise result
+                results[ix_result] = result
+            yield results.pop(ix_keyword)
+    finally:
+        stop_event.set()
+        thread.join()
 
 
 def process_reference_article(item: str,
@@ -2,47 +2,46 @@ import numpy as np
 import pandas as pd
 from google.cloud import bigquery
 from loguru import logger
-from tqdm import tqdm
 
 from util.common.helpers import offload_batch_to_bigquery
-from util.embedding.helpers import cosine_similarity
+from util.embedding.storage import get_embedding_matrix
 
 
 def process_article_embedding_batch(article_embeddings: pd.DataFrame,
                                     topic_embeddings: pd.DataFrame,
                                     topic_embedding_values: np.ndarray,
                                     bq_client: bigquery.Client,
-                                    target_table_id: str):
+                                    target_table_id: str,
+                                    article_embedding_values: np.ndarray = None):
     """
     Process the article embeddings and calculate the cosine similarity between the research topics and the articles.
-    :param topic_embedding_values: The research topic embeddings as a list of numpy arrays.
+    :param topic_embedding_values: The research topic embeddings as a matrix with one row per research topic.
     :param article_embeddings: The article embeddings.
     :param topic_embeddings: The research topic embeddings.
     :param bq_client: The BigQuery client.
     :param target_table_id: The target table ID.
+    :param article_embedding_values: The article embeddings as a matrix with one row per article, e.g. from the local
+    embedding store, decoded from the article embeddings if None.
     """
     logger.info("Calculating the cosine similarity between the research topics and the articles...")
 
-    # Initialize the article-topic mapping
-    article_topic_mapping = []
-    for i, article_embedding in enumerate(tqdm(article_embeddings['EMBEDDING_TENSOR_DATA'].values.tolist())):
-
-        # Calculate the cosine similarity between the research topics and the article
-        similarities = cosine_similarity(vector=article_embedding,
-                                         matrix=topic_embedding_values)
-
-        # Find the 3 top most similar research topics
-        top_3_topics = np.argsort(similarities)[::-1][:3]
-
-        # Add all the top 3 topics to the mapping along with ranking
-        for rank, topic in enumerate(top_3_topics, 1):
-            # Add the article-topic mapping
-            article_topic = dict(DOI=article_embeddings['DOI'].iloc[i],
-                                 RESEARCH_TOPIC_CODE=topic_embeddings['RESEARCH_TOPIC_CODE'].iloc[topic],
-                                 RANK=rank)
-
-            # Append to the article-topic mapping list
-            article_topic_mapping.append(article_topic)
+    # Calculate the cosine similarity between all the articles and research topics at once
+    if article_embedding_values is None:
+        article_embedding_values = get_embedding_matrix(article_embeddings)
+    article_matrix = np.asarray(article_embedding_values, dtype=np.float64)
+    topic_matrix = np.asarray(topic_embedding_values, dtype=np.float64)
+    similarities = (article_matrix @ topic_matrix.T) / (np.linalg.norm(article_matrix, axis=1)[:, None]
+                                                        * np.linalg.norm(topic_matrix, axis=1)[None, :])
+
+    # Find the 3 top most similar research topics of each article
+    top_3_topics = np.argsort(similarities, axis=1)[:, ::-1][:, :3]
+
+    # Add all the top 3 topics to the mapping along with ranking
+    article_topic_mapping = pd.DataFrame(dict(
+        DOI=np.repeat(article_embeddings['DOI'].to_numpy(), top_3_topics.shape[1]),
+        RESEARCH_TOPIC_CODE=topic_embeddings['RESEARCH_TOPIC_CODE'].to_numpy()[top_3_topics.reshape(-1)],
+        RANK=np.tile(np.arange(1, top_3_topics.shape[1] + 1), len(top_3_topics))
+    )).to_dict('records')
 
     logger.info("Offloading the article-topic mapping to BigQuery...")
     offload_batch_to_bigquery(client=bq_client,
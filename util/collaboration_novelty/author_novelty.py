@@ -0,0 +1,230 @@
+import numpy as np
+import pandas as pd
+
+from util.collaboration_novelty.serialization import deserialize_parquet, is_parquet, load_legacy_pickle, \
+    serialize_parquet
+
+# Counters of an author in a year, in the order in which they are stored
+AUTHOR_NOVELTY_COUNTERS = ['ARTICLE_COUNT',
+                           'NEW_AUTHOR_COLLABORATION_ARTICLE_COUNT',
+                           'NEW_INSTITUTION_COLLABORATION_ARTICLE_COUNT',
+                           'NEW_PARTNER_COUNT',
+                           'REPEAT_PARTNER_COUNT']
+
+# Columns that identify a row of the aggregate table
+AUTHOR_NOVELTY_KEY_COLUMNS = ['AUTHOR_SID', 'YEAR']
+
+# Names of the author novelty state in the edge-delta log
+DELTA_AUTHOR_NOVELTY_YEAR = 'AUTHOR_NOVELTY_YEAR'
+DELTA_AUTHOR_NOVELTY_COUNTER = 'AUTHOR_NOVELTY_COUNTER'
+DELTA_AUTHOR_NOVELTY_INSTITUTION = 'AUTHOR_NOVELTY_INSTITUTION'
+
+
+class AuthorNoveltyCounters:
+    """
+    Running per-author novelty counters of the year that is currently being processed:
+        - ARTICLE_COUNT: number of articles of the author
+        - NEW_AUTHOR_COLLABORATION_ARTICLE_COUNT: number of articles with at least one new co-author of the author
+        - NEW_INSTITUTION_COLLABORATION_ARTICLE_COUNT: number of articles on which an institution of the author forms a
+          new pair of institutions
+        - NEW_PARTNER_COUNT: number of co-authors the author collaborated with for the first time
+        - REPEAT_PARTNER_COUNT: number of collaborations with co-authors the author has collaborated with before
+        - INSTITUTION_COUNT: number of distinct institutions of the author
+
+    Articles arrive in chronological order, so the counters of a year are final as soon as the first article of a later
+    year is processed. At that point they are turned into one row per author and year, ready to be written to the
+    aggregate table, and only the counters of the current year are kept. The rows of the current year are written at
+    the end of every run as well, so the aggregate table is upserted on AUTHOR_NOVELTY_KEY_COLUMNS rather than appended
+    to.
+    """
+
+    def __init__(self):
+        # Year of the counters
+        self.year = None
+
+        # Author SID to the list of counters in the order of AUTHOR_NOVELTY_COUNTERS
+        self.counters = dict()
+
+        # Author SID to the set of the author's institution SIDs
+        self.institutions = dict()
+
+        # Rows of the completed years that have not been written yet
+        self.closed_rows = list()
+
+    def get_current_rows(self) -> list:
+        """
+        Get the rows of the current year without closing it, e.g. to inspect a year that is not complete yet.
+        :return: List of rows with the author SID, the year and the counters
+        """
+        return [dict(AUTHOR_SID=author_sid,
+                     YEAR=self.year,
+                     **dict(zip(AUTHOR_NOVELTY_COUNTERS, counters)),
+                     INSTITUTION_COUNT=len(self.institutions[author_sid]))
+                for author_sid, counters in self.counters.items()]
+
+    def _close_year(self) -> None:
+        """
+        Turn the counters of the current year into rows and reset them.
+        """
+        self.closed_rows.extend(self.get_current_rows())
+        self.counters, self.institutions = dict(), dict()
+
+    def add_articles(self,
+                     df_metadata: pd.DataFrame,
+                     df_author_pairs: pd.DataFrame) -> None:
+        """
+        Add processed articles to the counters.
+        :param df_metadata: DataFrame with the collaboration novelty metadata rows of the articles
+        :param df_author_pairs: DataFrame with the publication date, the two author SIDs and the new collaboration flag
+        of every author pair of the articles
+        """
+        if df_metadata.empty:
+            return
+
+        # Article counters of each author and year
+        df_metadata = df_metadata.assign(YEAR=pd.to_datetime(df_metadata['ARTICLE_PUBLICATION_DT']).dt.year)
+        groups = ['YEAR', 'AUTHOR_SID']
+        df_counts = pd.DataFrame(dict(
+            ARTICLE_COUNT=df_metadata.groupby(groups)['ARTICLE_SID'].nunique(),
+            NEW_AUTHOR_COLLABORATION_ARTICLE_COUNT=df_metadata[df_metadata['IS_NEW_AUTHOR_COLLABORATION']].groupby(
+                groups)['ARTICLE_SID'].nunique(),
+            NEW_INSTITUTION_COLLABORATION_ARTICLE_COUNT=df_metadata[
+                df_metadata['IS_NEW_INSTITUTION_COLLABORATION']].groupby(groups)['ARTICLE_SID'].nunique()))
+
+        # Partner counters of each author and year, counting every pair for both of its authors
+        df_partners = pd.DataFrame(dict(
+            YEAR=np.tile(pd.to_datetime(df_author_pairs['ARTICLE_PUBLICATION_DT']).dt.year.to_numpy(), 2),
+            AUTHOR_SID=np.concatenate([df_author_pairs['AUTHOR_SID_1'].to_numpy(dtype=object),
+                                       df_author_pairs['AUTHOR_SID_2'].to_numpy(dtype=object)]),
+            IS_NEW=np.tile(df_author_pairs['IS_NEW'].to_numpy(dtype=bool), 2)))
+        df_partner_counts = df_partners.groupby(groups)['IS_NEW'].agg(['sum', 'size'])
+        df_counts['NEW_PARTNER_COUNT'] = df_partner_counts['sum']
+        df_counts['REPEAT_PARTNER_COUNT'] = df_partner_counts['size'] - df_partner_counts['sum']
+        df_counts = df_counts.fillna(0).astype(np.int64)[AUTHOR_NOVELTY_COUNTERS]
+
+        institutions = df_metadata.groupby(groups)['INSTITUTION_SID'].unique()
+
+        # Add the counters year by year, closing the current year when a later one starts
+        for year, df_year in df_counts.groupby(level='YEAR', sort=True):
+            if self.year is not None and year < self.year:
+                raise ValueError(f"Articles from {year} arrived after articles from {self.year}. The author novelty "
+                                 f"counters require articles in chronological order.")
+            if self.year is not None and year > self.year:
+                self._close_year()
+            self.year = int(year)
+
+            for (_, author_sid), counts, author_institutions in zip(df_year.index, df_year.to_numpy().tolist(),
+                                                                     institutions.loc[year].reindex(
+                                                                         df_year.index.get_level_values(1)).tolist()):
+                author_counters = self.counters.get(author_sid)
+                if author_counters is None:
+                    self.counters[author_sid] = counts
+                    self.institutions[author_sid] = set(author_institutions)
+                else:
+                    for ix, count in enumerate(counts):
+                        author_counters[ix] += count
+                    self.institutions[author_sid].update(author_institutions)
+
+    def pop_closed_rows(self) -> list:
+        """
+        Get the rows of the completed years that have not been written yet and forget them.
+        :return: List of rows with the author SID, the year and the counters
+        """
+        closed_rows, self.closed_rows = self.closed_rows, list()
+        return closed_rows
+
+    def update(self, other: 'AuthorNoveltyCounters', year: int) -> None:
+        """
+        Add the counters of another instance with a disjoint set of authors, e.g. of another shard of the collaboration
+        stream. Its counters of the years before the given (latest) year are closed first.
+        :param other: Author novelty counters
+        :param year: Latest year over all the instances that are merged
+        """
+        if other.year is not None and other.year < year:
+            other._close_year()
+        self.closed_rows.extend(other.pop_closed_rows())
+        self.year = year
+        self.counters.update(other.counters)
+        self.institutions.update(other.institutions)
+
+    def get_delta(self, authors: np.ndarray) -> pd.DataFrame:
+        """
+        Get the state of the current year for a set of authors in the edge-delta format of the collaboration checkpoint.
+        :param authors: Array of author SIDs, e.g. the authors of a processed batch
+        :return: DataFrame with the graph name, the pair of nodes and the weight of every state entry
+        """
+        if self.year is None:
+            return pd.DataFrame(columns=['GRAPH', 'NODE_1', 'NODE_2', 'WEIGHT'])
+
+        authors = [author_sid for author_sid in pd.unique(authors) if author_sid in self.counters]
+        df_counters = pd.DataFrame(dict(
+            GRAPH=DELTA_AUTHOR_NOVELTY_COUNTER,
+            NODE_1=np.repeat(np.array(authors, dtype=object), len(AUTHOR_NOVELTY_COUNTERS)),
+            NODE_2=np.tile(np.array(AUTHOR_NOVELTY_COUNTERS, dtype=object), len(authors)),
+            WEIGHT=np.array([self.counters[author_sid] for author_sid in authors], dtype=np.int64).reshape(-1)))
+        author_institutions = [(author_sid, institution_sid) for author_sid in authors
+                               for institution_sid in self.institutions[author_sid]]
+        df_institutions = pd.DataFrame(dict(
+            GRAPH=DELTA_AUTHOR_NOVELTY_INSTITUTION,
+            NODE_1=[author_sid for author_sid, _ in author_institutions],
+            NODE_2=[institution_sid for _, institution_sid in author_institutions],
+            WEIGHT=np.ones(len(author_institutions), dtype=np.int64)))
+        df_year = pd.DataFrame(dict(GRAPH=[DELTA_AUTHOR_NOVELTY_YEAR], NODE_1=[''], NODE_2=[''], WEIGHT=[self.year]))
+        return pd.concat([df_year, df_counters, df_institutions], ignore_index=True)
+
+    def apply_delta(self, df_delta: pd.DataFrame) -> None:
+        """
+        Apply the state entries of an edge delta. The rows of the years the delta closes are not restored, as they were
+        written together with the batch of the delta.
+        :param df_delta: DataFrame with the graph name, the pair of nodes and the weight of every delta entry
+        """
+        df_year = df_delta[df_delta['GRAPH'] == DELTA_AUTHOR_NOVELTY_YEAR]
+        if df_year.empty:
+            return
+        year = int(df_year['WEIGHT'].iloc[0])
+        if self.year != year:
+            self.counters, self.institutions = dict(), dict()
+            self.year = year
+
+        df_counters = df_delta[df_delta['GRAPH'] == DELTA_AUTHOR_NOVELTY_COUNTER]
+        if df_counters.empty:
+            return
+        counters = df_counters.pivot(index='NODE_1', columns='NODE_2', values='WEIGHT')
+        for author_sid, counts in zip(counters.index.tolist(), counters[AUTHOR_NOVELTY_COUNTERS].to_numpy().tolist()):
+            self.counters[author_sid] = [int(count) for count in counts]
+            self.institutions[author_sid] = set()
+
+        df_institutions = df_delta[df_delta['GRAPH'] == DELTA_AUTHOR_NOVELTY_INSTITUTION]
+        for author_sid, institution_sid in zip(df_institutions['NODE_1'].tolist(), df_institutions['NODE_2'].tolist()):
+            self.institutions[author_sid].add(institution_sid)
+
+
+def serialize_author_novelty_counters(author_novelty: AuthorNoveltyCounters,
+                                      compression: str = 'zstd') -> bytes:
+    """
+    Serialize the counters of the current year to a Parquet file in the edge-delta format of the collaboration
+    checkpoint. The rows of the completed years are not stored, as they are written to the aggregate table as soon as
+    the year closes.
+    :param author_novelty: Author novelty counters
+    :param compression: Compression codec of the Parquet file, None to store it uncompressed
+    :return: Serialized counters
+    """
+    return serialize_parquet(df=author_novelty.get_delta(authors=np.array(list(author_novelty.counters), dtype=object)),
+                             compression=compression)
+
+
+def deserialize_author_novelty_counters(data: bytes,
+                                        allow_pickle: bool = False) -> AuthorNoveltyCounters:
+    """
+    Deserialize author novelty counters stored as a Parquet file or, with allow_pickle, as a pickle.
+    :param data: Serialized counters
+    :param allow_pickle: If True, also load counters pickled by earlier versions
+    :return: Author novelty counters
+    """
+    if not is_parquet(data):
+        return load_legacy_pickle(data=data, allow_pickle=allow_pickle, description='author novelty counters')
+
+    df_delta, _ = deserialize_parquet(data=data)
+    author_novelty = AuthorNoveltyCounters()
+    author_novelty.apply_delta(df_delta=df_delta)
+    return author_novelty
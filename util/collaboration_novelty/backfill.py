@@ -0,0 +1,220 @@
+import heapq
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from util.collaboration_novelty.author_novelty import AuthorNoveltyCounters
+from util.collaboration_novelty.batch import combination_indices, process_batch_collaboration_novelty
+from util.collaboration_novelty.compact_graph import get_empty_collaboration_graph, merge_collaboration_graph
+from util.collaboration_novelty.institution_index import InstitutionCollaborationIndex
+from util.collaboration_novelty.temporal import TemporalCollaborationHistory
+
+
+class UnionFind:
+    """
+    Disjoint-set forest over integer elements with path halving and union by size.
+    """
+
+    def __init__(self, n_elements: int):
+        self.parents = list(range(n_elements))
+        self.sizes = [1] * n_elements
+
+    def find(self, element: int) -> int:
+        """
+        Find the representative of the set of an element.
+        :param element: Element
+        :return: Representative element of the set
+        """
+        parents = self.parents
+        while parents[element] != element:
+            parents[element] = parents[parents[element]]
+            element = parents[element]
+        return element
+
+    def union(self, element_1: int, element_2: int) -> None:
+        """
+        Merge the sets of two elements.
+        :param element_1: First element
+        :param element_2: Second element
+        """
+        root_1, root_2 = self.find(element_1), self.find(element_2)
+        if root_1 == root_2:
+            return
+        if self.sizes[root_1] < self.sizes[root_2]:
+            root_1, root_2 = root_2, root_1
+        self.parents[root_2] = root_1
+        self.sizes[root_1] += self.sizes[root_2]
+
+
+def get_independent_article_components(df: pd.DataFrame) -> tuple:
+    """
+    Partition the articles into components that cannot influence each other's collaboration novelty. Two articles are
+    in the same component if they share an author or a pair of institutions (directly or through other articles), since
+    these are the only pieces of collaboration history the novelty of an article depends on. Sharing a single
+    institution is not enough.
+    :param df: DataFrame with the article SID, author SID and institution SID of the articles
+    :return: Tuple of the article SIDs in the order of their first appearance and the component label of each article
+    """
+    article_codes, article_sids = pd.factorize(df['ARTICLE_SID'])
+    author_codes, author_sids = pd.factorize(df['AUTHOR_SID'])
+    institution_codes, institution_sids = pd.factorize(df['INSTITUTION_SID'])
+    n_articles, n_authors, n_institutions = len(article_sids), len(author_sids), len(institution_sids)
+
+    # Unique institution pairs of each article
+    df_article_institutions = pd.DataFrame(dict(ARTICLE=article_codes, INSTITUTION=institution_codes))
+    df_article_institutions = df_article_institutions.drop_duplicates().sort_values('ARTICLE', kind='stable')
+    pair_article, position_1, position_2 = combination_indices(
+        np.bincount(df_article_institutions['ARTICLE'].to_numpy(), minlength=n_articles))
+    article_institutions = df_article_institutions['INSTITUTION'].to_numpy()
+    institution_1, institution_2 = article_institutions[position_1], article_institutions[position_2]
+    pair_codes, pair_keys = pd.factorize(np.minimum(institution_1, institution_2) * n_institutions
+                                         + np.maximum(institution_1, institution_2))
+
+    # Articles, authors and institution pairs are the elements; articles are joined with their authors and pairs
+    union_find = UnionFind(n_articles + n_authors + len(pair_keys))
+    df_article_authors = pd.DataFrame(dict(ARTICLE=article_codes, AUTHOR=author_codes)).drop_duplicates()
+    for article, element in zip(df_article_authors['ARTICLE'].tolist(),
+                                (n_articles + df_article_authors['AUTHOR'].to_numpy()).tolist()):
+        union_find.union(article, element)
+    for article, element in zip(pair_article.tolist(), (n_articles + n_authors + pair_codes).tolist()):
+        union_find.union(article, element)
+
+    components, _ = pd.factorize(np.array([union_find.find(article) for article in range(n_articles)]))
+    return np.asarray(article_sids, dtype=object), components
+
+
+def assign_components_to_shards(component_sizes: np.ndarray, n_shards: int) -> np.ndarray:
+    """
+    Assign the components to shards, placing the largest components first on the least loaded shard.
+    :param component_sizes: Number of rows in each component
+    :param n_shards: Number of shards
+    :return: Shard index of each component
+    """
+    component_shards = np.zeros(len(component_sizes), dtype=np.int64)
+    shard_loads = [(0, shard) for shard in range(n_shards)]
+    for component in np.argsort(-np.asarray(component_sizes), kind='stable').tolist():
+        load, shard = heapq.heappop(shard_loads)
+        component_shards[component] = shard
+        heapq.heappush(shard_loads, (load + int(component_sizes[component]), shard))
+    return component_shards
+
+
+def process_collaboration_shard(df_shard: pd.DataFrame,
+                                batch_size: int,
+                                backend: str = 'compact',
+                                temporal_settings: dict = None,
+                                track_author_novelty: bool = False) -> tuple:
+    """
+    Derive the collaboration novelty of a shard of independent components, starting from an empty collaboration
+    history.
+    :param df_shard: DataFrame with the collaborations of the shard's articles in chronological order
+    :param batch_size: Number of articles in a batch
+    :param backend: Collaboration graph backend ('networkx' or 'compact')
+    :param temporal_settings: Settings of the temporal collaboration history, None for the lifetime NCI
+    :param track_author_novelty: If True, maintain the author novelty counters of the shard
+    :return: Tuple of the collaboration novelty index and metadata rows, the partial author and institution graphs,
+    the partial institution collaboration index, the partial temporal collaboration history and the partial author
+    novelty counters
+    """
+    G_a, G_i = get_empty_collaboration_graph(backend=backend), get_empty_collaboration_graph(backend=backend)
+    institution_index = InstitutionCollaborationIndex()
+    temporal_history = TemporalCollaborationHistory(**temporal_settings) if temporal_settings is not None else None
+    author_novelty = AuthorNoveltyCounters() if track_author_novelty else None
+
+    # Rows of the same article are contiguous, so whole articles are cut at the batch boundaries
+    article_codes, _ = pd.factorize(df_shard['ARTICLE_SID'])
+    boundaries = np.searchsorted(article_codes, np.arange(0, article_codes.max(initial=-1) + 1, batch_size))
+
+    cni_rows, metadata_rows = list(), list()
+    for start, end in zip(boundaries.tolist(), boundaries[1:].tolist() + [len(df_shard)]):
+        batch_cni_rows, batch_metadata_rows = process_batch_collaboration_novelty(
+            df_batch=df_shard.iloc[start:end].reset_index(drop=True),
+            G_a=G_a,
+            G_i=G_i,
+            institution_index=institution_index,
+            temporal_history=temporal_history,
+            author_novelty=author_novelty)
+        cni_rows.extend(batch_cni_rows)
+        metadata_rows.extend(batch_metadata_rows)
+
+    return cni_rows, metadata_rows, G_a, G_i, institution_index, temporal_history, author_novelty
+
+
+def backfill_collaboration_novelty(df: pd.DataFrame,
+                                   n_workers: int,
+                                   batch_size: int,
+                                   backend: str = 'compact',
+                                   temporal_history: TemporalCollaborationHistory = None,
+                                   author_novelty: AuthorNoveltyCounters = None) -> tuple:
+    """
+    Derive the collaboration novelty of the whole collaboration stream from an empty collaboration history in parallel.
+    The articles are partitioned into independent components, the components are spread over shards that are processed
+    in separate worker processes, and the partial graphs are merged. Components share no author pairs and no
+    institution pairs, so the partial graphs are disjoint and the results are identical to a sequential run.
+    :param df: DataFrame with the collaborations of all the articles in chronological order
+    :param n_workers: Number of worker processes
+    :param batch_size: Number of articles in a batch
+    :param backend: Collaboration graph backend ('networkx' or 'compact')
+    :param temporal_history: Empty temporal collaboration history with the settings of the NCI variant, None for the
+    lifetime NCI
+    :param author_novelty: Empty author novelty counters, None to not track them. The rows of the completed years are
+    left in the counters in the order of the years.
+    :return: Tuple of the collaboration novelty index and metadata rows in the order of the stream, the author and
+    institution graphs, the institution collaboration index, the temporal collaboration history and the author novelty
+    counters
+    """
+    df = df.reset_index(drop=True)
+    temporal_settings = temporal_history.settings if temporal_history is not None else None
+
+    # Partition the articles into independent components and spread them over the shards
+    article_sids, article_components = get_independent_article_components(df=df)
+    article_codes, _ = pd.factorize(df['ARTICLE_SID'])
+    row_components = article_components[article_codes]
+    component_shards = assign_components_to_shards(component_sizes=np.bincount(row_components),
+                                                   n_shards=max(n_workers, 1))
+    row_shards = component_shards[row_components]
+    shards = [df[row_shards == shard] for shard in range(max(n_workers, 1)) if (row_shards == shard).any()]
+    logger.info(f"Partitioned {len(article_sids)} articles into {article_components.max(initial=-1) + 1} independent "
+                f"components over {len(shards)} shards with {[len(df_shard) for df_shard in shards]} rows.")
+
+    # Process the shards in parallel
+    params = [dict(df_shard=df_shard, batch_size=batch_size, backend=backend, temporal_settings=temporal_settings,
+                   track_author_novelty=author_novelty is not None)
+              for df_shard in shards]
+    if len(shards) <= 1:
+        shard_results = [process_collaboration_shard(**shard_params) for shard_params in params]
+    else:
+        with Pool(processes=min(n_workers, len(shards))) as pool:
+            results = [pool.apply_async(process_collaboration_shard, kwds=shard_params) for shard_params in params]
+            shard_results = list()
+            for ix_shard, result in enumerate(results):
+                shard_results.append(result.get())
+                logger.info(f"Finished processing shard {ix_shard}.")
+
+    # Merge the partial collaboration histories
+    G_a, G_i = get_empty_collaboration_graph(backend=backend), get_empty_collaboration_graph(backend=backend)
+    institution_index = InstitutionCollaborationIndex()
+    for _, _, G_a_shard, G_i_shard, institution_index_shard, temporal_history_shard, _ in shard_results:
+        merge_collaboration_graph(G=G_a, G_other=G_a_shard)
+        merge_collaboration_graph(G=G_i, G_other=G_i_shard)
+        institution_index.update(institution_index_shard)
+        if temporal_history is not None:
+            temporal_history.update(temporal_history_shard)
+
+    # Shards whose last article is older than the end of the stream close their current year on merge
+    if author_novelty is not None:
+        year = max(shard_result[6].year for shard_result in shard_results)
+        for shard_result in shard_results:
+            author_novelty.update(other=shard_result[6], year=year)
+        author_novelty.closed_rows.sort(key=lambda row: row['YEAR'])
+
+    # Restore the order of the stream
+    article_positions = dict(zip(article_sids.tolist(), range(len(article_sids))))
+    cni_rows = [row for shard_result in shard_results for row in shard_result[0]]
+    metadata_rows = [row for shard_result in shard_results for row in shard_result[1]]
+    cni_rows.sort(key=lambda row: article_positions[row['ARTICLE_SID']])
+    metadata_rows.sort(key=lambda row: article_positions[row['ARTICLE_SID']])
+
+    return cni_rows, metadata_rows, G_a, G_i, institution_index, temporal_history, author_novelty
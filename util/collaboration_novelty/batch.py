@@ -0,0 +1,297 @@
+import numpy as np
+import pandas as pd
+
+from util.collaboration_novelty.author_novelty import AuthorNoveltyCounters
+from util.collaboration_novelty.compact_graph import CollaborationGraph, get_edge_weights, set_edge_weights
+from util.collaboration_novelty.institution_index import InstitutionCollaborationIndex
+from util.collaboration_novelty.temporal import TemporalCollaborationHistory
+
+
+def combination_indices(group_sizes: np.ndarray) -> tuple:
+    """
+    Generate all 2-combinations of the elements within each contiguous group, in the same order as
+    itertools.combinations would generate them group by group.
+    :param group_sizes: Number of elements in each contiguous group
+    :return: Tuple of arrays with the group index of each pair and the positions of the first and second element
+    """
+    group_sizes = np.asarray(group_sizes, dtype=np.int64)
+    group_starts = np.concatenate([[0], np.cumsum(group_sizes)[:-1]]).astype(np.int64)
+    n_pairs = group_sizes * (group_sizes - 1) // 2
+    pair_offsets = np.concatenate([[0], np.cumsum(n_pairs)[:-1]]).astype(np.int64)
+
+    # Init the pair arrays
+    pair_group = np.repeat(np.arange(len(group_sizes)), n_pairs)
+    position_1 = np.empty(int(n_pairs.sum()), dtype=np.int64)
+    position_2 = np.empty(int(n_pairs.sum()), dtype=np.int64)
+
+    # Generate the pairs for all the groups of the same size at once
+    for size in np.unique(group_sizes[group_sizes > 1]):
+        groups = np.flatnonzero(group_sizes == size)
+        upper_1, upper_2 = np.triu_indices(size, k=1)
+        positions = pair_offsets[groups][:, None] + np.arange(len(upper_1))[None, :]
+        position_1[positions] = group_starts[groups][:, None] + upper_1[None, :]
+        position_2[positions] = group_starts[groups][:, None] + upper_2[None, :]
+
+    return pair_group, position_1, position_2
+
+
+def segment_sums(values: np.ndarray,
+                 segment_ids: np.ndarray,
+                 n_segments: int) -> list:
+    """
+    Sum the values of each contiguous segment with the built-in sum, so that the summation order (and therefore the
+    floating point result) is the same as when summing each segment in a Python loop.
+    :param values: Values ordered by segment
+    :param segment_ids: Segment index of each value, sorted ascending
+    :param n_segments: Number of segments
+    :return: List of sums, one for each segment
+    """
+    boundaries = np.searchsorted(segment_ids, np.arange(n_segments + 1)).tolist()
+    values = values.tolist()
+    return [sum(values[start:end]) for start, end in zip(boundaries[:-1], boundaries[1:])]
+
+
+def replay_institution_weights(pair_keys: np.ndarray,
+                               is_new: np.ndarray,
+                               base_weights: np.ndarray) -> tuple:
+    """
+    Replay the institution collaboration updates in chronological order. A new institution collaboration sets the
+    weight of the pair to 1 and an old one increments it by 1.
+    :param pair_keys: Institution pair key of each event, ordered chronologically
+    :param is_new: Whether each event is a new institution collaboration
+    :param base_weights: Weight of the pair in the collaboration graph before the batch for each event
+    :return: Tuple of arrays with the weight before each event and the weight after each event
+    """
+    df_events = pd.DataFrame(dict(KEY=pair_keys, NEW_RANK=0))
+    rank = df_events.groupby('KEY', sort=False).cumcount().to_numpy()
+
+    # Rank of the most recent new collaboration strictly before each event, -1 if there was none
+    df_events['NEW_RANK'] = np.where(is_new, rank, -1)
+    last_new_rank = df_events.groupby('KEY', sort=False)['NEW_RANK'].cummax()
+    last_new_rank = last_new_rank.groupby(df_events['KEY'], sort=False).shift(1, fill_value=-1).to_numpy()
+
+    weight_before = np.where(last_new_rank >= 0, rank - last_new_rank, base_weights + rank)
+    weight_after = np.where(is_new, 1, weight_before + 1)
+    return weight_before, weight_after
+
+
+def get_batch_collaboration_pairs(df_batch: pd.DataFrame) -> tuple:
+    """
+    Get the unique pairs of authors and the unique pairs of institutions that appear together on any article in the
+    batch.
+    :param df_batch: DataFrame with the article SID, author SID and institution SID of the articles
+    :return: Tuple of arrays with the first and second author SIDs and the first and second institution SIDs
+    """
+    pairs = list()
+    for column in ['AUTHOR_SID', 'INSTITUTION_SID']:
+        # Unique entities of each article, grouped by article
+        df_entities = df_batch[['ARTICLE_SID', column]].drop_duplicates()
+        article_codes, _ = pd.factorize(df_entities['ARTICLE_SID'])
+        entity_codes, entity_sids = pd.factorize(df_entities[column])
+        order = np.argsort(article_codes, kind='stable')
+        entity_codes, entity_sids = entity_codes[order], np.asarray(entity_sids, dtype=object)
+
+        # All pairs of entities on the same article, deduplicated across articles
+        _, position_1, position_2 = combination_indices(np.bincount(article_codes))
+        entity_1, entity_2 = entity_codes[position_1], entity_codes[position_2]
+        unique_pair_keys = np.unique(np.minimum(entity_1, entity_2) * len(entity_sids) + np.maximum(entity_1, entity_2))
+        pairs.extend([entity_sids[unique_pair_keys // len(entity_sids)],
+                      entity_sids[unique_pair_keys % len(entity_sids)]])
+
+    return tuple(pairs)
+
+
+def process_batch_collaboration_novelty(df_batch: pd.DataFrame,
+                                        G_a: CollaborationGraph,
+                                        G_i: CollaborationGraph,
+                                        institution_index: InstitutionCollaborationIndex,
+                                        temporal_history: TemporalCollaborationHistory = None,
+                                        author_novelty: AuthorNoveltyCounters = None) -> tuple:
+    """
+    Process a batch of articles and derive the collaboration novelty impact for all of them at once. The batch is
+    grouped only once, all author and institution pairs are generated as arrays, the prior weights are looked up in
+    bulk and the updates of articles that share pairs are replayed in the order in which the articles appear in the
+    batch. The results and the updated graphs are identical to calling process_article_collaboration_novelty for each
+    article in turn.
+    :param df_batch: DataFrame with the article SID, author SID, institution SID and publication date of the articles,
+    ordered chronologically
+    :param G_a: Collaboration author graph
+    :param G_i: Collaboration institution graph
+    :param institution_index: Index of the pairs of institutions that have collaborated before
+    :param temporal_history: Time-dependent collaboration history of the windowed or decayed NCI variant, None for the
+    lifetime NCI
+    :param author_novelty: Running per-author novelty counters to add the articles to, None to not track them
+    :return: Collaboration novelty index and metadata objects for the articles in the batch
+    """
+    if df_batch.empty:
+        return list(), list()
+
+    # ------------------------------ Group the batch ------------------------------
+    # Articles are processed in the order of their first appearance in the batch
+    article_codes, article_sids = pd.factorize(df_batch['ARTICLE_SID'])
+    author_codes, author_sids = pd.factorize(df_batch['AUTHOR_SID'])
+    institution_codes, institution_sids = pd.factorize(df_batch['INSTITUTION_SID'])
+    article_sids, author_sids, institution_sids = (np.asarray(sids, dtype=object)
+                                                  for sids in (article_sids, author_sids, institution_sids))
+    n_articles, n_authors, n_institutions = len(article_sids), len(author_sids), len(institution_sids)
+
+    # Unique author and institution pairs of each article, in the order of their first appearance
+    df_affiliations = pd.DataFrame(dict(ARTICLE=article_codes, AUTHOR=author_codes, INSTITUTION=institution_codes,
+                                        ROW=np.arange(len(df_batch))))
+    df_affiliations = df_affiliations.drop_duplicates(['ARTICLE', 'AUTHOR', 'INSTITUTION'])
+    df_affiliations = df_affiliations.sort_values('ARTICLE', kind='stable')
+
+    # Unique authors and institutions of each article, in the order of their first appearance
+    df_article_authors = df_affiliations.drop_duplicates(['ARTICLE', 'AUTHOR'])
+    df_article_institutions = df_affiliations.drop_duplicates(['ARTICLE', 'INSTITUTION'])
+    article_authors = df_article_authors['AUTHOR'].to_numpy()
+    article_institutions = df_article_institutions['INSTITUTION'].to_numpy()
+
+    # The publication date of the article is taken from its first row
+    first_rows = df_affiliations.drop_duplicates('ARTICLE')['ROW'].to_numpy()
+    article_publication_dts = df_batch['ARTICLE_PUBLICATION_DT'].iloc[first_rows].tolist()
+
+    # ------------------------------ Author pairs ------------------------------
+    author_pair_article, position_1, position_2 = combination_indices(
+        np.bincount(df_article_authors['ARTICLE'].to_numpy(), minlength=n_articles))
+    author_1, author_2 = article_authors[position_1], article_authors[position_2]
+    author_pair_keys = np.minimum(author_1, author_2) * n_authors + np.maximum(author_1, author_2)
+
+    # Look up the prior weight of every unique pair once, then add the occurrences earlier in the batch
+    unique_author_pair_keys, author_pair_index = np.unique(author_pair_keys, return_inverse=True)
+    unique_author_weights = get_edge_weights(G_a,
+                                             author_sids[unique_author_pair_keys // n_authors],
+                                             author_sids[unique_author_pair_keys % n_authors])
+    author_rank = pd.Series(author_pair_keys).groupby(author_pair_keys, sort=False).cumcount().to_numpy()
+    author_weight_before = unique_author_weights[author_pair_index] + author_rank
+    is_new_author_pair = author_weight_before == 0
+
+    # ------------------------------ Institution pairs ------------------------------
+    institution_pair_article, position_1, position_2 = combination_indices(
+        np.bincount(df_article_institutions['ARTICLE'].to_numpy(), minlength=n_articles))
+    institution_1, institution_2 = article_institutions[position_1], article_institutions[position_2]
+    institution_pair_keys = (np.minimum(institution_1, institution_2) * n_institutions
+                             + np.maximum(institution_1, institution_2))
+
+    # A pair of institutions on an article is connected by its authors unless the only author of both institutions is
+    # the same person
+    df_institution_authors = df_affiliations.groupby(['ARTICLE', 'INSTITUTION'], sort=False)['AUTHOR'].agg(
+        ['size', 'first'])
+    institution_n_authors = df_institution_authors['size'].to_numpy()
+    institution_first_author = df_institution_authors['first'].to_numpy()
+    is_cross_collaboration = ~((institution_n_authors[position_1] == 1) & (institution_n_authors[position_2] == 1)
+                               & (institution_first_author[position_1] == institution_first_author[position_2]))
+
+    # A pair of institutions has collaborated before if it is in the index or if an earlier article in the batch
+    # connected it through its authors
+    unique_institution_pair_keys, institution_pair_index = np.unique(institution_pair_keys, return_inverse=True)
+    unique_institutions_1 = institution_sids[unique_institution_pair_keys // n_institutions]
+    unique_institutions_2 = institution_sids[unique_institution_pair_keys % n_institutions]
+    is_indexed = institution_index.has_collaborated_many(unique_institutions_1, unique_institutions_2)
+    is_connected_so_far = pd.Series(is_cross_collaboration.astype(np.int8)).groupby(
+        institution_pair_keys, sort=False).cummax()
+    is_connected_earlier = is_connected_so_far.groupby(institution_pair_keys, sort=False).shift(
+        1, fill_value=0).to_numpy() > 0
+    is_new_institution_pair = ~(is_indexed[institution_pair_index] | is_connected_earlier)
+
+    # Look up the prior weight of every unique pair once, then replay the updates earlier in the batch
+    unique_institution_weights = get_edge_weights(G_i, unique_institutions_1, unique_institutions_2)
+    institution_weight_before, institution_weight_after = replay_institution_weights(
+        pair_keys=institution_pair_keys,
+        is_new=is_new_institution_pair,
+        base_weights=unique_institution_weights[institution_pair_index])
+
+    # ------------------------------ Novelty Collaboration Impact ------------------------------
+    if temporal_history is None:
+        author_weights, institution_weights = author_weight_before, institution_weight_before
+    else:
+        # Weigh the pairs by their collaborations at the time of the article and add the batch to the history
+        article_years = pd.DatetimeIndex(article_publication_dts).year.to_numpy()
+        author_weights = temporal_history.authors.add_collaborations(author_sids[author_1],
+                                                                     author_sids[author_2],
+                                                                     article_years[author_pair_article])
+        institution_weights = temporal_history.institutions.add_collaborations(institution_sids[institution_1],
+                                                                               institution_sids[institution_2],
+                                                                               article_years[institution_pair_article],
+                                                                               resets=is_new_institution_pair)
+
+    # Sum the pair factors of each article over new pairs first and old pairs second, as in the per-article process
+    author_order = np.lexsort((~is_new_author_pair, author_pair_article))
+    N_aa = np.array(segment_sums(values=1 / (1 + author_weights[author_order]),
+                                 segment_ids=author_pair_article[author_order],
+                                 n_segments=n_articles), dtype=np.float64)
+    institution_order = np.lexsort((~is_new_institution_pair, institution_pair_article))
+    N_ii = np.array(segment_sums(values=1 / (1 + institution_weights[institution_order]),
+                                 segment_ids=institution_pair_article[institution_order],
+                                 n_segments=n_articles), dtype=np.float64)
+    if temporal_history is None:
+        S_old = np.bincount(author_pair_article[~is_new_author_pair], minlength=n_articles)
+    else:
+        # A pair counts towards the size adjustment with its weight capped at 1
+        S_old = np.array(segment_sums(values=np.minimum(1, author_weights[author_order]),
+                                      segment_ids=author_pair_article[author_order],
+                                      n_segments=n_articles), dtype=np.float64)
+    S_a = 1 / (1 + S_old)
+    NCI = N_aa * (1 + N_ii) * S_a
+
+    # The new author collaboration flags follow the NCI variant: under the windowed and decayed variants a pair of
+    # authors is new if it has no weight at the time of the article, e.g. no collaboration in the window
+    if temporal_history is not None:
+        is_new_author_pair = author_weights == 0
+
+    cni_rows = [dict(ARTICLE_SID=article_sid, COLLABORATION_NOVELTY_INDEX=cni)
+                for article_sid, cni in zip(article_sids.tolist(), NCI.tolist())]
+
+    # ------------------------------ Metadata ------------------------------
+    # Authors and institutions that are part of at least one new pair on the article
+    new_author_keys = np.concatenate([author_pair_article[is_new_author_pair] * n_authors + author_1[is_new_author_pair],
+                                      author_pair_article[is_new_author_pair] * n_authors + author_2[is_new_author_pair]])
+    new_institution_keys = np.concatenate([
+        institution_pair_article[is_new_institution_pair] * n_institutions + institution_1[is_new_institution_pair],
+        institution_pair_article[is_new_institution_pair] * n_institutions + institution_2[is_new_institution_pair]])
+
+    affiliation_article = df_affiliations['ARTICLE'].to_numpy()
+    affiliation_author = df_affiliations['AUTHOR'].to_numpy()
+    affiliation_institution = df_affiliations['INSTITUTION'].to_numpy()
+    is_new_author = np.isin(affiliation_article * n_authors + affiliation_author, new_author_keys)
+    is_new_institution = np.isin(affiliation_article * n_institutions + affiliation_institution, new_institution_keys)
+
+    metadata_rows = [
+        dict(ARTICLE_SID=article_sids[article],
+             AUTHOR_SID=author_sids[author],
+             INSTITUTION_SID=institution_sids[institution],
+             ARTICLE_PUBLICATION_DT=article_publication_dts[article],
+             IS_NEW_AUTHOR_COLLABORATION=is_new_author_i,
+             IS_NEW_INSTITUTION_COLLABORATION=is_new_institution_i)
+        for article, author, institution, is_new_author_i, is_new_institution_i in
+        zip(affiliation_article.tolist(), affiliation_author.tolist(), affiliation_institution.tolist(),
+            is_new_author.tolist(), is_new_institution.tolist())
+    ]
+
+    if author_novelty is not None:
+        author_novelty.add_articles(
+            df_metadata=pd.DataFrame(metadata_rows),
+            df_author_pairs=pd.DataFrame(dict(
+                ARTICLE_PUBLICATION_DT=np.asarray(article_publication_dts, dtype=object)[author_pair_article],
+                AUTHOR_SID_1=author_sids[author_1],
+                AUTHOR_SID_2=author_sids[author_2],
+                IS_NEW=is_new_author_pair)))
+
+    # ------------------------------ Update the collaboration history ------------------------------
+    # Every occurrence of an author pair adds one collaboration
+    set_edge_weights(G_a,
+                     author_sids[unique_author_pair_keys // n_authors],
+                     author_sids[unique_author_pair_keys % n_authors],
+                     unique_author_weights + np.bincount(author_pair_index, minlength=len(unique_author_pair_keys)))
+
+    # The institution pair weight is the weight after its last occurrence in the batch
+    last_occurrence = np.zeros(len(unique_institution_pair_keys), dtype=np.int64)
+    np.maximum.at(last_occurrence, institution_pair_index, np.arange(len(institution_pair_index)))
+    set_edge_weights(G_i, unique_institutions_1, unique_institutions_2, institution_weight_after[last_occurrence])
+
+    # Record the pairs of institutions that were connected through their authors
+    is_connected = np.bincount(institution_pair_index, weights=is_cross_collaboration,
+                               minlength=len(unique_institution_pair_keys)) > 0
+    institution_index.add_collaborations(unique_institutions_1[is_connected], unique_institutions_2[is_connected])
+
+    return cni_rows, metadata_rows
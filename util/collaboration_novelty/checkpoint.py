@@ -0,0 +1,502 @@
+import io
+import json
+import uuid
+
+import numpy as np
+import pandas as pd
+from google.cloud import storage
+from google.cloud.exceptions import NotFound
+from loguru import logger
+
+from util.collaboration_novelty.author_novelty import AuthorNoveltyCounters, deserialize_author_novelty_counters, \
+    serialize_author_novelty_counters
+from util.collaboration_novelty.batch import get_batch_collaboration_pairs
+from util.collaboration_novelty.compact_graph import CollaborationGraph, get_edge_weights, \
+    get_empty_collaboration_graph, set_edge_weights
+from util.collaboration_novelty.graph import check_unconverted_collaboration_blobs, deserialize_collaboration_graph, \
+    fetch_collaboration_graph, fetch_institution_collaboration_index, serialize_collaboration_graph
+from util.collaboration_novelty.institution_index import InstitutionCollaborationIndex, \
+    deserialize_institution_collaboration_index, serialize_institution_collaboration_index
+from util.collaboration_novelty.temporal import TemporalCollaborationHistory, \
+    deserialize_temporal_collaboration_history, serialize_temporal_collaboration_history
+
+# Names of the graphs in the edge-delta log
+DELTA_GRAPH_AUTHOR = 'AUTHOR'
+DELTA_GRAPH_INSTITUTION = 'INSTITUTION'
+DELTA_GRAPH_INSTITUTION_INDEX = 'INSTITUTION_INDEX'
+DELTA_GRAPH_AUTHOR_TEMPORAL = 'AUTHOR_TEMPORAL'
+DELTA_GRAPH_INSTITUTION_TEMPORAL = 'INSTITUTION_TEMPORAL'
+
+
+class CollaborationCheckpoint:
+    """
+    Versioned checkpoint of the collaboration history in object storage. After every batch an edge delta with the
+    current weights of all the edges the batch touched is appended to a log, so the cost of a checkpoint scales with the
+    number of new edges rather than with the size of the graphs. Every few deltas the log is compacted into a full
+    snapshot. A manifest records the snapshot, the deltas that follow it and the batch watermark that each of them
+    covers; writing the manifest is the commit point of every checkpoint operation. The manifest also holds a random
+    generation ID, created with the checkpoint, that tells it apart from an earlier checkpoint under the same prefix.
+
+    Layout under the checkpoint prefix:
+        manifest.json
+        snapshots/<sequence>/G_a.csr, G_i.csr, institution_index.parquet[, temporal_history.parquet]
+            [, author_novelty.parquet]
+        deltas/<sequence>.parquet
+
+    Snapshots written by earlier versions may have pickled structures (.pkl), which are only loaded with allow_pickle.
+    """
+
+    def __init__(self,
+                 bucket: storage.Bucket,
+                 prefix: str,
+                 compaction_interval: int = 20,
+                 compression: str = 'zstd'):
+        """
+        :param bucket: Google Cloud Storage bucket or a local stand-in with the same interface
+        :param prefix: Blob name prefix of the checkpoint
+        :param compaction_interval: Number of deltas after which the log is compacted into a snapshot
+        :param compression: Compression codec of the snapshots ('zstd' or 'lz4'), None to store them uncompressed so
+        that the CSR graphs are loaded without decompression and their files can be memory-mapped
+        """
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+        self.compaction_interval = compaction_interval
+        self.compression = compression
+        self.manifest = dict(generation=uuid.uuid4().hex, snapshot=None, deltas=list(), next_sequence=1)
+
+    # ------------------------------ Blob names ------------------------------
+    @property
+    def manifest_blob_name(self) -> str:
+        """
+        Blob name of the manifest.
+        """
+        return f"{self.prefix}/manifest.json"
+
+    def snapshot_blob_names(self, sequence: int) -> dict:
+        """
+        Get the blob names of a snapshot.
+        :param sequence: Sequence number of the snapshot
+        :return: Dictionary with the blob names of the author graph, institution graph, institution index, temporal
+        collaboration history and author novelty counters
+        """
+        return dict(G_a=f"{self.prefix}/snapshots/{sequence:012d}/G_a.csr",
+                    G_i=f"{self.prefix}/snapshots/{sequence:012d}/G_i.csr",
+                    institution_index=f"{self.prefix}/snapshots/{sequence:012d}/institution_index.parquet",
+                    temporal_history=f"{self.prefix}/snapshots/{sequence:012d}/temporal_history.parquet",
+                    author_novelty=f"{self.prefix}/snapshots/{sequence:012d}/author_novelty.parquet")
+
+    def delta_blob_name(self, sequence: int) -> str:
+        """
+        Get the blob name of a delta.
+        :param sequence: Sequence number of the delta
+        :return: Blob name of the delta
+        """
+        return f"{self.prefix}/deltas/{sequence:012d}.parquet"
+
+    @property
+    def watermark(self):
+        """
+        Watermark of the last batch covered by the checkpoint, None if the checkpoint is empty.
+        """
+        if self.manifest['deltas']:
+            return self.manifest['deltas'][-1]['watermark']
+        if self.manifest['snapshot'] is not None:
+            return self.manifest['snapshot']['watermark']
+        return None
+
+    @property
+    def generation(self) -> str:
+        """
+        Random ID of the checkpoint, created together with it and kept by every later commit.
+        """
+        return self.manifest['generation']
+
+    # ------------------------------ Manifest ------------------------------
+    def _write_manifest(self) -> None:
+        """
+        Write the manifest, committing the current state of the checkpoint.
+        """
+        self.bucket.blob(blob_name=self.manifest_blob_name).upload_from_string(
+            json.dumps(self.manifest, indent=2), content_type='application/json')
+
+    # ------------------------------ Fetch ------------------------------
+    def fetch(self,
+              backend: str = 'networkx',
+              graph_a_blob_name: str = None,
+              graph_i_blob_name: str = None,
+              institution_index_blob_name: str = None,
+              temporal_history: TemporalCollaborationHistory = None,
+              author_novelty: AuthorNoveltyCounters = None,
+              initialize: bool = True,
+              allow_pickle: bool = False,
+              require_history: bool = False) -> tuple:
+        """
+        Fetch the collaboration history by loading the latest snapshot and replaying the deltas that follow it. If there
+        is no checkpoint yet, the graphs stored under the given (non-versioned) blob names are used as the starting
+        point.
+        :param backend: Collaboration graph backend to return the graphs in ('networkx' or 'compact')
+        :param graph_a_blob_name: Author collaboration graph blob name used when there is no checkpoint
+        :param graph_i_blob_name: Institution collaboration graph blob name used when there is no checkpoint
+        :param institution_index_blob_name: Institution collaboration index blob name used when there is no checkpoint
+        :param temporal_history: Empty temporal collaboration history with the settings of the NCI variant, used when
+        the checkpoint does not have one yet. None for the lifetime NCI.
+        :param author_novelty: Empty author novelty counters, used when the checkpoint does not have them yet. None to
+        not track the author novelty.
+        :param initialize: If True and there is no checkpoint yet, store the starting point as the first snapshot. Set
+        it to False for read-only use.
+        :param allow_pickle: If True, also load the pickled structures of snapshots and graphs stored by earlier
+        versions. Unpickling can run arbitrary code, so only the conversion to the current formats sets it.
+        :param require_history: If True, there must be a collaboration history to start from, e.g. because the target
+        tables already have rows, so a missing checkpoint without stored graphs raises an error instead of starting from
+        an empty history.
+        :return: Tuple of author and institution collaboration graphs, the institution collaboration index, the
+        temporal collaboration history and the author novelty counters
+        """
+        try:
+            self.manifest = json.loads(self.bucket.blob(blob_name=self.manifest_blob_name).download_as_string())
+        except NotFound as e:
+            # Graphs stored as pickles by earlier versions must be converted first, otherwise they would be taken for a
+            # missing collaboration history and the empty history would be stored as the first snapshot
+            check_unconverted_collaboration_blobs(bucket=self.bucket,
+                                                  blob_names=[graph_a_blob_name, graph_i_blob_name,
+                                                              institution_index_blob_name])
+            logger.warning("Could not find the collaboration checkpoint, starting from the stored graphs.")
+            G_a, G_i = fetch_collaboration_graph(bucket=self.bucket,
+                                                 graph_a_blob_name=graph_a_blob_name,
+                                                 graph_i_blob_name=graph_i_blob_name,
+                                                 backend=backend,
+                                                 allow_pickle=allow_pickle)
+            if require_history and G_a.number_of_edges() == 0:
+                raise ValueError("There is no collaboration checkpoint and there are no stored collaboration graphs, "
+                                 "but the target tables already have rows. Restore the collaboration history or empty "
+                                 "the target tables to start from an empty history.")
+            institution_index = fetch_institution_collaboration_index(
+                bucket=self.bucket,
+                institution_index_blob_name=institution_index_blob_name,
+                G_i=G_i,
+                allow_pickle=allow_pickle)
+
+            if temporal_history is not None and G_a.number_of_edges() > 0:
+                logger.warning("The temporal collaboration history starts empty, so the collaborations in the stored "
+                               "graphs do not count towards the windowed or decayed NCI.")
+
+            # Store the starting point as the first snapshot, so that the deltas always have a base to be replayed on
+            if initialize:
+                self.compact(G_a=G_a, G_i=G_i, institution_index=institution_index, temporal_history=temporal_history,
+                             author_novelty=author_novelty)
+            return G_a, G_i, institution_index, temporal_history, author_novelty
+
+        # Manifests written by earlier versions have no generation ID, which is created and committed right away
+        if 'generation' not in self.manifest:
+            self.manifest['generation'] = uuid.uuid4().hex
+            if initialize:
+                self._write_manifest()
+
+        # Load the snapshot
+        if self.manifest['snapshot'] is not None:
+            blob_names = self.manifest['snapshot']['blob_names']
+            # Snapshots written by earlier versions have pickled structures, which are detected on load
+            G_a, G_i = (deserialize_collaboration_graph(
+                data=self.bucket.blob(blob_name=blob_names[name]).download_as_string(), backend=backend,
+                allow_pickle=allow_pickle)
+                for name in ('G_a', 'G_i'))
+            institution_index = deserialize_institution_collaboration_index(
+                data=self.bucket.blob(blob_name=blob_names['institution_index']).download_as_string(),
+                allow_pickle=allow_pickle)
+            temporal_history = self._fetch_temporal_history(blob_names=blob_names, temporal_history=temporal_history,
+                                                            allow_pickle=allow_pickle)
+            if author_novelty is not None and 'author_novelty' in blob_names:
+                author_novelty = deserialize_author_novelty_counters(
+                    data=self.bucket.blob(blob_name=blob_names['author_novelty']).download_as_string(),
+                    allow_pickle=allow_pickle)
+            elif author_novelty is not None:
+                logger.warning("The collaboration checkpoint has no author novelty counters, starting them empty.")
+        else:
+            G_a, G_i = get_empty_collaboration_graph(backend=backend), get_empty_collaboration_graph(backend=backend)
+            institution_index = InstitutionCollaborationIndex()
+
+        # Replay the deltas in order
+        for delta in self.manifest['deltas']:
+            df_delta = pd.read_parquet(io.BytesIO(self.bucket.blob(blob_name=delta['blob_name']).download_as_string()))
+            apply_collaboration_delta(df_delta=df_delta, G_a=G_a, G_i=G_i, institution_index=institution_index,
+                                      temporal_history=temporal_history, author_novelty=author_novelty)
+
+        logger.info(f"Fetched the collaboration checkpoint with {len(self.manifest['deltas'])} deltas after the "
+                    f"snapshot, covering batches up to {self.watermark}.")
+
+        return G_a, G_i, institution_index, temporal_history, author_novelty
+
+    def _fetch_temporal_history(self,
+                                blob_names: dict,
+                                temporal_history: TemporalCollaborationHistory,
+                                allow_pickle: bool = False):
+        """
+        Load the temporal collaboration history of a snapshot.
+        :param blob_names: Blob names of the snapshot
+        :param temporal_history: Empty temporal collaboration history with the settings of the NCI variant, None for
+        the lifetime NCI
+        :param allow_pickle: If True, also load a history pickled by an earlier version
+        :return: Temporal collaboration history, None for the lifetime NCI
+        """
+        if temporal_history is None:
+            return None
+
+        if 'temporal_history' not in blob_names:
+            logger.warning("The collaboration checkpoint has no temporal collaboration history, starting it empty.")
+            return temporal_history
+
+        stored_temporal_history = deserialize_temporal_collaboration_history(
+            data=self.bucket.blob(blob_name=blob_names['temporal_history']).download_as_string(),
+            allow_pickle=allow_pickle)
+        if stored_temporal_history.settings != temporal_history.settings:
+            raise ValueError(f"The temporal collaboration history in the checkpoint has settings "
+                             f"{stored_temporal_history.settings}, but {temporal_history.settings} were requested. "
+                             f"Use a new checkpoint prefix to derive a different NCI variant.")
+        return stored_temporal_history
+
+    # ------------------------------ Append ------------------------------
+    def append(self,
+               df_batch: pd.DataFrame,
+               G_a: CollaborationGraph,
+               G_i: CollaborationGraph,
+               institution_index: InstitutionCollaborationIndex,
+               watermark,
+               temporal_history: TemporalCollaborationHistory = None,
+               author_novelty: AuthorNoveltyCounters = None) -> None:
+        """
+        Append the edge delta of a processed batch to the log and compact the log into a snapshot if it has grown past
+        the compaction interval. The graphs must already be updated with the batch.
+        :param df_batch: DataFrame with the article SID, author SID and institution SID of the processed batch
+        :param G_a: Collaboration author graph
+        :param G_i: Collaboration institution graph
+        :param institution_index: Index of the pairs of institutions that have collaborated before
+        :param watermark: JSON-serializable watermark of the batch, e.g. the last processed publication date and SID
+        :param temporal_history: Temporal collaboration history, None for the lifetime NCI
+        :param author_novelty: Author novelty counters, None if the author novelty is not tracked
+        """
+        self.write_delta(df_delta=get_collaboration_delta(df_batch=df_batch, G_a=G_a, G_i=G_i,
+                                                          institution_index=institution_index,
+                                                          temporal_history=temporal_history,
+                                                          author_novelty=author_novelty),
+                         watermark=watermark)
+
+        if self.needs_compaction:
+            self.compact(G_a=G_a, G_i=G_i, institution_index=institution_index, temporal_history=temporal_history,
+                         author_novelty=author_novelty)
+
+    def write_delta(self,
+                    df_delta: pd.DataFrame,
+                    watermark) -> None:
+        """
+        Write an edge delta to the log and commit it. Unlike append, it does not read the graphs, so it can run in a
+        background writer while the graphs are updated with the next batch.
+        :param df_delta: DataFrame with the graph name, the pair of nodes and the weight of every edge in the delta
+        :param watermark: JSON-serializable watermark of the batch, e.g. the last processed publication date and SID
+        """
+        # Write the delta first and commit it by adding it to the manifest
+        sequence = self.manifest['next_sequence']
+        buffer = io.BytesIO()
+        df_delta.to_parquet(buffer, index=False)
+        self.bucket.blob(blob_name=self.delta_blob_name(sequence)).upload_from_string(
+            buffer.getvalue(), content_type='application/octet-stream')
+
+        self.manifest['deltas'].append(dict(sequence=sequence,
+                                            blob_name=self.delta_blob_name(sequence),
+                                            n_edges=len(df_delta),
+                                            watermark=watermark))
+        self.manifest['next_sequence'] = sequence + 1
+        self._write_manifest()
+
+    @property
+    def needs_compaction(self) -> bool:
+        """
+        True if the log has grown past the compaction interval.
+        """
+        return len(self.manifest['deltas']) >= self.compaction_interval
+
+    @property
+    def is_compacted(self) -> bool:
+        """
+        True if the latest snapshot already covers the whole log.
+        """
+        return not self.manifest['deltas'] and self.manifest['snapshot'] is not None
+
+    # ------------------------------ Compact ------------------------------
+    def compact(self,
+                G_a: CollaborationGraph,
+                G_i: CollaborationGraph,
+                institution_index: InstitutionCollaborationIndex,
+                temporal_history: TemporalCollaborationHistory = None,
+                author_novelty: AuthorNoveltyCounters = None,
+                watermark=None) -> None:
+        """
+        Compact the log into a full snapshot of the collaboration history and remove the blobs the new snapshot
+        supersedes.
+        :param G_a: Collaboration author graph
+        :param G_i: Collaboration institution graph
+        :param institution_index: Index of the pairs of institutions that have collaborated before
+        :param temporal_history: Temporal collaboration history, None for the lifetime NCI
+        :param author_novelty: Author novelty counters, None if the author novelty is not tracked
+        :param watermark: Watermark of the snapshot if the graphs were updated without appending deltas (e.g. by a
+        backfill), otherwise the watermark of the last delta is kept
+        """
+        if self.is_compacted and watermark is None:
+            return
+        self.write_snapshot(snapshot=serialize_collaboration_snapshot(G_a=G_a, G_i=G_i,
+                                                                      institution_index=institution_index,
+                                                                      temporal_history=temporal_history,
+                                                                      author_novelty=author_novelty,
+                                                                      compression=self.compression),
+                            watermark=watermark)
+
+    def write_snapshot(self, snapshot: dict, watermark=None) -> None:
+        """
+        Write a serialized snapshot of the collaboration history, commit it and remove the blobs it supersedes. The
+        snapshot must cover all the deltas written before it.
+        :param snapshot: Dictionary with the serialized author graph, institution graph, institution index and, if any,
+        temporal collaboration history and author novelty counters
+        :param watermark: Watermark of the snapshot, None to keep the watermark of the last delta
+        """
+        if self.is_compacted and watermark is None:
+            return
+
+        # Write the snapshot
+        sequence = self.manifest['next_sequence']
+        blob_names = {name: blob_name for name, blob_name in self.snapshot_blob_names(sequence).items()
+                      if name in snapshot}
+        for name, blob_name in blob_names.items():
+            self.bucket.blob(blob_name=blob_name).upload_from_string(
+                snapshot[name], content_type='application/octet-stream')
+
+        # Commit the snapshot
+        superseded_snapshot, superseded_deltas = self.manifest['snapshot'], self.manifest['deltas']
+        watermark = watermark if watermark is not None else self.watermark
+        self.manifest = dict(generation=self.generation,
+                             snapshot=dict(sequence=sequence, blob_names=blob_names, watermark=watermark),
+                             deltas=list(),
+                             next_sequence=sequence + 1)
+        self._write_manifest()
+
+        # Remove the superseded blobs
+        superseded_blob_names = [delta['blob_name'] for delta in superseded_deltas]
+        if superseded_snapshot is not None:
+            superseded_blob_names.extend(superseded_snapshot['blob_names'].values())
+        for blob_name in superseded_blob_names:
+            try:
+                self.bucket.blob(blob_name=blob_name).delete()
+            except NotFound as e:
+                logger.warning(f"Could not find the superseded checkpoint blob {blob_name}.")
+
+
+def serialize_collaboration_snapshot(G_a: CollaborationGraph,
+                                     G_i: CollaborationGraph,
+                                     institution_index: InstitutionCollaborationIndex,
+                                     temporal_history: TemporalCollaborationHistory = None,
+                                     author_novelty: AuthorNoveltyCounters = None,
+                                     compression: str = 'zstd') -> dict:
+    """
+    Serialize the collaboration history for a snapshot.
+    :param G_a: Collaboration author graph
+    :param G_i: Collaboration institution graph
+    :param institution_index: Index of the pairs of institutions that have collaborated before
+    :param temporal_history: Temporal collaboration history, None for the lifetime NCI
+    :param author_novelty: Author novelty counters, None if the author novelty is not tracked
+    :param compression: Compression codec of the graphs and Parquet files, None to store them uncompressed
+    :return: Dictionary with the author and institution graphs in the CSR graph format and the institution index,
+    temporal collaboration history (if any) and author novelty counters (if any) as Parquet files
+    """
+    snapshot = dict(G_a=serialize_collaboration_graph(G=G_a, graph_format='csr', compression=compression),
+                    G_i=serialize_collaboration_graph(G=G_i, graph_format='csr', compression=compression),
+                    institution_index=serialize_institution_collaboration_index(institution_index=institution_index,
+                                                                                compression=compression))
+    if temporal_history is not None:
+        snapshot['temporal_history'] = serialize_temporal_collaboration_history(temporal_history=temporal_history,
+                                                                                compression=compression)
+    if author_novelty is not None:
+        snapshot['author_novelty'] = serialize_author_novelty_counters(author_novelty=author_novelty,
+                                                                       compression=compression)
+    return snapshot
+
+
+def get_collaboration_delta(df_batch: pd.DataFrame,
+                            G_a: CollaborationGraph,
+                            G_i: CollaborationGraph,
+                            institution_index: InstitutionCollaborationIndex,
+                            temporal_history: TemporalCollaborationHistory = None,
+                            author_novelty: AuthorNoveltyCounters = None) -> pd.DataFrame:
+    """
+    Get the edge delta of a processed batch: the current weights of all the author and institution pairs that appear
+    together on the batch's articles and the institution pairs the batch added to the index. Weights are absolute, so
+    replaying a delta more than once gives the same result.
+    :param df_batch: DataFrame with the article SID, author SID and institution SID of the processed batch
+    :param G_a: Collaboration author graph
+    :param G_i: Collaboration institution graph
+    :param institution_index: Index of the pairs of institutions that have collaborated before
+    :param temporal_history: Temporal collaboration history, None for the lifetime NCI
+    :param author_novelty: Author novelty counters, None if the author novelty is not tracked
+    :return: DataFrame with the graph name, the pair of nodes and the weight of every edge in the delta. With a
+    temporal collaboration history, the years and weights of its entries for every touched pair are added as list
+    columns. With author novelty counters, the counters of the batch's authors are added as entries of their own.
+    """
+    authors_1, authors_2, institutions_1, institutions_2 = get_batch_collaboration_pairs(df_batch=df_batch)
+    is_indexed = institution_index.has_collaborated_many(institutions_1, institutions_2)
+
+    df_deltas = [
+        pd.DataFrame(dict(GRAPH=DELTA_GRAPH_AUTHOR, NODE_1=authors_1, NODE_2=authors_2,
+                          WEIGHT=get_edge_weights(G_a, authors_1, authors_2))),
+        pd.DataFrame(dict(GRAPH=DELTA_GRAPH_INSTITUTION, NODE_1=institutions_1, NODE_2=institutions_2,
+                          WEIGHT=get_edge_weights(G_i, institutions_1, institutions_2))),
+        pd.DataFrame(dict(GRAPH=DELTA_GRAPH_INSTITUTION_INDEX, NODE_1=institutions_1[is_indexed],
+                          NODE_2=institutions_2[is_indexed], WEIGHT=np.ones(is_indexed.sum(), dtype=np.int64)))
+    ]
+    if author_novelty is not None:
+        df_deltas.append(author_novelty.get_delta(authors=df_batch['AUTHOR_SID'].to_numpy(dtype=object)))
+    if temporal_history is None:
+        return pd.concat(df_deltas, ignore_index=True)
+
+    for df_delta in df_deltas:
+        df_delta['YEARS'], df_delta['VALUES'] = None, None
+    for graph_name, edge_weights, nodes_1, nodes_2 in (
+            (DELTA_GRAPH_AUTHOR_TEMPORAL, temporal_history.authors, authors_1, authors_2),
+            (DELTA_GRAPH_INSTITUTION_TEMPORAL, temporal_history.institutions, institutions_1, institutions_2)):
+        years, values = edge_weights.get_states(nodes_1, nodes_2)
+        df_deltas.append(pd.DataFrame(dict(GRAPH=graph_name, NODE_1=nodes_1, NODE_2=nodes_2,
+                                           WEIGHT=np.zeros(len(nodes_1), dtype=np.int64), YEARS=years, VALUES=values)))
+    return pd.concat(df_deltas, ignore_index=True)
+
+
+def apply_collaboration_delta(df_delta: pd.DataFrame,
+                              G_a: CollaborationGraph,
+                              G_i: CollaborationGraph,
+                              institution_index: InstitutionCollaborationIndex,
+                              temporal_history: TemporalCollaborationHistory = None,
+                              author_novelty: AuthorNoveltyCounters = None) -> None:
+    """
+    Apply an edge delta to the collaboration history.
+    :param df_delta: DataFrame with the graph name, the pair of nodes and the weight of every edge in the delta
+    :param G_a: Collaboration author graph
+    :param G_i: Collaboration institution graph
+    :param institution_index: Index of the pairs of institutions that have collaborated before
+    :param temporal_history: Temporal collaboration history, None for the lifetime NCI
+    :param author_novelty: Author novelty counters, None if the author novelty is not tracked
+    """
+    for graph_name, G in ((DELTA_GRAPH_AUTHOR, G_a), (DELTA_GRAPH_INSTITUTION, G_i)):
+        df_graph = df_delta[df_delta['GRAPH'] == graph_name]
+        set_edge_weights(G, df_graph['NODE_1'].to_numpy(dtype=object), df_graph['NODE_2'].to_numpy(dtype=object),
+                         df_graph['WEIGHT'].to_numpy())
+
+    df_index = df_delta[df_delta['GRAPH'] == DELTA_GRAPH_INSTITUTION_INDEX]
+    institution_index.add_collaborations(df_index['NODE_1'].to_numpy(dtype=object),
+                                         df_index['NODE_2'].to_numpy(dtype=object))
+
+    if author_novelty is not None:
+        author_novelty.apply_delta(df_delta=df_delta)
+
+    # Deltas written for the lifetime NCI have no temporal entries
+    if temporal_history is None or 'YEARS' not in df_delta.columns:
+        return
+    for graph_name, edge_weights in ((DELTA_GRAPH_AUTHOR_TEMPORAL, temporal_history.authors),
+                                     (DELTA_GRAPH_INSTITUTION_TEMPORAL, temporal_history.institutions)):
+        df_graph = df_delta[df_delta['GRAPH'] == graph_name]
+        edge_weights.set_states(df_graph['NODE_1'].to_numpy(dtype=object), df_graph['NODE_2'].to_numpy(dtype=object),
+                                df_graph['YEARS'].tolist(), df_graph['VALUES'].tolist())
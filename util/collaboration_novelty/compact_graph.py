@@ -0,0 +1,506 @@
+from typing import Iterator, Union
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from util.collaboration_novelty.csr_graph import CSRCollaborationGraph
+
+# Number of pending (not yet merged) edges after which they are merged into the packed sorted arrays
+MAX_PENDING_EDGES = 1_000_000
+
+
+class CompactCollaborationGraph:
+    """
+    Weighted undirected collaboration graph with a compact memory layout. Node SIDs are interned to integer ids and every
+    edge is stored as a packed uint64 key (lower id in the upper 32 bits, higher id in the lower 32 bits) mapped to an
+    int32 weight. Most edges live in a pair of sorted NumPy arrays, while newly added edges are kept in a small pending
+    dictionary that is merged into the arrays once it grows past a threshold.
+
+    The class exposes the subset of the networkx graph API that the collaboration novelty process uses, so it can be
+    used as a drop-in replacement for the author and institution collaboration graphs.
+    """
+
+    def __init__(self, max_pending_edges: int = MAX_PENDING_EDGES):
+        # Node SID to integer id mapping and its inverse
+        self.node_ids = dict()
+        self.node_sids = list()
+
+        # Packed edge keys and weights, sorted by key
+        self.edge_keys = np.empty(0, dtype=np.uint64)
+        self.edge_weights = np.empty(0, dtype=np.int32)
+
+        # Edges that have not been merged into the packed arrays yet
+        self.pending_edges = dict()
+        self.max_pending_edges = max_pending_edges
+
+    # ------------------------------ Nodes ------------------------------
+    def intern_node(self, node: str) -> int:
+        """
+        Get the integer id of a node, adding the node to the graph if it does not exist yet.
+        :param node: Node SID
+        :return: Integer id of the node
+        """
+        node_id = self.node_ids.get(node)
+        if node_id is None:
+            node_id = len(self.node_sids)
+            self.node_ids[node] = node_id
+            self.node_sids.append(node)
+        return node_id
+
+    def number_of_nodes(self) -> int:
+        """
+        Get the number of nodes in the graph.
+        :return: Number of nodes
+        """
+        return len(self.node_sids)
+
+    def has_node(self, node: str) -> bool:
+        """
+        Check if the node is in the graph.
+        :param node: Node SID
+        :return: True if the node is in the graph, False otherwise
+        """
+        return node in self.node_ids
+
+    # ------------------------------ Edges ------------------------------
+    @staticmethod
+    def pack_key(node_id_1: int, node_id_2: int) -> int:
+        """
+        Pack a pair of integer node ids to an undirected uint64 edge key.
+        :param node_id_1: Integer id of the first node
+        :param node_id_2: Integer id of the second node
+        :return: Packed edge key
+        """
+        if node_id_1 > node_id_2:
+            node_id_1, node_id_2 = node_id_2, node_id_1
+        return (node_id_1 << 32) | node_id_2
+
+    @staticmethod
+    def unpack_keys(keys: np.ndarray) -> tuple:
+        """
+        Unpack an array of packed edge keys to arrays of integer node ids.
+        :param keys: Array of packed edge keys
+        :return: Tuple of arrays of the lower and higher integer node ids
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        return (keys >> np.uint64(32)).astype(np.int64), (keys & np.uint64(0xFFFFFFFF)).astype(np.int64)
+
+    def edge_key(self, node_1: str, node_2: str) -> Union[int, None]:
+        """
+        Get the packed edge key for a pair of node SIDs without adding the nodes to the graph.
+        :param node_1: First node SID
+        :param node_2: Second node SID
+        :return: Packed edge key or None if any of the nodes is not in the graph
+        """
+        node_id_1 = self.node_ids.get(node_1)
+        node_id_2 = self.node_ids.get(node_2)
+        if node_id_1 is None or node_id_2 is None:
+            return None
+        return self.pack_key(node_id_1, node_id_2)
+
+    def _find_packed(self, key: int) -> int:
+        """
+        Find the position of the key in the packed arrays.
+        :param key: Packed edge key
+        :return: Position of the key or -1 if the key is not in the packed arrays
+        """
+        position = int(np.searchsorted(self.edge_keys, np.uint64(key)))
+        if position < len(self.edge_keys) and self.edge_keys[position] == key:
+            return position
+        return -1
+
+    def get_weight(self, node_1: str, node_2: str, default: int = 0) -> int:
+        """
+        Get the weight of the edge between a pair of nodes.
+        :param node_1: First node SID
+        :param node_2: Second node SID
+        :param default: Weight to return if the edge does not exist
+        :return: Weight of the edge
+        """
+        key = self.edge_key(node_1, node_2)
+        if key is None:
+            return default
+
+        weight = self.pending_edges.get(key)
+        if weight is not None:
+            return weight
+
+        position = self._find_packed(key)
+        return int(self.edge_weights[position]) if position >= 0 else default
+
+    def has_edge(self, node_1: str, node_2: str) -> bool:
+        """
+        Check if there is an edge between a pair of nodes.
+        :param node_1: First node SID
+        :param node_2: Second node SID
+        :return: True if the edge exists, False otherwise
+        """
+        key = self.edge_key(node_1, node_2)
+        if key is None:
+            return False
+        return key in self.pending_edges or self._find_packed(key) >= 0
+
+    def get_edge_data(self, node_1: str, node_2: str, default: dict = None) -> Union[dict, None]:
+        """
+        Get the edge attributes in the same format as networkx.
+        :param node_1: First node SID
+        :param node_2: Second node SID
+        :param default: Value to return if the edge does not exist
+        :return: Dictionary with the edge weight or default if the edge does not exist
+        """
+        weight = self.get_weight(node_1, node_2, default=-1)
+        return default if weight < 0 else {'weight': weight}
+
+    def add_edge(self, node_1: str, node_2: str, weight: int = 1) -> None:
+        """
+        Add an edge between a pair of nodes or overwrite its weight if it already exists.
+        :param node_1: First node SID
+        :param node_2: Second node SID
+        :param weight: Weight of the edge
+        """
+        key = self.pack_key(self.intern_node(node_1), self.intern_node(node_2))
+
+        # Overwrite the weight in place if the edge is already packed
+        position = self._find_packed(key)
+        if position >= 0:
+            self.edge_weights[position] = weight
+            return
+
+        self.pending_edges[key] = weight
+        if len(self.pending_edges) >= self.max_pending_edges:
+            self.compact()
+
+    def increment_edge(self, node_1: str, node_2: str, increment: int = 1) -> None:
+        """
+        Increment the weight of the edge between a pair of nodes, adding the edge if it does not exist.
+        :param node_1: First node SID
+        :param node_2: Second node SID
+        :param increment: Value to add to the weight
+        """
+        key = self.pack_key(self.intern_node(node_1), self.intern_node(node_2))
+
+        if key in self.pending_edges:
+            self.pending_edges[key] += increment
+            return
+
+        position = self._find_packed(key)
+        if position >= 0:
+            self.edge_weights[position] += increment
+            return
+
+        self.pending_edges[key] = increment
+        if len(self.pending_edges) >= self.max_pending_edges:
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        Merge the pending edges into the packed sorted arrays.
+        """
+        if not self.pending_edges:
+            return
+
+        pending_keys = np.fromiter(self.pending_edges.keys(), dtype=np.uint64, count=len(self.pending_edges))
+        pending_weights = np.fromiter(self.pending_edges.values(), dtype=np.int32, count=len(self.pending_edges))
+        self.pending_edges = dict()
+
+        self._insert_packed(keys=pending_keys, weights=pending_weights)
+
+    def _insert_packed(self, keys: np.ndarray, weights: np.ndarray) -> None:
+        """
+        Insert edges that are not in the packed arrays yet, keeping the arrays sorted.
+        :param keys: Array of packed edge keys that are not in the packed arrays
+        :param weights: Array of edge weights
+        """
+        order = np.argsort(keys, kind='stable')
+        keys, weights = keys[order], weights[order]
+
+        # Merge the sorted keys into the packed arrays in linear time
+        positions = np.searchsorted(self.edge_keys, keys)
+        self.edge_keys = np.insert(self.edge_keys, positions, keys)
+        self.edge_weights = np.insert(self.edge_weights, positions, weights)
+
+    # ------------------------------ Bulk operations ------------------------------
+    def lookup_node_ids(self, nodes: np.ndarray, intern: bool = False) -> np.ndarray:
+        """
+        Get the integer ids for an array of node SIDs.
+        :param nodes: Array of node SIDs
+        :param intern: If True, add missing nodes to the graph, otherwise return -1 for missing nodes
+        :return: Array of integer node ids
+        """
+        codes, unique_nodes = pd.factorize(np.asarray(nodes, dtype=object))
+        if intern:
+            unique_ids = np.fromiter((self.intern_node(node) for node in unique_nodes), dtype=np.int64,
+                                     count=len(unique_nodes))
+        else:
+            unique_ids = np.fromiter((self.node_ids.get(node, -1) for node in unique_nodes), dtype=np.int64,
+                                     count=len(unique_nodes))
+        return unique_ids[codes]
+
+    @staticmethod
+    def pack_keys(node_ids_1: np.ndarray, node_ids_2: np.ndarray) -> np.ndarray:
+        """
+        Pack arrays of integer node ids to undirected uint64 edge keys.
+        :param node_ids_1: Array of integer ids of the first nodes
+        :param node_ids_2: Array of integer ids of the second nodes
+        :return: Array of packed edge keys
+        """
+        node_ids_1 = np.asarray(node_ids_1, dtype=np.uint64)
+        node_ids_2 = np.asarray(node_ids_2, dtype=np.uint64)
+        return (np.minimum(node_ids_1, node_ids_2) << np.uint64(32)) | np.maximum(node_ids_1, node_ids_2)
+
+    def get_weights(self, nodes_1: np.ndarray, nodes_2: np.ndarray) -> np.ndarray:
+        """
+        Get the weights of the edges between pairs of nodes in a single pass.
+        :param nodes_1: Array of first node SIDs
+        :param nodes_2: Array of second node SIDs
+        :return: Array of edge weights, 0 for pairs that are not connected
+        """
+        self.compact()
+
+        node_ids_1 = self.lookup_node_ids(nodes_1)
+        node_ids_2 = self.lookup_node_ids(nodes_2)
+        known = (node_ids_1 >= 0) & (node_ids_2 >= 0)
+
+        weights = np.zeros(len(known), dtype=np.int64)
+        if not known.any() or len(self.edge_keys) == 0:
+            return weights
+
+        keys = self.pack_keys(node_ids_1[known], node_ids_2[known])
+        positions = np.minimum(np.searchsorted(self.edge_keys, keys), len(self.edge_keys) - 1)
+        found = self.edge_keys[positions] == keys
+        weights[np.flatnonzero(known)[found]] = self.edge_weights[positions[found]]
+        return weights
+
+    def set_weights(self, nodes_1: np.ndarray, nodes_2: np.ndarray, weights: np.ndarray) -> None:
+        """
+        Set the weights of the edges between pairs of nodes in a single pass, adding the missing edges. Pairs must be
+        unique.
+        :param nodes_1: Array of first node SIDs
+        :param nodes_2: Array of second node SIDs
+        :param weights: Array of edge weights
+        """
+        self.compact()
+
+        keys = self.pack_keys(self.lookup_node_ids(nodes_1, intern=True), self.lookup_node_ids(nodes_2, intern=True))
+        weights = np.asarray(weights, dtype=np.int32)
+        if len(keys) == 0:
+            return
+
+        # Overwrite the weights of the existing edges in place
+        positions = np.minimum(np.searchsorted(self.edge_keys, keys), max(len(self.edge_keys) - 1, 0))
+        found = (self.edge_keys[positions] == keys) if len(self.edge_keys) > 0 else np.zeros(len(keys), dtype=bool)
+        self.edge_weights[positions[found]] = weights[found]
+
+        # Insert the new edges
+        self._insert_packed(keys=keys[~found], weights=weights[~found])
+
+    def number_of_edges(self) -> int:
+        """
+        Get the number of edges in the graph.
+        :return: Number of edges
+        """
+        return len(self.edge_keys) + len(self.pending_edges)
+
+    def edges(self, data: bool = False) -> Iterator[tuple]:
+        """
+        Iterate over the edges of the graph in the same format as networkx.
+        :param data: If True, yield the edge attributes as the third element
+        :return: Iterator over the edges
+        """
+        self.compact()
+        node_ids_1, node_ids_2 = self.unpack_keys(self.edge_keys)
+        for node_id_1, node_id_2, weight in zip(node_ids_1.tolist(), node_ids_2.tolist(), self.edge_weights.tolist()):
+            if data:
+                yield self.node_sids[node_id_1], self.node_sids[node_id_2], {'weight': weight}
+            else:
+                yield self.node_sids[node_id_1], self.node_sids[node_id_2]
+
+    # ------------------------------ Conversion ------------------------------
+    @classmethod
+    def from_networkx(cls, G: nx.Graph) -> 'CompactCollaborationGraph':
+        """
+        Build a compact collaboration graph from a networkx graph with integer weight attributes.
+        :param G: Networkx collaboration graph
+        :return: Compact collaboration graph
+        """
+        compact_graph = cls()
+        for node in G.nodes:
+            compact_graph.intern_node(node)
+
+        n_edges = G.number_of_edges()
+        keys = np.empty(n_edges, dtype=np.uint64)
+        weights = np.empty(n_edges, dtype=np.int32)
+        for ix, (node_1, node_2, weight) in enumerate(G.edges(data='weight', default=0)):
+            keys[ix] = compact_graph.pack_key(compact_graph.node_ids[node_1], compact_graph.node_ids[node_2])
+            weights[ix] = weight
+
+        order = np.argsort(keys, kind='stable')
+        compact_graph.edge_keys = keys[order]
+        compact_graph.edge_weights = weights[order]
+        return compact_graph
+
+    def to_networkx(self) -> nx.Graph:
+        """
+        Convert the compact collaboration graph to a networkx graph.
+        :return: Networkx collaboration graph
+        """
+        G = nx.Graph()
+        G.add_nodes_from(self.node_sids)
+        G.add_edges_from(self.edges(data=True))
+        return G
+
+    @classmethod
+    def from_csr(cls, G: CSRCollaborationGraph) -> 'CompactCollaborationGraph':
+        """
+        Build a compact collaboration graph from a CSR collaboration graph, without iterating over the edges.
+        :param G: CSR collaboration graph
+        :return: Compact collaboration graph
+        """
+        node_sids, node_ids_1, node_ids_2, weights = G.to_edge_arrays()
+        compact_graph = cls()
+        compact_graph.node_sids = node_sids
+        compact_graph.node_ids = dict(zip(node_sids, range(len(node_sids))))
+
+        # The edges of the CSR graph are sorted by the first and second node id, which is the order of the packed keys
+        compact_graph.edge_keys = cls.pack_keys(node_ids_1, node_ids_2)
+        compact_graph.edge_weights = weights.astype(np.int32)
+        return compact_graph
+
+    def to_csr(self) -> CSRCollaborationGraph:
+        """
+        Convert the compact collaboration graph to a CSR collaboration graph.
+        :return: CSR collaboration graph
+        """
+        self.compact()
+        node_ids_1, node_ids_2 = self.unpack_keys(self.edge_keys)
+        return CSRCollaborationGraph.from_edge_arrays(node_sids=self.node_sids,
+                                                      node_ids_1=node_ids_1,
+                                                      node_ids_2=node_ids_2,
+                                                      weights=self.edge_weights)
+
+
+# Any graph that can be used as an author or institution collaboration graph. CSR graphs are read-only.
+CollaborationGraph = Union[nx.Graph, CompactCollaborationGraph, CSRCollaborationGraph]
+
+# Available collaboration graph backends, 'csr' only for read-only use
+GRAPH_BACKENDS = ('networkx', 'compact', 'csr')
+
+
+def get_empty_collaboration_graph(backend: str = 'networkx') -> CollaborationGraph:
+    """
+    Create an empty collaboration graph for the given backend.
+    :param backend: Graph backend, one of GRAPH_BACKENDS
+    :return: Empty collaboration graph
+    """
+    if backend == 'networkx':
+        return nx.Graph()
+    if backend == 'compact':
+        return CompactCollaborationGraph()
+    if backend == 'csr':
+        return CSRCollaborationGraph.from_edge_arrays(node_sids=list(), node_ids_1=np.empty(0, dtype=np.int64),
+                                                      node_ids_2=np.empty(0, dtype=np.int64),
+                                                      weights=np.empty(0, dtype=np.int32))
+    raise ValueError(f"Unknown collaboration graph backend '{backend}'. Choose one of {GRAPH_BACKENDS}.")
+
+
+def to_collaboration_graph_backend(G: CollaborationGraph,
+                                   backend: str = 'networkx') -> CollaborationGraph:
+    """
+    Convert a collaboration graph to the given backend.
+    :param G: Collaboration graph
+    :param backend: Graph backend, one of GRAPH_BACKENDS
+    :return: Collaboration graph using the given backend
+    """
+    if isinstance(G, CSRCollaborationGraph):
+        if backend == 'csr':
+            return G
+        G = CompactCollaborationGraph.from_csr(G)
+    if backend == 'networkx':
+        return G.to_networkx() if isinstance(G, CompactCollaborationGraph) else G
+    if backend == 'compact':
+        return G if isinstance(G, CompactCollaborationGraph) else CompactCollaborationGraph.from_networkx(G)
+    if backend == 'csr':
+        G = G if isinstance(G, CompactCollaborationGraph) else CompactCollaborationGraph.from_networkx(G)
+        return G.to_csr()
+    raise ValueError(f"Unknown collaboration graph backend '{backend}'. Choose one of {GRAPH_BACKENDS}.")
+
+
+def increment_edge_weight(G: CollaborationGraph,
+                          node_1: str,
+                          node_2: str) -> None:
+    """
+    Increment the number of collaborations between a pair of existing nodes in a collaboration graph.
+    :param G: Collaboration graph
+    :param node_1: First node SID
+    :param node_2: Second node SID
+    """
+    if isinstance(G, CompactCollaborationGraph):
+        G.increment_edge(node_1, node_2)
+    else:
+        G[node_1][node_2]['weight'] += 1
+
+
+def get_edge_weight(G: CollaborationGraph,
+                    node_1: str,
+                    node_2: str) -> int:
+    """
+    Get the number of collaborations between a pair of nodes in a collaboration graph.
+    :param G: Collaboration graph
+    :param node_1: First node SID
+    :param node_2: Second node SID
+    :return: Number of collaborations, 0 if the nodes have never collaborated
+    """
+    if isinstance(G, (CompactCollaborationGraph, CSRCollaborationGraph)):
+        return G.get_weight(node_1, node_2)
+    return G.get_edge_data(node_1, node_2, default={'weight': 0})['weight']
+
+
+def get_edge_weights(G: CollaborationGraph,
+                     nodes_1: np.ndarray,
+                     nodes_2: np.ndarray) -> np.ndarray:
+    """
+    Get the number of collaborations between many pairs of nodes in a collaboration graph.
+    :param G: Collaboration graph
+    :param nodes_1: Array of first node SIDs
+    :param nodes_2: Array of second node SIDs
+    :return: Array of number of collaborations, 0 for pairs that have never collaborated
+    """
+    if isinstance(G, (CompactCollaborationGraph, CSRCollaborationGraph)):
+        return G.get_weights(nodes_1, nodes_2)
+    return np.fromiter((G.get_edge_data(node_1, node_2, default={'weight': 0})['weight']
+                        for node_1, node_2 in zip(nodes_1, nodes_2)), dtype=np.int64, count=len(nodes_1))
+
+
+def set_edge_weights(G: CollaborationGraph,
+                     nodes_1: np.ndarray,
+                     nodes_2: np.ndarray,
+                     weights: np.ndarray) -> None:
+    """
+    Set the number of collaborations between many unique pairs of nodes in a collaboration graph.
+    :param G: Collaboration graph
+    :param nodes_1: Array of first node SIDs
+    :param nodes_2: Array of second node SIDs
+    :param weights: Array of number of collaborations
+    """
+    if isinstance(G, CompactCollaborationGraph):
+        G.set_weights(nodes_1, nodes_2, weights)
+    else:
+        G.add_weighted_edges_from(zip(nodes_1, nodes_2, np.asarray(weights).tolist()))
+
+
+def merge_collaboration_graph(G: CollaborationGraph,
+                              G_other: CollaborationGraph) -> None:
+    """
+    Add the edges of another collaboration graph, overwriting the number of collaborations of the shared pairs.
+    :param G: Collaboration graph to merge into
+    :param G_other: Collaboration graph to merge
+    """
+    edges = list(G_other.edges(data=True))
+    if not edges:
+        return
+    nodes_1, nodes_2, data = zip(*edges)
+    set_edge_weights(G,
+                     np.array(nodes_1, dtype=object),
+                     np.array(nodes_2, dtype=object),
+                     np.array([edge_data['weight'] for edge_data in data], dtype=np.int64))
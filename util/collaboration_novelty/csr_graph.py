@@ -0,0 +1,433 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import Iterator, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# File signature and version of the CSR collaboration graph format
+CSR_GRAPH_MAGIC = b'COLLCSR1'
+
+# Alignment of the arrays in the file, so they can be memory-mapped and read without copying
+CSR_GRAPH_ALIGNMENT = 64
+
+# Compression codecs of the arrays, as provided by pyarrow
+CSR_GRAPH_COMPRESSIONS = ('zstd', 'lz4')
+
+
+class CSRCollaborationGraph:
+    """
+    Read-only weighted undirected collaboration graph in compressed sparse row (CSR) layout. Node SIDs are stored as a
+    sorted array of fixed-width UTF-8 strings, so the integer id of a node is its position in the array and a node is
+    looked up by binary search. Every edge is stored twice, once in the row of each of its nodes, with the neighbors of
+    a row sorted by id.
+
+    All the arrays can be views of a memory-mapped file, in which case opening a graph does not read it and the pages
+    are loaded (and shared between processes) only as they are used. A memory-mapped graph is pickled as the path of
+    its file, so passing it to worker processes maps the same file again instead of copying the arrays.
+
+    File layout (little endian):
+        magic (8 bytes) | header length (uint64) | JSON header | arrays, each aligned to CSR_GRAPH_ALIGNMENT bytes
+    The JSON header has the number of nodes and edges, the compression codec and the dtype, shape, offset and size of
+    the arrays node_sids, indptr, indices and weights.
+    """
+
+    def __init__(self,
+                 node_sids: np.ndarray,
+                 indptr: np.ndarray,
+                 indices: np.ndarray,
+                 weights: np.ndarray,
+                 buffer=None,
+                 path: str = None):
+        """
+        :param node_sids: Sorted array of fixed-width UTF-8 encoded node SIDs
+        :param indptr: Array of the offsets of each node's neighbors in indices, of length number of nodes + 1
+        :param indices: Array of the neighbor ids of each node, sorted within each node
+        :param weights: Array of the edge weights aligned with indices
+        :param buffer: Buffer the arrays are views of (e.g. a memory map), kept open for the lifetime of the graph
+        :param path: Path of the uncompressed file the arrays are memory-mapped from, if any
+        """
+        self.node_sids = node_sids
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.buffer = buffer
+        self.path = path
+
+    def __reduce__(self) -> tuple:
+        """
+        Pickle a memory-mapped graph as the path of its file and any other graph as its arrays.
+        :return: Tuple of the callable and the arguments that rebuild the graph
+        """
+        if self.path is not None:
+            return read_csr_graph, (self.path,)
+        return self.__class__, (np.asarray(self.node_sids), np.asarray(self.indptr), np.asarray(self.indices),
+                                np.asarray(self.weights))
+
+    # ------------------------------ Construction ------------------------------
+    @classmethod
+    def from_edge_arrays(cls,
+                         node_sids: list,
+                         node_ids_1: np.ndarray,
+                         node_ids_2: np.ndarray,
+                         weights: np.ndarray) -> 'CSRCollaborationGraph':
+        """
+        Build a CSR collaboration graph from the unique undirected edges of a graph.
+        :param node_sids: List of node SIDs, indexed by the node ids of the edges
+        :param node_ids_1: Array of the ids of the first nodes of the edges
+        :param node_ids_2: Array of the ids of the second nodes of the edges
+        :param weights: Array of the edge weights, stored as 32-bit integers unless they are floating point
+        :return: CSR collaboration graph
+        """
+        encoded_sids = np.array([str(node_sid).encode('utf-8') for node_sid in node_sids], dtype=bytes)
+
+        # Renumber the nodes in the order of their SIDs
+        order = np.argsort(encoded_sids, kind='stable')
+        ranks = np.empty(len(order), dtype=np.int64)
+        ranks[order] = np.arange(len(order))
+        ranks_1 = ranks[np.asarray(node_ids_1, dtype=np.int64)]
+        ranks_2 = ranks[np.asarray(node_ids_2, dtype=np.int64)]
+
+        # Store every edge in the rows of both of its nodes, sorted by row and neighbor
+        rows = np.concatenate([ranks_1, ranks_2])
+        neighbors = np.concatenate([ranks_2, ranks_1])
+        edge_weights = np.concatenate([weights, weights])
+        edge_weights = edge_weights.astype(np.float64 if np.issubdtype(edge_weights.dtype, np.floating) else np.int32)
+        entry_order = np.lexsort((neighbors, rows))
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(order)))]).astype(np.int64)
+
+        return cls(node_sids=encoded_sids[order],
+                   indptr=indptr,
+                   indices=neighbors[entry_order].astype(np.int32),
+                   weights=edge_weights[entry_order])
+
+    def to_edge_arrays(self) -> tuple:
+        """
+        Get the unique undirected edges of the graph.
+        :return: Tuple of the list of node SIDs and the arrays of the first node ids, second node ids and weights of
+        the edges, sorted by the first and second node id
+        """
+        rows = np.repeat(np.arange(self.number_of_nodes(), dtype=np.int64), np.diff(self.indptr))
+        indices = np.asarray(self.indices, dtype=np.int64)
+        is_upper = rows < indices
+        return self.get_node_sids(), rows[is_upper], indices[is_upper], np.asarray(self.weights)[is_upper]
+
+    # ------------------------------ Nodes ------------------------------
+    def number_of_nodes(self) -> int:
+        """
+        Get the number of nodes in the graph.
+        :return: Number of nodes
+        """
+        return len(self.node_sids)
+
+    def get_node_sids(self) -> list:
+        """
+        Get the SIDs of all the nodes in the order of their ids.
+        :return: List of node SIDs
+        """
+        return [node_sid.decode('utf-8') for node_sid in self.node_sids.tolist()]
+
+    def lookup_node_ids(self, nodes: np.ndarray) -> np.ndarray:
+        """
+        Get the integer ids for an array of node SIDs by binary search over the sorted node SIDs.
+        :param nodes: Array of node SIDs
+        :return: Array of integer node ids, -1 for nodes that are not in the graph
+        """
+        codes, unique_nodes = pd.factorize(np.asarray(nodes, dtype=object))
+        unique_ids = np.full(len(unique_nodes), -1, dtype=np.int64)
+        if len(unique_nodes) == 0 or self.number_of_nodes() == 0:
+            return unique_ids[codes] if len(codes) else np.empty(0, dtype=np.int64)
+
+        # SIDs longer than the stored width would be truncated to the width of the array, so they cannot be in the graph
+        encoded_nodes = [str(node).encode('utf-8') for node in unique_nodes]
+        fits = np.array([len(encoded_node) <= self.node_sids.dtype.itemsize for encoded_node in encoded_nodes])
+        queries = np.array(encoded_nodes, dtype=self.node_sids.dtype)
+        positions = np.minimum(np.searchsorted(self.node_sids, queries), self.number_of_nodes() - 1)
+        found = fits & (self.node_sids[positions] == queries)
+        unique_ids[found] = positions[found]
+        return unique_ids[codes]
+
+    def has_node(self, node: str) -> bool:
+        """
+        Check if the node is in the graph.
+        :param node: Node SID
+        :return: True if the node is in the graph, False otherwise
+        """
+        return bool(self.lookup_node_ids(np.array([node], dtype=object))[0] >= 0)
+
+    def _get_node_id(self, node: str) -> int:
+        """
+        Get the integer id of a node that must be in the graph.
+        :param node: Node SID
+        :return: Integer node id
+        """
+        node_id = int(self.lookup_node_ids(np.array([node], dtype=object))[0])
+        if node_id < 0:
+            raise KeyError(f"The node {node} is not in the graph.")
+        return node_id
+
+    def degree(self, node: str) -> int:
+        """
+        Get the number of neighbors of a node.
+        :param node: Node SID
+        :return: Number of neighbors
+        """
+        node_id = self._get_node_id(node)
+        return int(self.indptr[node_id + 1] - self.indptr[node_id])
+
+    def get_neighbors(self, node: str) -> tuple:
+        """
+        Get the neighbors of a node with the weights of their edges, read directly from the row of the node.
+        :param node: Node SID
+        :return: Tuple of the list of neighbor SIDs and the array of edge weights (integer, or float for a graph with
+        float weights), sorted by neighbor SID
+        """
+        node_id = self._get_node_id(node)
+        start, end = int(self.indptr[node_id]), int(self.indptr[node_id + 1])
+        neighbor_sids = [neighbor_sid.decode('utf-8')
+                         for neighbor_sid in self.node_sids[np.asarray(self.indices[start:end])].tolist()]
+        return neighbor_sids, np.asarray(self.weights[start:end], dtype=np.result_type(np.int64, self.weights.dtype))
+
+    def neighbors(self, node: str) -> Iterator[str]:
+        """
+        Iterate over the neighbors of a node in the same format as networkx.
+        :param node: Node SID
+        :return: Iterator over the neighbor SIDs
+        """
+        neighbor_sids, _ = self.get_neighbors(node)
+        return iter(neighbor_sids)
+
+    # ------------------------------ Edges ------------------------------
+    def number_of_edges(self) -> int:
+        """
+        Get the number of (undirected) edges in the graph.
+        :return: Number of edges
+        """
+        return len(self.indices) // 2
+
+    def _find_edges(self, node_ids_1: np.ndarray, node_ids_2: np.ndarray) -> np.ndarray:
+        """
+        Find the positions of edges in the neighbor arrays with a vectorized binary search within the rows of the first
+        nodes.
+        :param node_ids_1: Array of the ids of the first nodes, all in the graph
+        :param node_ids_2: Array of the ids of the second nodes, all in the graph
+        :return: Array of the positions of the edges in indices and weights, -1 for pairs that are not connected
+        """
+        low = np.asarray(self.indptr[node_ids_1], dtype=np.int64)
+        end = np.asarray(self.indptr[node_ids_1 + 1], dtype=np.int64)
+        high = end.copy()
+        active = low < high
+        while active.any():
+            middle = (low + high) // 2
+            go_right = active & (np.asarray(self.indices[np.minimum(middle, len(self.indices) - 1)]) < node_ids_2)
+            low = np.where(go_right, middle + 1, low)
+            high = np.where(active & ~go_right, middle, high)
+            active = low < high
+
+        positions = np.full(len(node_ids_1), -1, dtype=np.int64)
+        in_row = low < end
+        found = np.zeros(len(node_ids_1), dtype=bool)
+        found[in_row] = np.asarray(self.indices[low[in_row]]) == node_ids_2[in_row]
+        positions[found] = low[found]
+        return positions
+
+    def get_weights(self, nodes_1: np.ndarray, nodes_2: np.ndarray) -> np.ndarray:
+        """
+        Get the weights of the edges between pairs of nodes in a single pass.
+        :param nodes_1: Array of first node SIDs
+        :param nodes_2: Array of second node SIDs
+        :return: Array of edge weights, 0 for pairs that are not connected
+        """
+        node_ids_1 = self.lookup_node_ids(nodes_1)
+        node_ids_2 = self.lookup_node_ids(nodes_2)
+        known = (node_ids_1 >= 0) & (node_ids_2 >= 0)
+
+        weights = np.zeros(len(known), dtype=np.result_type(np.int64, self.weights.dtype))
+        if not known.any():
+            return weights
+
+        positions = self._find_edges(node_ids_1[known], node_ids_2[known])
+        found = positions >= 0
+        weights[np.flatnonzero(known)[found]] = np.asarray(self.weights[positions[found]])
+        return weights
+
+    def get_weight(self, node_1: str, node_2: str, default: int = 0) -> Union[int, float]:
+        """
+        Get the weight of the edge between a pair of nodes.
+        :param node_1: First node SID
+        :param node_2: Second node SID
+        :param default: Weight to return if the edge does not exist
+        :return: Weight of the edge, in the data type of the weights of the graph
+        """
+        weight = self.get_weights(np.array([node_1], dtype=object), np.array([node_2], dtype=object))[0].item()
+        return weight if weight > 0 else default
+
+    def has_edge(self, node_1: str, node_2: str) -> bool:
+        """
+        Check if there is an edge between a pair of nodes.
+        :param node_1: First node SID
+        :param node_2: Second node SID
+        :return: True if the edge exists, False otherwise
+        """
+        return self.get_weight(node_1, node_2) > 0
+
+    def get_edge_data(self, node_1: str, node_2: str, default: dict = None) -> Union[dict, None]:
+        """
+        Get the attributes of the edge between a pair of nodes in the same format as networkx.
+        :param node_1: First node SID
+        :param node_2: Second node SID
+        :param default: Value to return if the edge does not exist
+        :return: Dictionary with the edge weight or the default value
+        """
+        weight = self.get_weight(node_1, node_2)
+        return {'weight': weight} if weight > 0 else default
+
+    def edges(self, data: bool = False) -> Iterator[tuple]:
+        """
+        Iterate over the edges of the graph in the same format as networkx.
+        :param data: If True, yield the edge attributes as the third element
+        :return: Iterator over the edges
+        """
+        node_sids, node_ids_1, node_ids_2, weights = self.to_edge_arrays()
+        for node_id_1, node_id_2, weight in zip(node_ids_1.tolist(), node_ids_2.tolist(), weights.tolist()):
+            if data:
+                yield node_sids[node_id_1], node_sids[node_id_2], {'weight': weight}
+            else:
+                yield node_sids[node_id_1], node_sids[node_id_2]
+
+
+# ------------------------------ Serialization ------------------------------
+def _align(offset: int) -> int:
+    """
+    Round an offset up to the alignment of the arrays.
+    :param offset: Offset in bytes
+    :return: Aligned offset in bytes
+    """
+    return -(-offset // CSR_GRAPH_ALIGNMENT) * CSR_GRAPH_ALIGNMENT
+
+
+def serialize_csr_graph(G: CSRCollaborationGraph, compression: str = None) -> bytes:
+    """
+    Serialize a CSR collaboration graph to the CSR graph format.
+    :param G: CSR collaboration graph
+    :param compression: Compression codec of the arrays (one of CSR_GRAPH_COMPRESSIONS), None to store them
+    uncompressed so that they can be memory-mapped
+    :return: Serialized graph
+    """
+    if compression is not None and compression not in CSR_GRAPH_COMPRESSIONS:
+        raise ValueError(f"Unknown compression '{compression}'. Choose one of {CSR_GRAPH_COMPRESSIONS} or None.")
+
+    arrays = dict(node_sids=G.node_sids, indptr=G.indptr, indices=G.indices, weights=G.weights)
+    payloads = dict()
+    for name, array in arrays.items():
+        payload = np.ascontiguousarray(array).tobytes()
+        if compression is not None:
+            payload = pa.Codec(compression).compress(payload, asbytes=True)
+        payloads[name] = payload
+
+    # The header size depends on the offsets and the offsets on the header size, so reserve room for it
+    header = dict(n_nodes=G.number_of_nodes(), n_edges=G.number_of_edges(), compression=compression, arrays=dict())
+    header_capacity = _align(len(json.dumps(header)) + 256 * len(arrays) + 16)
+    offset = header_capacity
+    for name, array in arrays.items():
+        header['arrays'][name] = dict(dtype=np.asarray(array).dtype.str,
+                                      shape=list(np.asarray(array).shape),
+                                      offset=offset,
+                                      nbytes=int(np.asarray(array).nbytes),
+                                      stored_nbytes=len(payloads[name]))
+        offset = _align(offset + len(payloads[name]))
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    prefix = CSR_GRAPH_MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes
+    if len(prefix) > header_capacity:
+        raise ValueError("The header of the CSR graph does not fit in the space reserved for it.")
+
+    data = bytearray(offset)
+    data[:len(prefix)] = prefix
+    for name, payload in payloads.items():
+        start = header['arrays'][name]['offset']
+        data[start:start + len(payload)] = payload
+    return bytes(data)
+
+
+def is_csr_graph(data) -> bool:
+    """
+    Check if serialized data is in the CSR graph format.
+    :param data: Serialized graph
+    :return: True if the data starts with the signature of the CSR graph format
+    """
+    return bytes(data[:len(CSR_GRAPH_MAGIC)]) == CSR_GRAPH_MAGIC
+
+
+def deserialize_csr_graph(data) -> CSRCollaborationGraph:
+    """
+    Deserialize a graph in the CSR graph format. Uncompressed arrays are read-only views of the data, so deserializing
+    a memory map does not read the arrays.
+    :param data: Serialized graph as bytes or any buffer, e.g. a memory map
+    :return: CSR collaboration graph
+    """
+    if not is_csr_graph(data):
+        raise ValueError("The data is not in the CSR collaboration graph format.")
+    (header_length,) = struct.unpack('<Q', bytes(data[len(CSR_GRAPH_MAGIC):len(CSR_GRAPH_MAGIC) + 8]))
+    header_start = len(CSR_GRAPH_MAGIC) + 8
+    header = json.loads(bytes(data[header_start:header_start + header_length]).decode('utf-8'))
+
+    arrays = dict()
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        if header['compression'] is None:
+            array = np.frombuffer(data, dtype=dtype, count=spec['nbytes'] // dtype.itemsize, offset=spec['offset'])
+        else:
+            payload = bytes(data[spec['offset']:spec['offset'] + spec['stored_nbytes']])
+            array = np.frombuffer(pa.Codec(header['compression']).decompress(
+                payload, decompressed_size=spec['nbytes'], asbytes=True), dtype=dtype)
+        arrays[name] = array.reshape(spec['shape'])
+
+    return CSRCollaborationGraph(**arrays, buffer=data if header['compression'] is None else None)
+
+
+def write_csr_graph(G: CSRCollaborationGraph, path: str, compression: str = None) -> None:
+    """
+    Write a CSR collaboration graph to a local file.
+    :param G: CSR collaboration graph
+    :param path: Path of the file
+    :param compression: Compression codec of the arrays, None to be able to memory-map the file
+    """
+    with open(path, 'wb') as file:
+        file.write(serialize_csr_graph(G=G, compression=compression))
+
+
+def read_csr_graph(path: str) -> CSRCollaborationGraph:
+    """
+    Open a CSR collaboration graph from a local file. Uncompressed files are memory-mapped read-only, so opening the
+    graph takes about the same time regardless of its size, and processes that open the same file share its pages.
+    :param path: Path of the file
+    :return: CSR collaboration graph
+    """
+    with open(path, 'rb') as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    G = deserialize_csr_graph(data=buffer)
+    if G.buffer is not None:
+        G.path = os.path.abspath(path)
+    return G
+
+
+def share_csr_graph(G: CSRCollaborationGraph, directory: str = None) -> CSRCollaborationGraph:
+    """
+    Write a CSR collaboration graph to an uncompressed file and open it memory-mapped, so that worker processes the
+    graph is passed to share one physical copy of it. The file is placed in shared memory (/dev/shm) where available.
+    The caller removes the file (the path of the returned graph) once the workers are done.
+    :param G: CSR collaboration graph
+    :param directory: Directory of the file, /dev/shm or the temporary directory by default
+    :return: Memory-mapped CSR collaboration graph
+    """
+    if directory is None:
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    file_descriptor, path = tempfile.mkstemp(prefix='collaboration_graph_', suffix='.csr', dir=directory)
+    with os.fdopen(file_descriptor, 'wb') as file:
+        file.write(serialize_csr_graph(G=G, compression=None))
+    return read_csr_graph(path=path)
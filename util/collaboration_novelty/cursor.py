@@ -0,0 +1,91 @@
+import datetime
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Columns of the collaboration stream
+COLLABORATION_COLUMNS = ['ARTICLE_SID', 'AUTHOR_SID', 'INSTITUTION_SID', 'ARTICLE_PUBLICATION_DT']
+
+
+def read_local_collaboration_stream(source_path: str,
+                                    min_year: int,
+                                    watermark: dict = None,
+                                    loaded_article_sids: set = None,
+                                    max_chunksize: int = 65536) -> Iterator[pa.RecordBatch]:
+    """
+    Local stand-in for query_collaboration_stream that reads a Parquet snapshot of the source table (e.g. an export of
+    INT_COLLABORATION) and applies the same filters and ordering.
+    :param source_path: Path to the Parquet file or directory with the source table
+    :param min_year: Minimum year to consider
+    :param watermark: High-water mark with the publication date and SID of the last processed article
+    :param loaded_article_sids: Article SIDs that are already processed, used only without a watermark
+    :param max_chunksize: Maximum number of rows in a record batch
+    :return: Iterator of Arrow record batches with the publications after the watermark
+    """
+    table = pq.read_table(source_path, columns=COLLABORATION_COLUMNS + ['IS_SOLE_AUTHOR_PUBLICATION'])
+    publication_dt = table['ARTICLE_PUBLICATION_DT']
+
+    # Get articles after the watermark excluding sole author publications
+    mask = pc.and_(pc.and_(pc.invert(table['IS_SOLE_AUTHOR_PUBLICATION']),
+                           pc.not_equal(table['AUTHOR_SID'], 'n/a')),
+                   pc.and_(pc.not_equal(table['INSTITUTION_SID'], 'n/a'),
+                           pc.greater_equal(pc.year(publication_dt), min_year)))
+    if watermark is not None:
+        watermark_dt = pa.scalar(datetime.date.fromisoformat(watermark['ARTICLE_PUBLICATION_DT']),
+                                 type=publication_dt.type)
+        mask = pc.and_(mask, pc.or_(pc.greater(publication_dt, watermark_dt),
+                                    pc.and_(pc.equal(publication_dt, watermark_dt),
+                                            pc.greater(table['ARTICLE_SID'], watermark['ARTICLE_SID']))))
+    elif loaded_article_sids:
+        mask = pc.and_(mask, pc.invert(pc.is_in(table['ARTICLE_SID'], pa.array(list(loaded_article_sids)))))
+    article_sids = pc.unique(table.filter(mask)['ARTICLE_SID'])
+
+    # Get all rows for chosen article SIDs in chronological order
+    table = table.filter(pc.is_in(table['ARTICLE_SID'], article_sids)).select(COLLABORATION_COLUMNS)
+    table = table.sort_by([(column, 'ascending') for column in
+                           ['ARTICLE_PUBLICATION_DT', 'ARTICLE_SID', 'AUTHOR_SID', 'INSTITUTION_SID']])
+    return iter(table.to_batches(max_chunksize=max_chunksize))
+
+
+def iterate_collaboration_batches(record_batches: Iterator[pa.RecordBatch],
+                                  batch_size: int) -> Iterator[pd.DataFrame]:
+    """
+    Regroup a chronologically ordered stream of collaboration rows into batches of whole articles.
+    :param record_batches: Iterator of Arrow record batches ordered by publication date and article SID
+    :param batch_size: Number of articles in a batch
+    :return: Iterator of DataFrames with all the rows of batch_size articles (fewer in the last batch)
+    """
+    df_pending = None
+    article_codes = np.empty(0, dtype=np.int64)
+
+    for record_batch in record_batches:
+        df_record_batch = record_batch.to_pandas()
+        df_pending = df_record_batch if df_pending is None else pd.concat([df_pending, df_record_batch],
+                                                                          ignore_index=True)
+        # Rows of the same article are contiguous, so the article codes are non-decreasing
+        article_codes, _ = pd.factorize(df_pending['ARTICLE_SID'])
+
+        # Yield the batches whose articles are complete, i.e. followed by at least one row of another article
+        while len(article_codes) > 0 and article_codes[-1] >= batch_size:
+            cut = int(np.searchsorted(article_codes, batch_size))
+            yield df_pending.iloc[:cut].reset_index(drop=True)
+            df_pending = df_pending.iloc[cut:].reset_index(drop=True)
+            article_codes = article_codes[cut:] - batch_size
+
+    if df_pending is not None and len(df_pending) > 0:
+        yield df_pending
+
+
+def get_collaboration_watermark(df_batch: pd.DataFrame) -> dict:
+    """
+    Get the high-water mark of a chronologically ordered batch: the publication date and SID of its last article.
+    :param df_batch: DataFrame with the collaborations of the batch
+    :return: Dictionary with the publication date (ISO format) and the SID of the last article
+    """
+    last_row = df_batch.iloc[-1]
+    return dict(ARTICLE_PUBLICATION_DT=pd.Timestamp(last_row['ARTICLE_PUBLICATION_DT']).date().isoformat(),
+                ARTICLE_SID=str(last_row['ARTICLE_SID']))
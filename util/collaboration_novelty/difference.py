@@ -1,34 +1,28 @@
 import itertools
 
-import networkx as nx
 import pandas as pd
 
+from util.collaboration_novelty.compact_graph import CollaborationGraph, increment_edge_weight
+from util.collaboration_novelty.institution_index import InstitutionCollaborationIndex, \
+    get_institution_cross_collaborations
 
-def is_new_institution_collaboration(G: nx.Graph,
-                                     authors_institution_1: str,
-                                     authors_institution_2: str) -> bool:
+
+def is_new_institution_collaboration(institution_index: InstitutionCollaborationIndex,
+                                     institution_1: str,
+                                     institution_2: str) -> bool:
     """
     Check if a pair of institutions have collaborated before. We consider that a pair of institutions have not
-    collaborated before if there is no pair of authors from the pair of institutions that have collaborated before.
-    :param G: Collaboration graph
-    :param authors_institution_1: Authors from institution 1
-    :param authors_institution_2: Authors from institution 2
+    collaborated before if no author affiliated with one of them has ever co-authored an article with an author that
+    was at the time affiliated with the other one.
+    :param institution_index: Index of the pairs of institutions that have collaborated before
+    :param institution_1: Institution 1
+    :param institution_2: Institution 2
     :return: True if the pair of institutions have not collaborated before, False otherwise.
     """
-    for author_institution_1, author_institution_2 in itertools.product(authors_institution_1, authors_institution_2):
-        # If the pair of authors have collaborated before, the pair of institutions have collaborated before
-        if G.has_edge(author_institution_1, author_institution_2):
-            # If the pair of institutions have collaborated before, the collaboration is not new
-            return False
+    return not institution_index.has_collaborated(institution_1, institution_2)
 
-    # If there is no pair of authors from the pair of institutions that have collaborated before, the pair of
-    # institutions have not collaborated before and the collaboration is new.
-    # TODO: This is not the correct definition when authors have previously collaborated but were then affiliated with
-    #  different institutions.
-    return True
 
-
-def is_new_author_collaboration(G: nx.Graph,
+def is_new_author_collaboration(G: CollaborationGraph,
                                 author_1: str,
                                 author_2: str) -> bool:
     """
@@ -41,20 +35,22 @@ def is_new_author_collaboration(G: nx.Graph,
     return not G.has_edge(author_1, author_2)
 
 
-def update_collaboration(G_a: nx.Graph,
-                         G_i: nx.Graph,
+def update_collaboration(G_a: CollaborationGraph,
+                         G_i: CollaborationGraph,
+                         institution_index: InstitutionCollaborationIndex,
                          diff: dict) -> None:
     """
     Update the collaboration history graphs with the new collaboration information.
     :param G_a: Collaboration author graph
     :param G_i: Collaboration institution graph
+    :param institution_index: Index of the pairs of institutions that have collaborated before
     :param diff: Difference between the collaboration history and the new publication
     :return: Updated author and institution collaboration history graphs
     """
     # Update the author collaboration history (for old authors)
     for author_tuple in diff['old_authors']:
         # Increment the number of collaborations attribute for the pair of authors
-        G_a[author_tuple[0]][author_tuple[1]]['weight'] += 1
+        increment_edge_weight(G_a, author_tuple[0], author_tuple[1])
 
     # Update the author collaboration history (for new authors)
     for author_tuple in diff['new_authors']:
@@ -64,15 +60,19 @@ def update_collaboration(G_a: nx.Graph,
     # Update the institution collaboration history (for old institutions)
     for institution_tuple in diff['old_institutions']:
         # Increment the number of collaborations attribute for the pair of institutions
-        G_i[institution_tuple[0]][institution_tuple[1]]['weight'] += 1
+        increment_edge_weight(G_i, institution_tuple[0], institution_tuple[1])
 
     # Update the institution collaboration history (for new institutions)
     for institution_tuple in diff['new_institutions']:
         # Add a new edge between the pair of institutions and set the number of collaborations to 1
         G_i.add_edge(institution_tuple[0], institution_tuple[1], weight=1)
 
+    # Update the index of institutions that have collaborated through a pair of their authors
+    for institution_tuple in diff['institution_collaborations']:
+        institution_index.add_collaboration(institution_tuple[0], institution_tuple[1])
+
 
-def collaboration_difference_by_author(G: nx.Graph,
+def collaboration_difference_by_author(G: CollaborationGraph,
                                        authors: list) -> tuple:
     """
     Calculate the difference between the collaboration history and the new publication for authors.
@@ -94,31 +94,23 @@ def collaboration_difference_by_author(G: nx.Graph,
     return new_authors, old_authors
 
 
-def collaboration_difference_by_institution(G: nx.Graph,
-                                            institutions: list,
-                                            author_affiliations: pd.DataFrame) -> tuple:
+def collaboration_difference_by_institution(institution_index: InstitutionCollaborationIndex,
+                                            institutions: list) -> tuple:
     """
     Calculate the difference between the collaboration history and the new publication for institutions.
-    :param G: Collaboration graph
+    :param institution_index: Index of the pairs of institutions that have collaborated before
     :param institutions: The list of institutions
-    :param author_affiliations: The DataFrame with the author and institution pairs
-    :return:
+    :return: Tuple of new and old institutions lists
     """
     # Init the new and old institutions lists
     new_institutions, old_institutions = list(), list()
 
-    # Go through all the pairs of institutions and authors
+    # Go through all the pairs of institutions
     for institution_1, institution_2 in itertools.combinations(institutions, 2):
-        # Get full batch of authors from the pair of institutions
-        authors_institution_1 = author_affiliations[author_affiliations['INSTITUTION_SID'] == institution_1][
-            'AUTHOR_SID']
-        authors_institution_2 = author_affiliations[author_affiliations['INSTITUTION_SID'] == institution_2][
-            'AUTHOR_SID']
-
         # Check if the pair of institutions have collaborated before
-        if is_new_institution_collaboration(G=G,
-                                            authors_institution_1=authors_institution_1,
-                                            authors_institution_2=authors_institution_2):
+        if is_new_institution_collaboration(institution_index=institution_index,
+                                            institution_1=institution_1,
+                                            institution_2=institution_2):
             new_institutions.append((institution_1, institution_2))
         else:
             old_institutions.append((institution_1, institution_2))
@@ -126,13 +118,16 @@ def collaboration_difference_by_institution(G: nx.Graph,
     return new_institutions, old_institutions
 
 
-def collaboration_difference(G: nx.Graph,
+def collaboration_difference(G: CollaborationGraph,
+                             institution_index: InstitutionCollaborationIndex,
                              author_affiliations: pd.DataFrame) -> dict:
     """
     Calculate the difference between the collaboration history and the new publication.
     :param G: Collaboration graph
+    :param institution_index: Index of the pairs of institutions that have collaborated before
     :param author_affiliations: List of author and institution pairs
-    :return: Difference between the collaboration history and the new publication
+    :return: Difference between the collaboration history and the new publication, including the sets of authors and
+    institutions that take part in at least one new pair
     """
     # Get the authors and institutions
     authors = author_affiliations['AUTHOR_SID'].unique()
@@ -143,8 +138,13 @@ def collaboration_difference(G: nx.Graph,
 
     # Institutions
     new_institutions, old_institutions = collaboration_difference_by_institution(
-        G=G,
-        institutions=institutions,
+        institution_index=institution_index,
+        institutions=institutions
+    )
+
+    # Pairs of institutions that this publication connects through a pair of their authors
+    institution_collaborations = get_institution_cross_collaborations(
+        institutions=list(institutions),
         author_affiliations=author_affiliations
     )
 
@@ -153,5 +153,8 @@ def collaboration_difference(G: nx.Graph,
         new_authors=new_authors,
         old_authors=old_authors,
         new_institutions=new_institutions,
-        old_institutions=old_institutions
+        old_institutions=old_institutions,
+        institution_collaborations=institution_collaborations,
+        new_author_participants=set(itertools.chain.from_iterable(new_authors)),
+        new_institution_participants=set(itertools.chain.from_iterable(new_institutions))
     )
@@ -1,25 +1,91 @@
+import os
 import pickle
+from contextlib import contextmanager
+from typing import Iterator
 
-import networkx as nx
 from google.cloud import storage
 from google.cloud.exceptions import NotFound
 from loguru import logger
 
+from util.collaboration_novelty.compact_graph import CollaborationGraph, get_empty_collaboration_graph, \
+    to_collaboration_graph_backend
+from util.collaboration_novelty.csr_graph import CSRCollaborationGraph, deserialize_csr_graph, is_csr_graph, \
+    serialize_csr_graph, share_csr_graph
+from util.collaboration_novelty.institution_index import InstitutionCollaborationIndex, \
+    deserialize_institution_collaboration_index, serialize_institution_collaboration_index
+from util.collaboration_novelty.serialization import load_legacy_pickle
+
+
+def serialize_collaboration_graph(G: CollaborationGraph,
+                                  graph_format: str = 'csr',
+                                  compression: str = 'zstd') -> bytes:
+    """
+    Serialize a collaboration graph.
+    :param G: Collaboration graph
+    :param graph_format: 'csr' for the CSR graph format or 'pickle' for a pickle of the graph object
+    :param compression: Compression codec of the CSR graph format, None to be able to memory-map the graph
+    :return: Serialized graph
+    """
+    if graph_format == 'csr':
+        return serialize_csr_graph(G=to_collaboration_graph_backend(G=G, backend='csr'), compression=compression)
+    if graph_format == 'pickle':
+        return pickle.dumps(G)
+    raise ValueError(f"Unknown collaboration graph format '{graph_format}'. Choose 'csr' or 'pickle'.")
+
+
+def deserialize_collaboration_graph(data: bytes,
+                                    backend: str = 'networkx',
+                                    allow_pickle: bool = False) -> CollaborationGraph:
+    """
+    Deserialize a collaboration graph stored in the CSR graph format or, with allow_pickle, as a pickle.
+    :param data: Serialized graph
+    :param backend: Collaboration graph backend to return the graph in ('networkx', 'compact' or 'csr')
+    :param allow_pickle: If True, also load graphs pickled before the CSR graph format, e.g. to convert them
+    :return: Collaboration graph
+    """
+    if is_csr_graph(data):
+        G = deserialize_csr_graph(data=data)
+    else:
+        G = load_legacy_pickle(data=data, allow_pickle=allow_pickle, description='collaboration graph')
+    return to_collaboration_graph_backend(G=G, backend=backend)
+
+
+@contextmanager
+def shared_collaboration_graph(G: CollaborationGraph,
+                               directory: str = None) -> Iterator[CSRCollaborationGraph]:
+    """
+    Provide a read-only, memory-mapped CSR view of a collaboration graph for worker processes. The view is pickled as
+    the path of its file, so every worker that receives it maps the same physical copy of the graph instead of
+    unpickling its own. The file is removed when the context exits.
+    :param G: Collaboration graph
+    :param directory: Directory of the shared file, /dev/shm or the temporary directory by default
+    :return: Memory-mapped CSR collaboration graph
+    """
+    G_shared = share_csr_graph(G=to_collaboration_graph_backend(G=G, backend='csr'), directory=directory)
+    try:
+        yield G_shared
+    finally:
+        os.remove(G_shared.path)
+
 
 def fetch_collaboration_graph(bucket: storage.Bucket,
                               graph_a_blob_name: str,
-                              graph_i_blob_name: str) -> tuple:
+                              graph_i_blob_name: str,
+                              backend: str = 'networkx',
+                              allow_pickle: bool = False) -> tuple:
     """
     Query the collaboration history stored in a tuple of graphs.
     :param bucket: Google Cloud Storage client
     :param graph_a_blob_name: Author collaboration graph blob name
     :param graph_i_blob_name: Institution collaboration graph blob name
+    :param backend: Collaboration graph backend to return the graphs in ('networkx', 'compact' or 'csr')
+    :param allow_pickle: If True, also load graphs pickled before the CSR graph format
     :return: Tuple of author and institution collaboration graphs
     """
 
     # Init the graphs
-    G_a = nx.Graph()
-    G_i = nx.Graph()
+    G_a = get_empty_collaboration_graph(backend=backend)
+    G_i = get_empty_collaboration_graph(backend=backend)
 
     try:
         # Fetch blob from Google Cloud Storage
@@ -30,9 +96,10 @@ def fetch_collaboration_graph(bucket: storage.Bucket,
         G_a_data = G_a_blob.download_as_string()
         G_i_data = G_i_blob.download_as_string()
 
-        # Deserialize the data
-        G_a = pickle.loads(G_a_data)
-        G_i = pickle.loads(G_i_data)
+        # Deserialize the data and convert the graphs to the requested backend, since the stored graphs may use a
+        # different one
+        G_a = deserialize_collaboration_graph(data=G_a_data, backend=backend, allow_pickle=allow_pickle)
+        G_i = deserialize_collaboration_graph(data=G_i_data, backend=backend, allow_pickle=allow_pickle)
         return G_a, G_i
     except NotFound as e:
         logger.error("Could not find the collaboration graphs from Google Cloud Storage.")
@@ -40,11 +107,30 @@ def fetch_collaboration_graph(bucket: storage.Bucket,
     return G_a, G_i
 
 
+def check_unconverted_collaboration_blobs(bucket: storage.Bucket,
+                                          blob_names: list) -> None:
+    """
+    Check that none of the given blobs is missing while the pickle stored by an earlier version next to it (with the
+    .pkl extension) exists, since starting from an empty collaboration history instead would score every article as
+    novel.
+    :param bucket: Google Cloud Storage client
+    :param blob_names: Blob names of the collaboration graphs and the institution collaboration index
+    """
+    unconverted_blob_names = [blob_name for blob_name in blob_names
+                              if blob_name is not None and not bucket.blob(blob_name=blob_name).exists()
+                              and bucket.blob(blob_name=f"{os.path.splitext(blob_name)[0]}.pkl").exists()]
+    if unconverted_blob_names:
+        raise ValueError(f"The collaboration history is stored as pickles next to {unconverted_blob_names}. Convert it "
+                         f"with scripts/analytics/convert_collaboration_graphs.py.")
+
+
 def save_graphs(bucket: storage.Bucket,
                 graph_a_blob_name: str,
                 graph_i_blob_name: str,
-                _G_a: nx.Graph,
-                _G_i: nx.Graph):
+                _G_a: CollaborationGraph,
+                _G_i: CollaborationGraph,
+                graph_format: str = 'csr',
+                compression: str = 'zstd'):
     """
     Save the graphs to Google Cloud Storage
     :param graph_a_blob_name: Author collaboration graph blob name
@@ -52,11 +138,13 @@ def save_graphs(bucket: storage.Bucket,
     :param bucket: Google Cloud Storage client
     :param _G_a: Author collaboration graph
     :param _G_i: Institution collaboration graph
+    :param graph_format: 'csr' for the CSR graph format or 'pickle' for a pickle of the graph objects
+    :param compression: Compression codec of the CSR graph format, None to be able to memory-map the graphs
     """
 
     # Serialize the graphs
-    G_a_data = pickle.dumps(_G_a)
-    G_i_data = pickle.dumps(_G_i)
+    G_a_data = serialize_collaboration_graph(G=_G_a, graph_format=graph_format, compression=compression)
+    G_i_data = serialize_collaboration_graph(G=_G_i, graph_format=graph_format, compression=compression)
 
     # Create a blob for each graph and upload the data
     G_a_blob = bucket.blob(blob_name=graph_a_blob_name)
@@ -64,3 +152,45 @@ def save_graphs(bucket: storage.Bucket,
 
     G_i_blob = bucket.blob(blob_name=graph_i_blob_name)
     G_i_blob.upload_from_string(G_i_data, content_type='application/octet-stream')
+
+
+def fetch_institution_collaboration_index(bucket: storage.Bucket,
+                                          institution_index_blob_name: str,
+                                          G_i: CollaborationGraph,
+                                          allow_pickle: bool = False) -> InstitutionCollaborationIndex:
+    """
+    Query the index of the pairs of institutions that have collaborated before. If the index has not been stored yet,
+    it is bootstrapped from the institution collaboration graph.
+    :param bucket: Google Cloud Storage client
+    :param institution_index_blob_name: Institution collaboration index blob name
+    :param G_i: Institution collaboration graph
+    :param allow_pickle: If True, also load an index pickled by an earlier version
+    :return: Institution collaboration index
+    """
+    try:
+        # Fetch blob from Google Cloud Storage and deserialize the data
+        institution_index_blob = bucket.blob(blob_name=institution_index_blob_name)
+        return deserialize_institution_collaboration_index(data=institution_index_blob.download_as_string(),
+                                                           allow_pickle=allow_pickle)
+    except NotFound as e:
+        logger.warning("Could not find the institution collaboration index, bootstrapping it from the institution "
+                       "collaboration graph.")
+
+    return InstitutionCollaborationIndex.from_institution_graph(G_i=G_i)
+
+
+def save_institution_collaboration_index(bucket: storage.Bucket,
+                                         institution_index_blob_name: str,
+                                         institution_index: InstitutionCollaborationIndex,
+                                         compression: str = 'zstd'):
+    """
+    Save the institution collaboration index to Google Cloud Storage
+    :param bucket: Google Cloud Storage client
+    :param institution_index_blob_name: Institution collaboration index blob name
+    :param institution_index: Institution collaboration index
+    :param compression: Compression codec of the Parquet file, None to store it uncompressed
+    """
+    institution_index_blob = bucket.blob(blob_name=institution_index_blob_name)
+    institution_index_blob.upload_from_string(
+        serialize_institution_collaboration_index(institution_index=institution_index, compression=compression),
+        content_type='application/octet-stream')
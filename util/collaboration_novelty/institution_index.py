@@ -0,0 +1,191 @@
+import numpy as np
+import pandas as pd
+
+from util.collaboration_novelty.compact_graph import CollaborationGraph
+from util.collaboration_novelty.csr_graph import CSRCollaborationGraph
+from util.collaboration_novelty.serialization import deserialize_parquet, is_parquet, load_legacy_pickle, \
+    serialize_parquet
+
+
+class InstitutionCollaborationIndex:
+    """
+    Incremental index of the pairs of institutions that have collaborated before. A pair of institutions has
+    collaborated before if an author affiliated with one of them has co-authored an article with a different author
+    affiliated with the other one, using the affiliations at the time of the article. Authors who later change their
+    affiliation therefore do not turn their new institution's pairs into old collaborations.
+
+    Institution SIDs are interned to integer ids and every pair is stored as a packed integer key, so checking a pair is
+    a single set lookup.
+    """
+
+    def __init__(self):
+        # Institution SID to integer id mapping
+        self.institution_ids = dict()
+
+        # Packed keys of the pairs of institutions that have collaborated before
+        self.pair_keys = set()
+
+    def _intern(self, institution: str) -> int:
+        """
+        Get the integer id of an institution, adding it to the index if it does not exist yet.
+        :param institution: Institution SID
+        :return: Integer id of the institution
+        """
+        institution_id = self.institution_ids.get(institution)
+        if institution_id is None:
+            institution_id = len(self.institution_ids)
+            self.institution_ids[institution] = institution_id
+        return institution_id
+
+    def _pair_key(self, institution_1: str, institution_2: str) -> int:
+        """
+        Get the undirected packed key of a pair of institutions, or -1 if any of them is not in the index.
+        :param institution_1: First institution SID
+        :param institution_2: Second institution SID
+        :return: Packed pair key
+        """
+        institution_id_1 = self.institution_ids.get(institution_1)
+        institution_id_2 = self.institution_ids.get(institution_2)
+        if institution_id_1 is None or institution_id_2 is None:
+            return -1
+        return (min(institution_id_1, institution_id_2) << 32) | max(institution_id_1, institution_id_2)
+
+    def has_collaborated(self, institution_1: str, institution_2: str) -> bool:
+        """
+        Check if a pair of institutions have collaborated before.
+        :param institution_1: First institution SID
+        :param institution_2: Second institution SID
+        :return: True if the pair of institutions have collaborated before, False otherwise
+        """
+        return self._pair_key(institution_1, institution_2) in self.pair_keys
+
+    def has_collaborated_many(self, institutions_1: np.ndarray, institutions_2: np.ndarray) -> np.ndarray:
+        """
+        Check if many pairs of institutions have collaborated before.
+        :param institutions_1: Array of first institution SIDs
+        :param institutions_2: Array of second institution SIDs
+        :return: Boolean array, True for the pairs of institutions that have collaborated before
+        """
+        return np.fromiter((self._pair_key(institution_1, institution_2) in self.pair_keys
+                            for institution_1, institution_2 in zip(institutions_1, institutions_2)),
+                           dtype=bool, count=len(institutions_1))
+
+    def add_collaboration(self, institution_1: str, institution_2: str) -> None:
+        """
+        Record that a pair of institutions have collaborated.
+        :param institution_1: First institution SID
+        :param institution_2: Second institution SID
+        """
+        institution_id_1, institution_id_2 = self._intern(institution_1), self._intern(institution_2)
+        self.pair_keys.add((min(institution_id_1, institution_id_2) << 32) | max(institution_id_1, institution_id_2))
+
+    def add_collaborations(self, institutions_1: np.ndarray, institutions_2: np.ndarray) -> None:
+        """
+        Record that many pairs of institutions have collaborated.
+        :param institutions_1: Array of first institution SIDs
+        :param institutions_2: Array of second institution SIDs
+        """
+        for institution_1, institution_2 in zip(institutions_1, institutions_2):
+            self.add_collaboration(institution_1, institution_2)
+
+    def update(self, other: 'InstitutionCollaborationIndex') -> None:
+        """
+        Record all the pairs of institutions of another index.
+        :param other: Institution collaboration index
+        """
+        institution_sids = list(other.institution_ids.keys())
+        for pair_key in other.pair_keys:
+            self.add_collaboration(institution_sids[pair_key >> 32], institution_sids[pair_key & 0xFFFFFFFF])
+
+    def get_collaborations(self) -> tuple:
+        """
+        Get all the pairs of institutions in the index.
+        :return: Tuple of arrays with the first and second institution SIDs of every pair
+        """
+        institution_sids = np.array(list(self.institution_ids.keys()), dtype=object)
+        pair_keys = np.fromiter(self.pair_keys, dtype=np.int64, count=len(self.pair_keys))
+        return institution_sids[pair_keys >> 32], institution_sids[pair_keys & 0xFFFFFFFF]
+
+    def to_csr(self) -> CSRCollaborationGraph:
+        """
+        Get the index as a CSR graph with a unit weight for every pair of institutions that have collaborated before,
+        e.g. to share it with worker processes as a memory-mapped view.
+        :return: CSR collaboration graph
+        """
+        pair_keys = np.fromiter(self.pair_keys, dtype=np.int64, count=len(self.pair_keys))
+        return CSRCollaborationGraph.from_edge_arrays(node_sids=list(self.institution_ids.keys()),
+                                                      node_ids_1=pair_keys >> 32,
+                                                      node_ids_2=pair_keys & 0xFFFFFFFF,
+                                                      weights=np.ones(len(pair_keys), dtype=np.int32))
+
+    def __len__(self) -> int:
+        return len(self.pair_keys)
+
+    @classmethod
+    def from_institution_graph(cls, G_i: CollaborationGraph) -> 'InstitutionCollaborationIndex':
+        """
+        Bootstrap the index from an institution collaboration graph, treating every pair of institutions that have
+        appeared on the same article as a pair that has collaborated before.
+        :param G_i: Collaboration institution graph
+        :return: Institution collaboration index
+        """
+        institution_index = cls()
+        for institution_1, institution_2 in G_i.edges():
+            institution_index.add_collaboration(institution_1, institution_2)
+        return institution_index
+
+
+def serialize_institution_collaboration_index(institution_index: InstitutionCollaborationIndex,
+                                              compression: str = 'zstd') -> bytes:
+    """
+    Serialize an institution collaboration index to a Parquet file with one row per pair of institutions.
+    :param institution_index: Institution collaboration index
+    :param compression: Compression codec of the Parquet file, None to store it uncompressed
+    :return: Serialized index
+    """
+    institutions_1, institutions_2 = institution_index.get_collaborations()
+    return serialize_parquet(df=pd.DataFrame(dict(INSTITUTION_SID_1=institutions_1, INSTITUTION_SID_2=institutions_2)),
+                             compression=compression)
+
+
+def deserialize_institution_collaboration_index(data: bytes,
+                                                allow_pickle: bool = False) -> InstitutionCollaborationIndex:
+    """
+    Deserialize an institution collaboration index stored as a Parquet file or, with allow_pickle, as a pickle.
+    :param data: Serialized index
+    :param allow_pickle: If True, also load indexes pickled by earlier versions
+    :return: Institution collaboration index
+    """
+    if not is_parquet(data):
+        return load_legacy_pickle(data=data, allow_pickle=allow_pickle, description='institution collaboration index')
+
+    df, _ = deserialize_parquet(data=data)
+    institution_index = InstitutionCollaborationIndex()
+    institution_index.add_collaborations(df['INSTITUTION_SID_1'].to_numpy(dtype=object),
+                                         df['INSTITUTION_SID_2'].to_numpy(dtype=object))
+    return institution_index
+
+
+def get_institution_cross_collaborations(institutions: list,
+                                         author_affiliations: pd.DataFrame) -> list:
+    """
+    Get the pairs of institutions on an article that are connected by at least one pair of different authors, one
+    affiliated with each institution.
+    :param institutions: The list of institutions on the article
+    :param author_affiliations: The DataFrame with the author and institution pairs of the article
+    :return: List of pairs of institutions connected by a pair of different authors
+    """
+    # Authors of each institution on the article
+    institution_authors = author_affiliations.groupby('INSTITUTION_SID', sort=False)['AUTHOR_SID'].unique()
+
+    cross_collaborations = list()
+    for ix, institution_1 in enumerate(institutions):
+        authors_institution_1 = institution_authors[institution_1]
+        for institution_2 in institutions[ix + 1:]:
+            authors_institution_2 = institution_authors[institution_2]
+            # The only pair that does not connect the institutions is an author with both affiliations and no one else
+            if not (len(authors_institution_1) == 1 and len(authors_institution_2) == 1
+                    and authors_institution_1[0] == authors_institution_2[0]):
+                cross_collaborations.append((institution_1, institution_2))
+
+    return cross_collaborations
@@ -0,0 +1,160 @@
+import hashlib
+import json
+from typing import Iterable
+
+import pandas as pd
+from google.cloud import bigquery
+
+from util.collaboration_novelty.author_novelty import AUTHOR_NOVELTY_KEY_COLUMNS, AuthorNoveltyCounters
+from util.collaboration_novelty.batch import process_batch_collaboration_novelty
+from util.collaboration_novelty.checkpoint import CollaborationCheckpoint, get_collaboration_delta, \
+    serialize_collaboration_snapshot
+from util.collaboration_novelty.compact_graph import CollaborationGraph
+from util.collaboration_novelty.cursor import get_collaboration_watermark
+from util.collaboration_novelty.institution_index import InstitutionCollaborationIndex
+from util.collaboration_novelty.temporal import TemporalCollaborationHistory
+from util.common.helpers import merge_batch_to_bigquery, offload_batch_to_bigquery
+from util.common.pipeline import StageTimer, run_pipeline
+
+
+def get_batch_load_job_id(table_id: str,
+                          checkpoint: CollaborationCheckpoint,
+                          watermark: dict) -> str:
+    """
+    Get a deterministic ID of the load job of a batch. A batch that was loaded before a crash, but not checkpointed, is
+    replayed after the restart on the same checkpoint with the same delta sequence number and watermark, so its load
+    job has the same ID and the rows are not appended again. The batch size must therefore not change before the
+    replay. The checkpoint prefix and generation are part of the ID, so the batches of a new checkpoint (e.g. after a
+    reset or a rebuild from scratch) are loaded even though their sequence numbers and watermarks repeat.
+    :param table_id: Table ID of the target table
+    :param checkpoint: Collaboration checkpoint the batch is written to, whose next delta is the delta of the batch
+    :param watermark: Watermark of the batch
+    :return: Load job ID
+    """
+    key = json.dumps(dict(table_id=table_id,
+                          checkpoint_prefix=checkpoint.prefix,
+                          checkpoint_generation=checkpoint.generation,
+                          sequence=checkpoint.manifest['next_sequence'],
+                          watermark=watermark), sort_keys=True)
+    return f"collaboration_novelty_{hashlib.sha256(key.encode('utf-8')).hexdigest()}"
+
+
+def run_collaboration_novelty_pipeline(batches: Iterable[pd.DataFrame],
+                                       G_a: CollaborationGraph,
+                                       G_i: CollaborationGraph,
+                                       institution_index: InstitutionCollaborationIndex,
+                                       checkpoint: CollaborationCheckpoint,
+                                       bq_client: bigquery.Client,
+                                       target_table_id_collaboration_novelty_index: str,
+                                       target_table_id_collaboration_novelty_metadata: str,
+                                       prefetch_size: int = 2,
+                                       write_queue_size: int = 2,
+                                       temporal_history: TemporalCollaborationHistory = None,
+                                       author_novelty: AuthorNoveltyCounters = None,
+                                       target_table_id_collaboration_novelty_author_year: str = None) -> StageTimer:
+    """
+    Derive the collaboration novelty of a stream of batches with a pipeline: the next batch is fetched in the
+    background while the current one is processed, and the results of the previous one are offloaded to BigQuery and
+    checkpointed in the background.
+
+    The graphs, the institution index, the temporal history and the author novelty counters are only read and updated
+    in the calling thread. Everything the writer needs (the result rows, the edge delta and, every few batches, a
+    serialized snapshot) is taken from them right after the batch is processed, so the writer never sees a graph that is
+    being updated. The writer handles the batches one at a time and in order, and checkpoints a batch only after its
+    rows are loaded, so the checkpoint never gets ahead of the target tables. The rows are loaded with load job IDs
+    derived from the checkpoint, so the rows of a batch that was loaded but not checkpointed before a crash are not
+    appended again when the batch is replayed.
+    :param batches: Iterable of DataFrames with the collaborations of whole articles in chronological order
+    :param G_a: Collaboration author graph
+    :param G_i: Collaboration institution graph
+    :param institution_index: Index of the pairs of institutions that have collaborated before
+    :param checkpoint: Collaboration checkpoint fetched together with the graphs
+    :param bq_client: BigQuery client
+    :param target_table_id_collaboration_novelty_index: Table ID of the Collaboration Novelty Index
+    :param target_table_id_collaboration_novelty_metadata: Table ID of the Collaboration Novelty Metadata
+    :param prefetch_size: Maximum number of fetched batches waiting to be processed
+    :param write_queue_size: Maximum number of processed batches waiting to be offloaded
+    :param temporal_history: Temporal collaboration history of the windowed or decayed NCI variant, None for the
+    lifetime NCI
+    :param author_novelty: Running per-author novelty counters, None to not track them
+    :param target_table_id_collaboration_novelty_author_year: Table ID of the per-author-per-year Collaboration Novelty
+    aggregates, into which the counters of every year are merged once it is complete
+    :return: Stage timer with the time spent in each stage
+    """
+    timer = StageTimer()
+    # Number of deltas that will be in the log once the writer catches up, tracked here as the writer owns the manifest
+    n_pending_deltas = len(checkpoint.manifest['deltas'])
+
+    def process(df_batch: pd.DataFrame) -> dict:
+        nonlocal n_pending_deltas
+
+        with timer.measure('process.novelty'):
+            cni_rows, metadata_rows = process_batch_collaboration_novelty(df_batch=df_batch,
+                                                                          G_a=G_a,
+                                                                          G_i=G_i,
+                                                                          institution_index=institution_index,
+                                                                          temporal_history=temporal_history,
+                                                                          author_novelty=author_novelty)
+            author_year_rows = author_novelty.pop_closed_rows() if author_novelty is not None else list()
+        with timer.measure('process.delta'):
+            df_delta = get_collaboration_delta(df_batch=df_batch, G_a=G_a, G_i=G_i,
+                                               institution_index=institution_index,
+                                               temporal_history=temporal_history,
+                                               author_novelty=author_novelty)
+
+        n_pending_deltas += 1
+        snapshot = None
+        if n_pending_deltas >= checkpoint.compaction_interval:
+            with timer.measure('process.snapshot'):
+                snapshot = serialize_collaboration_snapshot(G_a=G_a, G_i=G_i, institution_index=institution_index,
+                                                            temporal_history=temporal_history,
+                                                            author_novelty=author_novelty,
+                                                            compression=checkpoint.compression)
+            n_pending_deltas = 0
+
+        return dict(cni_rows=cni_rows,
+                    metadata_rows=metadata_rows,
+                    author_year_rows=author_year_rows,
+                    df_delta=df_delta,
+                    watermark=get_collaboration_watermark(df_batch=df_batch),
+                    snapshot=snapshot)
+
+    def write(processed_batch: dict) -> None:
+        # Start all load jobs before waiting on either of them. The writer owns the manifest, so the delta of the batch
+        # is the next one in the log.
+        with timer.measure('write.offload'):
+            jobs = [offload_batch_to_bigquery(lst_batch=rows,
+                                              table_id=table_id,
+                                              client=bq_client,
+                                              verbose=False,
+                                              wait=False,
+                                              job_id=get_batch_load_job_id(
+                                                  table_id=table_id,
+                                                  checkpoint=checkpoint,
+                                                  watermark=processed_batch['watermark']))
+                    for table_id, rows in ((target_table_id_collaboration_novelty_index, processed_batch['cni_rows']),
+                                           (target_table_id_collaboration_novelty_metadata,
+                                            processed_batch['metadata_rows']))]
+            for job in jobs:
+                job.result()
+            # Rows of the author novelty aggregates only arrive with the first batch of a new year. They are merged, as
+            # the rows of the year may have been written while it was still open, at the end of an earlier run.
+            if processed_batch['author_year_rows']:
+                merge_batch_to_bigquery(lst_batch=processed_batch['author_year_rows'],
+                                        table_id=target_table_id_collaboration_novelty_author_year,
+                                        client=bq_client,
+                                        key_columns=AUTHOR_NOVELTY_KEY_COLUMNS,
+                                        verbose=False)
+
+        # Checkpoint the graph updates of the batch, after the rows they belong to have been written
+        with timer.measure('write.checkpoint'):
+            checkpoint.write_delta(df_delta=processed_batch['df_delta'], watermark=processed_batch['watermark'])
+            if processed_batch['snapshot'] is not None:
+                checkpoint.write_snapshot(snapshot=processed_batch['snapshot'])
+
+    return run_pipeline(items=batches,
+                        process=process,
+                        write=write,
+                        prefetch_size=prefetch_size,
+                        write_queue_size=write_queue_size,
+                        timer=timer)
@@ -1,13 +1,18 @@
-import networkx as nx
+import itertools
+
 import pandas as pd
 
+from util.collaboration_novelty.author_novelty import AuthorNoveltyCounters
+from util.collaboration_novelty.compact_graph import CollaborationGraph, get_edge_weight
 from util.collaboration_novelty.difference import update_collaboration, collaboration_difference
-from util.common.helpers import element_in_flattened_list
+from util.collaboration_novelty.institution_index import InstitutionCollaborationIndex
+from util.collaboration_novelty.temporal import TemporalCollaborationHistory, \
+    derive_temporal_collaboration_novelty_index
 
 
 def derive_collaboration_novelty_index(diff: dict,
-                                       G_a: nx.Graph,
-                                       G_i: nx.Graph) -> float:
+                                       G_a: CollaborationGraph,
+                                       G_i: CollaborationGraph) -> float:
     """
     Calculate the Novelty Collaboration Impact (NCI).
     :param diff: Difference between the collaboration history and the new publication
@@ -22,11 +27,11 @@ def derive_collaboration_novelty_index(diff: dict,
 
     # Calculate New Author Pair Factor
     author_pairs = authors_new + authors_old
-    N_aa = sum(1 / (1 + G_a.get_edge_data(a1, a2, default={'weight': 0})['weight']) for (a1, a2) in author_pairs)
+    N_aa = sum(1 / (1 + get_edge_weight(G_a, a1, a2)) for (a1, a2) in author_pairs)
 
     # Calculate New Institution Pair Factor
     institution_pairs = institutions_new + institutions_old
-    N_ii = sum(1 / (1 + G_i.get_edge_data(i1, i2, default={'weight': 0})['weight']) for (i1, i2) in institution_pairs)
+    N_ii = sum(1 / (1 + get_edge_weight(G_i, i1, i2)) for (i1, i2) in institution_pairs)
 
     # Calculate Size Adjustment Factor
     S_old = len(authors_old)
@@ -40,8 +45,11 @@ def derive_collaboration_novelty_index(diff: dict,
 
 def process_article_collaboration_novelty(article_sid: str,
                                           df: pd.DataFrame,
-                                          G_a: nx.Graph,
-                                          G_i: nx.Graph) -> tuple:
+                                          G_a: CollaborationGraph,
+                                          G_i: CollaborationGraph,
+                                          institution_index: InstitutionCollaborationIndex,
+                                          temporal_history: TemporalCollaborationHistory = None,
+                                          author_novelty: AuthorNoveltyCounters = None) -> tuple:
     """
     Process the article and derive the collaboration novelty impact. Calculate the difference between the collaboration
     history and the new publication, the Novelty Collaboration Impact (NCI), and update the collaboration history.
@@ -49,6 +57,10 @@ def process_article_collaboration_novelty(article_sid: str,
     :param article_sid: Article SID of the new publication
     :param G_a: Collaboration author graph
     :param G_i: Collaboration institution graph
+    :param institution_index: Index of the pairs of institutions that have collaborated before
+    :param temporal_history: Time-dependent collaboration history of the windowed or decayed NCI variant, None for the
+    lifetime NCI
+    :param author_novelty: Running per-author novelty counters to add the article to, None to not track them
     :return: Collaboration novelty index and metadata objects for the new publication
     """
 
@@ -57,36 +69,64 @@ def process_article_collaboration_novelty(article_sid: str,
 
     # Get the collaboration diff based on author collaborations
     diff = collaboration_difference(G=G_a,
+                                    institution_index=institution_index,
                                     author_affiliations=author_affiliations)
 
     # Calculate the Collaboration Novelty Index (CNI)
-    cni = derive_collaboration_novelty_index(diff=diff,
-                                             G_a=G_a,
-                                             G_i=G_i)
+    author_pairs = diff['new_authors'] + diff['old_authors']
+    if temporal_history is None:
+        cni = derive_collaboration_novelty_index(diff=diff,
+                                                 G_a=G_a,
+                                                 G_i=G_i)
+        is_new_author_pair = [True] * len(diff['new_authors']) + [False] * len(diff['old_authors'])
+    else:
+        # Weigh the pairs by their collaborations at the time of the article and add the article to the history
+        year = pd.Timestamp(df['ARTICLE_PUBLICATION_DT'].iloc[0]).year
+        author_weights = [temporal_history.authors.add_collaboration(a1, a2, year) for (a1, a2) in author_pairs]
+        institution_weights = [temporal_history.institutions.add_collaboration(i1, i2, year, reset=True)
+                               for (i1, i2) in diff['new_institutions']]
+        institution_weights += [temporal_history.institutions.add_collaboration(i1, i2, year)
+                                for (i1, i2) in diff['old_institutions']]
+        cni = derive_temporal_collaboration_novelty_index(author_weights=author_weights,
+                                                          institution_weights=institution_weights)
+        # A pair of authors is new if it has no weight at the time of the article, e.g. no collaboration in the window
+        is_new_author_pair = [weight == 0 for weight in author_weights]
 
     # Init the collaboration object
     cni_row = dict(ARTICLE_SID=article_sid,
                    COLLABORATION_NOVELTY_INDEX=cni)
 
     # Init the metadata object for each combination of author and institution
+    article_publication_dt = df['ARTICLE_PUBLICATION_DT'].iloc[0]
+    new_author_participants = set(itertools.chain.from_iterable(
+        pair for pair, is_new in zip(author_pairs, is_new_author_pair) if is_new))
+    new_institution_participants = diff['new_institution_participants']
     metadata_rows = [
         dict(ARTICLE_SID=article_sid,
              AUTHOR_SID=author_sid,
              INSTITUTION_SID=institution_sid,
-             ARTICLE_PUBLICATION_DT=df['ARTICLE_PUBLICATION_DT'].iloc[0],
-             IS_NEW_AUTHOR_COLLABORATION=element_in_flattened_list(element=author_sid,
-                                                                   list_of_lists=diff['new_authors']),
-             IS_NEW_INSTITUTION_COLLABORATION=element_in_flattened_list(element=institution_sid,
-                                                                        list_of_lists=diff['new_institutions'])
+             ARTICLE_PUBLICATION_DT=article_publication_dt,
+             IS_NEW_AUTHOR_COLLABORATION=author_sid in new_author_participants,
+             IS_NEW_INSTITUTION_COLLABORATION=institution_sid in new_institution_participants
              )
-        for (author_sid, institution_sid) in df[['AUTHOR_SID', 'INSTITUTION_SID']].drop_duplicates().values
+        for (author_sid, institution_sid) in author_affiliations.values
     ]
 
+    # Add the article to the author novelty counters
+    if author_novelty is not None:
+        author_novelty.add_articles(
+            df_metadata=pd.DataFrame(metadata_rows),
+            df_author_pairs=pd.DataFrame(dict(ARTICLE_PUBLICATION_DT=[article_publication_dt] * len(author_pairs),
+                                              AUTHOR_SID_1=[a1 for (a1, _) in author_pairs],
+                                              AUTHOR_SID_2=[a2 for (_, a2) in author_pairs],
+                                              IS_NEW=is_new_author_pair)))
+
     # Update the collaboration history
     update_collaboration(
         diff=diff,
         G_a=G_a,
-        G_i=G_i
+        G_i=G_i,
+        institution_index=institution_index
     )
 
     # Return the collaboration object and the updated collaboration history
@@ -1,86 +1,64 @@
-import pandas as pd
+from typing import Iterator
+
+import pyarrow as pa
 from google.cloud import bigquery
+from google.cloud.exceptions import NotFound
 
 
-def query_collaboration_n_batches(bq_client: bigquery.Client,
-                                  source_table_id: str,
-                                  target_table_id: str,
-                                  batch_size: int,
-                                  min_year: int) -> int:
+def has_rows(bq_client: bigquery.Client,
+             table_id: str) -> bool:
     """
-    Query the number of batches to process.
+    Check if a table has rows, from the table metadata.
     :param bq_client: BigQuery client
-    :param source_table_id: Source table ID
-    :param target_table_id: Target table ID
-    :param batch_size: Batch size
-    :param min_year: Minimum year to consider
-    :return: Number of batches to process
-    """
-
-    query_text = f"""
-    WITH LOADED_ARTICLES
-        /* Get articles that have not been processed yet. */
-         AS (SELECT ARTICLE_SID
-             FROM {target_table_id}
-             GROUP BY ARTICLE_SID),
-     BATCH_OF_ARTICLES
-        /* Get a batch of articles given a predefined N excluding sole author publications. */
-         AS (SELECT COUNT(DISTINCT ARTICLE_SID) AS N
-             FROM {source_table_id} S
-                      LEFT JOIN LOADED_ARTICLES T USING (ARTICLE_SID)
-             WHERE T.ARTICLE_SID IS NULL
-               AND S.IS_SOLE_AUTHOR_PUBLICATION = FALSE
-               AND S.AUTHOR_SID <> 'n/a'
-               AND S.INSTITUTION_SID <> 'n/a'
-               AND EXTRACT(YEAR FROM S.ARTICLE_PUBLICATION_DT) >= {min_year}
-               )
-    /* Get the number of batches */
-    SELECT CEIL(N / {batch_size}) AS N_BATCHES
-    FROM BATCH_OF_ARTICLES
+    :param table_id: Table ID
+    :return: True if the table exists and has rows
     """
-
-    return int(bq_client.query(query_text).result().to_dataframe().iloc[0, 0])
+    try:
+        return bq_client.get_table(table_id).num_rows > 0
+    except NotFound:
+        return False
 
 
-def query_collaboration_batch(bq_client: bigquery.Client,
-                              source_table_id: str,
-                              target_table_id: str,
-                              batch_size: int,
-                              min_year: int) -> pd.DataFrame:
+def query_collaboration_stream(bq_client: bigquery.Client,
+                               source_table_id: str,
+                               target_table_id: str,
+                               min_year: int,
+                               watermark: dict = None) -> Iterator[pa.RecordBatch]:
     """
-    Query a batch of collaborations that has not yet been processed.
+    Query all the collaborations after the watermark in a single pass, ordered chronologically by publication date and
+    article SID, and stream them as Arrow record batches. Without a watermark the articles that are already in the
+    target table are excluded instead.
     :param bq_client: BigQuery client
     :param source_table_id: Source table ID
     :param target_table_id: Target table ID
-    :param batch_size: Batch size
     :param min_year: Minimum year to consider
-    :return: DataFrame with the publications for the specific year
+    :param watermark: High-water mark with the publication date and SID of the last processed article
+    :return: Iterator of Arrow record batches with the publications after the watermark
     """
+    if watermark is None:
+        loaded_articles_filter = f"""AND S.ARTICLE_SID NOT IN (SELECT ARTICLE_SID FROM {target_table_id})"""
+    else:
+        loaded_articles_filter = f"""AND (S.ARTICLE_PUBLICATION_DT > DATE '{watermark['ARTICLE_PUBLICATION_DT']}'
+                    OR (S.ARTICLE_PUBLICATION_DT = DATE '{watermark['ARTICLE_PUBLICATION_DT']}'
+                        AND S.ARTICLE_SID > '{watermark['ARTICLE_SID']}'))"""
 
     query_text = f"""
-    WITH LOADED_ARTICLES
-        /* Get articles that have not been processed yet. */
-         AS (SELECT ARTICLE_SID
-             FROM {target_table_id}
-             GROUP BY ARTICLE_SID),
-     BATCH_OF_ARTICLES
-        /* Get a batch of articles given a predefined N excluding sole author publications. */
+    WITH ARTICLES
+        /* Get articles after the watermark excluding sole author publications. */
          AS (SELECT DISTINCT ARTICLE_SID
              FROM {source_table_id} S
-                      LEFT JOIN LOADED_ARTICLES T USING (ARTICLE_SID)
-             WHERE T.ARTICLE_SID IS NULL
-               AND S.IS_SOLE_AUTHOR_PUBLICATION = FALSE
+             WHERE S.IS_SOLE_AUTHOR_PUBLICATION = FALSE
                AND S.AUTHOR_SID <> 'n/a'
                AND S.INSTITUTION_SID <> 'n/a'
                AND EXTRACT(YEAR FROM S.ARTICLE_PUBLICATION_DT) >= {min_year}
-             LIMIT {batch_size})
-    /* Get the final batch of articles including all rows for chosen article SIDs */
+               {loaded_articles_filter})
+    /* Get all rows for chosen article SIDs in chronological order */
     SELECT S.ARTICLE_SID,
            S.AUTHOR_SID,
            S.INSTITUTION_SID,
            S.ARTICLE_PUBLICATION_DT
     FROM {source_table_id} S
-             INNER JOIN BATCH_OF_ARTICLES B USING (ARTICLE_SID)
-    ORDER BY S.ARTICLE_PUBLICATION_DT ASC
+             INNER JOIN ARTICLES A USING (ARTICLE_SID)
+    ORDER BY S.ARTICLE_PUBLICATION_DT, S.ARTICLE_SID, S.AUTHOR_SID, S.INSTITUTION_SID
     """
-    return bq_client.query(query_text).result().to_dataframe()
+    return bq_client.query(query_text).result().to_arrow_iterable()
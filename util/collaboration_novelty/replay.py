@@ -0,0 +1,264 @@
+import datetime
+import time
+
+import numpy as np
+import pandas as pd
+
+from util.collaboration_novelty.author_novelty import AuthorNoveltyCounters
+from util.collaboration_novelty.batch import process_batch_collaboration_novelty
+from util.collaboration_novelty.compact_graph import get_empty_collaboration_graph
+from util.collaboration_novelty.cursor import iterate_collaboration_batches, read_local_collaboration_stream
+from util.collaboration_novelty.institution_index import InstitutionCollaborationIndex
+from util.collaboration_novelty.process import process_article_collaboration_novelty
+from util.collaboration_novelty.temporal import get_temporal_collaboration_history
+from util.common.pipeline import run_pipeline
+
+# Novelty engines: the vectorized batch engine and the reference per-article process
+ENGINE_BATCH = 'batch'
+ENGINE_ARTICLE = 'article'
+
+# Engine configuration used for the keys that a configuration does not set, named as in config.yml
+DEFAULT_ENGINE_CONFIG = dict(ENGINE=ENGINE_BATCH,
+                             GRAPH_BACKEND='compact',
+                             BATCH_SIZE=1000,
+                             NCI_VARIANT='lifetime',
+                             NCI_WINDOW_YEARS=5,
+                             NCI_HALF_LIFE_YEARS=5,
+                             PREFETCH_SIZE=2,
+                             WRITE_QUEUE_SIZE=2)
+
+
+def generate_collaboration_stream(n_articles: int = 10000,
+                                  n_authors: int = 5000,
+                                  n_institutions: int = 200,
+                                  min_year: int = 2000,
+                                  n_years: int = 10,
+                                  seed: int = 0) -> pd.DataFrame:
+    """
+    Generate a synthetic co-authorship stream with the columns of INT_COLLABORATION that the collaboration novelty reads.
+    The stream mimics the shape of real co-authorship data: institution sizes and author productivity are heavy-tailed,
+    most teams are small with a few large consortia, teams are formed around a lead author who mostly re-invites past
+    co-authors and colleagues from the same institution, and some authors publish with a second affiliation. A few
+    sole-author publications and unknown institutions are included to exercise the filters of the stream.
+    :param n_articles: Number of articles
+    :param n_authors: Number of authors
+    :param n_institutions: Number of institutions
+    :param min_year: Year of the first article
+    :param n_years: Number of years the articles are spread over
+    :param seed: Seed of the random number generator
+    :return: DataFrame with the article SID, author SID, institution SID, publication date and sole-author flag
+    """
+    rng = np.random.default_rng(seed)
+
+    # Heavy-tailed institution sizes and author productivity
+    institution_weights = 1 / np.arange(1, n_institutions + 1)
+    home_institutions = rng.choice(n_institutions, size=n_authors, p=institution_weights / institution_weights.sum())
+    second_institutions = rng.choice(n_institutions, size=n_authors)
+    has_second_affiliation = rng.random(n_authors) < 0.1
+    author_weights = rng.lognormal(mean=0, sigma=1.2, size=n_authors)
+    author_weights /= author_weights.sum()
+    institution_authors = pd.Series(np.arange(n_authors)).groupby(home_institutions).apply(np.asarray).to_dict()
+
+    # Publication dates in chronological order
+    start = datetime.date(min_year, 1, 1)
+    n_days = (datetime.date(min_year + n_years, 1, 1) - start).days
+    publication_dts = [start + datetime.timedelta(days=int(day))
+                       for day in np.sort(rng.integers(0, n_days, size=n_articles))]
+
+    co_authors = [list() for _ in range(n_authors)]
+    rows = list()
+    for ix_article, publication_dt in enumerate(publication_dts):
+        # Team size: mostly small teams, a few sole-author publications and large consortia
+        draw = rng.random()
+        if draw < 0.05:
+            team_size = 1
+        elif draw < 0.07:
+            team_size = int(rng.integers(20, 150))
+        else:
+            team_size = 1 + int(rng.geometric(p=0.35))
+
+        # Form the team around a lead author
+        lead = int(rng.choice(n_authors, p=author_weights))
+        team = [lead]
+        members = {lead}
+        for _ in range(10 * team_size):
+            if len(team) >= team_size:
+                break
+            draw = rng.random()
+            if draw < 0.5 and co_authors[lead]:
+                member = co_authors[lead][int(rng.integers(len(co_authors[lead])))]
+            elif draw < 0.75:
+                colleagues = institution_authors[home_institutions[lead]]
+                member = int(colleagues[int(rng.integers(len(colleagues)))])
+            else:
+                member = int(rng.choice(n_authors, p=author_weights))
+            if member not in members:
+                team.append(member)
+                members.add(member)
+        for member in team:
+            co_authors[member].extend(other for other in team if other != member)
+
+        # Affiliations of the team members
+        article_sid = f'ART{ix_article:09d}'
+        is_sole_author_publication = len(team) == 1
+        for author in team:
+            institutions = [home_institutions[author]]
+            if has_second_affiliation[author] and rng.random() < 0.5:
+                institutions.append(second_institutions[author])
+            for institution in dict.fromkeys(institutions):
+                rows.append(dict(ARTICLE_SID=article_sid,
+                                 AUTHOR_SID=f'AUT{author:07d}',
+                                 INSTITUTION_SID=f'INS{institution:05d}' if rng.random() > 0.01 else 'n/a',
+                                 ARTICLE_PUBLICATION_DT=publication_dt,
+                                 IS_SOLE_AUTHOR_PUBLICATION=is_sole_author_publication))
+
+    return pd.DataFrame(rows)
+
+
+def get_engine_config(engine_config: dict = None) -> dict:
+    """
+    Complete an engine configuration with the defaults.
+    :param engine_config: Engine configuration with any of the keys of DEFAULT_ENGINE_CONFIG
+    :return: Engine configuration with all the keys of DEFAULT_ENGINE_CONFIG
+    """
+    engine_config = {**DEFAULT_ENGINE_CONFIG, **(engine_config or dict())}
+    unknown_keys = set(engine_config) - set(DEFAULT_ENGINE_CONFIG)
+    if unknown_keys:
+        raise ValueError(f"Unknown engine configuration keys {sorted(unknown_keys)}, "
+                         f"expected any of {list(DEFAULT_ENGINE_CONFIG)}.")
+    if engine_config['ENGINE'] not in (ENGINE_BATCH, ENGINE_ARTICLE):
+        raise ValueError(f"Unknown novelty engine {engine_config['ENGINE']}, "
+                         f"expected '{ENGINE_BATCH}' or '{ENGINE_ARTICLE}'.")
+    return engine_config
+
+
+def replay_collaboration_novelty(source_path: str,
+                                 min_year: int,
+                                 engine_config: dict = None) -> dict:
+    """
+    Replay the collaboration novelty pipeline over a local Parquet snapshot of the source table, starting from an empty
+    collaboration history and collecting the rows in memory instead of writing them to BigQuery. The stream is read
+    and batched exactly as in derive_collaboration_novelty.py, so two replays of the same snapshot see the same
+    articles in the same order.
+    :param source_path: Path to the Parquet file or directory with the source table
+    :param min_year: Minimum year to consider
+    :param engine_config: Engine configuration with any of the keys of DEFAULT_ENGINE_CONFIG
+    :return: Dictionary with the collaboration novelty index, metadata and author-year rows (including the current
+    year), the number of articles, the wall time in seconds and the stage timer
+    """
+    engine_config = get_engine_config(engine_config)
+    G_a = get_empty_collaboration_graph(backend=engine_config['GRAPH_BACKEND'])
+    G_i = get_empty_collaboration_graph(backend=engine_config['GRAPH_BACKEND'])
+    institution_index = InstitutionCollaborationIndex()
+    temporal_history = get_temporal_collaboration_history(variant=engine_config['NCI_VARIANT'],
+                                                          window_years=engine_config['NCI_WINDOW_YEARS'],
+                                                          half_life_years=engine_config['NCI_HALF_LIFE_YEARS'])
+    author_novelty = AuthorNoveltyCounters()
+
+    def process(df_batch: pd.DataFrame) -> tuple:
+        if engine_config['ENGINE'] == ENGINE_BATCH:
+            cni_rows, metadata_rows = process_batch_collaboration_novelty(df_batch=df_batch,
+                                                                          G_a=G_a,
+                                                                          G_i=G_i,
+                                                                          institution_index=institution_index,
+                                                                          temporal_history=temporal_history,
+                                                                          author_novelty=author_novelty)
+        else:
+            cni_rows, metadata_rows = list(), list()
+            for article_sid, df_article in df_batch.groupby('ARTICLE_SID', sort=False):
+                cni_row, article_metadata_rows = process_article_collaboration_novelty(
+                    article_sid=article_sid,
+                    df=df_article,
+                    G_a=G_a,
+                    G_i=G_i,
+                    institution_index=institution_index,
+                    temporal_history=temporal_history,
+                    author_novelty=author_novelty)
+                cni_rows.append(cni_row)
+                metadata_rows.extend(article_metadata_rows)
+        return cni_rows, metadata_rows, author_novelty.pop_closed_rows()
+
+    # In-memory sink
+    sink = dict(cni_rows=list(), metadata_rows=list(), author_year_rows=list())
+
+    def write(processed_batch: tuple) -> None:
+        for name, rows in zip(('cni_rows', 'metadata_rows', 'author_year_rows'), processed_batch):
+            sink[name].extend(rows)
+
+    record_batches = read_local_collaboration_stream(source_path=source_path, min_year=min_year)
+    start = time.perf_counter()
+    timer = run_pipeline(items=iterate_collaboration_batches(record_batches=record_batches,
+                                                             batch_size=engine_config['BATCH_SIZE']),
+                         process=process,
+                         write=write,
+                         prefetch_size=engine_config['PREFETCH_SIZE'],
+                         write_queue_size=engine_config['WRITE_QUEUE_SIZE'])
+    seconds = time.perf_counter() - start
+    sink['author_year_rows'].extend(author_novelty.get_current_rows())
+
+    return dict(**sink, n_articles=len(sink['cni_rows']), seconds=seconds, timer=timer)
+
+
+def _diff_rows(table_name: str,
+               df_a: pd.DataFrame,
+               df_b: pd.DataFrame,
+               keys: list,
+               rtol: float,
+               atol: float) -> pd.DataFrame:
+    """
+    Compare the rows of a table from two replays. Float columns are compared with a tolerance, all others exactly.
+    :param table_name: Name of the table to report the differences under
+    :param df_a: DataFrame with the rows of the first replay
+    :param df_b: DataFrame with the rows of the second replay
+    :param keys: Columns that identify a row
+    :param rtol: Relative tolerance of float columns
+    :param atol: Absolute tolerance of float columns
+    :return: DataFrame with the table name, the row key, the column and both values of every difference
+    """
+    df = df_a.merge(df_b, on=keys, how='outer', suffixes=('_A', '_B'), indicator=True)
+    key = df[keys].astype(str).agg('|'.join, axis=1)
+
+    differences = list()
+    for side, column in (('left_only', 'B'), ('right_only', 'A')):
+        is_missing = (df['_merge'] == side).to_numpy()
+        differences.append(pd.DataFrame(dict(TABLE=table_name, KEY=key[is_missing], COLUMN=f'<missing in {column}>',
+                                             VALUE_A=None, VALUE_B=None)))
+
+    df_both, key_both = df[df['_merge'] == 'both'], key[df['_merge'] == 'both']
+    for column in [column for column in df_a.columns if column not in keys]:
+        values_a, values_b = df_both[f'{column}_A'], df_both[f'{column}_B']
+        if pd.api.types.is_float_dtype(values_a) or pd.api.types.is_float_dtype(values_b):
+            is_different = ~np.isclose(values_a.to_numpy(dtype=np.float64), values_b.to_numpy(dtype=np.float64),
+                                       rtol=rtol, atol=atol, equal_nan=True)
+        else:
+            is_different = (values_a != values_b).to_numpy()
+        differences.append(pd.DataFrame(dict(TABLE=table_name, KEY=key_both[is_different], COLUMN=column,
+                                             VALUE_A=values_a[is_different], VALUE_B=values_b[is_different])))
+
+    return pd.concat(differences, ignore_index=True)
+
+
+def diff_collaboration_novelty(result_a: dict,
+                               result_b: dict,
+                               rtol: float = 1e-9,
+                               atol: float = 1e-12) -> pd.DataFrame:
+    """
+    Compare two replays of the collaboration novelty row by row: the NCI of every article (with a float tolerance), the
+    new collaboration flags of every metadata row and the counters of every author and year.
+    :param result_a: Result of the first replay
+    :param result_b: Result of the second replay
+    :param rtol: Relative tolerance of the NCI
+    :param atol: Absolute tolerance of the NCI
+    :return: DataFrame with the table name, the row key, the column and both values of every difference, empty if the
+    replays agree
+    """
+    tables = (('COLLABORATION_NOVELTY_INDEX', 'cni_rows', ['ARTICLE_SID']),
+              ('COLLABORATION_NOVELTY_METADATA', 'metadata_rows', ['ARTICLE_SID', 'AUTHOR_SID', 'INSTITUTION_SID']),
+              ('COLLABORATION_NOVELTY_AUTHOR_YEAR', 'author_year_rows', ['AUTHOR_SID', 'YEAR']))
+    return pd.concat([_diff_rows(table_name=table_name,
+                                 df_a=pd.DataFrame(result_a[name]),
+                                 df_b=pd.DataFrame(result_b[name]),
+                                 keys=keys,
+                                 rtol=rtol,
+                                 atol=atol)
+                      for table_name, name, keys in tables], ignore_index=True)
@@ -0,0 +1,187 @@
+import datetime
+from contextlib import ExitStack
+from multiprocessing import Pool
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+from util.collaboration_novelty.batch import combination_indices, segment_sums
+from util.collaboration_novelty.compact_graph import CollaborationGraph, get_edge_weights
+from util.collaboration_novelty.csr_graph import CSRCollaborationGraph
+from util.collaboration_novelty.graph import shared_collaboration_graph
+from util.collaboration_novelty.institution_index import InstitutionCollaborationIndex
+from util.collaboration_novelty.temporal import TemporalCollaborationHistory
+
+
+def get_team_pairs(team_codes: np.ndarray,
+                   member_codes: np.ndarray,
+                   n_teams: int,
+                   n_members: int) -> tuple:
+    """
+    Get all pairs of unique members within each team.
+    :param team_codes: Team index of each member row
+    :param member_codes: Member index of each member row
+    :param n_teams: Number of teams
+    :param n_members: Number of unique members over all teams
+    :return: Tuple of arrays with the team of each pair, the first and second member, the unique pair keys and the
+    index of each pair in the unique pair keys
+    """
+    df_members = pd.DataFrame(dict(TEAM=team_codes, MEMBER=member_codes)).drop_duplicates()
+    df_members = df_members.sort_values('TEAM', kind='stable')
+    members = df_members['MEMBER'].to_numpy()
+
+    pair_team, position_1, position_2 = combination_indices(
+        np.bincount(df_members['TEAM'].to_numpy(), minlength=n_teams))
+    member_1, member_2 = members[position_1], members[position_2]
+    unique_pair_keys, pair_index = np.unique(np.minimum(member_1, member_2) * n_members
+                                             + np.maximum(member_1, member_2), return_inverse=True)
+    return pair_team, member_1, member_2, unique_pair_keys, pair_index
+
+
+def score_collaboration_novelty(df_teams: pd.DataFrame,
+                                G_a: CollaborationGraph,
+                                G_i: CollaborationGraph,
+                                institution_index: Union[InstitutionCollaborationIndex, CSRCollaborationGraph],
+                                temporal_history: TemporalCollaborationHistory = None,
+                                year: int = None,
+                                temporal_weights: tuple = None) -> pd.DataFrame:
+    """
+    Score the Novelty Collaboration Impact (NCI) that a publication by each of many hypothetical teams would have,
+    without updating the collaboration history. Every team is scored against the current history on its own, so the
+    teams do not influence each other. All pair weights are looked up in bulk, once per unique pair over all teams.
+    The score of a team is the NCI that process_article_collaboration_novelty would derive for an article by the team.
+    :param df_teams: DataFrame with the team ID, author SID and institution SID of every team member and affiliation
+    :param G_a: Collaboration author graph
+    :param G_i: Collaboration institution graph
+    :param institution_index: Index of the pairs of institutions that have collaborated before, or its CSR graph
+    (InstitutionCollaborationIndex.to_csr)
+    :param temporal_history: Temporal collaboration history of the windowed or decayed NCI variant, None for the
+    lifetime NCI
+    :param year: Year of the hypothetical publication for the temporal NCI variants, the current year by default
+    :param temporal_weights: Tuple of the author and institution CSR graphs with the weights of the temporal history in
+    the year (TemporalEdgeWeights.to_csr), used instead of the temporal history if given
+    :return: DataFrame with the team ID, the NCI and the number of new and old author and institution pairs of each team
+    """
+    team_codes, team_ids = pd.factorize(df_teams['TEAM_ID'])
+    author_codes, author_sids = pd.factorize(df_teams['AUTHOR_SID'])
+    institution_codes, institution_sids = pd.factorize(df_teams['INSTITUTION_SID'])
+    author_sids, institution_sids = np.asarray(author_sids, dtype=object), np.asarray(institution_sids, dtype=object)
+    n_teams, n_authors, n_institutions = len(team_ids), len(author_sids), len(institution_sids)
+    year = year if year is not None else datetime.date.today().year
+
+    # ------------------------------ Author pairs ------------------------------
+    author_pair_team, _, _, unique_author_pair_keys, author_pair_index = get_team_pairs(
+        team_codes=team_codes, member_codes=author_codes, n_teams=n_teams, n_members=n_authors)
+    unique_authors_1 = author_sids[unique_author_pair_keys // n_authors]
+    unique_authors_2 = author_sids[unique_author_pair_keys % n_authors]
+    unique_author_weights = get_edge_weights(G_a, unique_authors_1, unique_authors_2)
+    is_new_author_pair = unique_author_weights[author_pair_index] == 0
+
+    # ------------------------------ Institution pairs ------------------------------
+    institution_pair_team, _, _, unique_institution_pair_keys, institution_pair_index = get_team_pairs(
+        team_codes=team_codes, member_codes=institution_codes, n_teams=n_teams, n_members=n_institutions)
+    unique_institutions_1 = institution_sids[unique_institution_pair_keys // n_institutions]
+    unique_institutions_2 = institution_sids[unique_institution_pair_keys % n_institutions]
+    if isinstance(institution_index, CSRCollaborationGraph):
+        has_collaborated = institution_index.get_weights(unique_institutions_1, unique_institutions_2) > 0
+    else:
+        has_collaborated = institution_index.has_collaborated_many(unique_institutions_1, unique_institutions_2)
+    is_new_institution_pair = ~has_collaborated[institution_pair_index]
+
+    # ------------------------------ Pair weights ------------------------------
+    if temporal_weights is not None:
+        G_a_year, G_i_year = temporal_weights
+        author_weights = G_a_year.get_weights(unique_authors_1, unique_authors_2)[author_pair_index]
+        institution_weights = G_i_year.get_weights(unique_institutions_1, unique_institutions_2)[
+            institution_pair_index]
+    elif temporal_history is None:
+        author_weights = unique_author_weights[author_pair_index]
+        institution_weights = get_edge_weights(G_i, unique_institutions_1, unique_institutions_2)[
+            institution_pair_index]
+    else:
+        author_weights = temporal_history.authors.get_weights(unique_authors_1, unique_authors_2, year)[
+            author_pair_index]
+        institution_weights = temporal_history.institutions.get_weights(unique_institutions_1, unique_institutions_2,
+                                                                        year)[institution_pair_index]
+
+    # ------------------------------ Novelty Collaboration Impact ------------------------------
+    # Sum the pair factors of each team over new pairs first and old pairs second, as in the per-article process
+    author_order = np.lexsort((~is_new_author_pair, author_pair_team))
+    N_aa = np.array(segment_sums(values=1 / (1 + author_weights[author_order]),
+                                 segment_ids=author_pair_team[author_order],
+                                 n_segments=n_teams), dtype=np.float64)
+    institution_order = np.lexsort((~is_new_institution_pair, institution_pair_team))
+    N_ii = np.array(segment_sums(values=1 / (1 + institution_weights[institution_order]),
+                                 segment_ids=institution_pair_team[institution_order],
+                                 n_segments=n_teams), dtype=np.float64)
+    S_old = np.array(segment_sums(values=np.minimum(1, author_weights[author_order]),
+                                  segment_ids=author_pair_team[author_order],
+                                  n_segments=n_teams), dtype=np.float64)
+    S_a = 1 / (1 + S_old)
+
+    return pd.DataFrame(dict(
+        TEAM_ID=team_ids,
+        COLLABORATION_NOVELTY_INDEX=N_aa * (1 + N_ii) * S_a,
+        N_NEW_AUTHOR_PAIRS=np.bincount(author_pair_team[is_new_author_pair], minlength=n_teams),
+        N_OLD_AUTHOR_PAIRS=np.bincount(author_pair_team[~is_new_author_pair], minlength=n_teams),
+        N_NEW_INSTITUTION_PAIRS=np.bincount(institution_pair_team[is_new_institution_pair], minlength=n_teams),
+        N_OLD_INSTITUTION_PAIRS=np.bincount(institution_pair_team[~is_new_institution_pair], minlength=n_teams)
+    ))
+
+
+def score_collaboration_novelty_parallel(df_teams: pd.DataFrame,
+                                         G_a: CollaborationGraph,
+                                         G_i: CollaborationGraph,
+                                         institution_index: InstitutionCollaborationIndex,
+                                         n_workers: int,
+                                         temporal_history: TemporalCollaborationHistory = None,
+                                         year: int = None) -> pd.DataFrame:
+    """
+    Score the Novelty Collaboration Impact (NCI) of many hypothetical teams in worker processes. The teams are split
+    into one chunk per worker and the graphs are shared with the workers as memory-mapped CSR views, so all the workers
+    read one physical copy of each graph. The institution index and the weights of the temporal history in the year of
+    the publication are turned into CSR graphs once and shared the same way, so no worker unpickles its own copy.
+    Teams are scored independently, so the scores are identical to those of score_collaboration_novelty.
+    :param df_teams: DataFrame with the team ID, author SID and institution SID of every team member and affiliation
+    :param G_a: Collaboration author graph
+    :param G_i: Collaboration institution graph
+    :param institution_index: Index of the pairs of institutions that have collaborated before
+    :param n_workers: Number of worker processes
+    :param temporal_history: Temporal collaboration history of the windowed or decayed NCI variant, None for the
+    lifetime NCI
+    :param year: Year of the hypothetical publication for the temporal NCI variants, the current year by default
+    :return: DataFrame with the team ID, the NCI and the number of new and old author and institution pairs of each team
+    """
+    team_codes, team_ids = pd.factorize(df_teams['TEAM_ID'])
+    n_chunks = min(max(n_workers, 1), len(team_ids))
+    if n_chunks <= 1:
+        return score_collaboration_novelty(df_teams=df_teams, G_a=G_a, G_i=G_i, institution_index=institution_index,
+                                           temporal_history=temporal_history, year=year)
+
+    # Split the teams into contiguous chunks in the order of their first row, so the scores keep the order of the teams
+    team_chunks = np.arange(len(team_ids)) * n_chunks // len(team_ids)
+    row_chunks = team_chunks[team_codes]
+    year = year if year is not None else datetime.date.today().year
+
+    with ExitStack() as stack:
+        def share(G: CollaborationGraph) -> CSRCollaborationGraph:
+            # Graphs that are already memory-mapped are passed as they are
+            if isinstance(G, CSRCollaborationGraph) and G.path is not None:
+                return G
+            return stack.enter_context(shared_collaboration_graph(G=G))
+
+        G_a_shared, G_i_shared = share(G_a), share(G_i)
+        institution_index_shared = share(institution_index.to_csr())
+        temporal_weights_shared = None
+        if temporal_history is not None:
+            temporal_weights_shared = (share(temporal_history.authors.to_csr(year=year)),
+                                       share(temporal_history.institutions.to_csr(year=year)))
+        params = [dict(df_teams=df_teams[row_chunks == chunk], G_a=G_a_shared, G_i=G_i_shared,
+                       institution_index=institution_index_shared, year=year, temporal_weights=temporal_weights_shared)
+                  for chunk in range(n_chunks)]
+        with Pool(processes=n_chunks) as pool:
+            results = [pool.apply_async(score_collaboration_novelty, kwds=chunk_params) for chunk_params in params]
+            df_scores = pd.concat([result.get() for result in results], ignore_index=True)
+
+    return df_scores
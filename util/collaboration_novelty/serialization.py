@@ -0,0 +1,69 @@
+import io
+import json
+import pickle
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Signature at the start of every Parquet file
+PARQUET_MAGIC = b'PAR1'
+
+# Key of the settings of a serialized collaboration history structure in the Parquet schema metadata
+PARQUET_SETTINGS_KEY = b'collaboration_novelty_settings'
+
+
+def is_parquet(data) -> bool:
+    """
+    Check if serialized data is a Parquet file.
+    :param data: Serialized data
+    :return: True if the data starts with the Parquet signature
+    """
+    return bytes(data[:len(PARQUET_MAGIC)]) == PARQUET_MAGIC
+
+
+def serialize_parquet(df: pd.DataFrame,
+                      compression: str = None,
+                      settings: dict = None) -> bytes:
+    """
+    Serialize a DataFrame to a Parquet file.
+    :param df: DataFrame
+    :param compression: Compression codec of the Parquet file ('zstd' or 'lz4'), None to store it uncompressed
+    :param settings: JSON-serializable settings stored in the schema metadata, e.g. the settings of the NCI variant
+    :return: Parquet file
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if settings is not None:
+        table = table.replace_schema_metadata({**(table.schema.metadata or dict()),
+                                               PARQUET_SETTINGS_KEY: json.dumps(settings).encode('utf-8')})
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression=compression if compression is not None else 'none')
+    return buffer.getvalue()
+
+
+def deserialize_parquet(data) -> tuple:
+    """
+    Deserialize a Parquet file written by serialize_parquet.
+    :param data: Parquet file
+    :return: Tuple of the DataFrame and the settings stored with it (None if there are none)
+    """
+    table = pq.read_table(pa.BufferReader(data))
+    settings = (table.schema.metadata or dict()).get(PARQUET_SETTINGS_KEY)
+    return table.to_pandas(), json.loads(settings) if settings is not None else None
+
+
+def load_legacy_pickle(data: bytes,
+                       allow_pickle: bool,
+                       description: str):
+    """
+    Load a collaboration history structure stored as a pickle by an earlier version. Unpickling can run arbitrary code,
+    so it has to be allowed explicitly, which only the conversion to the current formats does.
+    :param data: Pickled data
+    :param allow_pickle: If True, unpickle the data, otherwise raise an error
+    :param description: Description of the structure for the error message
+    :return: Unpickled object
+    """
+    if not allow_pickle:
+        raise ValueError(f"The {description} is stored as a pickle, which is not loaded by default. Convert it with "
+                         f"scripts/analytics/convert_collaboration_graphs.py.")
+    return pickle.loads(data)
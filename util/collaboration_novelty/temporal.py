@@ -0,0 +1,336 @@
+import numpy as np
+import pandas as pd
+
+from util.collaboration_novelty.csr_graph import CSRCollaborationGraph
+from util.collaboration_novelty.serialization import deserialize_parquet, is_parquet, load_legacy_pickle, \
+    serialize_parquet
+
+# Variants of the Novelty Collaboration Impact (NCI)
+NCI_VARIANT_LIFETIME = 'lifetime'
+NCI_VARIANT_WINDOW = 'window'
+NCI_VARIANT_DECAY = 'decay'
+NCI_VARIANTS = (NCI_VARIANT_LIFETIME, NCI_VARIANT_WINDOW, NCI_VARIANT_DECAY)
+
+# Names of the edge weights in a serialized temporal collaboration history
+TEMPORAL_GRAPH_AUTHOR = 'AUTHOR'
+TEMPORAL_GRAPH_INSTITUTION = 'INSTITUTION'
+
+
+class TemporalEdgeWeights:
+    """
+    Collaboration edge weights that depend on the time of the query. Every edge keeps a short list of
+    [year, weight] entries:
+        - window: one counter per year with collaborations, only for the years inside the window. The weight is the
+          number of collaborations in the last window_years years.
+        - decay: a single entry with the weight decayed to the year of its last access. The weight halves every
+          half_life_years years.
+
+    Queries are expected in chronological order, as in the collaboration stream. Counters that fall out of the window
+    are dropped and decay is applied lazily when an edge is accessed, so the history never has to be recomputed and
+    every query or update takes constant amortized time.
+    """
+
+    def __init__(self,
+                 variant: str,
+                 window_years: int = 5,
+                 half_life_years: float = 5.0):
+        """
+        :param variant: Edge weight variant ('window' or 'decay')
+        :param window_years: Number of years in the window, including the year of the query
+        :param half_life_years: Number of years after which the weight of a collaboration halves
+        """
+        if variant not in (NCI_VARIANT_WINDOW, NCI_VARIANT_DECAY):
+            raise ValueError(f"Unknown temporal edge weight variant {variant}.")
+
+        self.variant = variant
+        self.window_years = window_years
+        self.half_life_years = half_life_years
+
+        # Node SID to integer id mapping
+        self.node_ids = dict()
+
+        # Packed edge key to the list of [year, weight] entries, ordered by year
+        self.edges = dict()
+
+    def _edge_key(self, node_1: str, node_2: str) -> int:
+        """
+        Get the undirected packed key of an edge, adding its nodes if they do not exist yet.
+        :param node_1: First node SID
+        :param node_2: Second node SID
+        :return: Packed edge key
+        """
+        node_id_1 = self.node_ids.setdefault(node_1, len(self.node_ids))
+        node_id_2 = self.node_ids.setdefault(node_2, len(self.node_ids))
+        return (min(node_id_1, node_id_2) << 32) | max(node_id_1, node_id_2)
+
+    def _weight(self, entries: list, year: int) -> float:
+        """
+        Get the weight of an edge in a year, dropping the counters outside the window or folding the decay into the
+        entry.
+        :param entries: List of [year, weight] entries of the edge
+        :param year: Year of the query
+        :return: Weight of the edge
+        """
+        if self.variant == NCI_VARIANT_WINDOW:
+            n_expired = 0
+            while n_expired < len(entries) and entries[n_expired][0] <= year - self.window_years:
+                n_expired += 1
+            if n_expired:
+                del entries[:n_expired]
+            return sum(entry[1] for entry in entries)
+
+        entry = entries[0]
+        if entry[0] < year:
+            entry[1] *= 0.5 ** ((year - entry[0]) / self.half_life_years)
+            entry[0] = year
+        return entry[1]
+
+    def get_weight(self, node_1: str, node_2: str, year: int) -> float:
+        """
+        Get the weight of an edge in a year without modifying the stored entries, so it can be used for queries outside
+        the chronological order of the stream.
+        :param node_1: First node SID
+        :param node_2: Second node SID
+        :param year: Year of the query
+        :return: Weight of the edge, 0 if there is no collaboration in the history
+        """
+        key = self._edge_key(node_1, node_2) if node_1 in self.node_ids and node_2 in self.node_ids else None
+        entries = self.edges.get(key)
+        if not entries:
+            return 0
+        if self.variant == NCI_VARIANT_WINDOW:
+            return sum(entry[1] for entry in entries if year - self.window_years < entry[0] <= year)
+        return entries[0][1] * 0.5 ** ((year - entries[0][0]) / self.half_life_years)
+
+    def get_weights(self, nodes_1: np.ndarray, nodes_2: np.ndarray, year: int) -> np.ndarray:
+        """
+        Get the weights of many edges in a year without modifying the stored entries.
+        :param nodes_1: Array of first node SIDs
+        :param nodes_2: Array of second node SIDs
+        :param year: Year of the query
+        :return: Array of weights, 0 for pairs without collaborations in the history
+        """
+        return np.fromiter((self.get_weight(node_1, node_2, year) for node_1, node_2 in zip(nodes_1, nodes_2)),
+                           dtype=np.float64, count=len(nodes_1))
+
+    def add_collaboration(self, node_1: str, node_2: str, year: int, reset: bool = False) -> float:
+        """
+        Add a collaboration to an edge.
+        :param node_1: First node SID
+        :param node_2: Second node SID
+        :param year: Year of the collaboration
+        :param reset: If True, forget the previous collaborations of the edge first
+        :return: Weight of the edge before the collaboration
+        """
+        key = self._edge_key(node_1, node_2)
+        entries = self.edges.get(key)
+        if not entries:
+            self.edges[key] = [[year, 1]]
+            return 0
+
+        weight = self._weight(entries, year)
+        if reset:
+            entries[:] = [[year, 1]]
+        elif entries and entries[-1][0] == year:
+            entries[-1][1] += 1
+        else:
+            entries.append([year, 1])
+        return weight
+
+    def add_collaborations(self,
+                           nodes_1: np.ndarray,
+                           nodes_2: np.ndarray,
+                           years: np.ndarray,
+                           resets: np.ndarray = None) -> np.ndarray:
+        """
+        Add many collaborations in the given (chronological) order.
+        :param nodes_1: Array of first node SIDs
+        :param nodes_2: Array of second node SIDs
+        :param years: Array of years of the collaborations
+        :param resets: Boolean array, True for the collaborations that forget the previous ones of the edge
+        :return: Array with the weight of the edge before each collaboration
+        """
+        resets = np.zeros(len(nodes_1), dtype=bool) if resets is None else resets
+        return np.fromiter((self.add_collaboration(node_1, node_2, year, reset)
+                            for node_1, node_2, year, reset in zip(nodes_1, nodes_2, np.asarray(years).tolist(),
+                                                                   np.asarray(resets).tolist())),
+                           dtype=np.float64, count=len(nodes_1))
+
+    def get_states(self, nodes_1: np.ndarray, nodes_2: np.ndarray) -> tuple:
+        """
+        Get the stored entries of many edges.
+        :param nodes_1: Array of first node SIDs
+        :param nodes_2: Array of second node SIDs
+        :return: Tuple of lists with the years and the weights of the entries of each edge
+        """
+        entries = [self.edges.get(self._edge_key(node_1, node_2), list()) for node_1, node_2 in zip(nodes_1, nodes_2)]
+        return ([[entry[0] for entry in edge_entries] for edge_entries in entries],
+                [[float(entry[1]) for entry in edge_entries] for edge_entries in entries])
+
+    def set_states(self, nodes_1: np.ndarray, nodes_2: np.ndarray, years: list, weights: list) -> None:
+        """
+        Set the stored entries of many edges.
+        :param nodes_1: Array of first node SIDs
+        :param nodes_2: Array of second node SIDs
+        :param years: List with the years of the entries of each edge
+        :param weights: List with the weights of the entries of each edge
+        """
+        for node_1, node_2, edge_years, edge_weights in zip(nodes_1, nodes_2, years, weights):
+            key = self._edge_key(node_1, node_2)
+            if len(edge_years) == 0:
+                self.edges.pop(key, None)
+                continue
+            self.edges[key] = [[int(year), int(weight) if self.variant == NCI_VARIANT_WINDOW else float(weight)]
+                               for year, weight in zip(edge_years, edge_weights)]
+
+    def update(self, other: 'TemporalEdgeWeights') -> None:
+        """
+        Add the edges of another history with the same settings, overwriting the entries of the shared edges.
+        :param other: Temporal edge weights
+        """
+        node_sids = list(other.node_ids.keys())
+        for key, entries in other.edges.items():
+            self.edges[self._edge_key(node_sids[key >> 32], node_sids[key & 0xFFFFFFFF])] = [list(entry)
+                                                                                           for entry in entries]
+
+    def get_edges(self) -> tuple:
+        """
+        Get all the edges in the history.
+        :return: Tuple of arrays with the first and second node SIDs of every edge
+        """
+        node_sids = np.array(list(self.node_ids.keys()), dtype=object)
+        keys = np.fromiter(self.edges.keys(), dtype=np.int64, count=len(self.edges))
+        return node_sids[keys >> 32], node_sids[keys & 0xFFFFFFFF]
+
+    def to_csr(self, year: int) -> CSRCollaborationGraph:
+        """
+        Get the weights of all the edges in a year as a CSR graph without modifying the stored entries, e.g. to share
+        them with worker processes as a memory-mapped view. Edges without weight in the year are left out.
+        :param year: Year of the query
+        :return: CSR collaboration graph with integer weights for the window variant and float weights for decay
+        """
+        keys = np.fromiter(self.edges.keys(), dtype=np.int64, count=len(self.edges))
+        node_sids = list(self.node_ids.keys())
+        weights = np.array([self.get_weight(node_sids[key >> 32], node_sids[key & 0xFFFFFFFF], year)
+                            for key in keys.tolist()],
+                           dtype=np.int64 if self.variant == NCI_VARIANT_WINDOW else np.float64)
+        has_weight = weights > 0
+        return CSRCollaborationGraph.from_edge_arrays(node_sids=node_sids,
+                                                      node_ids_1=keys[has_weight] >> 32,
+                                                      node_ids_2=keys[has_weight] & 0xFFFFFFFF,
+                                                      weights=weights[has_weight])
+
+    def number_of_edges(self) -> int:
+        return len(self.edges)
+
+
+class TemporalCollaborationHistory:
+    """
+    Time-dependent collaboration history of authors and institutions used by the windowed and decayed variants of the
+    Novelty Collaboration Impact (NCI). It follows the same update rules as the collaboration graphs: every occurrence
+    of an author pair adds a collaboration, while a new institution collaboration forgets the previous ones of the pair.
+    """
+
+    def __init__(self,
+                 variant: str,
+                 window_years: int = 5,
+                 half_life_years: float = 5.0):
+        """
+        :param variant: NCI variant ('window' or 'decay')
+        :param window_years: Number of years in the window, including the year of the article
+        :param half_life_years: Number of years after which the weight of a collaboration halves
+        """
+        self.authors = TemporalEdgeWeights(variant=variant, window_years=window_years, half_life_years=half_life_years)
+        self.institutions = TemporalEdgeWeights(variant=variant, window_years=window_years,
+                                                half_life_years=half_life_years)
+
+    def update(self, other: 'TemporalCollaborationHistory') -> None:
+        """
+        Add the author and institution edges of another history with the same settings.
+        :param other: Temporal collaboration history
+        """
+        self.authors.update(other.authors)
+        self.institutions.update(other.institutions)
+
+    @property
+    def settings(self) -> dict:
+        """
+        Settings that define the meaning of the stored weights.
+        """
+        return dict(variant=self.authors.variant,
+                    window_years=self.authors.window_years,
+                    half_life_years=self.authors.half_life_years)
+
+
+def get_temporal_collaboration_history(variant: str,
+                                       window_years: int = 5,
+                                       half_life_years: float = 5.0):
+    """
+    Get an empty time-dependent collaboration history for an NCI variant.
+    :param variant: NCI variant ('lifetime', 'window' or 'decay')
+    :param window_years: Number of years in the window, including the year of the article
+    :param half_life_years: Number of years after which the weight of a collaboration halves
+    :return: Temporal collaboration history, None for the lifetime variant which uses the collaboration graphs
+    """
+    if variant not in NCI_VARIANTS:
+        raise ValueError(f"Unknown NCI variant {variant}. Choose one of {NCI_VARIANTS}.")
+    if variant == NCI_VARIANT_LIFETIME:
+        return None
+    return TemporalCollaborationHistory(variant=variant, window_years=window_years, half_life_years=half_life_years)
+
+
+def serialize_temporal_collaboration_history(temporal_history: TemporalCollaborationHistory,
+                                             compression: str = 'zstd') -> bytes:
+    """
+    Serialize a temporal collaboration history to a Parquet file with one row per author or institution edge and the
+    years and weights of its entries as list columns. The settings of the NCI variant are stored in the file metadata.
+    :param temporal_history: Temporal collaboration history
+    :param compression: Compression codec of the Parquet file, None to store it uncompressed
+    :return: Serialized history
+    """
+    df_edges = list()
+    for graph_name, edge_weights in ((TEMPORAL_GRAPH_AUTHOR, temporal_history.authors),
+                                     (TEMPORAL_GRAPH_INSTITUTION, temporal_history.institutions)):
+        nodes_1, nodes_2 = edge_weights.get_edges()
+        years, values = edge_weights.get_states(nodes_1, nodes_2)
+        df_edges.append(pd.DataFrame(dict(GRAPH=graph_name, NODE_1=nodes_1, NODE_2=nodes_2, YEARS=years,
+                                          VALUES=values)))
+    return serialize_parquet(df=pd.concat(df_edges, ignore_index=True), compression=compression,
+                             settings=temporal_history.settings)
+
+
+def deserialize_temporal_collaboration_history(data: bytes,
+                                               allow_pickle: bool = False) -> TemporalCollaborationHistory:
+    """
+    Deserialize a temporal collaboration history stored as a Parquet file or, with allow_pickle, as a pickle.
+    :param data: Serialized history
+    :param allow_pickle: If True, also load histories pickled by earlier versions
+    :return: Temporal collaboration history
+    """
+    if not is_parquet(data):
+        return load_legacy_pickle(data=data, allow_pickle=allow_pickle, description='temporal collaboration history')
+
+    df_edges, settings = deserialize_parquet(data=data)
+    temporal_history = TemporalCollaborationHistory(**settings)
+    for graph_name, edge_weights in ((TEMPORAL_GRAPH_AUTHOR, temporal_history.authors),
+                                     (TEMPORAL_GRAPH_INSTITUTION, temporal_history.institutions)):
+        df_graph = df_edges[df_edges['GRAPH'] == graph_name]
+        edge_weights.set_states(df_graph['NODE_1'].to_numpy(dtype=object), df_graph['NODE_2'].to_numpy(dtype=object),
+                                df_graph['YEARS'].tolist(), df_graph['VALUES'].tolist())
+    return temporal_history
+
+
+def derive_temporal_collaboration_novelty_index(author_weights: list,
+                                                institution_weights: list) -> float:
+    """
+    Calculate the Novelty Collaboration Impact (NCI) from time-dependent pair weights. Pairs are expected with the new
+    pairs first, as in derive_collaboration_novelty_index. A pair counts towards the size adjustment with its weight
+    capped at 1, which is the number of old author pairs for integer weights.
+    :param author_weights: Weights of the author pairs of the article
+    :param institution_weights: Weights of the institution pairs of the article
+    :return: Novelty Collaboration Impact score
+    """
+    N_aa = sum(1 / (1 + weight) for weight in author_weights)
+    N_ii = sum(1 / (1 + weight) for weight in institution_weights)
+    S_a = 1 / (1 + sum(min(1, weight) for weight in author_weights))
+    return N_aa * (1 + N_ii) * S_a
@@ -1,6 +1,9 @@
+import uuid
+
 import backoff
 import pandas as pd
 import requests
+from google.api_core.exceptions import Conflict
 from google.cloud import bigquery
 from loguru import logger
 from tqdm import tqdm
@@ -33,7 +36,9 @@ def offload_batch_to_bigquery(lst_batch: list,
                               table_id: str,
                               client: bigquery.Client,
                               data_schema: list = None,
-                              verbose: bool = True) -> None:
+                              verbose: bool = True,
+                              wait: bool = True,
+                              job_id: str = None) -> bigquery.LoadJob:
     """
     Offloads a batch of records to BigQuery.
     :param data_schema: The schema of the data to offload.
@@ -41,6 +46,10 @@ def offload_batch_to_bigquery(lst_batch: list,
     :param lst_batch: List of records to offload.
     :param table_id: The ID of the destination table in BigQuery.
     :param verbose: If True, print an info message on success.
+    :param wait: If True, wait for the load job to complete. Otherwise, the caller must wait for the returned job.
+    :param job_id: Deterministic ID of the load job, so a batch whose load was started before a crash is not loaded
+    again. None to let BigQuery generate one.
+    :return: The load job.
     """
     # Convert the list of records to a DataFrame
     df_batch = pd.DataFrame(lst_batch)
@@ -57,11 +66,26 @@ def offload_batch_to_bigquery(lst_batch: list,
         )
 
     # Offload the DataFrame to BigQuery, appending it to the existing table
-    job = client.load_table_from_dataframe(
-        dataframe=df_batch,
-        destination=table_id,
-        job_config=job_config
-    )
+    try:
+        job = client.load_table_from_dataframe(
+            dataframe=df_batch,
+            destination=table_id,
+            job_id=job_id,
+            job_config=job_config
+        )
+    except Conflict:
+        # The load of the batch was started before a crash: wait for it, and load the batch again if it failed
+        job = client.get_job(job_id)
+        if job.exception() is not None:
+            job = client.load_table_from_dataframe(
+                dataframe=df_batch,
+                destination=table_id,
+                job_id_prefix=f'{job_id}-retry-',
+                job_config=job_config
+            )
+
+    if not wait:
+        return job
 
     # Wait for the load job to complete
     job.result()
@@ -70,6 +94,60 @@ def offload_batch_to_bigquery(lst_batch: list,
     if verbose:
         logger.info(f"Offloaded a batch of {len(df_batch)} items to BigQuery.")
 
+    return job
+
+
+# ------------------------------ merge_batch_to_bigquery ------------------------------
+def merge_batch_to_bigquery(lst_batch: list,
+                            table_id: str,
+                            client: bigquery.Client,
+                            key_columns: list,
+                            data_schema: list = None,
+                            verbose: bool = True) -> None:
+    """
+    Upserts a batch of records into a BigQuery table: the records are loaded to a staging table next to the destination
+    table and merged on the key columns, so existing rows are updated and new ones inserted. The staging table is
+    removed afterwards.
+    :param lst_batch: List of records to upsert.
+    :param table_id: The ID of the destination table in BigQuery.
+    :param client: BigQuery client.
+    :param key_columns: The columns that identify a row of the destination table.
+    :param data_schema: The schema of the data to upsert.
+    :param verbose: If True, print an info message on success.
+    """
+    # Convert the list of records to a DataFrame
+    df_batch = pd.DataFrame(lst_batch)
+    if df_batch.empty:
+        return
+
+    # Load the batch to a staging table, replacing it if it exists
+    staging_table_id = f"{table_id}_STAGING_{uuid.uuid4().hex}"
+    job_config = bigquery.LoadJobConfig(write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+    if data_schema is not None:
+        job_config.schema = data_schema
+    client.load_table_from_dataframe(dataframe=df_batch, destination=staging_table_id, job_config=job_config).result()
+
+    # Merge the staging table into the destination table on the key columns
+    columns = list(df_batch.columns)
+    value_columns = [column for column in columns if column not in key_columns]
+    query = f"""
+        MERGE `{table_id}` T
+        USING `{staging_table_id}` S
+        ON {' AND '.join(f'T.{column} = S.{column}' for column in key_columns)}
+        WHEN MATCHED THEN
+            UPDATE SET {', '.join(f'{column} = S.{column}' for column in value_columns)}
+        WHEN NOT MATCHED THEN
+            INSERT ({', '.join(columns)}) VALUES ({', '.join(f'S.{column}' for column in columns)})
+    """
+    try:
+        client.query(query).result()
+    finally:
+        client.delete_table(staging_table_id, not_found_ok=True)
+
+    # Print info message on success
+    if verbose:
+        logger.info(f"Merged a batch of {len(df_batch)} items into {table_id}.")
+
 
 def get_empty_iteration_settings(total_records: int = 0) -> dict:
     """
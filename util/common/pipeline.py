@@ -0,0 +1,165 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Iterable
+
+import pandas as pd
+from loguru import logger
+
+# Sentinel marking the end of a queue
+_END_OF_QUEUE = object()
+
+
+class StageTimer:
+    """
+    Thread-safe accumulator of the wall time spent in each stage of a pipeline.
+    """
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, stage: str):
+        """
+        Measure the wall time of the enclosed block and add it to the stage.
+        :param stage: Name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.durations[stage] += time.perf_counter() - start
+                self.counts[stage] += 1
+
+    def report(self) -> pd.DataFrame:
+        """
+        Summarize the time spent in each stage.
+        :return: DataFrame with the total time, number of calls and average time of each stage, slowest stage first
+        """
+        with self._lock:
+            df_report = pd.DataFrame(dict(STAGE=list(self.durations.keys()),
+                                          TOTAL_SECONDS=list(self.durations.values()),
+                                          N_CALLS=[self.counts[stage] for stage in self.durations.keys()]))
+        df_report['AVERAGE_SECONDS'] = df_report['TOTAL_SECONDS'] / df_report['N_CALLS'].clip(lower=1)
+        return df_report.sort_values('TOTAL_SECONDS', ascending=False, ignore_index=True)
+
+    def log_report(self) -> None:
+        """
+        Log the summary of the time spent in each stage.
+        """
+        logger.info(f"Pipeline stage timings:\n{self.report().to_string(index=False)}")
+
+
+def _produce(items: Iterable,
+             item_queue: queue.Queue,
+             timer: StageTimer,
+             stop_event: threading.Event) -> None:
+    """
+    Pull the items from the iterable and put them to a bounded queue, followed by the end sentinel. An exception raised
+    by the iterable is put to the queue instead, so that it is re-raised by the consumer.
+    :param items: Iterable of items
+    :param item_queue: Bounded queue of prefetched items
+    :param timer: Stage timer
+    :param stop_event: Event set by the consumer when it stops early
+    """
+    try:
+        iterator = iter(items)
+        while not stop_event.is_set():
+            with timer.measure('fetch'):
+                item = next(iterator, _END_OF_QUEUE)
+            if item is _END_OF_QUEUE:
+                break
+            item_queue.put(item)
+    except BaseException as e:
+        item_queue.put(e)
+        return
+    item_queue.put(_END_OF_QUEUE)
+
+
+def _consume(write_queue: queue.Queue,
+             write: callable,
+             timer: StageTimer,
+             errors: list) -> None:
+    """
+    Write the processed items from a bounded queue one at a time, in order, until the end sentinel.
+    :param write_queue: Bounded queue of processed items
+    :param write: Function that writes a processed item
+    :param timer: Stage timer
+    :param errors: List to store the exception of a failed write to
+    """
+    while True:
+        processed_item = write_queue.get()
+        if processed_item is _END_OF_QUEUE:
+            return
+        # After a failure the remaining items are drained but not written, keeping the writes in order
+        if errors:
+            continue
+        try:
+            with timer.measure('write'):
+                write(processed_item)
+        except BaseException as e:
+            errors.append(e)
+
+
+def run_pipeline(items: Iterable,
+                 process: callable,
+                 write: callable,
+                 prefetch_size: int = 2,
+                 write_queue_size: int = 2,
+                 timer: StageTimer = None) -> StageTimer:
+    """
+    Run a three-stage pipeline with bounded queues: a background thread prefetches the next items while the current
+    one is processed, and a single background writer writes the processed items in order while the next ones are
+    processed. Processing always happens in the calling thread, so it is the only stage that may mutate shared state.
+    :param items: Iterable of items, e.g. batches fetched from BigQuery
+    :param process: Function that processes an item and returns the object to write
+    :param write: Function that writes a processed object, e.g. offloads it to BigQuery
+    :param prefetch_size: Maximum number of prefetched items waiting to be processed
+    :param write_queue_size: Maximum number of processed items waiting to be written
+    :param timer: Stage timer to accumulate the timings to
+    :return: Stage timer with the time spent fetching, processing and writing, and waiting in between
+    """
+    timer = timer if timer is not None else StageTimer()
+    item_queue, write_queue = queue.Queue(maxsize=prefetch_size), queue.Queue(maxsize=write_queue_size)
+    stop_event, write_errors = threading.Event(), list()
+
+    producer = threading.Thread(target=_produce, args=(items, item_queue, timer, stop_event), daemon=True)
+    writer = threading.Thread(target=_consume, args=(write_queue, write, timer, write_errors), daemon=True)
+    producer.start()
+    writer.start()
+
+    try:
+        while not write_errors:
+            with timer.measure('wait_fetch'):
+                item = item_queue.get()
+            if item is _END_OF_QUEUE:
+                break
+            if isinstance(item, BaseException):
+                raise item
+
+            with timer.measure('process'):
+                processed_item = process(item)
+
+            with timer.measure('wait_write'):
+                write_queue.put(processed_item)
+    finally:
+        # Stop prefetching and let the writer finish the items that were already processed
+        stop_event.set()
+        while producer.is_alive():
+            try:
+                item_queue.get_nowait()
+            except queue.Empty:
+                producer.join(timeout=0.1)
+        write_queue.put(_END_OF_QUEUE)
+        with timer.measure('wait_write'):
+            writer.join()
+
+    if write_errors:
+        raise write_errors[0]
+
+    return timer
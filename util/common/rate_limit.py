@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+
+class AsyncTokenBucket:
+    """
+    Token-bucket rate limiter shared by the tasks of an event loop. The bucket holds up to capacity tokens and refills
+    at rate tokens per second; every request takes one token and waits for the next token when the bucket is empty, so
+    the requests of all the tasks never exceed the rate on average and never exceed the capacity in a burst. Waiting
+    tasks are served in the order they arrived.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        :param rate: Number of tokens added per second, i.e. the maximum average request rate
+        :param capacity: Maximum number of tokens, i.e. the maximum burst of requests, the rate (at least 1) by default
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        """
+        Add the tokens of the time since the last refill.
+        """
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate: float) -> None:
+        """
+        Change the rate of the bucket, e.g. to the rate limit announced by a server. The capacity is lowered to the new
+        rate (at least 1), so a lower rate also limits the bursts.
+        :param rate: Number of tokens added per second
+        """
+        self._refill()
+        self.rate = rate
+        self.capacity = min(self.capacity, max(1.0, rate))
+        self._tokens = min(self._tokens, self.capacity)
+
+    async def acquire(self) -> None:
+        """
+        Take a token, waiting until one is available.
+        """
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
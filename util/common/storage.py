@@ -0,0 +1,103 @@
+import os
+
+from google.cloud.exceptions import NotFound
+
+
+class LocalBlob:
+    """
+    Local filesystem stand-in for a Google Cloud Storage blob, implementing the subset of the API used in this project.
+    """
+
+    def __init__(self, bucket: 'LocalBucket', name: str):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def path(self) -> str:
+        """
+        Path of the file that stores the blob.
+        :return: Path of the file
+        """
+        return os.path.join(self.bucket.root_path, *self.name.split('/'))
+
+    def exists(self) -> bool:
+        """
+        Check if the blob exists.
+        :return: True if the blob exists, False otherwise
+        """
+        return os.path.isfile(self.path)
+
+    def download_as_bytes(self) -> bytes:
+        """
+        Download the content of the blob.
+        :return: Content of the blob
+        """
+        if not self.exists():
+            raise NotFound(f"Blob {self.name} does not exist in local bucket {self.bucket.root_path}.")
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def download_as_string(self) -> bytes:
+        """
+        Download the content of the blob (alias of download_as_bytes).
+        :return: Content of the blob
+        """
+        return self.download_as_bytes()
+
+    def upload_from_string(self, data, content_type: str = None) -> None:
+        """
+        Upload the content of the blob, replacing it atomically if it already exists.
+        :param data: Content of the blob as bytes or string
+        :param content_type: Ignored, kept for compatibility with Google Cloud Storage
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, 'wb') as f:
+            f.write(data)
+        os.replace(temporary_path, self.path)
+
+    def delete(self) -> None:
+        """
+        Delete the blob.
+        """
+        if not self.exists():
+            raise NotFound(f"Blob {self.name} does not exist in local bucket {self.bucket.root_path}.")
+        os.remove(self.path)
+
+
+class LocalBucket:
+    """
+    Local filesystem stand-in for a Google Cloud Storage bucket. Blob names are mapped to paths relative to the root
+    directory, so the code that works with a bucket can be run and tested offline.
+    """
+
+    def __init__(self, root_path: str):
+        self.root_path = root_path
+        os.makedirs(root_path, exist_ok=True)
+
+    def blob(self, blob_name: str) -> LocalBlob:
+        """
+        Get a blob by its name. The blob does not need to exist yet.
+        :param blob_name: Blob name
+        :return: Local blob
+        """
+        return LocalBlob(bucket=self, name=blob_name)
+
+    def list_blobs(self, prefix: str = '') -> list:
+        """
+        List the blobs whose name starts with the prefix.
+        :param prefix: Blob name prefix
+        :return: List of blobs sorted by name
+        """
+        blobs = list()
+        for directory, _, file_names in os.walk(self.root_path):
+            for file_name in file_names:
+                if file_name.endswith('.tmp'):
+                    continue
+                blob_name = os.path.relpath(os.path.join(directory, file_name), self.root_path).replace(os.sep, '/')
+                if blob_name.startswith(prefix):
+                    blobs.append(self.blob(blob_name))
+        return sorted(blobs, key=lambda blob: blob.name)
@@ -125,6 +125,48 @@ def trend_eutopia_collaboration(settings: dict):
     return dcc.Graph(figure=fig)
 
 
+def trend_author_novelty(settings: dict):
+    """
+    Get the trend of new collaborations from the per-author novelty aggregates.
+    :param settings: The settings for connection to Redis and BigQuery.
+    :return: The trend of new collaborations.
+    """
+    df_trend_author_novelty = queries.overview_trend_author_novelty(settings=settings)
+
+    fig = go.Figure()
+
+    for ix, col in enumerate(['New Author Collaborations', 'New Institution Collaborations']):
+        fig.add_trace(go.Scatter(x=df_trend_author_novelty['Year'],
+                                 y=df_trend_author_novelty[col],
+                                 mode='lines+markers',
+                                 name=col,
+                                 marker=dict(color=settings['config'].DASHBOARD.COLORS.CLASS_COLORS[ix]),
+                                 line=dict(color=settings['config'].DASHBOARD.COLORS.CLASS_COLORS[ix]))
+                      )
+
+    fig.update_layout(
+        title='NEW COLLABORATION TREND',
+        xaxis=dict(
+            title='Year',
+            showgrid=False,
+            color=settings['config'].DASHBOARD.COLORS.TEXT_COLOR
+        ),
+        yaxis=dict(
+            title='Author Articles',
+            showgrid=False,
+            color=settings['config'].DASHBOARD.COLORS.TEXT_COLOR,
+            zeroline=False
+        ),
+        font=dict(
+            family='Open Sans, sans-serif'
+        ),
+        plot_bgcolor=settings['config'].DASHBOARD.COLORS.BACKGROUND_COLOR,
+        paper_bgcolor=settings['config'].DASHBOARD.COLORS.BACKGROUND_COLOR,
+        font_color=settings['config'].DASHBOARD.COLORS.TEXT_COLOR)
+
+    return dcc.Graph(figure=fig)
+
+
 def layout(settings: dict):
     """
     Get the layout for the overview page.
@@ -152,6 +194,14 @@ def layout(settings: dict):
                     className="m-1 mt-4"
                 )
             ]
+        ),
+        dbc.Row(
+            children=[
+                dbc.Col(
+                    trend_author_novelty(settings=settings),
+                    className="m-1 mt-4"
+                )
+            ]
         )
     ],
         className='p-4',
@@ -107,6 +107,37 @@ def overview_trend_eutopia_collaboration(settings: dict):
     return data
 
 
+def overview_trend_author_novelty(settings: dict):
+    """
+    Get the trend of new collaborations from the per-author novelty aggregates.
+    :param settings: The settings.
+    :return: The trend of new collaborations.
+    """
+    schema = settings['config'].GCP.READ_SCHEMA
+
+    query = f"""
+        SELECT YEAR,
+               SUM(ARTICLE_COUNT)                               AS AUTHOR_ARTICLES,
+               SUM(NEW_AUTHOR_COLLABORATION_ARTICLE_COUNT)      AS NEW_AUTHOR_COLLABORATIONS,
+               SUM(NEW_INSTITUTION_COLLABORATION_ARTICLE_COUNT) AS NEW_INSTITUTION_COLLABORATIONS,
+               SUM(NEW_PARTNER_COUNT)                           AS NEW_PARTNERS,
+               SUM(REPEAT_PARTNER_COUNT)                        AS REPEAT_PARTNERS
+        FROM {schema}.FCT_COLLABORATION_NOVELTY_AUTHOR_YEAR
+        WHERE YEAR >= 2000
+        GROUP BY 1
+        ORDER BY 1 ASC
+    """
+
+    # Fetch the data
+    data = fetch(settings=settings,
+                 query=query)
+
+    # Turn column names from snake case to title case and replace underscores with spaces
+    data.columns = cols_to_title(data.columns)
+
+    return data
+
+
 def overview_breakdown_publications_by_institution(settings):
     """
     Get the breakdown of publications by institution.
@@ -2,7 +2,9 @@ import pandas as pd
 from google.cloud import bigquery
 from transformers import AutoModel, AutoTokenizer
 
+from util.embedding.cache import EmbeddingCache
 from util.embedding.helpers import embed_batch
+from util.embedding.storage import EMBEDDING_STORAGE_DTYPE, encode_embeddings
 
 
 def embed_article_batch(item: str,
@@ -11,13 +13,17 @@ def embed_article_batch(item: str,
     """
     Embed a batch of input texts using a transformer model.
     :param item: The input batch of texts to embed.
-    :param metadata: The metadata for the current iteration including the model and tokenizer for embeddings
+    :param metadata: The metadata for the current iteration including the model and tokenizer for embeddings and
+    optionally the embedding cache, the chunking settings of long texts and the data type to store the embeddings in
     :param iteration_settings:  The settings for the current iteration including list of records to offload to BigQuery and total number of records processed so far.
     :return: The updated settings for the current iteration.
     """
     # Get the metadata
     model: AutoModel = metadata['model']
     tokenizer: AutoTokenizer = metadata['tokenizer']
+    cache: EmbeddingCache = metadata.get('cache')
+    chunking: dict = metadata.get('chunking')
+    storage_dtype: str = metadata.get('storage_dtype', EMBEDDING_STORAGE_DTYPE)
 
     # Get the lists of DOIs and articles to embed
     lst_dois = item['ARTICLE_DOI']
@@ -26,17 +32,18 @@ def embed_article_batch(item: str,
     # Generate normalized embeddings
     embeddings = embed_batch(lst_to_embed=lst_article_full_text,
                              model=model,
-                             tokenizer=tokenizer)
+                             tokenizer=tokenizer,
+                             cache=cache,
+                             chunking=chunking)
 
-    # Join the embeddings with the DOIs
+    # Join the embeddings, encoded as bytes, with the DOIs
     new_batch = [
         {
             'DOI': doi,
-            'EMBEDDING_TENSOR_SHAPE': list(tensor.shape),
-            'EMBEDDING_TENSOR_DATA': tensor.flatten().tolist()
+            **embedding_fields
         }
-        for doi, tensor in
-        zip(lst_dois, embeddings)]
+        for doi, embedding_fields in
+        zip(lst_dois, encode_embeddings(embeddings=embeddings.numpy(), dtype=storage_dtype))]
 
     # Update the settings for the current iteration
     iteration_settings['batch'].extend(new_batch)
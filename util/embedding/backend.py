@@ -0,0 +1,150 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from loguru import logger
+from torch import Tensor
+from transformers import AutoConfig, AutoModel, AutoTokenizer
+
+# Embedding backends: the FP32 PyTorch model, the PyTorch model with dynamically INT8-quantized linear layers, or the
+# model exported to ONNX and run with ONNX Runtime (with INT8-quantized weights if the exported model is quantized)
+EMBEDDING_BACKENDS = ('torch', 'torch_int8', 'onnx')
+
+# Inputs of the exported ONNX model, with the batch and sequence axes of variable size
+ONNX_INPUT_NAMES = ['input_ids', 'attention_mask', 'token_type_ids']
+ONNX_OPSET_VERSION = 14
+
+
+class ONNXEmbeddingModel:
+    """
+    Transformer model exported to ONNX and run with ONNX Runtime, with the same call interface as the PyTorch model as
+    far as the embedding functions use it: it is called with the tokenized batch and returns the last hidden state.
+    """
+
+    def __init__(self, onnx_model_path: str, hidden_size: int, n_threads: int = None):
+        """
+        :param onnx_model_path: Path of the exported ONNX model
+        :param hidden_size: Size of the hidden states of the model
+        :param n_threads: Number of intra-op threads, the number of physical cores by default
+        """
+        import onnxruntime
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if n_threads is not None:
+            session_options.intra_op_num_threads = n_threads
+            session_options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(onnx_model_path, sess_options=session_options,
+                                                    providers=['CPUExecutionProvider'])
+        self.input_names = {session_input.name for session_input in self.session.get_inputs()}
+        self.config = SimpleNamespace(hidden_size=hidden_size)
+        self.onnx_model_path = onnx_model_path
+        self.n_threads = n_threads
+
+    def __reduce__(self) -> tuple:
+        """
+        Pickle the model as its settings, so that worker processes open their own ONNX Runtime session.
+        :return: Tuple of the class and the arguments that rebuild the model
+        """
+        return self.__class__, (self.onnx_model_path, self.config.hidden_size, self.n_threads)
+
+    def __call__(self, **batch_dict) -> SimpleNamespace:
+        """
+        Run the model on a tokenized batch.
+        :param batch_dict: Tokenized batch with the input IDs, attention mask and token type IDs as PyTorch tensors
+        :return: Object with the last hidden state as a PyTorch tensor
+        """
+        inputs = {name: tensor.numpy().astype(np.int64) for name, tensor in batch_dict.items()
+                  if name in self.input_names}
+        (last_hidden_state,) = self.session.run(['last_hidden_state'], inputs)
+        return SimpleNamespace(last_hidden_state=torch.from_numpy(last_hidden_state))
+
+
+def export_onnx_model(model: AutoModel,
+                      tokenizer: AutoTokenizer,
+                      onnx_model_path: str,
+                      quantize: bool = True) -> str:
+    """
+    Export a transformer model to ONNX, optionally with its weights dynamically quantized to INT8.
+    :param model: The transformer model to export.
+    :param tokenizer: The tokenizer of the model, used to build the example input of the export.
+    :param onnx_model_path: Path of the exported model.
+    :param quantize: If True, quantize the weights of the exported model to INT8.
+    :return: The path of the exported model.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_model_path)), exist_ok=True)
+    example = tokenizer(['collaboration novelty'], return_tensors='pt')
+    input_names = [name for name in ONNX_INPUT_NAMES if name in example]
+    fp32_model_path = onnx_model_path.replace('.onnx', '.fp32.onnx') if quantize else onnx_model_path
+
+    model.eval()
+    with torch.no_grad():
+        torch.onnx.export(model,
+                          args=tuple(example[name] for name in input_names),
+                          f=fp32_model_path,
+                          input_names=input_names,
+                          output_names=['last_hidden_state'],
+                          dynamic_axes={**{name: {0: 'batch', 1: 'sequence'} for name in input_names},
+                                        'last_hidden_state': {0: 'batch', 1: 'sequence'}},
+                          opset_version=ONNX_OPSET_VERSION)
+    logger.info(f"Exported the model to {fp32_model_path} ({os.path.getsize(fp32_model_path) / 2 ** 20:.0f} MiB).")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(model_input=fp32_model_path, model_output=onnx_model_path, weight_type=QuantType.QInt8)
+        os.remove(fp32_model_path)
+        logger.info(f"Quantized the model to {onnx_model_path} "
+                    f"({os.path.getsize(onnx_model_path) / 2 ** 20:.0f} MiB).")
+
+    return onnx_model_path
+
+
+def get_embedding_model(model_name: str,
+                        backend: str = 'torch',
+                        onnx_model_path: str = None,
+                        n_threads: int = None):
+    """
+    Get the model of an embedding backend.
+    :param model_name: The name of the model.
+    :param backend: The embedding backend, one of EMBEDDING_BACKENDS.
+    :param onnx_model_path: Path of the exported ONNX model for the 'onnx' backend.
+    :param n_threads: Number of threads to run the model with, the default of the backend if None.
+    :return: The model of the backend, to be used with embed_batch.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}'. Choose one of {EMBEDDING_BACKENDS}.")
+
+    # The ONNX backend only needs the configuration of the model, not its PyTorch weights
+    if backend == 'onnx':
+        if onnx_model_path is None or not os.path.exists(onnx_model_path):
+            raise FileNotFoundError(f"The ONNX model '{onnx_model_path}' does not exist. Export it first with "
+                                    f"scripts/embedding/export_embedding_model.py.")
+        return ONNXEmbeddingModel(onnx_model_path=onnx_model_path,
+                                  hidden_size=AutoConfig.from_pretrained(model_name).hidden_size,
+                                  n_threads=n_threads)
+
+    if n_threads is not None:
+        torch.set_num_threads(n_threads)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    if backend == 'torch_int8':
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def get_cosine_drift(embeddings: Tensor, reference_embeddings: Tensor) -> dict:
+    """
+    Get the drift of normalized embeddings from reference embeddings of the same texts.
+    :param embeddings: Normalized embeddings of the backend, one row per text.
+    :param reference_embeddings: Normalized FP32 embeddings, one row per text.
+    :return: Dictionary with the minimum, 1st percentile and mean cosine similarity and the maximum cosine drift
+    """
+    cosine_similarities = (embeddings.float() * reference_embeddings.float()).sum(dim=1).numpy()
+    return dict(N_TEXTS=len(cosine_similarities),
+                MIN_COSINE_SIMILARITY=float(cosine_similarities.min()),
+                P01_COSINE_SIMILARITY=float(np.percentile(cosine_similarities, 1)),
+                MEAN_COSINE_SIMILARITY=float(cosine_similarities.mean()),
+                MAX_COSINE_DRIFT=float(1 - cosine_similarities.min()))
+
@@ -0,0 +1,276 @@
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Callable, Union
+
+import numpy as np
+
+# Share of the maximum size the cache is evicted down to once it exceeds the maximum, so that it is not evicted again
+# after every insert
+CACHE_EVICTION_TARGET = 0.9
+
+# Seconds a connection waits for a lock held by another process
+CACHE_BUSY_TIMEOUT = 60
+
+# Size of the blocks a model file is read in to hash it
+MODEL_FILE_HASH_BLOCK_SIZE = 2 ** 20
+
+
+def get_model_file_hash(path: str) -> str:
+    """
+    Get the SHA-256 hash of the content of a model file, e.g. an exported ONNX model.
+    :param path: Path of the model file
+    :return: Hexadecimal digest of the file
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(MODEL_FILE_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_embedding_model_key(model_name: str,
+                            backend: str = 'torch',
+                            max_length: int = 512,
+                            chunking: dict = None,
+                            onnx_model_path: str = None) -> str:
+    """
+    Get the key of the settings that determine the embedding of a text: the model, its backend and the tokenizer
+    settings. Embeddings cached under one key are never returned for another, so changing any of the settings only
+    invalidates the entries of the previous settings. The key of the 'onnx' backend includes the path and the content
+    hash of the exported model, so a new export, e.g. with or without quantization, invalidates the entries of the
+    previous export.
+    :param model_name: The name of the model.
+    :param backend: The embedding backend.
+    :param max_length: Maximum number of tokens of a text, or of a chunk of a text.
+    :param chunking: Chunking settings of long texts (see util.embedding.inference.CHUNKING), None if they are
+    truncated.
+    :param onnx_model_path: Path of the exported ONNX model, required for the 'onnx' backend.
+    :return: Key of the embedding model
+    """
+    if backend == 'onnx':
+        if onnx_model_path is None or not os.path.exists(onnx_model_path):
+            raise FileNotFoundError(f"The ONNX model '{onnx_model_path}' does not exist.")
+        backend = (f"{backend}(path={os.path.abspath(onnx_model_path)},"
+                   f"sha256={get_model_file_hash(path=onnx_model_path)})")
+
+    if chunking is None:
+        length_handling = 'truncation'
+    else:
+        length_handling = (f"chunking(stride={chunking['STRIDE']},max_chunks={chunking['MAX_CHUNKS']},"
+                           f"weighting={chunking['WEIGHTING']}"
+                           f"{',decay=' + str(chunking['DECAY']) if chunking['WEIGHTING'] == 'decay' else ''})")
+    return f"{model_name}|{backend}|max_length={max_length}|{length_handling}|mean_pooling|l2_normalized"
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of text embeddings in a local SQLite database, keyed by the hash of the embedding model key and the
+    input text. Embeddings are stored as float32 bytes with the time they were last used, and when the cache grows
+    beyond its maximum size the least recently used entries are evicted. The total size of the embeddings is kept in a
+    one-row table that triggers update in the same transaction as the entries, so it is checked without scanning the
+    cache. Several processes can use the same cache file, and the cache is pickled as its settings, so that pool workers
+    open their own connection.
+    """
+
+    def __init__(self, path: str, model_key: str, max_bytes: int = None):
+        """
+        :param path: Path of the SQLite database
+        :param model_key: Key of the embedding model, see get_embedding_model_key
+        :param max_bytes: Maximum total size of the cached embeddings in bytes, None for no maximum
+        """
+        self.path = path
+        self.model_key = model_key
+        self.max_bytes = max_bytes
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=CACHE_BUSY_TIMEOUT)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS EMBEDDING_CACHE (
+                                       KEY BLOB PRIMARY KEY,
+                                       MODEL_KEY TEXT NOT NULL,
+                                       EMBEDDING BLOB NOT NULL,
+                                       NBYTES INTEGER NOT NULL,
+                                       LAST_ACCESS REAL NOT NULL
+                                   ) WITHOUT ROWID""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS IX_LAST_ACCESS ON EMBEDDING_CACHE (LAST_ACCESS)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS IX_MODEL_KEY ON EMBEDDING_CACHE (MODEL_KEY)")
+        self.connection.commit()
+
+        # Track the total size of the embeddings. A cache created by an earlier version is scanned once to start the
+        # tracked size, in the same transaction that adds the triggers, so no entry is missed by another process.
+        self.connection.execute("BEGIN IMMEDIATE")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS EMBEDDING_CACHE_SIZE (
+                                       ID INTEGER PRIMARY KEY CHECK (ID = 0),
+                                       NBYTES INTEGER NOT NULL
+                                   )""")
+        self.connection.execute("""CREATE TRIGGER IF NOT EXISTS TR_EMBEDDING_CACHE_INSERT
+                                   AFTER INSERT ON EMBEDDING_CACHE
+                                   BEGIN
+                                       UPDATE EMBEDDING_CACHE_SIZE SET NBYTES = NBYTES + NEW.NBYTES;
+                                   END""")
+        self.connection.execute("""CREATE TRIGGER IF NOT EXISTS TR_EMBEDDING_CACHE_UPDATE
+                                   AFTER UPDATE OF NBYTES ON EMBEDDING_CACHE
+                                   BEGIN
+                                       UPDATE EMBEDDING_CACHE_SIZE SET NBYTES = NBYTES + NEW.NBYTES - OLD.NBYTES;
+                                   END""")
+        self.connection.execute("""CREATE TRIGGER IF NOT EXISTS TR_EMBEDDING_CACHE_DELETE
+                                   AFTER DELETE ON EMBEDDING_CACHE
+                                   BEGIN
+                                       UPDATE EMBEDDING_CACHE_SIZE SET NBYTES = NBYTES - OLD.NBYTES;
+                                   END""")
+        if self.connection.execute("SELECT NBYTES FROM EMBEDDING_CACHE_SIZE").fetchone() is None:
+            self.connection.execute("INSERT INTO EMBEDDING_CACHE_SIZE (ID, NBYTES) "
+                                    "SELECT 0, COALESCE(SUM(NBYTES), 0) FROM EMBEDDING_CACHE")
+        self.connection.commit()
+
+        # Number of lookups that were and were not in the cache
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def __reduce__(self) -> tuple:
+        """
+        Pickle the cache as its settings.
+        :return: Tuple of the class and the arguments that rebuild the cache
+        """
+        return self.__class__, (self.path, self.model_key, self.max_bytes)
+
+    def get_keys(self, texts: list) -> list:
+        """
+        Get the cache keys of texts for the embedding model of the cache.
+        :param texts: List of input texts
+        :return: List of SHA-256 digests
+        """
+        prefix = self.model_key.encode('utf-8') + b'\0'
+        return [hashlib.sha256(prefix + str(text).encode('utf-8')).digest() for text in texts]
+
+    def get_many(self, texts: list) -> list:
+        """
+        Look up the embeddings of texts and mark the ones that are found as used.
+        :param texts: List of input texts
+        :return: List with the embedding of each text as a float32 array, None for texts that are not in the cache
+        """
+        keys = self.get_keys(texts)
+        found = dict()
+        for start in range(0, len(keys), 500):
+            batch_keys = list(set(keys[start:start + 500]))
+            found.update(self.connection.execute(
+                f"SELECT KEY, EMBEDDING FROM EMBEDDING_CACHE WHERE KEY IN ({','.join('?' * len(batch_keys))})",
+                batch_keys).fetchall())
+        if found:
+            with self.connection:
+                self.connection.executemany("UPDATE EMBEDDING_CACHE SET LAST_ACCESS = ? WHERE KEY = ?",
+                                            [(time.time(), key) for key in found])
+
+        embeddings = [np.frombuffer(found[key], dtype=np.float32) if key in found else None for key in keys]
+        self.n_hits += sum(embedding is not None for embedding in embeddings)
+        self.n_misses += sum(embedding is None for embedding in embeddings)
+        return embeddings
+
+    def put_many(self, texts: list, embeddings: np.ndarray) -> None:
+        """
+        Store the embeddings of texts and evict the least recently used entries if the cache is too large. Existing
+        entries are updated in place rather than replaced, so that the triggers keep the tracked size of the cache.
+        :param texts: List of input texts
+        :param embeddings: Array of the embeddings of the texts, one row per text
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO EMBEDDING_CACHE (KEY, MODEL_KEY, EMBEDDING, NBYTES, LAST_ACCESS) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (KEY) DO UPDATE SET MODEL_KEY = excluded.MODEL_KEY, EMBEDDING = excluded.EMBEDDING, "
+                "NBYTES = excluded.NBYTES, LAST_ACCESS = excluded.LAST_ACCESS",
+                [(key, self.model_key, embedding.tobytes(), embedding.nbytes, now)
+                 for key, embedding in zip(self.get_keys(texts), embeddings)])
+        if self.max_bytes is not None:
+            self.evict(max_bytes=self.max_bytes)
+
+    def get_or_compute(self, texts: list, compute: Callable[[list], np.ndarray]) -> np.ndarray:
+        """
+        Get the embeddings of texts from the cache and compute (and store) only those of the texts that are not in it.
+        Every distinct text is computed once.
+        :param texts: List of input texts
+        :param compute: Function that embeds a list of texts and returns an array with one row per text
+        :return: Array of the embeddings of the texts in the order of the texts
+        """
+        texts = list(texts)
+        embeddings = self.get_many(texts)
+        missing_texts = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        if missing_texts:
+            computed = np.asarray(compute(missing_texts), dtype=np.float32)
+            self.put_many(missing_texts, computed)
+            computed_by_text = dict(zip(missing_texts, computed))
+            embeddings = [computed_by_text[text] if embedding is None else embedding
+                          for text, embedding in zip(texts, embeddings)]
+        if not embeddings:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack(embeddings)
+
+    def get_size(self) -> int:
+        """
+        Get the total size of the cached embeddings, as tracked by the triggers.
+        :return: Size in bytes
+        """
+        return int(self.connection.execute("SELECT NBYTES FROM EMBEDDING_CACHE_SIZE").fetchone()[0])
+
+    def evict(self, max_bytes: int) -> int:
+        """
+        If the cached embeddings exceed the maximum size, evict the least recently used entries of any model until they
+        are at most CACHE_EVICTION_TARGET times the maximum size. The entries are only scanned when the tracked size
+        exceeds the maximum.
+        :param max_bytes: Maximum total size of the cached embeddings in bytes
+        :return: Number of evicted entries
+        """
+        excess = self.get_size() - max_bytes
+        if excess <= 0:
+            return 0
+
+        # Collect the least recently used entries that make up the excess down to the eviction target
+        excess += int(max_bytes * (1 - CACHE_EVICTION_TARGET))
+        evicted_keys, evicted_bytes = list(), 0
+        for key, nbytes in self.connection.execute("SELECT KEY, NBYTES FROM EMBEDDING_CACHE ORDER BY LAST_ACCESS"):
+            if evicted_bytes >= excess:
+                break
+            evicted_keys.append((key,))
+            evicted_bytes += nbytes
+
+        with self.connection:
+            self.connection.executemany("DELETE FROM EMBEDDING_CACHE WHERE KEY = ?", evicted_keys)
+        return len(evicted_keys)
+
+    def clear(self, model_key: str = None) -> int:
+        """
+        Remove the entries of an embedding model, e.g. of a model that is no longer used.
+        :param model_key: Key of the embedding model, the model of the cache by default
+        :return: Number of removed entries
+        """
+        with self.connection:
+            return self.connection.execute("DELETE FROM EMBEDDING_CACHE WHERE MODEL_KEY = ?",
+                                           (model_key or self.model_key,)).rowcount
+
+
+def get_embedding_cache(cache_path: str,
+                        model_name: str,
+                        backend: str = 'torch',
+                        max_bytes: int = None,
+                        chunking: dict = None,
+                        onnx_model_path: str = None) -> Union[EmbeddingCache, None]:
+    """
+    Open the embedding cache of an embedding model.
+    :param cache_path: Path of the SQLite database, None to not use a cache
+    :param model_name: The name of the model.
+    :param backend: The embedding backend.
+    :param max_bytes: Maximum total size of the cached embeddings in bytes, None for no maximum
+    :param chunking: Chunking settings of long texts (see util.embedding.inference.CHUNKING), None if they are
+    truncated.
+    :param onnx_model_path: Path of the exported ONNX model, required for the 'onnx' backend.
+    :return: Embedding cache, None if there is no cache path
+    """
+    if cache_path is None:
+        return None
+    return EmbeddingCache(path=cache_path,
+                          model_key=get_embedding_model_key(model_name=model_name, backend=backend, chunking=chunking,
+                                                            onnx_model_path=onnx_model_path),
+                          max_bytes=max_bytes)
@@ -1,33 +1,31 @@
 import numpy as np
 import pandas as pd
-import torch.nn.functional as F
+import torch
 from torch import Tensor
 from tqdm import tqdm
 from transformers import AutoModel, AutoTokenizer
 
-
-def average_pool(last_hidden_states: Tensor,
-                 attention_mask: Tensor) -> Tensor:
-    """
-    Average pooling of the last hidden states of a transformer model.
-    :param last_hidden_states: The last hidden states of a transformer model.
-    :param attention_mask: The attention mask of the input.
-    :return: The average pooled embeddings.
-    """
-    # Mask the last hidden states
-    last_hidden = last_hidden_states.masked_fill(~attention_mask[..., None].bool(), 0.0)
-    # Sum the last hidden states and divide by the number of non-padded tokens
-    return last_hidden.sum(dim=1) / attention_mask.sum(dim=1)[..., None]
+from util.embedding.backend import get_embedding_model
+from util.embedding.cache import EmbeddingCache
+from util.embedding.inference import embed_texts
 
 
-def get_model_and_tokenizer(model_name: str) -> tuple:
+def get_model_and_tokenizer(model_name: str,
+                            backend: str = 'torch',
+                            onnx_model_path: str = None,
+                            n_threads: int = None) -> tuple:
     """
     Get the model and tokenizer for a given model name.
     :param model_name: The name of the model.
+    :param backend: The embedding backend: 'torch' (FP32), 'torch_int8' (dynamically quantized linear layers) or
+    'onnx' (ONNX Runtime).
+    :param onnx_model_path: Path of the exported ONNX model for the 'onnx' backend.
+    :param n_threads: Number of threads to run the model with, the default of the backend if None.
     :return: The model and tokenizer.
     """
-    # Load the model and tokenizer
-    model = AutoModel.from_pretrained(model_name)
+    # Load the model of the embedding backend and the tokenizer
+    model = get_embedding_model(model_name=model_name, backend=backend, onnx_model_path=onnx_model_path,
+                                n_threads=n_threads)
     tokenizer = AutoTokenizer.from_pretrained(model_name)
 
     return model, tokenizer
@@ -45,27 +43,31 @@ def split_list_to_batch(lst: list, batch_size: int):
 
 def embed_batch(lst_to_embed: list,
                 model: AutoModel,
-                tokenizer: AutoTokenizer) -> list:
+                tokenizer: AutoTokenizer,
+                cache: EmbeddingCache = None,
+                chunking: dict = None) -> Tensor:
     """
-    Embed a batch of input texts using a transformer model.
+    Embed a batch of input texts using a transformer model. The texts are run through the inference engine, so a batch
+    can be of any size: it is split into batches of similar length under a token budget.
     :param lst_to_embed: The input batch of texts to embed.
     :param model: The transformer model to use for embeddings.
     :param tokenizer: The tokenizer to use for embeddings.
+    :param cache: The embedding cache to look the texts up in first, None to embed all the texts.
+    :param chunking: Chunking settings of long texts (see util.embedding.inference.CHUNKING), None to truncate them.
     :return: The embeddings of the input texts.
     """
-    # Tokenize the input texts
-    batch_dict = tokenizer(lst_to_embed, max_length=512, padding=True, truncation=True, return_tensors='pt')
-
-    # Get the embeddings from the model
-    outputs = model(**batch_dict)
-    # Average pool the embeddings
-    embeddings = average_pool(outputs.last_hidden_state, batch_dict['attention_mask'])
-
-    # Normalize embeddings
-    normalized_embeddings = F.normalize(embeddings, p=2, dim=1)
-
-    # Return the normalized embeddings
-    return normalized_embeddings
+    # Generate the normalized embeddings in the order of the input texts
+    if cache is None:
+        return embed_texts(lst_to_embed=lst_to_embed,
+                           model=model,
+                           tokenizer=tokenizer,
+                           chunking=chunking)
+
+    # Embed only the texts that are not in the cache
+    return torch.from_numpy(cache.get_or_compute(
+        texts=lst_to_embed,
+        compute=lambda texts: embed_texts(lst_to_embed=texts, model=model, tokenizer=tokenizer,
+                                          chunking=chunking).numpy()))
 
 
 def cosine_similarity(vector: np.ndarray,
@@ -0,0 +1,238 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+from transformers import AutoModel, AutoTokenizer, BatchEncoding
+
+# Maximum number of tokens of a text, longer texts are truncated
+MAX_LENGTH = 512
+
+# Maximum number of padded tokens (texts x longest text) and texts in a batch of the inference engine
+MAX_BATCH_TOKENS = 8192
+MAX_BATCH_SIZE = 64
+
+# Default chunking settings of long texts: overlap of consecutive chunks in tokens, maximum number of chunks of a text,
+# weighting of the chunks when they are pooled (see pool_chunk_embeddings) and decay of the 'decay' weighting
+CHUNKING = dict(STRIDE=64, MAX_CHUNKS=8, WEIGHTING='tokens', DECAY=0.5)
+CHUNK_WEIGHTINGS = ('tokens', 'uniform', 'decay')
+
+# Key of the encodings with the text of each chunk
+CHUNK_DOCUMENT_KEY = 'chunk_document_id'
+
+# Upper bound of the number of characters per token, to cut texts to the characters their chunks can hold
+MAX_CHARS_PER_TOKEN = 10
+
+
+def average_pool(last_hidden_states: Tensor,
+                 attention_mask: Tensor) -> Tensor:
+    """
+    Average pooling of the last hidden states of a transformer model.
+    :param last_hidden_states: The last hidden states of a transformer model.
+    :param attention_mask: The attention mask of the input.
+    :return: The average pooled embeddings.
+    """
+    # Mask the last hidden states
+    last_hidden = last_hidden_states.masked_fill(~attention_mask[..., None].bool(), 0.0)
+    # Sum the last hidden states and divide by the number of non-padded tokens
+    return last_hidden.sum(dim=1) / attention_mask.sum(dim=1)[..., None]
+
+
+def get_token_budget_batches(lengths: np.ndarray,
+                             max_batch_tokens: int = MAX_BATCH_TOKENS,
+                             max_batch_size: int = MAX_BATCH_SIZE) -> list:
+    """
+    Group texts into batches of similar token length under a token budget. The texts are sorted by length (longest
+    first) and cut into consecutive batches, so a batch is padded to a length close to that of all of its texts. A batch
+    takes texts as long as the number of texts times the length of its longest text stays within the budget.
+    :param lengths: Array of the token length of each text
+    :param max_batch_tokens: Maximum number of padded tokens in a batch
+    :param max_batch_size: Maximum number of texts in a batch
+    :return: List of arrays with the positions of the texts in each batch
+    """
+    order = np.argsort(-np.asarray(lengths), kind='stable')
+    batches, start = list(), 0
+    while start < len(order):
+        # The first text of a batch is its longest, so it sets the padded length of the batch
+        longest = max(int(lengths[order[start]]), 1)
+        size = int(min(max(max_batch_tokens // longest, 1), max_batch_size, len(order) - start))
+        batches.append(order[start:start + size])
+        start += size
+    return batches
+
+
+def get_chunk_indices(document_ids: np.ndarray) -> np.ndarray:
+    """
+    Get the index of every chunk within its document.
+    :param document_ids: Array of the document of each chunk, in the order of the documents
+    :return: Array of the index of each chunk within its document
+    """
+    document_ids = np.asarray(document_ids)
+    return np.arange(len(document_ids)) - np.searchsorted(document_ids, document_ids, side='left')
+
+
+def tokenize_texts(lst_to_embed: list,
+                   tokenizer: AutoTokenizer,
+                   max_length: int = MAX_LENGTH,
+                   chunking: dict = None) -> BatchEncoding:
+    """
+    Tokenize input texts without padding. Without chunking, the texts are truncated to the maximum length. With
+    chunking, every text is split into windows of the maximum length that overlap by STRIDE tokens, at most MAX_CHUNKS
+    per text, in one batched call of the fast tokenizer; texts are cut beforehand to the number of characters their
+    chunks can hold, so that long texts are not tokenized beyond their last chunk.
+    :param lst_to_embed: The input texts to embed.
+    :param tokenizer: The tokenizer to use for embeddings.
+    :param max_length: Maximum number of tokens of a text or of a chunk.
+    :param chunking: Chunking settings (see CHUNKING), None to truncate the texts.
+    :return: The encodings of the texts, one list of token IDs (and attention mask) per text, or per chunk with the text
+    of each chunk in CHUNK_DOCUMENT_KEY.
+    """
+    if chunking is None:
+        return tokenizer(list(lst_to_embed), max_length=max_length, truncation=True, padding=False)
+
+    max_chars = chunking['MAX_CHUNKS'] * max_length * MAX_CHARS_PER_TOKEN
+    encodings = tokenizer([str(text)[:max_chars] for text in lst_to_embed], max_length=max_length, truncation=True,
+                          padding=False, stride=chunking['STRIDE'], return_overflowing_tokens=True)
+    document_ids = np.asarray(encodings.pop('overflow_to_sample_mapping'), dtype=np.int64)
+
+    # Keep the first chunks of every text
+    positions = np.flatnonzero(get_chunk_indices(document_ids=document_ids) < chunking['MAX_CHUNKS'])
+    encodings = BatchEncoding({key: [values[position] for position in positions] for key, values in encodings.items()})
+    encodings[CHUNK_DOCUMENT_KEY] = document_ids[positions].tolist()
+    return encodings
+
+
+def select_encodings(encodings: BatchEncoding, positions: list) -> BatchEncoding:
+    """
+    Select the encodings of some of the texts, with all their chunks if the texts are chunked.
+    :param encodings: The encodings of the texts, see tokenize_texts.
+    :param positions: Positions of the texts to select
+    :return: The encodings of the selected texts, in the order of the positions
+    """
+    if CHUNK_DOCUMENT_KEY not in encodings:
+        return BatchEncoding({key: [values[position] for position in positions]
+                              for key, values in encodings.items()})
+
+    # Select the chunks of the texts and number the texts by their position in the selection
+    chunks_by_document = dict()
+    for chunk, document_id in enumerate(encodings[CHUNK_DOCUMENT_KEY]):
+        chunks_by_document.setdefault(document_id, list()).append(chunk)
+    chunks = [chunk for position in positions for chunk in chunks_by_document[position]]
+    selection = BatchEncoding({key: [values[chunk] for chunk in chunks] for key, values in encodings.items()})
+    selection[CHUNK_DOCUMENT_KEY] = [new_position for new_position, position in enumerate(positions)
+                                     for _ in chunks_by_document[position]]
+    return selection
+
+
+def pool_chunk_embeddings(chunk_embeddings: Tensor,
+                          document_ids: np.ndarray,
+                          lengths: np.ndarray,
+                          n_documents: int,
+                          weighting: str = 'tokens',
+                          decay: float = 0.5) -> Tensor:
+    """
+    Pool the embeddings of the chunks of every document into one embedding, as the normalized weighted sum of the
+    embeddings of its chunks.
+    :param chunk_embeddings: The normalized embeddings of the chunks, one row per chunk.
+    :param document_ids: Array of the document of each chunk, in the order of the documents
+    :param lengths: Array of the number of tokens of each chunk
+    :param n_documents: Number of documents
+    :param weighting: Weight of a chunk, one of CHUNK_WEIGHTINGS: its number of tokens ('tokens'), 1 ('uniform') or
+    decay ** its index within the document ('decay'), which favours the beginning of the document
+    :param decay: Decay of the weights of the 'decay' weighting
+    :return: The normalized embeddings of the documents, one row per document.
+    """
+    if weighting == 'tokens':
+        weights = np.asarray(lengths, dtype=np.float32)
+    elif weighting == 'uniform':
+        weights = np.ones(len(document_ids), dtype=np.float32)
+    elif weighting == 'decay':
+        weights = np.power(decay, get_chunk_indices(document_ids=document_ids)).astype(np.float32)
+    else:
+        raise ValueError(f"Unknown chunk weighting '{weighting}'. Choose one of {CHUNK_WEIGHTINGS}.")
+
+    pooled = torch.zeros((n_documents, chunk_embeddings.shape[1]), dtype=chunk_embeddings.dtype)
+    pooled.index_add_(0, torch.from_numpy(np.asarray(document_ids, dtype=np.int64)),
+                      chunk_embeddings * torch.from_numpy(weights)[:, None])
+    return F.normalize(pooled, p=2, dim=1)
+
+
+def embed_encodings(encodings: BatchEncoding,
+                    model: AutoModel,
+                    tokenizer: AutoTokenizer,
+                    max_batch_tokens: int = MAX_BATCH_TOKENS,
+                    max_batch_size: int = MAX_BATCH_SIZE,
+                    chunking: dict = None) -> Tensor:
+    """
+    Embed tokenized texts using a transformer model. The texts, or the chunks of all the texts, are grouped into
+    batches of similar length under a token budget (see get_token_budget_batches), so little compute is spent on
+    padding, and run through the model in inference mode. The embeddings of the chunks of a text are pooled into the
+    embedding of the text (see pool_chunk_embeddings). The embeddings are returned in the order of the texts.
+    :param encodings: The encodings of the texts, see tokenize_texts.
+    :param model: The transformer model to use for embeddings.
+    :param tokenizer: The tokenizer the texts were encoded with, used to pad the batches.
+    :param max_batch_tokens: Maximum number of padded tokens in a batch.
+    :param max_batch_size: Maximum number of texts in a batch.
+    :param chunking: Chunking settings the texts were tokenized with (see CHUNKING), None if they were truncated.
+    :return: The normalized embeddings of the texts, one row per text.
+    """
+    document_ids = encodings.get(CHUNK_DOCUMENT_KEY)
+    keys = [key for key in encodings.keys() if key != CHUNK_DOCUMENT_KEY]
+    lengths = np.array([len(input_ids) for input_ids in encodings['input_ids']], dtype=np.int64)
+
+    embeddings = torch.empty((len(lengths), model.config.hidden_size), dtype=torch.float32)
+    with torch.inference_mode():
+        for positions in get_token_budget_batches(lengths=lengths,
+                                                  max_batch_tokens=max_batch_tokens,
+                                                  max_batch_size=max_batch_size):
+            # Pad the batch to its longest text
+            batch_dict = tokenizer.pad({key: [encodings[key][position] for position in positions] for key in keys},
+                                       padding=True, return_tensors='pt')
+
+            # Get the embeddings from the model and average pool them
+            outputs = model(**batch_dict)
+            batch_embeddings = average_pool(outputs.last_hidden_state, batch_dict['attention_mask'])
+
+            # Normalize the embeddings and put them back in the order of the input texts
+            embeddings[torch.from_numpy(positions)] = F.normalize(batch_embeddings, p=2, dim=1).float()
+
+    if document_ids is None:
+        return embeddings
+
+    chunking = chunking if chunking is not None else CHUNKING
+    return pool_chunk_embeddings(chunk_embeddings=embeddings,
+                                 document_ids=np.asarray(document_ids, dtype=np.int64),
+                                 lengths=lengths,
+                                 n_documents=int(document_ids[-1]) + 1 if len(document_ids) else 0,
+                                 weighting=chunking['WEIGHTING'],
+                                 decay=chunking['DECAY'])
+
+
+def embed_texts(lst_to_embed: list,
+                model: AutoModel,
+                tokenizer: AutoTokenizer,
+                max_batch_tokens: int = MAX_BATCH_TOKENS,
+                max_batch_size: int = MAX_BATCH_SIZE,
+                max_length: int = MAX_LENGTH,
+                chunking: dict = None) -> Tensor:
+    """
+    Embed any number of input texts using a transformer model. The texts are tokenized once, grouped into batches of
+    similar length under a token budget (see get_token_budget_batches), so little compute is spent on padding, and run
+    through the model in inference mode. With chunking, long texts are split into chunks that are embedded together
+    with the chunks of the other texts and pooled back per text. The embeddings are returned in the order of the input
+    texts.
+    :param lst_to_embed: The input texts to embed.
+    :param model: The transformer model to use for embeddings.
+    :param tokenizer: The tokenizer to use for embeddings.
+    :param max_batch_tokens: Maximum number of padded tokens in a batch.
+    :param max_batch_size: Maximum number of texts in a batch.
+    :param max_length: Maximum number of tokens of a text or of a chunk.
+    :param chunking: Chunking settings (see CHUNKING), None to truncate the texts.
+    :return: The normalized embeddings of the input texts, one row per text.
+    """
+    return embed_encodings(encodings=tokenize_texts(lst_to_embed=lst_to_embed, tokenizer=tokenizer,
+                                                    max_length=max_length, chunking=chunking),
+                           model=model,
+                           tokenizer=tokenizer,
+                           max_batch_tokens=max_batch_tokens,
+                           max_batch_size=max_batch_size,
+                           chunking=chunking)
@@ -0,0 +1,163 @@
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+# Seconds a connection waits for a lock held by another process
+LEDGER_BUSY_TIMEOUT = 60
+
+# Statuses of the work items: queued to be embedded, being embedded, embedded into a staged file and loaded to BigQuery
+LEDGER_QUEUED = 'QUEUED'
+LEDGER_IN_PROGRESS = 'IN_PROGRESS'
+LEDGER_STAGED = 'STAGED'
+LEDGER_DONE = 'DONE'
+
+
+class EmbeddingLedger:
+    """
+    Local ledger of the articles of an embedding run in a SQLite database. Every article is queued with its input text,
+    marked in progress while it is embedded, staged with the path of the file that holds its embedding (see
+    EmbeddingStagingWriter) and done once that file is loaded to BigQuery, when its input text is dropped. A restarted
+    run resumes from the ledger: articles that were in progress are queued again, staged files are loaded, and done
+    articles are never queued again, so no article is embedded twice and no BigQuery query is needed to find the work.
+
+    The ledger can be used from several threads, e.g. the embedding thread and the writer and load threads of the
+    staging writer.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Path of the SQLite database
+        """
+        self.path = path
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=LEDGER_BUSY_TIMEOUT, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS EMBEDDING_LEDGER (
+                                       DOI TEXT PRIMARY KEY,
+                                       EMBEDDING_INPUT TEXT,
+                                       STATUS TEXT NOT NULL,
+                                       FILE TEXT,
+                                       LAST_UPDATE REAL NOT NULL
+                                   ) WITHOUT ROWID""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS IX_STATUS ON EMBEDDING_LEDGER (STATUS)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS IX_FILE ON EMBEDDING_LEDGER (FILE)")
+        self.connection.commit()
+        self._lock = threading.Lock()
+
+    def __reduce__(self) -> tuple:
+        """
+        Pickle the ledger as its path.
+        :return: Tuple of the class and the arguments that rebuild the ledger
+        """
+        return self.__class__, (self.path,)
+
+    def _execute_many(self, query: str, parameters: list) -> None:
+        """
+        Execute a query for each set of parameters in one transaction.
+        :param query: SQL query
+        :param parameters: List of the parameters of each execution
+        """
+        with self._lock, self.connection:
+            self.connection.executemany(query, parameters)
+
+    def enqueue(self, articles: pd.DataFrame) -> int:
+        """
+        Queue articles that are not in the ledger yet.
+        :param articles: DataFrame of the articles with the ARTICLE_DOI and EMBEDDING_INPUT columns
+        :return: Number of queued articles
+        """
+        n_queued = self.count(LEDGER_QUEUED)
+        now = time.time()
+        self._execute_many("INSERT OR IGNORE INTO EMBEDDING_LEDGER (DOI, EMBEDDING_INPUT, STATUS, LAST_UPDATE) "
+                           "VALUES (?, ?, ?, ?)",
+                           [(str(doi), str(text), LEDGER_QUEUED, now) for doi, text in
+                            zip(articles['ARTICLE_DOI'], articles['EMBEDDING_INPUT'])])
+        return self.count(LEDGER_QUEUED) - n_queued
+
+    def get_queued(self, limit: int = None) -> pd.DataFrame:
+        """
+        Get the queued articles.
+        :param limit: Maximum number of articles, None for all of them
+        :return: DataFrame of the articles with the ARTICLE_DOI and EMBEDDING_INPUT columns
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT DOI, EMBEDDING_INPUT FROM EMBEDDING_LEDGER WHERE STATUS = ? ORDER BY DOI LIMIT ?",
+                (LEDGER_QUEUED, -1 if limit is None else limit)).fetchall()
+        return pd.DataFrame(rows, columns=['ARTICLE_DOI', 'EMBEDDING_INPUT'])
+
+    def count(self, status: str) -> int:
+        """
+        Count the articles with a status.
+        :param status: Status of the articles
+        :return: Number of articles
+        """
+        with self._lock:
+            return int(self.connection.execute("SELECT COUNT(1) FROM EMBEDDING_LEDGER WHERE STATUS = ?",
+                                               (status,)).fetchone()[0])
+
+    def mark_in_progress(self, dois: list) -> None:
+        """
+        Mark articles as being embedded.
+        :param dois: DOIs of the articles
+        """
+        now = time.time()
+        self._execute_many("UPDATE EMBEDDING_LEDGER SET STATUS = ?, LAST_UPDATE = ? WHERE DOI = ?",
+                           [(LEDGER_IN_PROGRESS, now, str(doi)) for doi in dois])
+
+    def mark_staged(self, dois: list, file: str) -> None:
+        """
+        Mark articles as embedded into a staged file.
+        :param dois: DOIs of the articles
+        :param file: Path of the staged file
+        """
+        now = time.time()
+        self._execute_many("UPDATE EMBEDDING_LEDGER SET STATUS = ?, FILE = ?, LAST_UPDATE = ? WHERE DOI = ?",
+                           [(LEDGER_STAGED, file, now, str(doi)) for doi in dois])
+
+    def move_staged(self, files: list, file: str) -> None:
+        """
+        Record that staged files were combined into another staged file.
+        :param files: Paths of the combined staged files
+        :param file: Path of the staged file they were combined into
+        """
+        now = time.time()
+        self._execute_many("UPDATE EMBEDDING_LEDGER SET FILE = ?, LAST_UPDATE = ? WHERE STATUS = ? AND FILE = ?",
+                           [(file, now, LEDGER_STAGED, old_file) for old_file in files])
+
+    def mark_done(self, file: str) -> None:
+        """
+        Mark the articles of a staged file as loaded to BigQuery and drop their input texts.
+        :param file: Path of the staged file
+        """
+        self._execute_many("UPDATE EMBEDDING_LEDGER SET STATUS = ?, EMBEDDING_INPUT = NULL, FILE = NULL, "
+                           "LAST_UPDATE = ? WHERE STATUS = ? AND FILE = ?",
+                           [(LEDGER_DONE, time.time(), LEDGER_STAGED, file)])
+
+    def get_staged_files(self) -> list:
+        """
+        Get the staged files that hold embeddings that are not loaded to BigQuery yet.
+        :return: List of the paths of the staged files
+        """
+        with self._lock:
+            return [row[0] for row in self.connection.execute(
+                "SELECT DISTINCT FILE FROM EMBEDDING_LEDGER WHERE STATUS = ?", (LEDGER_STAGED,))]
+
+    def requeue(self, file: str = None) -> None:
+        """
+        Queue articles again: those that were in progress when a run stopped or, if a file is given, those of a staged
+        file that was lost.
+        :param file: Path of a lost staged file, None to queue the articles that were in progress
+        """
+        now = time.time()
+        if file is None:
+            self._execute_many("UPDATE EMBEDDING_LEDGER SET STATUS = ?, LAST_UPDATE = ? WHERE STATUS = ?",
+                               [(LEDGER_QUEUED, now, LEDGER_IN_PROGRESS)])
+        else:
+            self._execute_many("UPDATE EMBEDDING_LEDGER SET STATUS = ?, FILE = NULL, LAST_UPDATE = ? "
+                               "WHERE STATUS = ? AND FILE = ?",
+                               [(LEDGER_QUEUED, now, LEDGER_STAGED, file)])
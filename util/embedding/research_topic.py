@@ -1,19 +1,25 @@
+import numpy as np
 import pandas as pd
-import torch
 from tqdm import tqdm
 from transformers import AutoModel, AutoTokenizer
 
+from util.embedding.cache import EmbeddingCache
 from util.embedding.helpers import embed_batch
+from util.embedding.storage import EMBEDDING_STORAGE_DTYPE, encode_embeddings, get_embedding_matrix
 
 
 def embed_research_topic_metadata(lst_research_topics: list,
                                   model: AutoModel,
-                                  tokenizer: AutoTokenizer) -> pd.DataFrame:
+                                  tokenizer: AutoTokenizer,
+                                  cache: EmbeddingCache = None,
+                                  storage_dtype: str = EMBEDDING_STORAGE_DTYPE) -> pd.DataFrame:
     """
     Process the embeddings for the CERIF research topics.
     :param research_topics: list of batches of research topics
     :param model: model to use for embeddings
     :param tokenizer: tokenizer to use for embeddings
+    :param cache: embedding cache to look the texts up in first, None to embed all the texts
+    :param storage_dtype: data type to store the embeddings in
     :return: DataFrame containing the embeddings
     """
 
@@ -29,16 +35,17 @@ def embed_research_topic_metadata(lst_research_topics: list,
         # Generate normalized embeddings for the research topics from CERIF
         cerif_topic_embeddings = embed_batch(lst_to_embed=lst_research_topic_embedding_input,
                                              model=model,
-                                             tokenizer=tokenizer)
+                                             tokenizer=tokenizer,
+                                             cache=cache)
         # Process the batch
         new_batch = [
             {
                 'RESEARCH_TOPIC_CODE': research_topic_code,
-                'EMBEDDING_TENSOR_SHAPE': list(tensor.shape),
-                'EMBEDDING_TENSOR_DATA': tensor.flatten().tolist()
+                **embedding_fields
             }
-            for research_topic_code, tensor in
-            zip(lst_research_topic_code, cerif_topic_embeddings)
+            for research_topic_code, embedding_fields in
+            zip(lst_research_topic_code, encode_embeddings(embeddings=cerif_topic_embeddings.numpy(),
+                                                           dtype=storage_dtype))
         ]
 
         # Add the embeddings to the list
@@ -62,6 +69,8 @@ def embed_research_topic_top_n_articles_batch(item: str,
     # Get the metadata
     model: AutoModel = metadata['model']
     tokenizer: AutoTokenizer = metadata['tokenizer']
+    cache: EmbeddingCache = metadata.get('cache')
+    storage_dtype: str = metadata.get('storage_dtype', EMBEDDING_STORAGE_DTYPE)
 
     # List of research topic codes and DOIs
     lst_research_topic_code = item['RESEARCH_TOPIC_CODE']
@@ -71,18 +80,19 @@ def embed_research_topic_top_n_articles_batch(item: str,
     # Generate normalized embeddings for the research topics from CERIF
     embeddings = embed_batch(lst_to_embed=lst_embedding_input,
                              model=model,
-                             tokenizer=tokenizer)
+                             tokenizer=tokenizer,
+                             cache=cache)
 
     # Process the batch
     new_batch = [
         {
             'RESEARCH_TOPIC_CODE': research_topic_code,
             'ARTICLE_DOI': article_doi,
-            'EMBEDDING_TENSOR_SHAPE': list(tensor.shape),
-            'EMBEDDING_TENSOR_DATA': tensor.flatten().tolist()
+            **embedding_fields
         }
-        for research_topic_code, article_doi, tensor in
-        zip(lst_research_topic_code, lst_article_doi, embeddings)
+        for research_topic_code, article_doi, embedding_fields in
+        zip(lst_research_topic_code, lst_article_doi, encode_embeddings(embeddings=embeddings.numpy(),
+                                                                        dtype=storage_dtype))
     ]
 
     # Update the settings for the current iteration
@@ -94,38 +104,42 @@ def embed_research_topic_top_n_articles_batch(item: str,
     return iteration_settings
 
 
-def combine_research_topic_embeddings(research_topic_code: str,
-                                      df_research_topic_metadata: pd.DataFrame,
-                                      df_research_topic_top_n_articles: pd.DataFrame) -> torch.Tensor:
+def combine_research_topic_embeddings(df_research_topic_metadata: pd.DataFrame,
+                                      df_research_topic_top_n_articles: pd.DataFrame,
+                                      research_topic_weight: float = 0.2) -> tuple:
     """
-    Combine the embeddings for the research topic and its top N articles.
-    :param research_topic_code: The research topic code to combine the embeddings for.
+    Combine the embedding of every research topic with the average embedding of its top N articles, as
+    research_topic_weight * topic embedding + (1 - research_topic_weight) * average article embedding. A research topic
+    without articles keeps its own embedding. The articles are grouped by research topic once, sorted into contiguous
+    segments, and all the averages are computed in one segment sum, so the cost is linear in the number of rows.
     :param df_research_topic_metadata: The DataFrame containing the research topic embeddings.
     :param df_research_topic_top_n_articles: The DataFrame containing the top N articles embeddings.
-    :return: The combined embedding for the research topic and its top N articles.
+    :param research_topic_weight: Weight of the research topic embedding in the combination.
+    :return: Tuple of the array of the research topic codes, in the order of their first appearance in
+    df_research_topic_metadata, and the matrix of their combined embeddings, one row per research topic.
     """
-    # Fetch research topic embedding
-    df_research_topic_batch = df_research_topic_metadata[
-        df_research_topic_metadata['RESEARCH_TOPIC_CODE'] == research_topic_code]
-    embedding_research_topic = torch.tensor(df_research_topic_batch['EMBEDDING_TENSOR_DATA'].values[0])
-
-    # Fetch top N articles embeddings
-    # Filter the top N articles for the given research topic code
-    df_research_topic_top_n_articles_batch = df_research_topic_top_n_articles[
-        df_research_topic_top_n_articles['RESEARCH_TOPIC_CODE'] == research_topic_code]
-
-    # Check if the DataFrame is empty
-    if df_research_topic_top_n_articles_batch.empty:
-        embedding_combined = embedding_research_topic
-    else:
-        # Calculate average embedding
-        tensor_data = df_research_topic_top_n_articles_batch['EMBEDDING_TENSOR_DATA'].values
-        tensor_data = [torch.tensor(data) for data in tensor_data]
-        stacked_tensors = torch.stack(tensor_data)
-        embedding_top_n_articles = torch.mean(stacked_tensors, dim=0)
-
-        # Combine the embeddings
-        embedding_combined = (0.2 * embedding_research_topic + 0.8 * embedding_top_n_articles)
-
-    # Return the combined embedding
-    return embedding_combined
+    # Take the first embedding of every research topic
+    research_topic_codes, first_rows = np.unique(df_research_topic_metadata['RESEARCH_TOPIC_CODE'].to_numpy(),
+                                                 return_index=True)
+    order = np.argsort(first_rows, kind='stable')
+    research_topic_codes, first_rows = research_topic_codes[order], first_rows[order]
+    # Copy the decoded embeddings, which may be a read-only view of their bytes
+    embeddings_combined = np.array(get_embedding_matrix(df_research_topic_metadata.iloc[first_rows]))
+    if df_research_topic_top_n_articles.empty:
+        return research_topic_codes, embeddings_combined
+
+    # Sort the articles of the research topics into contiguous segments, one per research topic with articles
+    topic_ids = pd.Index(research_topic_codes).get_indexer(df_research_topic_top_n_articles['RESEARCH_TOPIC_CODE'])
+    rows = np.flatnonzero(topic_ids >= 0)
+    rows = rows[np.argsort(topic_ids[rows], kind='stable')]
+    if len(rows) == 0:
+        return research_topic_codes, embeddings_combined
+    embeddings_articles = get_embedding_matrix(df_research_topic_top_n_articles.iloc[rows])
+    segment_topic_ids, segment_starts, segment_counts = np.unique(topic_ids[rows], return_index=True,
+                                                                  return_counts=True)
+
+    # Average the articles of every segment and combine them with the embeddings of their research topics
+    embeddings_top_n_articles = np.add.reduceat(embeddings_articles, segment_starts, axis=0) / segment_counts[:, None]
+    embeddings_combined[segment_topic_ids] = (research_topic_weight * embeddings_combined[segment_topic_ids]
+                                              + (1 - research_topic_weight) * embeddings_top_n_articles)
+    return research_topic_codes, embeddings_combined
@@ -0,0 +1,156 @@
+import copy
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+
+import pandas as pd
+from loguru import logger
+from transformers import AutoModel, AutoTokenizer
+
+from util.common.pipeline import StageTimer, run_pipeline
+from util.embedding.cache import EmbeddingCache
+from util.embedding.helpers import split_list_to_batch
+from util.embedding.inference import MAX_LENGTH, embed_encodings, select_encodings, tokenize_texts
+from util.embedding.staging import EmbeddingStagingWriter
+
+# Embedding runners: 'threaded' (one model in one process, see embed_articles_threaded) or 'pool' (a process pool with a
+# copy of the model per worker)
+EMBEDDING_RUNNERS = ('threaded', 'pool')
+
+
+def iterate_tokenized_batches(batches: Iterable,
+                              tokenizer: AutoTokenizer,
+                              n_threads: int = 2,
+                              max_length: int = MAX_LENGTH,
+                              chunking: dict = None) -> Iterable:
+    """
+    Tokenize batches of articles in a thread pool, ahead of the batch that is being embedded. Fast tokenizers release
+    the GIL while encoding, so the threads run in parallel with each other and with the model. Every thread tokenizes
+    with its own copy of the tokenizer, because a fast tokenizer must not be used from several threads at once.
+    :param batches: Iterable of DataFrames of articles with the EMBEDDING_INPUT column
+    :param tokenizer: The tokenizer to use for embeddings.
+    :param n_threads: Number of tokenizer threads, which is also the number of batches tokenized ahead
+    :param max_length: Maximum number of tokens of a text or of a chunk.
+    :param chunking: Chunking settings of long texts (see util.embedding.inference.CHUNKING), None to truncate them.
+    :return: Iterator of tuples of each batch and its encodings, in the order of the batches
+    """
+    thread_local = threading.local()
+
+    def tokenize(batch: pd.DataFrame) -> tuple:
+        if not hasattr(thread_local, 'tokenizer'):
+            thread_local.tokenizer = copy.deepcopy(tokenizer)
+        return batch, tokenize_texts(lst_to_embed=batch['EMBEDDING_INPUT'].astype(str).tolist(),
+                                     tokenizer=thread_local.tokenizer,
+                                     max_length=max_length,
+                                     chunking=chunking)
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        futures = deque()
+        for batch in batches:
+            futures.append(executor.submit(tokenize, batch))
+            if len(futures) > n_threads:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+def embed_batches_threaded(batches: Iterable,
+                           model: AutoModel,
+                           tokenizer: AutoTokenizer,
+                           write: callable,
+                           cache: EmbeddingCache = None,
+                           n_tokenizer_threads: int = 2,
+                           chunking: dict = None,
+                           timer: StageTimer = None) -> StageTimer:
+    """
+    Embed batches of articles with one copy of the model in the calling process. The batches are tokenized ahead in a
+    thread pool (see iterate_tokenized_batches), the model runs in the calling thread with the intra-op threads of the
+    backend (see TEXT_EMBEDDING.N_THREADS) and a single background writer writes the embeddings of each batch while the
+    next batches are embedded.
+    :param batches: Iterable of DataFrames of articles with the EMBEDDING_INPUT column
+    :param model: The transformer model to use for embeddings.
+    :param tokenizer: The tokenizer to use for embeddings.
+    :param write: Function that writes a tuple of a batch and the matrix of its embeddings
+    :param cache: The embedding cache to look the texts up in first, None to embed all the texts.
+    :param n_tokenizer_threads: Number of tokenizer threads.
+    :param chunking: Chunking settings of long texts (see util.embedding.inference.CHUNKING), None to truncate them.
+    :param timer: Stage timer to accumulate the timings to
+    :return: Stage timer with the time spent tokenizing, embedding and writing, and waiting in between
+    """
+    def process(tokenized_batch: tuple) -> tuple:
+        batch, encodings = tokenized_batch
+        if cache is None:
+            return batch, embed_encodings(encodings=encodings, model=model, tokenizer=tokenizer,
+                                          chunking=chunking).numpy()
+
+        # Embed only the texts that are not in the cache, from their encodings
+        texts = batch['EMBEDDING_INPUT'].astype(str).tolist()
+        position_by_text = {text: position for position, text in enumerate(texts)}
+        return batch, cache.get_or_compute(
+            texts=texts,
+            compute=lambda missing_texts: embed_encodings(
+                encodings=select_encodings(encodings=encodings,
+                                           positions=[position_by_text[text] for text in missing_texts]),
+                model=model,
+                tokenizer=tokenizer,
+                chunking=chunking).numpy())
+
+    return run_pipeline(items=iterate_tokenized_batches(batches=batches,
+                                                        tokenizer=tokenizer,
+                                                        n_threads=n_tokenizer_threads,
+                                                        chunking=chunking),
+                        process=process,
+                        write=write,
+                        timer=timer)
+
+
+def embed_articles_threaded(articles: pd.DataFrame,
+                            model: AutoModel,
+                            tokenizer: AutoTokenizer,
+                            staging_writer: EmbeddingStagingWriter,
+                            cache: EmbeddingCache = None,
+                            article_batch_size: int = 64,
+                            n_tokenizer_threads: int = 2,
+                            chunking: dict = None,
+                            timer: StageTimer = None) -> StageTimer:
+    """
+    Embed articles with one copy of the model in the calling process (see embed_batches_threaded) and stream the
+    embeddings from the background writer to BigQuery through the staging writer. The articles are marked in progress in
+    the ledger of the staging writer, if any, and all the embeddings are loaded when the function returns.
+    :param articles: DataFrame of the articles with the ARTICLE_DOI and EMBEDDING_INPUT columns
+    :param model: The transformer model to use for embeddings.
+    :param tokenizer: The tokenizer to use for embeddings.
+    :param staging_writer: The staging writer of the embedding table.
+    :param cache: The embedding cache to look the texts up in first, None to embed all the texts.
+    :param article_batch_size: Number of articles tokenized and embedded at once.
+    :param n_tokenizer_threads: Number of tokenizer threads.
+    :param chunking: Chunking settings of long texts (see util.embedding.inference.CHUNKING), None to truncate them.
+    :param timer: Stage timer to accumulate the timings to
+    :return: Stage timer with the time spent tokenizing, embedding and writing, and waiting in between
+    """
+    timer = timer if timer is not None else StageTimer()
+    if staging_writer.ledger is not None:
+        staging_writer.ledger.mark_in_progress(dois=articles['ARTICLE_DOI'].tolist())
+
+    def write(embedded_batch: tuple) -> None:
+        batch, embeddings = embedded_batch
+        staging_writer.write(keys=dict(DOI=batch['ARTICLE_DOI'].astype(str).to_numpy()), embeddings=embeddings)
+
+    timer = embed_batches_threaded(batches=split_list_to_batch(lst=articles.reset_index(drop=True),
+                                                               batch_size=article_batch_size),
+                                   model=model,
+                                   tokenizer=tokenizer,
+                                   write=write,
+                                   cache=cache,
+                                   n_tokenizer_threads=n_tokenizer_threads,
+                                   chunking=chunking,
+                                   timer=timer)
+
+    # Wait for the last loads, so that the next articles to embed are queried after their embeddings are in BigQuery
+    with timer.measure('wait_load'):
+        staging_writer.flush()
+    logger.info(f"Loaded {staging_writer.n_loaded_rows} of {staging_writer.n_written_rows} embeddings to "
+                f"{staging_writer.table_id}.")
+
+    return timer
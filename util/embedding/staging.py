@@ -0,0 +1,232 @@
+import glob
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pyarrow.parquet as pq
+from google.api_core.exceptions import Conflict
+from google.cloud import bigquery
+from loguru import logger
+
+from util.embedding.ledger import EmbeddingLedger
+from util.embedding.storage import EMBEDDING_STORAGE_DTYPE, encode_embedding_table
+
+# Prefixes of the staged files: a segment holds one written batch, a load file the segments of one load job
+STAGING_SEGMENT_PREFIX = 'segment-'
+STAGING_LOAD_FILE_PREFIX = 'embeddings-'
+
+
+class EmbeddingStagingWriter:
+    """
+    Streaming writer of embeddings to BigQuery through local Parquet files. Every batch of embeddings is encoded as an
+    Arrow table without Python objects per row (see encode_embedding_table) and written to a Parquet segment. Once the
+    segments reach rows_per_file rows, they are combined into one file that is loaded to BigQuery in the background: the
+    upload and the load job run in a separate thread, so writing a batch never waits for BigQuery. A staged file is
+    removed once it is loaded, and the files of failed loads are kept in the staging directory.
+
+    With a ledger, every segment is recorded in the ledger as soon as it is written, and every file is loaded with a
+    load job ID derived from its name, so that a file is never loaded twice. After a crash, recover() loads the staged
+    files and keeps the segments of the ledger, so finished embeddings are not lost.
+
+    The writer is not thread-safe: write from a single thread, e.g. the writer of util.common.pipeline.run_pipeline.
+    """
+
+    def __init__(self,
+                 bq_client: bigquery.Client,
+                 table_id: str,
+                 staging_dir: str,
+                 data_schema: list = None,
+                 dtype: str = EMBEDDING_STORAGE_DTYPE,
+                 rows_per_file: int = 100000,
+                 max_pending_loads: int = 4,
+                 ledger: EmbeddingLedger = None,
+                 key_column: str = 'DOI'):
+        """
+        :param bq_client: The BigQuery client.
+        :param table_id: The ID of the embedding table.
+        :param staging_dir: Directory of the staged Parquet files
+        :param data_schema: The schema of the embedding table.
+        :param dtype: Data type to store the embeddings in.
+        :param rows_per_file: Number of rows of a staged file, i.e. of a load job
+        :param max_pending_loads: Maximum number of staged files waiting to be loaded before a roll waits for the oldest
+        load, which bounds the disk space of the staged files
+        :param ledger: Ledger of the run to record the staged embeddings in, None to not record them
+        :param key_column: Key column of the embeddings that identifies them in the ledger
+        """
+        self.bq_client = bq_client
+        self.table_id = table_id
+        self.staging_dir = os.path.abspath(staging_dir)
+        self.dtype = dtype
+        self.rows_per_file = rows_per_file
+        self.max_pending_loads = max_pending_loads
+        self.ledger = ledger
+        self.key_column = key_column
+
+        # Load the list column of the shapes as a repeated field, not as a record with a list of items
+        parquet_options = bigquery.ParquetOptions()
+        parquet_options.enable_list_inference = True
+        self.job_config = bigquery.LoadJobConfig(source_format=bigquery.SourceFormat.PARQUET,
+                                                 write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+                                                 parquet_options=parquet_options)
+        if data_schema is not None:
+            self.job_config.schema = data_schema
+
+        os.makedirs(self.staging_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='embedding-staging-load')
+        self._pending_loads = list()
+        self._segments, self._n_segment_rows = list(), 0
+        self._lock = threading.Lock()
+
+        # Number of rows written and loaded
+        self.n_written_rows = 0
+        self.n_loaded_rows = 0
+
+    def _get_path(self, prefix: str) -> str:
+        """
+        Get the path of a new staged file.
+        :param prefix: Prefix of the file name
+        :return: Path of the file
+        """
+        return os.path.join(self.staging_dir, f'{prefix}{uuid.uuid4().hex}.parquet')
+
+    def write(self, keys: dict, embeddings: np.ndarray) -> None:
+        """
+        Write a batch of embeddings to a segment, and roll the segments into a file to load once they are full.
+        :param keys: Dictionary of the key columns of the embeddings, e.g. dict(DOI=[...])
+        :param embeddings: Array of embeddings, one row per embedding
+        """
+        table = encode_embedding_table(keys=keys, embeddings=embeddings, dtype=self.dtype)
+        if table.num_rows == 0:
+            return
+        path = self._get_path(prefix=STAGING_SEGMENT_PREFIX)
+        pq.write_table(table, path)
+        if self.ledger is not None:
+            self.ledger.mark_staged(dois=keys[self.key_column], file=path)
+        self._segments.append(path)
+        self._n_segment_rows += table.num_rows
+        self.n_written_rows += table.num_rows
+
+        if self._n_segment_rows >= self.rows_per_file:
+            self.roll()
+
+    def roll(self) -> None:
+        """
+        Combine the segments into a file and load it to BigQuery in the background.
+        """
+        if not self._segments:
+            return
+        segments, n_rows = self._segments, self._n_segment_rows
+        self._segments, self._n_segment_rows = list(), 0
+
+        path = self._get_path(prefix=STAGING_LOAD_FILE_PREFIX)
+        parquet_writer = None
+        for segment in segments:
+            table = pq.read_table(segment)
+            parquet_writer = parquet_writer or pq.ParquetWriter(path, table.schema)
+            parquet_writer.write_table(table)
+        parquet_writer.close()
+        if self.ledger is not None:
+            self.ledger.move_staged(files=segments, file=path)
+        for segment in segments:
+            os.remove(segment)
+
+        self._submit_load(path=path, n_rows=n_rows)
+
+    def _submit_load(self, path: str, n_rows: int) -> None:
+        """
+        Load a staged file in the background, after the oldest loads beyond the maximum number of pending loads.
+        :param path: Path of the staged file
+        :param n_rows: Number of rows of the file
+        """
+        while len(self._pending_loads) >= self.max_pending_loads:
+            self._pending_loads.pop(0).result()
+        self._pending_loads.append(self._executor.submit(self._load, path, n_rows))
+
+    def _load(self, path: str, n_rows: int) -> None:
+        """
+        Load a staged file to BigQuery and remove it. The load job ID is the file name, so a file whose load was started
+        before a crash is not loaded again.
+        :param path: Path of the staged file
+        :param n_rows: Number of rows of the file
+        """
+        job_id = os.path.splitext(os.path.basename(path))[0]
+        try:
+            with open(path, 'rb') as file:
+                self.bq_client.load_table_from_file(file_obj=file, destination=self.table_id, job_id=job_id,
+                                                    job_config=self.job_config).result()
+        except Conflict:
+            # The load of the file was started before a crash: wait for it, and load the file again if it failed
+            if self.bq_client.get_job(job_id).exception() is not None:
+                with open(path, 'rb') as file:
+                    self.bq_client.load_table_from_file(file_obj=file, destination=self.table_id,
+                                                        job_id_prefix=f'{job_id}-retry-',
+                                                        job_config=self.job_config).result()
+
+        if self.ledger is not None:
+            self.ledger.mark_done(file=path)
+        os.remove(path)
+        with self._lock:
+            self.n_loaded_rows += n_rows
+        logger.info(f"Loaded a staged file of {n_rows} embeddings to {self.table_id}.")
+
+    def recover(self) -> None:
+        """
+        Recover the staged embeddings of a stopped run from the ledger: the articles that were being embedded are queued
+        again, the segments are kept to be combined with the next ones, the files to load are loaded and the articles
+        of lost files are queued again. Staged files that are not in the ledger are removed.
+        """
+        if self.ledger is None:
+            raise ValueError("The staged embeddings can only be recovered with a ledger.")
+
+        self.ledger.requeue()
+        staged_files = set()
+        for path in self.ledger.get_staged_files():
+            if not os.path.exists(path):
+                logger.warning(f"The staged file {path} is lost, its articles are queued again.")
+                self.ledger.requeue(file=path)
+                continue
+            staged_files.add(path)
+            n_rows = pq.read_metadata(path).num_rows
+            if os.path.basename(path).startswith(STAGING_SEGMENT_PREFIX):
+                self._segments.append(path)
+                self._n_segment_rows += n_rows
+            else:
+                self._submit_load(path=path, n_rows=n_rows)
+
+        # Remove the files of writes and rolls that were interrupted before they were recorded in the ledger
+        for path in glob.glob(os.path.join(self.staging_dir, '*.parquet')):
+            if path not in staged_files:
+                os.remove(path)
+        logger.info(f"Recovered {len(self._segments)} segments and {len(self._pending_loads)} files to load from the "
+                    f"ledger.")
+
+    def flush(self) -> None:
+        """
+        Roll the segments and wait until all the staged files are loaded.
+        """
+        self.roll()
+        pending_loads, self._pending_loads = self._pending_loads, list()
+        errors = [future.exception() for future in pending_loads if future.exception() is not None]
+        if errors:
+            raise errors[0]
+
+    def close(self) -> None:
+        """
+        Load all the staged files and stop the load thread.
+        """
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Keep the staged files of a failed run, after the loads that were started are done
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,170 @@
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.cloud import bigquery
+
+# Data types the embeddings can be stored in, as little-endian bytes
+EMBEDDING_STORAGE_DTYPES = ('float32', 'float16')
+EMBEDDING_STORAGE_DTYPE = 'float32'
+
+
+def get_embedding_schema() -> list:
+    """
+    Get the BigQuery schema fields of stored embeddings.
+    :return: List of schema fields with the shape, data type and bytes of the embedding
+    """
+    return [
+        bigquery.SchemaField("EMBEDDING_TENSOR_SHAPE", "INT64", mode="REPEATED"),
+        bigquery.SchemaField("EMBEDDING_TENSOR_DTYPE", "STRING"),
+        bigquery.SchemaField("EMBEDDING_TENSOR_BYTES", "BYTES")
+    ]
+
+
+def encode_embeddings(embeddings: np.ndarray,
+                      dtype: str = EMBEDDING_STORAGE_DTYPE) -> list:
+    """
+    Encode embeddings as the fields of stored embeddings: the shape, the data type and the little-endian bytes of each
+    embedding.
+    :param embeddings: Array of embeddings, one row per embedding
+    :param dtype: Data type to store the embeddings in, one of EMBEDDING_STORAGE_DTYPES
+    :return: List of dictionaries with the EMBEDDING_TENSOR_SHAPE, EMBEDDING_TENSOR_DTYPE and EMBEDDING_TENSOR_BYTES of
+    each embedding
+    """
+    if dtype not in EMBEDDING_STORAGE_DTYPES:
+        raise ValueError(f"Unknown embedding storage data type '{dtype}'. Choose one of {EMBEDDING_STORAGE_DTYPES}.")
+
+    # Convert all the embeddings at once and cut the bytes into one value per embedding
+    embeddings = np.asarray(embeddings)
+    data = np.ascontiguousarray(embeddings, dtype=np.dtype(dtype).newbyteorder('<')).tobytes()
+    row_nbytes = len(data) // max(len(embeddings), 1)
+    shape = list(embeddings.shape[1:])
+    return [dict(EMBEDDING_TENSOR_SHAPE=shape,
+                 EMBEDDING_TENSOR_DTYPE=dtype,
+                 EMBEDDING_TENSOR_BYTES=data[start:start + row_nbytes])
+            for start in range(0, len(data), row_nbytes or 1)]
+
+
+def encode_embedding_table(keys: dict,
+                           embeddings: np.ndarray,
+                           dtype: str = EMBEDDING_STORAGE_DTYPE) -> pa.Table:
+    """
+    Encode embeddings as an Arrow table with the columns of stored embeddings, without creating Python objects per row:
+    the bytes of all the embeddings are one buffer, viewed as a fixed-size binary column (loaded to BigQuery as BYTES).
+    :param keys: Dictionary of the key columns of the embeddings, e.g. dict(DOI=[...])
+    :param embeddings: Array of embeddings, one row per embedding
+    :param dtype: Data type to store the embeddings in, one of EMBEDDING_STORAGE_DTYPES
+    :return: Table with the key columns, EMBEDDING_TENSOR_SHAPE, EMBEDDING_TENSOR_DTYPE and EMBEDDING_TENSOR_BYTES
+    """
+    if dtype not in EMBEDDING_STORAGE_DTYPES:
+        raise ValueError(f"Unknown embedding storage data type '{dtype}'. Choose one of {EMBEDDING_STORAGE_DTYPES}.")
+
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.dtype(dtype).newbyteorder('<'))
+    n_embeddings, shape = len(embeddings), np.array(embeddings.shape[1:], dtype=np.int64)
+    row_nbytes = embeddings[0].nbytes if n_embeddings else embeddings.itemsize * int(np.prod(shape))
+    return pa.table(dict(
+        **{column: pa.array(values) for column, values in keys.items()},
+        EMBEDDING_TENSOR_SHAPE=pa.ListArray.from_arrays(
+            offsets=pa.array(np.arange(n_embeddings + 1, dtype=np.int32) * len(shape)),
+            values=pa.array(np.tile(shape, n_embeddings))),
+        EMBEDDING_TENSOR_DTYPE=pa.repeat(dtype, n_embeddings),
+        EMBEDDING_TENSOR_BYTES=pa.FixedSizeBinaryArray.from_buffers(pa.binary(row_nbytes), n_embeddings,
+                                                                    [None, pa.py_buffer(embeddings)])
+    ))
+
+
+def decode_embeddings(values: Union[pd.Series, list, pa.Array, pa.ChunkedArray],
+                      dtype: str = EMBEDDING_STORAGE_DTYPE) -> np.ndarray:
+    """
+    Decode stored embeddings into a matrix with one row per embedding. Arrow fixed-size binary arrays and binary arrays
+    (e.g. from RowIterator.to_arrow) whose values all have the same length are decoded without copying: the matrix is a
+    view of the Arrow buffer. Other inputs are joined into one buffer first.
+    :param values: Bytes of the embeddings
+    :param dtype: Data type the embeddings are stored in
+    :return: Matrix of the embeddings with the stored data type
+    """
+    dtype = np.dtype(dtype).newbyteorder('<')
+
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks() if values.num_chunks != 1 else values.chunk(0)
+    if isinstance(values, pa.Array) and pa.types.is_fixed_size_binary(values.type) and values.null_count == 0:
+        byte_width = values.type.byte_width
+        return np.frombuffer(values.buffers()[1], dtype=dtype, count=len(values) * byte_width // dtype.itemsize,
+                             offset=values.offset * byte_width).reshape(len(values), -1)
+    if isinstance(values, pa.Array) and pa.types.is_binary(values.type) and values.null_count == 0:
+        offsets = np.frombuffer(values.buffers()[1], dtype=np.int32)[values.offset:values.offset + len(values) + 1]
+        lengths = np.diff(offsets)
+        if len(values) > 0 and (lengths == lengths[0]).all():
+            return np.frombuffer(values.buffers()[2], dtype=dtype,
+                                 count=int(offsets[-1] - offsets[0]) // dtype.itemsize,
+                                 offset=int(offsets[0])).reshape(len(values), -1)
+        values = values.to_pylist()
+
+    values = list(values)
+    if not values:
+        return np.empty((0, 0), dtype=dtype)
+    return np.frombuffer(b''.join(values), dtype=dtype).reshape(len(values), -1)
+
+
+def get_embedding_matrix(df: pd.DataFrame) -> np.ndarray:
+    """
+    Get the embeddings of a DataFrame of stored embeddings as a float32 matrix. Embeddings stored as repeated FLOAT64
+    values (EMBEDDING_TENSOR_DATA) before the bytes format are supported as well, also in rows without bytes of a
+    DataFrame that has both columns, e.g. a table that is partly migrated.
+    :param df: DataFrame with the EMBEDDING_TENSOR_BYTES and EMBEDDING_TENSOR_DTYPE or the EMBEDDING_TENSOR_DATA columns
+    :return: Matrix of the embeddings, one row per row of the DataFrame
+    """
+    if 'EMBEDDING_TENSOR_BYTES' not in df.columns:
+        return np.array(df['EMBEDDING_TENSOR_DATA'].tolist(), dtype=np.float32).reshape(len(df), -1)
+
+    is_legacy = df['EMBEDDING_TENSOR_BYTES'].isna().to_numpy()
+    if is_legacy.any():
+        if 'EMBEDDING_TENSOR_DATA' not in df.columns:
+            raise ValueError(f"{int(is_legacy.sum())} embeddings have neither bytes nor legacy values.")
+        legacy = get_embedding_matrix(df=df.loc[is_legacy, ['EMBEDDING_TENSOR_DATA']])
+        if is_legacy.all():
+            return legacy
+        stored = get_embedding_matrix(df=df.loc[~is_legacy, ['EMBEDDING_TENSOR_DTYPE', 'EMBEDDING_TENSOR_BYTES']])
+        embeddings = np.empty((len(df), stored.shape[1]), dtype=np.float32)
+        embeddings[is_legacy], embeddings[~is_legacy] = legacy, stored
+        return embeddings
+
+    dtypes = df['EMBEDDING_TENSOR_DTYPE'].unique()
+    if len(dtypes) > 1:
+        raise ValueError(f"The embeddings are stored in several data types: {list(dtypes)}.")
+    dtype = dtypes[0] if len(dtypes) else EMBEDDING_STORAGE_DTYPE
+    return decode_embeddings(values=df['EMBEDDING_TENSOR_BYTES'], dtype=dtype).astype(np.float32, copy=False)
+
+
+def write_embedding_mirror(path: str,
+                           keys: pd.DataFrame,
+                           embeddings: np.ndarray,
+                           dtype: str = EMBEDDING_STORAGE_DTYPE) -> None:
+    """
+    Write embeddings to a local Parquet mirror with the key columns and the embeddings as a fixed-size list column.
+    :param path: Path of the Parquet file
+    :param keys: DataFrame with the key columns of the embeddings, e.g. the DOI
+    :param embeddings: Array of embeddings, one row per row of keys
+    :param dtype: Data type to store the embeddings in, one of EMBEDDING_STORAGE_DTYPES
+    """
+    if dtype not in EMBEDDING_STORAGE_DTYPES:
+        raise ValueError(f"Unknown embedding storage data type '{dtype}'. Choose one of {EMBEDDING_STORAGE_DTYPES}.")
+    embeddings = np.ascontiguousarray(embeddings, dtype=dtype)
+    table = pa.Table.from_pandas(keys.reset_index(drop=True), preserve_index=False)
+    table = table.append_column('EMBEDDING', pa.FixedSizeListArray.from_arrays(pa.array(embeddings.reshape(-1)),
+                                                                                embeddings.shape[1]))
+    pq.write_table(table, path)
+
+
+def read_embedding_mirror(path: str) -> tuple:
+    """
+    Read a local Parquet mirror of embeddings. The matrix is a view of the values of the fixed-size list column.
+    :param path: Path of the Parquet file
+    :return: Tuple of the DataFrame with the key columns and the matrix of the embeddings
+    """
+    table = pq.read_table(path)
+    column = table['EMBEDDING'].combine_chunks()
+    embeddings = column.flatten().to_numpy(zero_copy_only=True).reshape(len(column), column.type.list_size)
+    return table.drop_columns(['EMBEDDING']).to_pandas(), embeddings
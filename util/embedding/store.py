@@ -0,0 +1,238 @@
+import json
+import os
+import re
+from typing import Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from google.cloud import bigquery
+from loguru import logger
+
+from util.embedding.storage import decode_embeddings
+
+# Files of an embedding store, the matrix and the keys of every generation
+EMBEDDING_STORE_MANIFEST = 'manifest.json'
+EMBEDDING_STORE_MATRIX = 'embeddings-{:06d}.f32'
+EMBEDDING_STORE_KEYS = 'keys-{:06d}-{:06d}.parquet'
+
+# Files of a store written before the store had generations, which are generation 0
+EMBEDDING_STORE_LEGACY_MATRIX = 'embeddings.f32'
+EMBEDDING_STORE_LEGACY_KEYS = 'keys-{:06d}.parquet'
+
+# Generation of the matrix and key files of a store
+EMBEDDING_STORE_FILE_PATTERN = re.compile(r'^(?:embeddings(?:-(\d+))?\.f32|keys-(?:(\d+)-)?\d+\.parquet)$')
+
+
+class EmbeddingStore:
+    """
+    Local append-only store of embeddings: a float32 matrix in a raw file that is memory-mapped read-only, and the keys
+    of its rows (e.g. DOIs or research topic codes) in Parquet files, one per append. Keys are looked up with Arrow
+    compute functions, so neither opening the store nor looking up keys creates Python objects per row, and processes
+    that open the same store share the pages of the matrix.
+
+    The manifest holds the number of rows of the store and is replaced atomically after the rows and keys of an append
+    are written, so readers always see a consistent store: rows beyond the manifest (of an interrupted append) are
+    ignored and overwritten by the next append. Readers see appends of other processes after refresh().
+
+    Clearing the store starts a new generation with its own matrix and key files, published through the manifest, so
+    the matrix a reader has mapped is never truncated below the rows it has seen. The files of the previous generation
+    are kept for the readers that have read the manifest but not opened the files yet, and older generations are
+    removed. Removing a file does not affect the readers that still map it.
+    """
+
+    def __init__(self, path: str, dim: int = None):
+        """
+        :param path: Directory of the store
+        :param dim: Dimension of the embeddings, required to create a new store
+        """
+        self.path = path
+        manifest_path = os.path.join(path, EMBEDDING_STORE_MANIFEST)
+        if not os.path.exists(manifest_path):
+            if dim is None:
+                raise FileNotFoundError(f"There is no embedding store at {path}. Pass the dimension to create one.")
+            os.makedirs(path, exist_ok=True)
+            self._write_manifest(dict(dim=int(dim), generation=1, n_rows=0, n_key_files=0))
+        self.refresh()
+
+    def _get_matrix_path(self) -> str:
+        """
+        Get the path of the matrix of the current generation.
+        :return: Path of the matrix file
+        """
+        generation = self.manifest.get('generation', 0)
+        return os.path.join(self.path, EMBEDDING_STORE_MATRIX.format(generation) if generation > 0
+                            else EMBEDDING_STORE_LEGACY_MATRIX)
+
+    def _get_key_path(self, ix: int) -> str:
+        """
+        Get the path of a key file of the current generation.
+        :param ix: Index of the key file
+        :return: Path of the key file
+        """
+        generation = self.manifest.get('generation', 0)
+        return os.path.join(self.path, EMBEDDING_STORE_KEYS.format(generation, ix) if generation > 0
+                            else EMBEDDING_STORE_LEGACY_KEYS.format(ix))
+
+    def _write_manifest(self, manifest: dict) -> None:
+        """
+        Replace the manifest of the store atomically.
+        :param manifest: Dictionary with the dimension, number of rows and number of key files of the store
+        """
+        temporary_path = os.path.join(self.path, EMBEDDING_STORE_MANIFEST + '.tmp')
+        with open(temporary_path, 'w') as file:
+            json.dump(manifest, file)
+        os.replace(temporary_path, os.path.join(self.path, EMBEDDING_STORE_MANIFEST))
+        self.manifest = manifest
+
+    def refresh(self) -> None:
+        """
+        Open the current version of the store: memory-map its matrix and read its keys.
+        """
+        with open(os.path.join(self.path, EMBEDDING_STORE_MANIFEST)) as file:
+            self.manifest = json.load(file)
+        self.dim, self.n_rows = self.manifest['dim'], self.manifest['n_rows']
+
+        if self.n_rows > 0:
+            self.embeddings = np.memmap(self._get_matrix_path(), dtype='<f4', mode='r', shape=(self.n_rows, self.dim))
+        else:
+            self.embeddings = np.empty((0, self.dim), dtype='<f4')
+
+        key_paths = [self._get_key_path(ix) for ix in range(self.manifest['n_key_files'])]
+        self.keys = pa.chunked_array([pq.read_table(key_path)['KEY'].combine_chunks() for key_path in key_paths],
+                                     type=pa.string())
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def get_positions(self, keys) -> np.ndarray:
+        """
+        Get the rows of keys in the matrix.
+        :param keys: Keys to look up, as a list, NumPy or Arrow array
+        :return: Array of the row of each key, -1 for keys that are not in the store
+        """
+        positions = pc.index_in(pa.array(keys, type=pa.string()), value_set=self.keys.combine_chunks())
+        return positions.fill_null(-1).to_numpy().astype(np.int64)
+
+    def get_embeddings(self, keys) -> tuple:
+        """
+        Get the embeddings of keys.
+        :param keys: Keys to look up, as a list, NumPy or Arrow array
+        :return: Tuple of the boolean array of the keys that are in the store and the matrix of their embeddings
+        """
+        positions = self.get_positions(keys)
+        found = positions >= 0
+        return found, np.asarray(self.embeddings[positions[found]])
+
+    def append(self, keys, embeddings: np.ndarray) -> int:
+        """
+        Append the embeddings of keys that are not in the store yet. Only one process may append to a store at a time.
+        :param keys: Keys of the embeddings, as a list, NumPy or Arrow array
+        :param embeddings: Matrix of the embeddings, one row per key
+        :return: Number of appended embeddings
+        """
+        keys = pa.array(keys, type=pa.string())
+        embeddings = np.asarray(embeddings)
+        if embeddings.ndim != 2 or embeddings.shape[1] != self.dim or len(embeddings) != len(keys):
+            raise ValueError(f"Expected a matrix of {len(keys)} embeddings of dimension {self.dim}, got an array of "
+                             f"shape {embeddings.shape}.")
+
+        # Keep the first embedding of each key that is not in the store yet
+        is_new = (self.get_positions(keys) < 0)
+        is_first = np.zeros(len(keys), dtype=bool)
+        is_first[np.unique(pc.index_in(keys, value_set=pc.unique(keys)).to_numpy(), return_index=True)[1]] = True
+        selected = np.flatnonzero(is_new & is_first)
+        if len(selected) == 0:
+            return 0
+
+        # Write the rows after the rows of the manifest, overwriting those of an interrupted append. The rows of the
+        # manifest only grow within a generation, so the file is never truncated below the rows a reader has seen.
+        matrix_path = self._get_matrix_path()
+        with open(matrix_path, 'ab') as file:
+            file.truncate(self.n_rows * self.dim * 4)
+        with open(matrix_path, 'ab') as file:
+            file.write(np.ascontiguousarray(embeddings[selected], dtype='<f4').tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+
+        # Write the keys and publish the rows in the manifest
+        n_key_files = self.manifest['n_key_files']
+        pq.write_table(pa.table(dict(KEY=keys.take(pa.array(selected)))), self._get_key_path(n_key_files))
+        self._write_manifest(dict(self.manifest, n_rows=self.n_rows + len(selected), n_key_files=n_key_files + 1))
+        self.refresh()
+        return len(selected)
+
+    def clear(self) -> None:
+        """
+        Remove all the embeddings of the store, e.g. to rebuild it from a table that was replaced. The store continues
+        in a new, empty generation, and the files of the generations before the previous one are removed.
+        """
+        generation = self.manifest.get('generation', 0) + 1
+        self._write_manifest(dict(self.manifest, generation=generation, n_rows=0, n_key_files=0))
+        for file_name in os.listdir(self.path):
+            match = EMBEDDING_STORE_FILE_PATTERN.match(file_name)
+            if match is not None and int(match.group(1) or match.group(2) or 0) < generation - 1:
+                os.remove(os.path.join(self.path, file_name))
+        self.refresh()
+
+
+def open_embedding_store(path: str) -> Union[EmbeddingStore, None]:
+    """
+    Open an embedding store read-only, e.g. in an analytics job or the dashboard.
+    :param path: Directory of the store
+    :return: Embedding store, None if there is no store at the path
+    """
+    if not os.path.exists(os.path.join(path, EMBEDDING_STORE_MANIFEST)):
+        return None
+    return EmbeddingStore(path=path)
+
+
+def sync_embedding_store(path: str,
+                         bq_client: bigquery.Client,
+                         table_id: str,
+                         key_column: str,
+                         batch_size: int = 50000,
+                         rebuild: bool = False) -> EmbeddingStore:
+    """
+    Append the embeddings of a BigQuery embedding table that are not in the local store yet, creating the store if
+    needed. Only the key column of the table is downloaded to find the new keys, and the embeddings of the new keys are
+    downloaded as Arrow in batches and decoded without copying. Embeddings already in the store are not updated, so
+    tables that are replaced rather than appended to are synced with rebuild.
+    :param path: Directory of the store
+    :param bq_client: The BigQuery client.
+    :param table_id: The ID of the embedding table.
+    :param key_column: The key column of the table, e.g. DOI.
+    :param batch_size: Number of embeddings downloaded at once.
+    :param rebuild: Whether to remove the embeddings of the store first
+    :return: Embedding store
+    """
+    store = open_embedding_store(path=path)
+    if store is not None and rebuild:
+        store.clear()
+    store_keys = store.keys.combine_chunks() if store is not None else pa.array([], type=pa.string())
+
+    table_keys = bq_client.query(f"SELECT {key_column} FROM `{table_id}`").result().to_arrow()[key_column]
+    new_keys = pc.unique(pc.filter(table_keys, pc.invert(pc.is_in(table_keys, value_set=store_keys))).combine_chunks())
+    logger.info(f"{len(new_keys)} of {len(table_keys)} embeddings of {table_id} are not in the store at {path}.")
+
+    n_appended = 0
+    for start in range(0, len(new_keys), batch_size):
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ArrayQueryParameter('keys', 'STRING', new_keys[start:start + batch_size].to_pylist())])
+        table = bq_client.query(f"""SELECT {key_column}, EMBEDDING_TENSOR_DTYPE, EMBEDDING_TENSOR_BYTES
+                                    FROM `{table_id}`
+                                    WHERE {key_column} IN UNNEST(@keys)""", job_config=job_config).result().to_arrow()
+
+        dtypes = table['EMBEDDING_TENSOR_DTYPE'].unique().to_pylist()
+        if len(dtypes) > 1:
+            raise ValueError(f"The embeddings are stored in several data types: {dtypes}.")
+        embeddings = decode_embeddings(values=table['EMBEDDING_TENSOR_BYTES'], dtype=dtypes[0])
+        if store is None:
+            store = EmbeddingStore(path=path, dim=embeddings.shape[1])
+        n_appended += store.append(keys=table[key_column], embeddings=embeddings)
+        logger.info(f"Appended {n_appended} of {len(new_keys)} embeddings to the store.")
+
+    if store is None:
+        raise ValueError(f"There are no embeddings in {table_id} to create the store at {path} with.")
+    return store